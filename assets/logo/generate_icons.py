@@ -4,10 +4,26 @@ PlantMeet Logo Generator
 将SVG logo转换为各种平台所需的PNG图标
 """
 
+import argparse
+import hashlib
+import json
+import math
 import os
+import shutil
 import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 
+from svg_render import SUBPROCESS_TOOLS, cairosvg_available, load_svg
+
+# logo 源文件所在目录（即本脚本所在目录）
+LOGO_DIR = Path(__file__).resolve().parent
+
+# 构建缓存格式版本，渲染逻辑变化时递增以使旧缓存失效
+CACHE_VERSION = 1
+
 # 定义所需的图标尺寸
 ICON_SIZES = {
     # Android 图标
@@ -61,120 +77,416 @@ ICON_SIZES = {
 
 def check_dependencies():
     """检查所需依赖"""
-    try:
-        # 检查是否安装了cairosvg
-        import cairosvg
+    # 检查是否安装了cairosvg（以及cairo动态库）
+    if cairosvg_available():
         return True
-    except ImportError:
+    else:
         print("❌ 缺少依赖: cairosvg")
         print("请运行: pip install cairosvg")
         return False
 
 def convert_svg_to_png_cairosvg(svg_path, png_path, size):
-    """使用cairosvg将SVG转换为PNG"""
+    """使用cairosvg将SVG转换为PNG
+
+    同一进程内每个SVG只解析一次，后续尺寸复用解析树。
+    """
     try:
-        import cairosvg
-        
         # 确保输出目录存在
         os.makedirs(os.path.dirname(png_path), exist_ok=True)
         
         # 转换SVG为PNG
-        cairosvg.svg2png(
-            url=svg_path,
-            write_to=png_path,
-            output_width=size,
-            output_height=size,
-        )
+        with open(png_path, 'wb') as f:
+            f.write(load_svg(svg_path).render(size, 'cairosvg'))
         return True
     except Exception as e:
         print(f"❌ 转换失败 {png_path}: {e}")
         return False
 
-def convert_svg_to_png_subprocess(svg_path, png_path, size):
-    """使用系统命令转换SVG为PNG"""
-    # 确保输出目录存在
+def convert_svg_to_png_tool(tool, svg_path, png_path, size):
+    """使用指定的外部工具转换SVG为PNG"""
     os.makedirs(os.path.dirname(png_path), exist_ok=True)
+    try:
+        result = subprocess.run(SUBPROCESS_TOOLS[tool](svg_path, png_path, size),
+                                capture_output=True, text=True)
+        return result.returncode == 0
+    except FileNotFoundError:
+        return False
+
+def detect_backend(svg_path):
+    """探测一次可用的转换后端，避免每个图标重复尝试已失败的工具"""
+    if check_dependencies():
+        return 'cairosvg'
     
-    # 尝试使用不同的工具
-    tools = [
-        # Inkscape
-        ['inkscape', svg_path, '-w', str(size), '-h', str(size), '-o', png_path],
-        # ImageMagick
-        ['convert', svg_path, '-resize', f'{size}x{size}', png_path],
-        # rsvg-convert
-        ['rsvg-convert', '-w', str(size), '-h', str(size), svg_path, '-o', png_path]
-    ]
-    
-    for tool in tools:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        probe_png = os.path.join(tmp_dir, 'probe.png')
+        for tool in SUBPROCESS_TOOLS:
+            if shutil.which(tool) and convert_svg_to_png_tool(tool, str(svg_path), probe_png, 16):
+                return tool
+    return None
+
+def render_icon(backend, svg_path, png_path, size):
+    """使用已探测的后端渲染单个图标，返回 (是否成功, 耗时秒数)
+
+    定义在模块顶层，便于进程池序列化调用。
+    """
+    started = time.perf_counter()
+    if backend == 'cairosvg':
+        success = convert_svg_to_png_cairosvg(svg_path, png_path, size)
+    else:
+        success = convert_svg_to_png_tool(backend, svg_path, png_path, size)
+    return success, time.perf_counter() - started
+
+def downsample_icon(master_png, png_path, size):
+    """从大尺寸母版高质量缩放出小尺寸图标，返回 (是否成功, 耗时秒数)"""
+    started = time.perf_counter()
+    try:
+        from PIL import Image
+        
+        os.makedirs(os.path.dirname(png_path), exist_ok=True)
+        with Image.open(master_png) as master:
+            master.convert('RGBA').resize((size, size), Image.LANCZOS).save(png_path, optimize=True)
+        success = True
+    except Exception as e:
+        print(f"❌ 缩放失败 {png_path}: {e}")
+        success = False
+    return success, time.perf_counter() - started
+
+def compare_png(png_a, png_b):
+    """计算两张同尺寸PNG的PSNR (dB)，完全一致时返回 inf"""
+    from PIL import Image, ImageChops, ImageStat
+    
+    with Image.open(png_a) as a, Image.open(png_b) as b:
+        diff = ImageChops.difference(a.convert('RGBA'), b.convert('RGBA'))
+    mse = sum(ImageStat.Stat(diff).sum2) / (diff.size[0] * diff.size[1] * 4)
+    if mse == 0:
+        return math.inf
+    return 10 * math.log10(255 * 255 / mse)
+
+def _run_jobs(executor, jobs):
+    """执行 {key: (函数, 参数)}，有进程池时并行，否则顺序执行"""
+    results = {}
+    if executor is None:
+        for key, (func, args) in jobs.items():
+            results[key] = func(*args)
+        return results
+    
+    futures = {executor.submit(func, *args): key for key, (func, args) in jobs.items()}
+    for future in as_completed(futures):
         try:
-            result = subprocess.run(tool, capture_output=True, text=True)
-            if result.returncode == 0:
-                return True
-        except FileNotFoundError:
-            continue
+            results[futures[future]] = future.result()
+        except Exception as e:
+            print(f"❌ 转换失败 {futures[future]}: {e}")
+            results[futures[future]] = (False, 0.0)
+    return results
+
+def file_sha256(path):
+    """计算文件内容的SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_cache(cache_path):
+    """读取构建缓存清单，不存在或版本不符时返回空清单"""
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+        if cache.get('version') == CACHE_VERSION:
+            return cache
+    except (OSError, ValueError):
+        pass
+    return {'version': CACHE_VERSION, 'backend': None, 'entries': {}}
+
+def save_cache(cache_path, cache):
+    """原子写入构建缓存清单"""
+    cache_path = Path(cache_path)
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_name(cache_path.name + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(cache, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(tmp_path, cache_path)
+
+def is_up_to_date(entry, output_path, key):
+    """判断目标是否与缓存记录一致：缓存键相同且输出文件未被改动"""
+    if not entry or entry.get('key') != key:
+        return False
+    try:
+        stat = os.stat(output_path)
+    except OSError:
+        return False
+    if stat.st_size != entry.get('bytes'):
+        return False
+    # 大小和修改时间都未变时直接信任缓存，否则再比较内容哈希
+    if stat.st_mtime_ns == entry.get('mtime_ns'):
+        return True
+    return file_sha256(output_path) == entry.get('sha256')
+
+def commit_output(staged_png, output_path):
+    """将暂存的PNG写入目标路径，内容相同则不改动目标文件
+
+    通过同目录临时文件 + rename 原子替换，避免留下写了一半的图标。
+    返回 (是否写入, 输出哈希)。
+    """
+    new_hash = file_sha256(staged_png)
+    if os.path.exists(output_path) and file_sha256(output_path) == new_hash:
+        return False, new_hash
     
-    return False
+    output_dir = os.path.dirname(output_path)
+    os.makedirs(output_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(output_path) + '.', dir=output_dir)
+    try:
+        with os.fdopen(fd, 'wb') as dst, open(staged_png, 'rb') as src:
+            shutil.copyfileobj(src, dst)
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return True, new_hash
 
-def generate_icons(svg_path='logo_simple.svg', project_root='../../'):
-    """生成所有图标"""
+def generate_icons(svg_path=LOGO_DIR / 'logo_simple.svg', project_root=LOGO_DIR.parent.parent, jobs=None,
+                   downsample=False, verify_downsample=False, min_psnr=30.0,
+                   backend=None, force=False, cache_path=None):
+    """生成所有图标
+
+    先探测一次可用后端，再把所有尺寸分发到进程池并行渲染。
+    jobs 为并行进程数，默认使用 CPU 核心数；jobs=1 时在当前进程内顺序渲染。
+    
+    目标按 (源SVG, 尺寸) 去重，每个唯一尺寸只栅格化一次，再复制到所有目标路径。
+    downsample=True 时每个源SVG只栅格化最大尺寸，其余尺寸由母版高质量缩放得到（需要Pillow）；
+    verify_downsample=True 时额外直接渲染做对比，PSNR 低于 min_psnr 的尺寸改用直接渲染结果。
+    
+    按 (SVG内容哈希, 尺寸, 后端, 模式, 缓存版本) 跳过未变化的目标，force=True 时忽略缓存全部重新生成。
+    缓存清单默认保存在 <project_root>/.dart_tool/plantmeet_icon_cache.json。
+    只有内容确实变化的PNG才会被原子替换，未变化的文件保持原修改时间。
+    """
     svg_file = Path(svg_path)
     if not svg_file.exists():
         print(f"❌ SVG文件不存在: {svg_path}")
         return False
     
     project_path = Path(project_root).resolve()
-    success_count = 0
-    total_count = 0
+    cache_path = Path(cache_path) if cache_path else project_path / '.dart_tool' / 'plantmeet_icon_cache.json'
+    jobs = jobs or os.cpu_count() or 1
+    wall_started = time.perf_counter()
     
     print(f"🚀 开始生成图标...")
     print(f"📁 项目路径: {project_path}")
     print(f"🎨 SVG源文件: {svg_file}")
     
-    # 首先尝试使用cairosvg
-    use_cairosvg = check_dependencies()
+    # 小尺寸使用与主SVG同目录的简化版本，找不到时回退到脚本目录
+    simple_svg = svg_file.parent / 'logo_simple.svg'
+    if not simple_svg.exists():
+        simple_svg = LOGO_DIR / 'logo_simple.svg'
     
+    tasks = []
+    # (源SVG, 尺寸) -> 该尺寸的所有目标
+    groups = {}
     for platform, icons in ICON_SIZES.items():
-        print(f"\n📱 生成 {platform.upper()} 图标...")
-        
         for relative_path, size in icons.items():
-            output_path = project_path / relative_path
-            total_count += 1
-            
             # 选择SVG源文件（小尺寸使用简化版本）
-            source_svg = svg_file if size >= 64 else 'logo_simple.svg'
-            
-            success = False
-            if use_cairosvg:
-                success = convert_svg_to_png_cairosvg(str(source_svg), str(output_path), size)
-            
-            if not success:
-                success = convert_svg_to_png_subprocess(str(source_svg), str(output_path), size)
-            
-            if success:
-                print(f"  ✅ {size}x{size} -> {relative_path}")
-                success_count += 1
-            else:
-                print(f"  ❌ {size}x{size} -> {relative_path}")
+            source_svg = str(svg_file if size >= 64 else simple_svg)
+            output_path = str(project_path / relative_path)
+            tasks.append((platform, relative_path, size, source_svg, output_path))
+            groups.setdefault((source_svg, size), []).append((relative_path, output_path))
+    
+    svg_hashes = {source_svg: file_sha256(source_svg) for source_svg, _ in groups}
+    mode = 'downsample' if downsample else 'direct'
+    cache = load_cache(cache_path)
     
-    print(f"\n📊 生成完成: {success_count}/{total_count} 成功")
+    def cache_key(source_svg, size, backend_name):
+        return f"{svg_hashes[source_svg]}:{size}:{backend_name}:{mode}:{CACHE_VERSION}"
     
-    if success_count == 0:
+    # 未指定后端时先按上次使用的后端判断是否全部最新，避免无谓的后端探测
+    check_backend = backend or cache.get('backend')
+    stale = set(groups)
+    if check_backend and not force:
+        stale = {
+            key for key, targets in groups.items()
+            if not all(is_up_to_date(cache['entries'].get(relative_path), output_path,
+                                     cache_key(key[0], key[1], check_backend))
+                       for relative_path, output_path in targets)
+        }
+    
+    if not stale:
+        wall_seconds = time.perf_counter() - wall_started
+        print(f"\n✅ 所有 {len(tasks)} 个图标均为最新，无需重新生成 ({wall_seconds * 1000:.0f} ms)")
+        return True
+    
+    if not backend:
+        backend = detect_backend(svg_file)
+    if not backend:
+        print("❌ 未找到可用的SVG转换工具")
         print("\n💡 提示: 请确保安装以下工具之一:")
         print("  - pip install cairosvg")
         print("  - brew install inkscape (macOS)")
         print("  - sudo apt-get install inkscape (Ubuntu)")
         print("  - brew install imagemagick (macOS)")
+        return False
+    if backend != check_backend:
+        # 后端变化时所有缓存条目都已失效
+        stale = set(groups)
+    
+    if downsample:
+        try:
+            import PIL
+        except ImportError:
+            print("⚠️  缩放模式需要 Pillow (pip install pillow)，改为逐尺寸渲染")
+            downsample = False
+    print(f"🔧 转换后端: {backend}, 并行进程数: {jobs}, 模式: {'母版缩放' if downsample else '逐尺寸渲染'}")
+    print(f"♻️  需要生成 {len(stale)}/{len(groups)} 个唯一尺寸")
+    
+    tmp_dir = tempfile.mkdtemp(prefix='plantmeet_icons_')
+    # 每个唯一尺寸先渲染到暂存目录，再统一提交到目标路径
+    staged = {
+        key: os.path.join(tmp_dir, f"{Path(key[0]).stem}_{key[1]}.png")
+        for key in groups
+    }
+    masters = {}
+    if downsample:
+        for source_svg, size in groups:
+            masters[source_svg] = max(masters.get(source_svg, 0), size)
+    
+    results = {}
+    methods = {}
+    written = set()
+    try:
+        executor = ProcessPoolExecutor(max_workers=jobs) if jobs > 1 else None
+        try:
+            # 第一阶段: 栅格化（缩放模式下只渲染每个源SVG的最大尺寸）
+            needed_masters = {key[0] for key in stale}
+            render_jobs = {
+                key: (render_icon, (backend, key[0], staged[key], key[1]))
+                for key in groups
+                if (key in stale and not downsample)
+                or (downsample and key[0] in needed_masters and masters[key[0]] == key[1])
+            }
+            results.update(_run_jobs(executor, render_jobs))
+            methods.update({key: 'render' for key in render_jobs})
+            
+            # 第二阶段: 由母版缩放出其余尺寸
+            if downsample:
+                scale_jobs = {}
+                verify_jobs = {}
+                for key in stale:
+                    if key in render_jobs:
+                        continue
+                    source_svg, size = key
+                    master_key = (source_svg, masters[source_svg])
+                    if results.get(master_key, (False, 0.0))[0]:
+                        scale_jobs[key] = (downsample_icon, (staged[master_key], staged[key], size))
+                        if verify_downsample:
+                            reference = os.path.join(tmp_dir, f"reference_{Path(source_svg).stem}_{size}.png")
+                            verify_jobs[key] = (render_icon, (backend, source_svg, reference, size))
+                    else:
+                        scale_jobs[key] = (render_icon, (backend, source_svg, staged[key], size))
+                
+                scaled = _run_jobs(executor, {**{('scale',) + k: v for k, v in scale_jobs.items()},
+                                              **{('verify',) + k: v for k, v in verify_jobs.items()}})
+                for key, job in scale_jobs.items():
+                    results[key] = scaled[('scale',) + key]
+                    methods[key] = 'downsample' if job[0] is downsample_icon else 'render'
+                
+                # 质量检查: 与直接渲染结果对比，低于阈值时改用直接渲染
+                for key, (_, args) in verify_jobs.items():
+                    reference = args[2]
+                    if not (results[key][0] and scaled[('verify',) + key][0]):
+                        continue
+                    psnr = compare_png(staged[key], reference)
+                    label = '∞' if math.isinf(psnr) else f"{psnr:.1f}"
+                    if psnr < min_psnr:
+                        shutil.copyfile(reference, staged[key])
+                        methods[key] = 'render'
+                        print(f"  ⚠️  {key[1]}x{key[1]} 缩放质量不足 (PSNR {label} dB)，改用直接渲染")
+                    else:
+                        print(f"  🔍 {key[1]}x{key[1]} 缩放质量 PSNR {label} dB")
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        
+        # 第三阶段: 提交到所有目标路径，内容未变的文件不改动
+        for key in stale:
+            if not results[key][0]:
+                continue
+            for relative_path, output_path in groups[key]:
+                changed, output_hash = commit_output(staged[key], output_path)
+                if changed:
+                    written.add(output_path)
+                stat = os.stat(output_path)
+                cache['entries'][relative_path] = {
+                    'key': cache_key(key[0], key[1], backend),
+                    'sha256': output_hash,
+                    'bytes': stat.st_size,
+                    'mtime_ns': stat.st_mtime_ns,
+                }
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    
+    cache['backend'] = backend
+    save_cache(cache_path, cache)
+    
+    success_count = 0
+    render_seconds = 0.0
+    current_platform = None
+    for platform, relative_path, size, source_svg, output_path in tasks:
+        if platform != current_platform:
+            print(f"\n📱 {platform.upper()} 图标:")
+            current_platform = platform
+        key = (source_svg, size)
+        if key not in stale:
+            print(f"  ⏭️  {size}x{size} -> {relative_path} (最新)")
+            success_count += 1
+            continue
+        success, elapsed = results[key]
+        if not success:
+            print(f"  ❌ {size}x{size} -> {relative_path}")
+            continue
+        success_count += 1
+        if output_path == groups[key][0][1]:
+            render_seconds += elapsed
+            note = f"{'缩放' if methods[key] == 'downsample' else '渲染'} {elapsed * 1000:.0f} ms"
+        else:
+            note = '复制'
+        if output_path not in written:
+            note += ', 内容未变'
+        print(f"  ✅ {size}x{size} -> {relative_path} ({note})")
+    
+    rendered = sum(1 for method in methods.values() if method == 'render')
+    wall_seconds = time.perf_counter() - wall_started
+    print(f"\n📊 生成完成: {success_count}/{len(tasks)} 成功 "
+          f"(栅格化 {rendered} 次, 缩放 {len(methods) - rendered} 次, 写入 {len(written)} 个文件)")
+    print(f"⏱️  总耗时: {wall_seconds:.2f} 秒 (累计渲染 {render_seconds:.2f} 秒)")
         
     return success_count > 0
 
 def main():
     """主函数"""
+    parser = argparse.ArgumentParser(description='PlantMeet 图标生成器')
+    parser.add_argument('--project-root', default=str(LOGO_DIR.parent.parent),
+                        help='Flutter 项目根目录 (默认: 本脚本上两级目录)')
+    parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count(),
+                        help='并行渲染进程数 (默认: CPU 核心数)')
+    parser.add_argument('--downsample', action='store_true',
+                        help='每个SVG只渲染最大尺寸，其余尺寸由母版缩放得到 (需要 Pillow)')
+    parser.add_argument('--verify-downsample', action='store_true',
+                        help='缩放模式下与直接渲染结果对比质量')
+    parser.add_argument('--min-psnr', type=float, default=30.0,
+                        help='缩放结果的最低 PSNR，低于该值改用直接渲染 (默认: 30)')
+    parser.add_argument('--backend', choices=['cairosvg'] + list(SUBPROCESS_TOOLS),
+                        help='指定转换后端，不指定时自动探测')
+    parser.add_argument('--force', action='store_true',
+                        help='忽略构建缓存，重新生成所有图标')
+    parser.add_argument('--cache-file',
+                        help='构建缓存清单路径 (默认: <项目>/.dart_tool/plantmeet_icon_cache.json)')
+    args = parser.parse_args()
+    
     print("🌱 PlantMeet Logo Generator")
     print("=" * 40)
     
-    # 检查SVG文件
-    svg_files = ['logo_base.svg', 'logo_simple.svg']
-    available_files = [f for f in svg_files if Path(f).exists()]
+    # 检查SVG文件（相对脚本目录查找，不依赖当前工作目录）
+    svg_files = [LOGO_DIR / 'logo_base.svg', LOGO_DIR / 'logo_simple.svg']
+    available_files = [f for f in svg_files if f.exists()]
     
     if not available_files:
         print("❌ 未找到SVG文件，请确保logo_base.svg或logo_simple.svg存在")
@@ -185,7 +497,9 @@ def main():
     print(f"📁 使用SVG文件: {svg_file}")
     
     # 生成图标
-    success = generate_icons(svg_file)
+    success = generate_icons(svg_file, project_root=args.project_root, jobs=args.jobs, downsample=args.downsample,
+                             verify_downsample=args.verify_downsample, min_psnr=args.min_psnr,
+                             backend=args.backend, force=args.force, cache_path=args.cache_file)
     
     if success:
         print("\n🎉 图标生成完成!")
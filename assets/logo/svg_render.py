@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+PlantMeet SVG 渲染层
+每个源SVG只读取、解析一次，再从同一份解析结果渲染多个尺寸。
+图标、启动图、商店素材等工具都可以直接调用 render_many()。
+
+使用方法:
+python3 svg_render.py logo_base.svg --sizes 192 512 1024 --out-dir /tmp/icons
+python3 svg_render.py logo_base.svg --benchmark [--repeat 3]
+"""
+
+import argparse
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+
+# 外部转换工具，按优先级排列
+SUBPROCESS_TOOLS = {
+    'inkscape': lambda svg, png, size: ['inkscape', svg, '-w', str(size), '-h', str(size), '-o', png],
+    'convert': lambda svg, png, size: ['convert', svg, '-resize', f'{size}x{size}', png],
+    'rsvg-convert': lambda svg, png, size: ['rsvg-convert', '-w', str(size), '-h', str(size), svg, '-o', png],
+}
+
+# 基准测试默认尺寸，与 generate_icons.py 的唯一尺寸一致
+BENCHMARK_SIZES = [16, 20, 29, 32, 40, 48, 58, 60, 64, 72, 76, 80, 87, 96,
+                   120, 128, 144, 152, 167, 180, 192, 256, 512, 1024]
+
+# 进程内已加载的SVG，键为 (绝对路径, 修改时间, 文件大小)
+_LOADED = {}
+
+def cairosvg_available():
+    """cairosvg 及其依赖的 cairo 动态库是否可用"""
+    try:
+        import cairosvg
+        return True
+    except (ImportError, OSError):
+        # cairocffi 找不到 libcairo 时抛出 OSError
+        return False
+
+def default_backend():
+    """返回首选的可用后端，没有可用后端时返回 None"""
+    if cairosvg_available():
+        return 'cairosvg'
+    for tool in SUBPROCESS_TOOLS:
+        if shutil.which(tool):
+            return tool
+    return None
+
+class SvgSource:
+    """已加载到内存的SVG源，可重复渲染为不同尺寸的PNG"""
+
+    def __init__(self, path=None, data=None):
+        if data is None:
+            if path is None:
+                raise ValueError("必须提供 path 或 data")
+            data = Path(path).read_bytes()
+        self.path = str(path) if path is not None else None
+        self.data = data
+        self.sha256 = hashlib.sha256(data).hexdigest()
+        self._tree = None
+        self._tool_svg = None
+
+    @property
+    def tree(self):
+        """cairosvg 解析树，首次访问时解析一次"""
+        if self._tree is None:
+            from cairosvg.parser import Tree
+            # 传入 url 以便解析SVG中的相对引用
+            self._tree = Tree(bytestring=self.data, url=self.path)
+        return self._tree
+
+    def render(self, size, backend='cairosvg'):
+        """渲染为 size x size 的PNG，返回PNG字节"""
+        if backend == 'cairosvg':
+            import io
+            from cairosvg.surface import PNGSurface
+
+            output = io.BytesIO()
+            surface = PNGSurface(self.tree, output, 96, output_width=size, output_height=size)
+            surface.finish()
+            return output.getvalue()
+        return self._render_tool(backend, size)
+
+    def _render_tool(self, tool, size):
+        """通过外部工具渲染；内存中的SVG只落盘一次"""
+        if self._tool_svg is None:
+            if self.path and os.path.exists(self.path):
+                self._tool_svg = self.path
+            else:
+                fd, self._tool_svg = tempfile.mkstemp(suffix='.svg', prefix='plantmeet_svg_')
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(self.data)
+
+        fd, png_path = tempfile.mkstemp(suffix='.png', prefix='plantmeet_png_')
+        os.close(fd)
+        try:
+            result = subprocess.run(SUBPROCESS_TOOLS[tool](self._tool_svg, png_path, size),
+                                    capture_output=True, text=True)
+            if result.returncode != 0:
+                raise RuntimeError(f"{tool} 渲染失败: {result.stderr.strip()}")
+            return Path(png_path).read_bytes()
+        finally:
+            os.unlink(png_path)
+
+    def close(self):
+        """清理为外部工具落盘的临时SVG"""
+        if self._tool_svg and self._tool_svg != self.path and os.path.exists(self._tool_svg):
+            os.unlink(self._tool_svg)
+        self._tool_svg = None
+
+def load_svg(path):
+    """加载SVG并在当前进程内缓存，文件变化后自动重新加载"""
+    resolved = Path(path).resolve()
+    stat = resolved.stat()
+    key = (str(resolved), stat.st_mtime_ns, stat.st_size)
+    source = _LOADED.get(key)
+    if source is None:
+        source = SvgSource(resolved)
+        _LOADED[key] = source
+    return source
+
+def render_many(svg, sizes, backend=None):
+    """从同一份SVG渲染多个尺寸
+
+    svg 可以是文件路径、SVG字节或 SvgSource；返回 {尺寸: PNG字节}。
+    """
+    backend = backend or default_backend()
+    if backend is None:
+        raise RuntimeError("未找到可用的SVG转换工具 (cairosvg / inkscape / convert / rsvg-convert)")
+
+    if isinstance(svg, SvgSource):
+        source = svg
+    elif isinstance(svg, bytes):
+        source = SvgSource(data=svg)
+    else:
+        source = load_svg(svg)
+    return {size: source.render(size, backend) for size in dict.fromkeys(sizes)}
+
+def render_per_file(svg_path, sizes, backend, out_dir):
+    """旧的逐文件渲染路径：每个尺寸都重新读取并解析SVG，仅用于基准对比"""
+    outputs = {}
+    for size in dict.fromkeys(sizes):
+        png_path = os.path.join(out_dir, f"per_file_{size}.png")
+        if backend == 'cairosvg':
+            import cairosvg
+            cairosvg.svg2png(url=str(svg_path), write_to=png_path,
+                             output_width=size, output_height=size)
+        else:
+            subprocess.run(SUBPROCESS_TOOLS[backend](str(svg_path), png_path, size),
+                           capture_output=True, check=True)
+        outputs[size] = Path(png_path).read_bytes()
+    return outputs
+
+def benchmark(svg_path, sizes=None, backend=None, repeat=3):
+    """对比逐文件渲染与 render_many 的耗时，并检查两者输出是否一致"""
+    sizes = sizes or BENCHMARK_SIZES
+    backend = backend or default_backend()
+    if backend is None:
+        raise RuntimeError("未找到可用的SVG转换工具")
+
+    per_file_times = []
+    batch_times = []
+    mismatched = []
+    with tempfile.TemporaryDirectory(prefix='plantmeet_bench_') as out_dir:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            per_file = render_per_file(svg_path, sizes, backend, out_dir)
+            per_file_times.append(time.perf_counter() - started)
+
+            # 每轮使用新的 SvgSource，计入一次读取和解析的开销
+            started = time.perf_counter()
+            source = SvgSource(svg_path)
+            batch = render_many(source, sizes, backend)
+            batch_times.append(time.perf_counter() - started)
+            source.close()
+
+        mismatched = [size for size in per_file if per_file[size] != batch[size]]
+
+    return {
+        'svg': str(svg_path),
+        'backend': backend,
+        'sizes': len(dict.fromkeys(sizes)),
+        'repeat': repeat,
+        'per_file_seconds': min(per_file_times),
+        'render_many_seconds': min(batch_times),
+        'speedup': min(per_file_times) / min(batch_times) if min(batch_times) > 0 else float('inf'),
+        'mismatched_sizes': mismatched,
+    }
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='PlantMeet SVG 渲染工具')
+    parser.add_argument('svg', help='源SVG文件')
+    parser.add_argument('--sizes', type=int, nargs='+', default=None,
+                        help='输出尺寸列表 (默认: 与图标生成相同的唯一尺寸)')
+    parser.add_argument('--backend', choices=['cairosvg'] + list(SUBPROCESS_TOOLS),
+                        help='指定转换后端，不指定时自动选择')
+    parser.add_argument('--out-dir', default='.',
+                        help='PNG输出目录 (默认: 当前目录)')
+    parser.add_argument('--benchmark', action='store_true',
+                        help='对比逐文件渲染与批量渲染的耗时')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='基准测试重复次数，取最快一次 (默认: 3)')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        result = benchmark(args.svg, args.sizes, args.backend, args.repeat)
+        print(f"⏱️  SVG渲染基准: {result['svg']} ({result['backend']}, {result['sizes']} 个尺寸, 重复 {result['repeat']} 次)")
+        print(f"  逐文件渲染: {result['per_file_seconds'] * 1000:.1f} ms")
+        print(f"  render_many: {result['render_many_seconds'] * 1000:.1f} ms")
+        print(f"  加速比: {result['speedup']:.2f}x")
+        if result['mismatched_sizes']:
+            print(f"  ⚠️  输出不一致的尺寸: {result['mismatched_sizes']}")
+        else:
+            print("  ✅ 两种路径输出完全一致")
+        return
+
+    out_dir = Path(args.out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    stem = Path(args.svg).stem
+    for size, png in render_many(args.svg, args.sizes or BENCHMARK_SIZES, args.backend).items():
+        output_path = out_dir / f"{stem}_{size}.png"
+        output_path.write_bytes(png)
+        print(f"  ✅ {size}x{size} -> {output_path}")
+
+if __name__ == "__main__":
+    main()
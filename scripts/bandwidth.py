@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+模型服务器带宽整形
+
+令牌桶实现全局带宽上限和单客户端带宽上限；所有等待发送的传输按虚拟时间
+做加权轮转（每次发放一个发送配额），保证多台设备同时下载时公平分享带宽，
+先连上的连接不会饿死后来的连接。
+
+限速可通过管理端点在运行时调整:
+  GET  /admin/bandwidth   查看当前限速和活动传输
+  POST /admin/bandwidth   {"global_rate": 50, "client_rate": 10, "weights": {"192.168.1.5": 2}}
+                          （单位 MB/s，0 表示不限速）
+
+多进程模式下全局上限平均分给各工作进程（每个进程一个令牌桶），管理端点收到的调整由
+处理该请求的工作进程写入监管进程的状态目录，其他工作进程在 1 秒内同步；单客户端上限和
+公平调度仍按工作进程分别计算（同一客户端的连接分到 N 个进程时最多可得 N 倍的单客户端上限）。
+"""
+
+import json
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+MB = 1024 * 1024
+
+# 单次发送配额（与服务器的读块大小一致）
+DEFAULT_QUANTUM = 64 * 1024
+
+# 令牌桶容量对应的突发时长（秒）
+BURST_SECONDS = 0.25
+
+class TokenBucket:
+    """令牌桶，rate 为每秒字节数，0 表示不限速；由调用方负责加锁"""
+
+    def __init__(self, rate, min_capacity=DEFAULT_QUANTUM):
+        self.min_capacity = min_capacity
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        self.set_rate(rate)
+
+    def set_rate(self, rate):
+        self.rate = max(0, rate)
+        # 容量至少容纳一个配额，否则大块请求永远得不到满足
+        self.capacity = max(self.rate * BURST_SECONDS, self.min_capacity)
+        self.tokens = min(self.tokens, self.capacity) if self.rate else self.capacity
+
+    def refill(self, now):
+        if self.rate:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def can_take(self, nbytes):
+        return not self.rate or self.tokens >= nbytes
+
+    def take(self, nbytes):
+        if self.rate:
+            self.tokens -= nbytes
+
+    def wait_time(self, nbytes):
+        """令牌足够发送 nbytes 还需等待的秒数"""
+        if not self.rate or self.tokens >= nbytes:
+            return 0.0
+        return (nbytes - self.tokens) / self.rate
+
+class Flow:
+    """一次传输在整形器中的登记，由 BandwidthShaper.open_flow() 创建"""
+
+    def __init__(self, shaper, client):
+        self.shaper = shaper
+        self.client = client
+        self.vtime = 0.0
+        self.pending = 0
+        self.sent_bytes = 0
+        self.opened_at = time.monotonic()
+
+    def acquire(self, nbytes):
+        """发送 nbytes 前调用，必要时阻塞直到轮到本传输且令牌足够"""
+        self.shaper.acquire(self, nbytes)
+
+    def close(self):
+        self.shaper.close_flow(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+class BandwidthShaper:
+    """全局 + 单客户端令牌桶，配合按虚拟时间的加权轮转调度"""
+
+    def __init__(self, global_rate=0, client_rate=0, quantum=DEFAULT_QUANTUM, workers=1):
+        self.quantum = quantum
+        # 多进程模式下本进程只分得全局上限的 1/workers
+        self.workers = max(1, workers)
+        self.global_bucket = TokenBucket(global_rate // self.workers, quantum)
+        self.client_rate = client_rate
+        self.client_buckets = {}
+        # 没有活动传输的客户端 -> 空闲开始时间；令牌桶保留到补满后才删除
+        self.idle_clients = {}
+        self.weights = {}
+        self.flows = set()
+        self.waiting = []
+        self.vclock = 0.0
+        self._cond = threading.Condition()
+
+    @property
+    def enabled(self):
+        return bool(self.global_bucket.rate or self.client_rate)
+
+    def open_flow(self, client):
+        flow = Flow(self, client)
+        with self._cond:
+            flow.vtime = self.vclock
+            self.flows.add(flow)
+            self.idle_clients.pop(client, None)
+            self._drop_idle_buckets(time.monotonic())
+            if client not in self.client_buckets:
+                self.client_buckets[client] = TokenBucket(self.client_rate, self.quantum)
+        return flow
+
+    def close_flow(self, flow):
+        with self._cond:
+            self.flows.discard(flow)
+            if flow in self.waiting:
+                self.waiting.remove(flow)
+            now = time.monotonic()
+            if not any(other.client == flow.client for other in self.flows):
+                # 断开后立即重连的客户端必须沿用已耗尽的令牌桶，否则每次重连都能多拿一次额度
+                self.idle_clients[flow.client] = now
+            self._drop_idle_buckets(now)
+            self._cond.notify_all()
+
+    def _drop_idle_buckets(self, now):
+        """删除空闲且已补满的客户端令牌桶（新建的桶从零开始，补满后再删除不会多给额度）"""
+        for client in list(self.idle_clients):
+            bucket = self.client_buckets.get(client)
+            if bucket is not None:
+                bucket.refill(now)
+                if bucket.rate and bucket.tokens < bucket.capacity:
+                    continue
+            self.client_buckets.pop(client, None)
+            del self.idle_clients[client]
+
+    def set_limits(self, global_rate=None, client_rate=None, weights=None):
+        """运行时调整限速（字节/秒，全局上限为所有工作进程合计）和客户端权重"""
+        with self._cond:
+            if global_rate is not None:
+                self.global_bucket.set_rate(global_rate // self.workers)
+            if client_rate is not None:
+                self.client_rate = client_rate
+                for bucket in self.client_buckets.values():
+                    bucket.set_rate(client_rate)
+            if weights is not None:
+                self.weights.update({client: max(0.01, float(w)) for client, w in weights.items()})
+            self._cond.notify_all()
+
+    def acquire(self, flow, nbytes):
+        # 不限速时不加锁，直接放行
+        if not self.enabled:
+            flow.sent_bytes += nbytes
+            return
+
+        with self._cond:
+            flow.pending = nbytes
+            # 空闲后重新排队的传输从当前虚拟时间开始，不能用积攒的额度抢占
+            flow.vtime = max(flow.vtime, self.vclock)
+            self.waiting.append(flow)
+            while True:
+                now = time.monotonic()
+                self.global_bucket.refill(now)
+                for bucket in self.client_buckets.values():
+                    bucket.refill(now)
+
+                chosen, delay = self._pick()
+                if chosen is flow:
+                    self._grant(flow)
+                    self._cond.notify_all()
+                    return
+                if chosen is not None:
+                    # 轮到其他传输，唤醒它们后继续等待
+                    self._cond.notify_all()
+                    self._cond.wait(0.05)
+                else:
+                    self._cond.wait(max(delay, 0.001))
+
+    def _pick(self):
+        """按虚拟时间从小到大选择第一个令牌足够的等待者，返回 (传输, 无人可发时的等待秒数)"""
+        delay = 1.0
+        for candidate in sorted(self.waiting, key=lambda f: f.vtime):
+            bucket = self.client_buckets.get(candidate.client)
+            if bucket is not None and not bucket.can_take(candidate.pending):
+                # 该客户端已达上限，让给其他客户端
+                delay = min(delay, bucket.wait_time(candidate.pending))
+                continue
+            if not self.global_bucket.can_take(candidate.pending):
+                # 全局令牌不足时保持顺序，等待补充
+                return None, self.global_bucket.wait_time(candidate.pending)
+            return candidate, 0.0
+        return None, delay
+
+    def _grant(self, flow):
+        nbytes = flow.pending
+        self.waiting.remove(flow)
+        self.global_bucket.take(nbytes)
+        bucket = self.client_buckets.get(flow.client)
+        if bucket is not None:
+            bucket.take(nbytes)
+        self.vclock = flow.vtime
+        flow.vtime += nbytes / self.weights.get(flow.client, 1.0)
+        flow.sent_bytes += nbytes
+        flow.pending = 0
+
+    def limits(self):
+        """当前限速设置（字节/秒），用于在工作进程之间同步"""
+        with self._cond:
+            return {
+                'global_rate': self.global_bucket.rate * self.workers,
+                'client_rate': self.client_rate,
+                'weights': dict(self.weights),
+            }
+
+    def status(self):
+        """管理端点返回的当前状态"""
+        with self._cond:
+            now = time.monotonic()
+            flows = [{
+                'client': flow.client,
+                'sent_bytes': flow.sent_bytes,
+                'seconds': round(now - flow.opened_at, 1),
+                'avg_rate_mb': round(flow.sent_bytes / MB / max(now - flow.opened_at, 1e-6), 2),
+                'waiting': flow in self.waiting,
+            } for flow in self.flows]
+            return {
+                'global_rate': self.global_bucket.rate * self.workers / MB,
+                'client_rate': self.client_rate / MB,
+                'workers': self.workers,
+                'weights': dict(self.weights),
+                'active_transfers': len(flows),
+                'flows': sorted(flows, key=lambda f: f['client']),
+            }
+
+def attach_shaper(server, global_rate_mb=0, client_rate_mb=0, admin_token=None, workers=1):
+    """为 HTTP 服务器挂载带宽整形器，速率单位 MB/s；global_rate_mb 为 workers 个工作进程合计"""
+    server.shaper = BandwidthShaper(int(global_rate_mb * MB), int(client_rate_mb * MB), workers=workers)
+    server.admin_token = admin_token
+    return server.shaper
+
+class BandwidthHandlerMixin:
+    """请求处理器混入类：传输限速和 /admin/bandwidth 管理端点
+
+    需要服务器先经过 attach_shaper() 挂载整形器。
+    """
+
+    ADMIN_PATH = '/admin/bandwidth'
+
+    def open_flow(self):
+        """为当前请求登记一个限速传输"""
+        return self.server.shaper.open_flow(self.client_address[0])
+
+    def _admin_allowed(self):
+        token = self.server.admin_token
+        if token:
+            return self.headers.get('X-Admin-Token') == token
+        # 未设置令牌时只允许本机访问
+        return self.client_address[0] in ('127.0.0.1', '::1', '::ffff:127.0.0.1')
+
+    def serve_bandwidth_admin(self):
+        """处理 /admin/bandwidth 的 GET/POST，返回是否已处理"""
+        url = urlsplit(self.path)
+        if url.path != self.ADMIN_PATH:
+            return False
+        if not self._admin_allowed():
+            self.send_error(403, "Admin access denied")
+            return True
+
+        if self.command == 'POST':
+            try:
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                params = json.loads(body) if body.strip() else {}
+                for key, values in parse_qs(url.query).items():
+                    params[key] = values[-1]
+                self.server.shaper.set_limits(
+                    global_rate=int(float(params['global_rate']) * MB) if 'global_rate' in params else None,
+                    client_rate=int(float(params['client_rate']) * MB) if 'client_rate' in params else None,
+                    weights=params.get('weights'),
+                )
+            except (ValueError, TypeError, AttributeError) as e:
+                self.send_error(400, f"Invalid bandwidth settings: {e}")
+                return True
+            # 多进程模式下通知其他工作进程
+            publish = getattr(self.server, 'publish_bandwidth', None)
+            if publish is not None:
+                publish(self.server.shaper.limits())
+            self.log_message("带宽限制已更新: %s", json.dumps(params, ensure_ascii=False))
+
+        body = json.dumps(self.server.shaper.status(), ensure_ascii=False, indent=2).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        self.wfile.write(body)
+        return True
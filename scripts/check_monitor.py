@@ -4,16 +4,42 @@
 
 使用方法:
 python3 scripts/check_monitor.py [--log-file LOG_FILE] [--tail LINES]
+
+时间分桶聚合报告 (错误直方图 / Top-K / 突增检测):
+python3 scripts/check_monitor.py --aggregate [--bucket minute] [--json report.json]
 """
 
 import argparse
+import json
+import math
 import os
 import sys
+import time
+from array import array
 from pathlib import Path
 from datetime import datetime
 import subprocess
 import re
 
+from monitor_logs import ERROR_PATTERNS
+
+# 聚合桶宽度（秒）
+BUCKET_SECONDS = {
+    'second': 1,
+    'minute': 60,
+}
+
+# 超出跟踪上限的错误类型统一归入该键
+OTHER_FINGERPRINT = '<其他>'
+
+# 错误指纹归一化：去掉日志头、PID、数字、十六进制地址和引号内容
+_LOGCAT_HEADER_RE = re.compile(r'^[VDIWEF]/\s*([^\s(:]+)\s*\(\s*\d+\s*\):\s*')
+_HEX_RE = re.compile(r'0x[0-9a-fA-F]+')
+_NUMBER_RE = re.compile(r'\d+')
+_QUOTED_RE = re.compile(r'(["\'])(?:(?!\1).)*\1')
+_SPACES_RE = re.compile(r'\s+')
+_PATTERN_RE = re.compile('|'.join(ERROR_PATTERNS), re.IGNORECASE)
+
 def format_time_ago(timestamp):
     """格式化时间差"""
     now = datetime.now()
@@ -54,7 +80,9 @@ def analyze_log_file(log_file_path):
         'last_time': None,
         'last_error_time': None,
         'file_size': log_file.stat().st_size,
-        'recent_errors': []
+        'recent_errors': [],
+        'shed_notes': 0,
+        'last_shed_note': None
     }
     
     try:
@@ -83,6 +111,10 @@ def analyze_log_file(log_file_path):
                         stats['recent_errors'] = stats['recent_errors'][1:] + [line]
                 elif '[INFO]' in line:
                     stats['info_lines'] += 1
+                elif '[SHED]' in line:
+                    # 监控过载时的降级记录（聚合计数、丢弃统计）
+                    stats['shed_notes'] += 1
+                    stats['last_shed_note'] = line
     
     except Exception as e:
         print(f"❌ 读取日志文件失败: {e}")
@@ -90,6 +122,241 @@ def analyze_log_file(log_file_path):
     
     return stats
 
+def error_fingerprint(message, max_length=120):
+    """将错误消息归一化为指纹，使同类错误落入同一计数器"""
+    header = _LOGCAT_HEADER_RE.match(message)
+    if header:
+        message = f"{header.group(1)}: {message[header.end():]}"
+    message = _HEX_RE.sub('<addr>', message)
+    message = _QUOTED_RE.sub('"…"', message)
+    message = _NUMBER_RE.sub('#', message)
+    message = _SPACES_RE.sub(' ', message).strip()
+    return message[:max_length]
+
+def error_pattern(message):
+    """返回消息命中的第一个错误关键词"""
+    match = _PATTERN_RE.search(message)
+    return match.group(0) if match else OTHER_FINGERPRINT
+
+def _grow(counter, length):
+    """将计数数组补零扩展到指定长度"""
+    missing = length - len(counter)
+    if missing > 0:
+        counter.frombytes(bytes(missing * counter.itemsize))
+
+def aggregate_log_file(log_file_path, bucket_seconds=60, group_by='fingerprint',
+                       max_fingerprints=50):
+    """单次流式扫描日志，按固定时间窗口聚合行数和错误数
+
+    每个桶使用 array('I') 计数，内存只与桶数量 × 跟踪的错误类型数成正比，与行数无关。
+    超过 max_fingerprints 的新错误类型归入 OTHER_FINGERPRINT。
+    """
+    log_file = Path(log_file_path)
+    if not log_file.exists():
+        print(f"❌ 日志文件不存在: {log_file}")
+        return None
+
+    classify = error_pattern if group_by == 'pattern' else error_fingerprint
+    total_counts = array('I')
+    error_counts = array('I')
+    fingerprint_counts = {}
+    fingerprint_totals = {}
+    start_epoch = None
+    untimed_lines = 0
+
+    # 同一秒内的行共享时间戳前缀，缓存解析结果避免重复 strptime
+    last_prefix = None
+    last_epoch = None
+
+    scan_started = time.perf_counter()
+    try:
+        with open(log_file, 'r', encoding='utf-8', errors='replace') as f:
+            for line in f:
+                prefix = line[:19]
+                if prefix != last_prefix:
+                    try:
+                        last_epoch = int(datetime.strptime(prefix, '%Y-%m-%d %H:%M:%S').timestamp())
+                    except ValueError:
+                        last_epoch = None
+                    last_prefix = prefix
+
+                if last_epoch is None:
+                    if line.strip():
+                        untimed_lines += 1
+                    continue
+
+                if start_epoch is None:
+                    # 桶边界对齐到整秒/整分钟
+                    start_epoch = last_epoch - last_epoch % bucket_seconds
+                # 乱序的早期时间戳归入第一个桶
+                index = max(0, (last_epoch - start_epoch) // bucket_seconds)
+                if index >= len(total_counts):
+                    _grow(total_counts, index + 1)
+                    _grow(error_counts, index + 1)
+                total_counts[index] += 1
+
+                marker = line.find('[ERROR] ', 20)
+                if marker == -1:
+                    continue
+                error_counts[index] += 1
+
+                key = classify(line[marker + 8:].rstrip('\n'))
+                counter = fingerprint_counts.get(key)
+                if counter is None:
+                    if len(fingerprint_counts) >= max_fingerprints:
+                        key = OTHER_FINGERPRINT
+                        counter = fingerprint_counts.get(key)
+                    if counter is None:
+                        counter = array('I')
+                        fingerprint_counts[key] = counter
+                        fingerprint_totals[key] = 0
+                if index >= len(counter):
+                    _grow(counter, index + 1)
+                counter[index] += 1
+                fingerprint_totals[key] += 1
+    except Exception as e:
+        print(f"❌ 读取日志文件失败: {e}")
+        return None
+
+    return {
+        'log_file': str(log_file),
+        'bucket_seconds': bucket_seconds,
+        'group_by': group_by,
+        'start_epoch': start_epoch,
+        'total_counts': total_counts,
+        'error_counts': error_counts,
+        'fingerprint_counts': fingerprint_counts,
+        'fingerprint_totals': fingerprint_totals,
+        'untimed_lines': untimed_lines,
+        'scan_seconds': time.perf_counter() - scan_started,
+    }
+
+def detect_spikes(counts, window=30, threshold=3.0, min_count=5):
+    """基于滑动窗口均值/标准差检测错误突增
+
+    当前桶计数超过前 window 个桶的 mean + threshold * std，且不少于 min_count 时判定为突增。
+    """
+    spikes = []
+    # 至少积累若干个桶的历史后才开始判定，避免开头的零基线误报
+    warmup = min(window, 5)
+    window_sum = 0.0
+    window_sq = 0.0
+    for index, value in enumerate(counts):
+        filled = min(index, window)
+        if filled > 0:
+            mean = window_sum / filled
+            std = math.sqrt(max(0.0, window_sq / filled - mean * mean))
+        else:
+            mean = std = 0.0
+
+        if (filled >= warmup and value >= min_count
+                and value > mean + threshold * std and value > 2 * mean):
+            spikes.append({'bucket': index, 'count': value, 'baseline': round(mean, 2)})
+
+        window_sum += value
+        window_sq += value * value
+        if index >= window:
+            dropped = counts[index - window]
+            window_sum -= dropped
+            window_sq -= dropped * dropped
+    return spikes
+
+def rebin(counts, max_rows):
+    """将细粒度桶合并为最多 max_rows 行，返回 (每行桶数, 合并后计数)"""
+    if not counts:
+        return 1, []
+    factor = max(1, math.ceil(len(counts) / max_rows))
+    merged = [sum(counts[i:i + factor]) for i in range(0, len(counts), factor)]
+    return factor, merged
+
+def _bucket_time(aggregation, index):
+    """桶序号转换为可读时间"""
+    epoch = aggregation['start_epoch'] + index * aggregation['bucket_seconds']
+    return datetime.fromtimestamp(epoch).strftime('%Y-%m-%d %H:%M:%S')
+
+def build_aggregation_report(aggregation, top_k=10, max_rows=30, spike_window=30,
+                             spike_threshold=3.0, spike_min_count=5):
+    """由聚合结果生成可序列化的报告"""
+    error_counts = aggregation['error_counts']
+    factor, histogram = rebin(error_counts, max_rows)
+    bucket_seconds = aggregation['bucket_seconds']
+
+    top_errors = sorted(aggregation['fingerprint_totals'].items(),
+                        key=lambda item: item[1], reverse=True)[:top_k]
+
+    spikes = detect_spikes(error_counts, spike_window, spike_threshold, spike_min_count)
+    for spike in spikes:
+        spike['time'] = _bucket_time(aggregation, spike['bucket'])
+        # 找出该桶内贡献最多的错误类型
+        contributors = [
+            (key, counts[spike['bucket']])
+            for key, counts in aggregation['fingerprint_counts'].items()
+            if spike['bucket'] < len(counts) and counts[spike['bucket']]
+        ]
+        contributors.sort(key=lambda item: item[1], reverse=True)
+        spike['top_errors'] = [{'key': k, 'count': c} for k, c in contributors[:3]]
+
+    has_data = aggregation['start_epoch'] is not None
+    return {
+        'log_file': aggregation['log_file'],
+        'bucket_seconds': bucket_seconds,
+        'group_by': aggregation['group_by'],
+        'start_time': _bucket_time(aggregation, 0) if has_data else None,
+        'bucket_count': len(error_counts),
+        'total_lines': sum(aggregation['total_counts']),
+        'error_lines': sum(error_counts),
+        'untimed_lines': aggregation['untimed_lines'],
+        'scan_seconds': round(aggregation['scan_seconds'], 3),
+        'error_series': list(error_counts),
+        'line_series': list(aggregation['total_counts']),
+        'histogram': {
+            'buckets_per_row': factor,
+            'row_seconds': factor * bucket_seconds,
+            'rows': [
+                {'time': _bucket_time(aggregation, i * factor), 'errors': count}
+                for i, count in enumerate(histogram)
+            ] if has_data else [],
+        },
+        'top_errors': [{'key': key, 'count': count} for key, count in top_errors],
+        'spikes': spikes,
+    }
+
+def print_aggregation_report(report, bar_width=40):
+    """以文本形式输出聚合报告"""
+    print(f"📈 错误时间分布: {report['log_file']}")
+    print(f"  桶宽度: {report['bucket_seconds']} 秒, 桶数量: {report['bucket_count']}")
+    print(f"  总行数: {report['total_lines']}, 错误行数: {report['error_lines']}")
+    if report['untimed_lines']:
+        print(f"  无时间戳行: {report['untimed_lines']}")
+    print(f"  扫描耗时: {report['scan_seconds']:.3f} 秒")
+    print()
+
+    rows = report['histogram']['rows']
+    if rows:
+        peak = max(row['errors'] for row in rows) or 1
+        print(f"📊 错误直方图 (每行 {report['histogram']['row_seconds']} 秒):")
+        for row in rows:
+            bar = '█' * round(row['errors'] / peak * bar_width)
+            print(f"  {row['time']} | {row['errors']:>7} {bar}")
+        print()
+
+    if report['top_errors']:
+        label = '错误关键词' if report['group_by'] == 'pattern' else '错误指纹'
+        print(f"🏆 Top {len(report['top_errors'])} {label}:")
+        for i, item in enumerate(report['top_errors'], 1):
+            print(f"  {i:>2}. {item['count']:>7}  {item['key']}")
+        print()
+
+    if report['spikes']:
+        print(f"⚠️  检测到 {len(report['spikes'])} 次错误突增:")
+        for spike in report['spikes']:
+            print(f"  {spike['time']}  {spike['count']} 条 (基线 {spike['baseline']})")
+            for item in spike['top_errors']:
+                print(f"      {item['count']:>5}  {item['key']}")
+    else:
+        print("✅ 未检测到错误突增")
+    print()
+
 def check_monitor_process():
     """检查监控进程是否运行"""
     try:
@@ -119,9 +386,48 @@ def main():
                        help='显示最后几行日志 (默认: 10)')
     parser.add_argument('--errors-only', action='store_true',
                        help='仅显示错误日志')
+    parser.add_argument('--aggregate', '-a', action='store_true',
+                       help='按时间窗口聚合错误，输出直方图、Top-K 和突增检测')
+    parser.add_argument('--bucket', choices=sorted(BUCKET_SECONDS), default='minute',
+                       help='聚合桶宽度 (默认: minute)')
+    parser.add_argument('--group-by', choices=['fingerprint', 'pattern'], default='fingerprint',
+                       help='错误分组方式: 归一化指纹或命中的关键词 (默认: fingerprint)')
+    parser.add_argument('--top-k', type=int, default=10,
+                       help='显示出现最多的错误类型数量 (默认: 10)')
+    parser.add_argument('--max-fingerprints', type=int, default=50,
+                       help='最多单独跟踪的错误类型数量，其余归入"其他" (默认: 50)')
+    parser.add_argument('--hist-rows', type=int, default=30,
+                       help='直方图最多显示的行数 (默认: 30)')
+    parser.add_argument('--spike-window', type=int, default=30,
+                       help='突增检测的基线窗口桶数 (默认: 30)')
+    parser.add_argument('--spike-threshold', type=float, default=3.0,
+                       help='突增判定阈值，单位为标准差 (默认: 3.0)')
+    parser.add_argument('--spike-min-count', type=int, default=5,
+                       help='判定为突增的最小错误数 (默认: 5)')
+    parser.add_argument('--json', metavar='PATH',
+                       help='将聚合报告写入 JSON 文件，使用 - 输出到标准输出')
     
     args = parser.parse_args()
     
+    if args.aggregate or args.json:
+        aggregation = aggregate_log_file(args.log_file, BUCKET_SECONDS[args.bucket],
+                                         args.group_by, args.max_fingerprints)
+        if not aggregation:
+            sys.exit(1)
+        report = build_aggregation_report(aggregation, args.top_k, args.hist_rows,
+                                          args.spike_window, args.spike_threshold,
+                                          args.spike_min_count)
+        if args.json == '-':
+            json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+            print()
+            return
+        print_aggregation_report(report)
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            print(f"💾 聚合报告已保存到: {args.json}")
+        return
+    
     print("=== PlantMeet 日志监控状态 ===")
     
     # 检查监控进程
@@ -144,6 +450,8 @@ def main():
     print(f"  总行数: {stats['total_lines']}")
     print(f"  错误行数: {stats['error_lines']}")
     print(f"  信息行数: {stats['info_lines']}")
+    if stats['shed_notes']:
+        print(f"  ⚠️  降级记录: {stats['shed_notes']} 条 (最近: {stats['last_shed_note']})")
     
     if stats['start_time']:
         print(f"  开始时间: {stats['start_time'].strftime('%Y-%m-%d %H:%M:%S')}")
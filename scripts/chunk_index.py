@@ -0,0 +1,446 @@
+#!/usr/bin/env python3
+"""
+模型文件的内容定义分块（CDC）索引
+
+按文件内容而不是固定偏移切分数据块：每个字节映射为 1 个比特，最近 20 个字节的比特串
+等于固定模式时切分（相当于 20 比特窗口的滚动哈希，随机数据上平均块大小约 1MB）。
+在文件中间插入或删除数据只影响附近的块，其余块的 SHA-256 不变，
+升级模型时客户端只需下载本地没有的块。
+
+同一遍读取还按固定 8MB 块计算 SHA-256（哈希表），服务器在范围响应的头部和 /hashes/<文件名>
+中提供，客户端边下载边校验，损坏时只需重新下载出错的块。
+
+比特映射和模式查找分别用 bytes.translate 和 bytes.find 完成，处理速度接近磁盘读取速度，
+不依赖第三方库。
+
+使用方法:
+python3 scripts/chunk_index.py assets/models/gemma-3n-E4B-it-int4.task
+python3 scripts/chunk_index.py old.task new.task     # 统计两个版本可复用的数据量
+"""
+
+import argparse
+import base64
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from urllib.parse import quote, unquote, urlsplit
+
+MB = 1024 * 1024
+
+INDEX_VERSION = 2
+
+# 切分参数，客户端和服务器必须一致
+BOUNDARY_PATTERN = '10011101000110100110'
+MIN_CHUNK = 256 * 1024
+MAX_CHUNK = 8 * MB
+
+CHUNKER = {
+    'algorithm': 'bitpattern-v1',
+    'pattern': BOUNDARY_PATTERN,
+    'min_size': MIN_CHUNK,
+    'max_size': MAX_CHUNK,
+}
+
+READ_BLOCK = 16 * MB
+
+# 固定大小的校验块，与下载落盘的块大小一致，续传位置总在块边界上
+HASH_BLOCK = 8 * MB
+
+# 范围响应最多在头部列出这么多块的哈希，更大的范围从 /hashes/<文件名> 获取
+MAX_HEADER_BLOCKS = 16
+
+def _bit_table():
+    """字节到比特的映射表，由固定种子的 SHA-256 导出（256 比特正好对应 256 个字节值）"""
+    digest = hashlib.sha256(b'plantmeet-cdc-v1').digest()
+    bits = [(digest[i // 8] >> (i % 8)) & 1 for i in range(256)]
+    return bytes(bits)
+
+BIT_TABLE = _bit_table()
+PATTERN = bytes(int(c) for c in BOUNDARY_PATTERN)
+WINDOW = len(PATTERN)
+
+def cache_dir():
+    """索引缓存目录"""
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return Path(base) / 'plantmeet' / 'chunk-index'
+
+def iter_chunks(f, progress=None):
+    """逐块切分文件对象，产出 (偏移, 长度, sha256)；progress(已处理字节) 可选"""
+    carry = b''
+    block_start = 0
+    chunk_start = 0
+    hasher = hashlib.sha256()
+
+    while True:
+        data = f.read(READ_BLOCK)
+        if not data:
+            break
+        block_end = block_start + len(data)
+
+        # 在映射后的比特串中查找模式，窗口结束位置即候选切分点
+        bits = carry + data.translate(BIT_TABLE)
+        base = block_start - len(carry)
+        candidates = []
+        found = bits.find(PATTERN)
+        while found != -1:
+            candidates.append(base + found + WINDOW)
+            found = bits.find(PATTERN, found + 1)
+
+        cursor = block_start
+        index = 0
+        while True:
+            while index < len(candidates) and candidates[index] < chunk_start + MIN_CHUNK:
+                index += 1
+            cut = chunk_start + MAX_CHUNK
+            if index < len(candidates) and candidates[index] <= cut:
+                cut = candidates[index]
+            if cut > block_end:
+                break
+            hasher.update(data[cursor - block_start:cut - block_start])
+            yield chunk_start, cut - chunk_start, hasher.hexdigest()
+            hasher = hashlib.sha256()
+            chunk_start = cursor = cut
+
+        hasher.update(data[cursor - block_start:])
+        carry = bits[-(WINDOW - 1):]
+        block_start = block_end
+        if progress:
+            progress(block_end)
+
+    if block_start > chunk_start:
+        yield chunk_start, block_start - chunk_start, hasher.hexdigest()
+
+class _HashingReader:
+    """读取时顺便计算整个文件和每个固定大小块的 SHA-256"""
+
+    def __init__(self, f, block_size=HASH_BLOCK):
+        self.f = f
+        self.sha256 = hashlib.sha256()
+        self.block_size = block_size
+        self.blocks = []
+        self._block = hashlib.sha256()
+        self._filled = 0
+
+    def read(self, size):
+        data = self.f.read(size)
+        self.sha256.update(data)
+        view = memoryview(data)
+        while view:
+            n = min(len(view), self.block_size - self._filled)
+            self._block.update(view[:n])
+            self._filled += n
+            view = view[n:]
+            if self._filled == self.block_size:
+                self._finish_block()
+        return data
+
+    def _finish_block(self):
+        self.blocks.append(self._block.hexdigest())
+        self._block = hashlib.sha256()
+        self._filled = 0
+
+    def block_hashes(self):
+        if self._filled:
+            self._finish_block()
+        return self.blocks
+
+def build_index(path, progress=None):
+    """对文件建立分块索引，返回清单 dict"""
+    path = Path(path)
+    started = time.monotonic()
+    with open(path, 'rb') as f:
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        reader = _HashingReader(f)
+        chunks = [[offset, length, digest] for offset, length, digest in iter_chunks(reader, progress)]
+    size = chunks[-1][0] + chunks[-1][1] if chunks else 0
+    return {
+        'version': INDEX_VERSION,
+        'file': path.name,
+        'size': size,
+        'sha256': reader.sha256.hexdigest(),
+        'chunker': dict(CHUNKER),
+        'chunks': chunks,
+        'blocks': {'algorithm': 'sha-256', 'size': HASH_BLOCK, 'sha256': reader.block_hashes()},
+        'index_seconds': round(time.monotonic() - started, 2),
+    }
+
+def hash_table(index):
+    """索引中的固定大小块哈希表（/hashes/<文件名> 的内容）"""
+    return {
+        'file': index['file'],
+        'size': index['size'],
+        'sha256': index['sha256'],
+        'algorithm': index['blocks']['algorithm'],
+        'block_size': index['blocks']['size'],
+        'blocks': index['blocks']['sha256'],
+    }
+
+def verify_blocks(chunks, offset, table, refetch):
+    """把下载的数据流按哈希表的块边界重新组块并逐块校验
+
+    chunks 为从 offset 开始的数据流；校验失败的块调用 refetch(起点, 长度) 单独重新下载，
+    仍然不对时抛出 ValueError。起点不在块边界时第一块不完整，不做校验。
+    """
+    block_size = table['block_size']
+    size = table['size']
+    buffer = bytearray()
+    position = offset
+    for data in chunks:
+        buffer += data
+        while position < size:
+            index = position // block_size
+            length = min((index + 1) * block_size, size) - position
+            if len(buffer) < length:
+                break
+            block = bytes(buffer[:length])
+            del buffer[:length]
+            if position % block_size == 0 and hashlib.sha256(block).hexdigest() != table['blocks'][index]:
+                print(f"\n⚠️  第 {index} 块校验失败，重新下载该块")
+                block = refetch(position, length)
+                if hashlib.sha256(block).hexdigest() != table['blocks'][index]:
+                    raise ValueError(f"第 {index} 块重新下载后仍然校验失败")
+            yield block
+            position += length
+    # 连接提前结束时不足一块的数据照常写入，续传时从块边界重新下载
+    if buffer:
+        yield bytes(buffer)
+
+def _cache_path(path, stat):
+    key = hashlib.sha1(os.fsencode(os.path.abspath(path))).hexdigest()[:16]
+    return cache_dir() / f"{Path(path).name}-{key}-{stat.st_size}-{stat.st_mtime_ns}.json"
+
+def load_or_build_index(path, progress=None):
+    """读取缓存的索引，文件变化后重新建立；多个进程同时调用时只有一个进程建立索引"""
+    stat = os.stat(path)
+    cache_path = _cache_path(path, stat)
+
+    def cached():
+        try:
+            with open(cache_path, 'r') as f:
+                index = json.load(f)
+            if index.get('version') == INDEX_VERSION and index.get('chunker') == CHUNKER:
+                return index
+        except (OSError, ValueError):
+            pass
+        return None
+
+    index = cached()
+    if index is not None:
+        return index
+
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(f"{cache_path}.lock", 'w') as lock:
+        try:
+            import fcntl
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        except ImportError:
+            pass
+        # 等锁期间其他进程可能已经建好
+        index = cached()
+        if index is None:
+            index = build_index(path, progress)
+            tmp_path = f"{cache_path}.tmp{os.getpid()}"
+            with open(tmp_path, 'w') as f:
+                json.dump(index, f)
+            os.replace(tmp_path, cache_path)
+    try:
+        os.unlink(f"{cache_path}.lock")
+    except OSError:
+        pass
+    return index
+
+def reuse_stats(old_index, new_index):
+    """统计新版本中可从旧版本复用的块和字节数"""
+    known = {digest for _, _, digest in old_index['chunks']}
+    reused = [length for _, length, digest in new_index['chunks'] if digest in known]
+    return {
+        'chunks': len(new_index['chunks']),
+        'reused_chunks': len(reused),
+        'reused_bytes': sum(reused),
+        'download_bytes': new_index['size'] - sum(reused),
+    }
+
+def _compressed(data):
+    body = json.dumps(data, separators=(',', ':')).encode('utf-8')
+    return body, gzip.compress(body, 6)
+
+class ChunkIndexStore:
+    """服务器侧：按需在后台建立模型目录中文件的索引，并缓存压缩后的清单和哈希表"""
+
+    def __init__(self, root, files=None):
+        self.root = Path(root)
+        # 不在目录中的文件（如共享模型缓存中的文件）按名称登记
+        self.files = dict(files or {})
+        self._entries = {}
+        self._building = {}
+        self._lock = threading.Lock()
+
+    def warm(self):
+        """启动时在后台读取（或建立）登记文件的索引，哈希表加载到内存后响应头部才带校验值"""
+        for path in self.files.values():
+            path = Path(path)
+            if path.is_file():
+                self._entry(path)
+
+    def resolve(self, name):
+        """只允许访问目录下的普通文件"""
+        if not name or name != Path(name).name or name.startswith('.'):
+            return None
+        path = Path(self.files.get(name, self.root / name))
+        return path if path.is_file() else None
+
+    def _entry(self, path):
+        """索引建好后的缓存条目；尚未建好时启动后台建立并返回 None"""
+        stat = path.stat()
+        key = (str(path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                return entry
+            if key not in self._building:
+                self._building[key] = 0
+                threading.Thread(target=self._build, args=(path, key),
+                                 name='chunk-indexer', daemon=True).start()
+        return None
+
+    def manifest(self, path):
+        """返回 (清单 JSON 字节, gzip 字节)；索引尚未建好时返回 None"""
+        entry = self._entry(path)
+        return entry and entry['manifest']
+
+    def hashes(self, path):
+        """返回 (哈希表 JSON 字节, gzip 字节)；索引尚未建好时返回 None"""
+        entry = self._entry(path)
+        return entry and entry['hashes']
+
+    def digests(self, path):
+        """返回 (整个文件的 sha256, 块大小, 各块 sha256 列表)；索引尚未建好时返回 None"""
+        entry = self._entry(path)
+        return entry and entry['digests']
+
+    def progress(self, path):
+        """后台建立索引的进度 (已处理字节, 文件大小)"""
+        stat = path.stat()
+        return self._building.get((str(path), stat.st_size, stat.st_mtime_ns), 0), stat.st_size
+
+    def _build(self, path, key):
+        def progress(done):
+            self._building[key] = done
+
+        try:
+            index = load_or_build_index(path, progress)
+            blocks = index['blocks']
+            # 清单和哈希表只生成一次，预先压缩好
+            entry = {
+                'manifest': _compressed(index),
+                'hashes': _compressed(hash_table(index)),
+                'digests': (index['sha256'], blocks['size'], blocks['sha256']),
+            }
+            with self._lock:
+                self._entries = {k: v for k, v in self._entries.items() if k[0] != key[0]}
+                self._entries[key] = entry
+        except OSError as e:
+            print(f"⚠️  建立分块索引失败 {path}: {e}")
+        finally:
+            with self._lock:
+                self._building.pop(key, None)
+
+def attach_chunk_index(server, root, files=None):
+    """为 HTTP 服务器挂载分块索引，处理器通过 self.server.chunk_index 访问"""
+    server.chunk_index = ChunkIndexStore(root, files)
+    return server.chunk_index
+
+class ChunkIndexHandlerMixin:
+    """请求处理器混入类：/chunks/<文件名> 分块清单、/hashes/<文件名> 哈希表端点和响应校验头
+
+    需要服务器先经过 attach_chunk_index() 挂载索引。
+    """
+
+    CHUNKS_PREFIX = '/chunks/'
+    HASHES_PREFIX = '/hashes/'
+
+    def send_digest_headers(self, name, file_path, start, length):
+        """发送整个文件的 Repr-Digest 和覆盖 [start, start+length) 的各块 SHA-256
+
+        哈希表尚未加载时不发送，不阻塞文件传输。
+        """
+        digests = self.server.chunk_index.digests(file_path)
+        if digests is None or length <= 0:
+            return
+        sha256, block_size, blocks = digests
+        self.send_header('Repr-Digest', f"sha-256=:{base64.b64encode(bytes.fromhex(sha256)).decode()}:")
+        self.send_header('X-Chunk-Size', str(block_size))
+        first = start // block_size
+        last = (start + length - 1) // block_size
+        if last - first < MAX_HEADER_BLOCKS:
+            self.send_header('X-Chunk-Sha256', ', '.join(f'{i}={blocks[i]}' for i in range(first, last + 1)))
+        self.send_header('Link', f'<{self.HASHES_PREFIX}{quote(name)}>; rel="chunk-hashes"')
+
+    def serve_chunk_manifest(self):
+        """处理 /chunks/<文件名> 和 /hashes/<文件名>，返回是否已处理"""
+        path = urlsplit(self.path).path
+        store = self.server.chunk_index
+        if path.startswith(self.CHUNKS_PREFIX):
+            prefix, lookup = self.CHUNKS_PREFIX, store.manifest
+        elif path.startswith(self.HASHES_PREFIX):
+            prefix, lookup = self.HASHES_PREFIX, store.hashes
+        else:
+            return False
+
+        file_path = store.resolve(unquote(path[len(prefix):]))
+        if file_path is None:
+            self.send_error(404, "File not found")
+            return True
+
+        entry = lookup(file_path)
+        if entry is None:
+            done, total = store.progress(file_path)
+            body = json.dumps({'status': 'indexing', 'indexed_bytes': done, 'size': total}).encode('utf-8')
+            self.send_response(503)
+            self.send_header('Retry-After', '5')
+        else:
+            body, compressed = entry
+            self.send_response(200)
+            if 'gzip' in self.headers.get('Accept-Encoding', ''):
+                body = compressed
+                self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+        return True
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='模型文件分块索引')
+    parser.add_argument('files', nargs='+', help='要建立索引的文件；给出两个文件时统计后者可复用前者的数据量')
+    parser.add_argument('--json', action='store_true', help='输出完整的索引 JSON')
+    args = parser.parse_args()
+
+    indexes = []
+    for file in args.files:
+        index = load_or_build_index(file)
+        indexes.append(index)
+        if args.json:
+            print(json.dumps(index, indent=2))
+            continue
+        sizes = [length for _, length, _ in index['chunks']]
+        print(f"📦 {file}: {index['size'] / MB:.1f} MB, {len(sizes)} 个块, "
+              f"平均 {index['size'] / max(len(sizes), 1) / MB:.2f} MB")
+        print(f"  sha256: {index['sha256']}")
+
+    if len(indexes) == 2 and not args.json:
+        stats = reuse_stats(indexes[0], indexes[1])
+        print(f"\n♻️  可复用 {stats['reused_chunks']}/{stats['chunks']} 个块, "
+              f"{stats['reused_bytes'] / MB:.1f} MB；需下载 {stats['download_bytes'] / MB:.1f} MB")
+
+if __name__ == "__main__":
+    main()
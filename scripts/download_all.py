@@ -0,0 +1,504 @@
+#!/usr/bin/env python3
+"""
+按模型清单批量下载 - 新开发机一条命令准备好应用需要的所有模型
+
+清单（默认 scripts/models.json，也支持 YAML）列出每个模型的下载地址（可多个镜像）、大小、sha256
+和存放位置：
+
+- 所有模型共享一个全局连接数上限，按优先级、再按大小从小到大调度，小文件先就绪
+- 服务器支持范围请求的大文件拆成多段，由空闲连接并发下载，直到最后都占满带宽
+- 写入路径与 download_model.py 相同（预分配 .part 文件、断点续传、完成后原子改名），两者的进度互通
+- 检出目录或共享模型缓存中已有的模型直接跳过；下载完成后校验 sha256 并加入共享模型缓存
+- 清单中没有 sha256 的模型下载后隔离为 <目标>.unverified，标记为未校验并以非零状态码退出，同时打印
+  实际的 sha256 供写入清单；写入清单或加 --allow-unpinned 后重新运行，隔离的文件校验后移到目标位置，
+  不会重新下载。没有 sha256 时只比较大小不算已存在（检出目录中的同大小文件同样隔离后报告）
+- 自带的 models.json 尚未填写 sha256，在写入之前需要加 --allow-unpinned
+- 每秒显示总吞吐量，结束时输出每个模型的用时和平均速度
+
+使用方法:
+python3 scripts/download_all.py --allow-unpinned          # 清单尚未填写 sha256 时
+python3 scripts/download_all.py --connections 8 --order shortest
+python3 scripts/download_all.py --only model.tflite --dry-run
+
+环境变量:
+HF_TOKEN - HuggingFace Access Token（清单中 token_env 指定的变量）
+"""
+
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+import requests
+
+from download_storage import SegmentedPartFile, format_size
+from model_store import ModelStore, file_sha256, link_from_store
+
+MB = 1024 * 1024
+
+DEFAULT_MANIFEST = Path(__file__).parent / 'models.json'
+DEFAULT_CONNECTIONS = 6
+
+# 大于该值且服务器支持范围请求的文件拆分为多段下载
+SPLIT_THRESHOLD = 64 * MB
+MIN_SEGMENT = 32 * MB
+# 每个连接平均分到的段数；段越多，下载末尾越不容易只剩一个连接在工作
+SEGMENTS_PER_CONNECTION = 4
+
+READ_CHUNK = 1 * MB
+MAX_RETRIES = 5
+TIMEOUT = 30
+
+# 吞吐量按最近几秒的滑动窗口计算
+RATE_WINDOW = 5.0
+
+def get_project_root() -> Path:
+    """获取项目根目录"""
+    return Path(__file__).parent.parent
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+class Artifact:
+    """清单中的一个模型文件及其下载状态"""
+
+    def __init__(self, entry, root):
+        missing = [key for key in ('name', 'dest') if not entry.get(key)]
+        if missing or not (entry.get('urls') or entry.get('url')):
+            raise ValueError(f"清单条目缺少字段 {missing or ['urls']}: {entry}")
+        self.name = entry['name']
+        self.urls = list(entry.get('urls') or [entry['url']])
+        self.size = entry.get('size')
+        self.sha256 = entry.get('sha256')
+        self.dest = root / entry['dest']
+        # 清单中没有 sha256 时下载好的文件先放在这里，确认后才移到 dest
+        self.quarantine = self.dest.with_name(self.dest.name + '.unverified')
+        self.priority = entry.get('priority', 0)
+        self.token_env = entry.get('token_env')
+        self.ranges = False
+        self.part = None
+        self.remaining = 0
+        self.status = '等待'
+        self.error = None
+        self.downloaded = 0
+        self.started = None
+        self.finished = None
+
+    def headers(self):
+        headers = {'User-Agent': 'PlantMeet/1.0 Model Downloader'}
+        token = os.environ.get(self.token_env) if self.token_env else None
+        if token:
+            headers['Authorization'] = f'Bearer {token}'
+        return headers
+
+    def is_complete(self, allow_unpinned=False):
+        """检出目录中已有完整文件（只比较大小，与 download_model.py 一致）；没有 sha256 时只比较大小不算完整"""
+        if not self.sha256 and not allow_unpinned:
+            return False
+        return self.size is not None and self.dest.exists() and self.dest.stat().st_size == self.size
+
+    def unverified_file(self):
+        """等待校验的同大小文件：上次隔离的下载，或没有 sha256 时检出目录中已有的文件"""
+        candidates = [self.quarantine] + ([self.dest] if not self.sha256 else [])
+        for path in candidates:
+            if self.size is not None and path.exists() and path.stat().st_size == self.size:
+                return path
+        return None
+
+def load_manifest(path, root=None):
+    """读取模型清单（JSON 或 YAML），返回 Artifact 列表"""
+    path = Path(path)
+    root = root or get_project_root()
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.suffix in ('.yaml', '.yml'):
+            try:
+                import yaml
+            except ImportError:
+                raise SystemExit("❌ 读取 YAML 清单需要 PyYAML: pip install pyyaml")
+            data = yaml.safe_load(f)
+        else:
+            data = json.load(f)
+    entries = data.get('artifacts', []) if isinstance(data, dict) else data
+    return [Artifact(entry, root) for entry in entries]
+
+class ThroughputMeter:
+    """统计总下载字节数和滑动窗口吞吐量"""
+
+    def __init__(self):
+        self.total = 0
+        self._samples = deque()
+        self._lock = threading.Lock()
+
+    def add(self, n):
+        with self._lock:
+            self.total += n
+
+    def rate(self):
+        now = time.monotonic()
+        with self._lock:
+            self._samples.append((now, self.total))
+            while now - self._samples[0][0] > RATE_WINDOW:
+                self._samples.popleft()
+            start, start_total = self._samples[0]
+        return (self.total - start_total) / (now - start) if now > start else 0.0
+
+class BatchDownloader:
+    """在全局连接数上限内调度所有模型（及大文件的分段）的下载"""
+
+    def __init__(self, artifacts, connections=DEFAULT_CONNECTIONS, order='priority', allow_unpinned=False):
+        self.artifacts = artifacts
+        self.connections = max(1, connections)
+        self.order = order
+        self.allow_unpinned = allow_unpinned
+        self.jobs = queue.Queue()
+        self.meter = ThroughputMeter()
+        self.active = 0
+        self.stop = threading.Event()
+        self._lock = threading.Lock()
+        self._print_lock = threading.Lock()
+        self._finalizers = []
+
+    def log(self, message):
+        """输出一行消息，不与进度行混在一起"""
+        with self._print_lock:
+            print(f"\r\033[K{message}", flush=True)
+
+    def probe(self, artifact):
+        """HEAD 请求获取大小和范围请求支持；依次尝试各个镜像"""
+        for url in artifact.urls:
+            try:
+                response = requests.head(url, headers=artifact.headers(), allow_redirects=True, timeout=TIMEOUT)
+                response.raise_for_status()
+            except requests.RequestException as e:
+                self.log(f"⚠️  {artifact.name}: {url} 不可用 ({e})")
+                continue
+            remote_size = int(response.headers.get('content-length', 0))
+            if remote_size:
+                if artifact.size is not None and artifact.size != remote_size:
+                    self.log(f"⚠️  {artifact.name}: 远程文件大小 {remote_size} 与清单 {artifact.size} 不一致，以远程为准")
+                artifact.size = remote_size
+            artifact.ranges = response.headers.get('accept-ranges', '').lower() == 'bytes'
+            return True
+        artifact.status = '失败'
+        artifact.error = '所有下载地址都不可用'
+        return False
+
+    def prepare(self):
+        """跳过已有的模型，探测其余模型并把下载分段放入队列"""
+        if self.order == 'shortest':
+            key = lambda a: (a.size is None, a.size or 0, a.priority)
+        else:
+            key = lambda a: (a.priority, a.size is None, a.size or 0)
+
+        for artifact in self.artifacts:
+            if artifact.is_complete(self.allow_unpinned):
+                artifact.status = '已存在'
+            elif artifact.size is not None and self._link_from_store(artifact):
+                artifact.status = '共享缓存'
+        pending = [a for a in self.artifacts if a.status == '等待']
+
+        # 并发探测，避免某个镜像超时拖慢启动
+        probes = [threading.Thread(target=self.probe, args=(a,), daemon=True) for a in pending]
+        for thread in probes:
+            thread.start()
+        for thread in probes:
+            thread.join()
+
+        jobs = []
+        for artifact in sorted(pending, key=key):
+            if artifact.status != '等待':
+                continue
+            if not artifact.size:
+                artifact.status = '失败'
+                artifact.error = '无法获取文件大小'
+                continue
+            if artifact.is_complete(self.allow_unpinned):
+                artifact.status = '已存在'
+                continue
+            unverified = artifact.unverified_file()
+            if unverified:
+                # 已下载过、等待校验的文件不重新下载
+                self._accept(artifact, unverified)
+                continue
+            if self._link_from_store(artifact):
+                artifact.status = '共享缓存'
+                continue
+
+            segment_size = artifact.size
+            if artifact.ranges and artifact.size > SPLIT_THRESHOLD:
+                segments = self.connections * SEGMENTS_PER_CONNECTION
+                segment_size = max(MIN_SEGMENT, -(-artifact.size // segments))
+            artifact.part = SegmentedPartFile(artifact.dest, artifact.size, identity=artifact.urls[0],
+                                              segment_size=segment_size)
+            artifact.status = '下载中'
+            jobs.append((artifact, artifact.part.open()))
+
+        for artifact, segments in jobs:
+            artifact.remaining = len(segments)
+            resumed = artifact.part.received
+            if resumed:
+                self.log(f"↩️  {artifact.name}: 从 {format_size(resumed)} 处续传")
+            if not segments:
+                self._finish(artifact)
+            for segment in segments:
+                self.jobs.put((artifact, segment))
+        return [artifact for artifact, _ in jobs]
+
+    def _link_from_store(self, artifact):
+        """从共享缓存链接；没有 sha256 时按文件名和大小匹配的缓存不可信，不使用"""
+        if not artifact.sha256 and not self.allow_unpinned:
+            return False
+        return link_from_store(artifact.dest, artifact.size, artifact.sha256)
+
+    def _worker(self):
+        session = requests.Session()
+        while not self.stop.is_set():
+            try:
+                artifact, segment = self.jobs.get_nowait()
+            except queue.Empty:
+                return
+            if artifact.error:
+                continue
+            if artifact.started is None:
+                artifact.started = time.monotonic()
+            try:
+                done = self._fetch(session, artifact, segment)
+            except (OSError, ValueError) as e:
+                artifact.error = str(e)
+                artifact.status = '失败'
+                self.log(f"❌ {artifact.name}: {e}")
+                continue
+            if not done:
+                continue
+            with self._lock:
+                artifact.remaining -= 1
+                last = artifact.remaining == 0
+            if last:
+                self._finish(artifact)
+
+    def _fetch(self, session, artifact, segment):
+        """下载一个分段，网络错误时换镜像重试；返回是否下载完整（中途停止时为 False）"""
+        whole = segment[0] == 0 and segment[1] == artifact.size
+        urls = list(artifact.urls)
+        error = None
+        for attempt in range(MAX_RETRIES):
+            if self.stop.is_set() or artifact.error:
+                return False
+            if attempt:
+                time.sleep(min(2 ** attempt, 30))
+            url = urls[attempt % len(urls)]
+            headers = artifact.headers()
+            if segment[2] > 0 or not whole:
+                headers['Range'] = f'bytes={segment[2]}-{segment[1] - 1}'
+            with self._lock:
+                self.active += 1
+            try:
+                with session.get(url, headers=headers, stream=True, timeout=TIMEOUT) as response:
+                    response.raise_for_status()
+                    if 'Range' in headers and response.status_code != 206:
+                        if not whole:
+                            raise ValueError("服务器不支持范围请求")
+                        artifact.part.reset_segment(segment)
+                    for chunk in response.iter_content(chunk_size=READ_CHUNK):
+                        if self.stop.is_set():
+                            return False
+                        artifact.part.write_at(segment, chunk)
+                        artifact.downloaded += len(chunk)
+                        self.meter.add(len(chunk))
+                if segment[2] == segment[1]:
+                    return True
+                error = f"连接提前关闭 ({format_size(segment[2] - segment[0])}/{format_size(segment[1] - segment[0])})"
+            except requests.RequestException as e:
+                error = str(e)
+                status = e.response.status_code if e.response is not None else None
+                if status and 400 <= status < 500 and status not in (408, 429):
+                    # 客户端错误重试也不会成功，换下一个镜像
+                    urls.remove(url)
+                    if not urls:
+                        raise OSError(error)
+            finally:
+                with self._lock:
+                    self.active -= 1
+            self.log(f"⚠️  {artifact.name}: {error}，重试 ({attempt + 1}/{MAX_RETRIES})")
+        raise OSError(f"重试 {MAX_RETRIES} 次后仍失败: {error}")
+
+    def _finish(self, artifact):
+        """所有分段完成后在后台改名、校验并加入共享缓存，不占用下载连接"""
+        with self._lock:
+            # 中断后不再开始改名；.part 中各段都已完成，重新运行时直接改名
+            if self.stop.is_set():
+                return
+            thread = threading.Thread(target=self._finalize, args=(artifact,), daemon=True)
+            thread.start()
+            self._finalizers.append(thread)
+
+    def _finalize(self, artifact):
+        try:
+            artifact.part.commit()
+            artifact.part.close()
+        except (OSError, ValueError) as e:
+            artifact.status = '失败'
+            artifact.error = str(e)
+            self.log(f"❌ {artifact.name}: {e}")
+            return
+        artifact.finished = time.monotonic()
+        self._accept(artifact, artifact.dest)
+
+    def _accept(self, artifact, path):
+        """校验下载好的文件（目标文件或隔离的文件），通过后放到目标位置并加入共享缓存；
+        清单中没有 sha256 时隔离为 .unverified 并报告实际的 sha256"""
+        try:
+            digest = file_sha256(path)
+            if artifact.sha256 and digest != artifact.sha256.lower():
+                path.unlink()
+                raise ValueError(f"SHA-256 校验失败 (期望 {artifact.sha256}，实际 {digest})")
+            if not artifact.sha256 and not self.allow_unpinned:
+                if path != artifact.quarantine:
+                    os.replace(path, artifact.quarantine)
+                artifact.status = '未校验'
+                artifact.error = f'清单中没有 sha256，实际 "size": {artifact.size}, "sha256": "{digest}"'
+                self.log(f"❌ {artifact.name}: 清单中没有 sha256，文件未经校验，已隔离为 {artifact.quarantine}\n"
+                         f"   确认来源可信后写入清单: \"size\": {artifact.size}, \"sha256\": \"{digest}\"，"
+                         f"或加 --allow-unpinned 重新运行")
+                # 未经校验的文件不放进共享缓存，以免其他检出目录按文件名复用
+                return
+            if path != artifact.dest:
+                os.replace(path, artifact.dest)
+            artifact.status = '完成'
+            self.log(f"✅ {artifact.name} {'下载完成' if artifact.finished else '校验通过'} "
+                     f"({format_size(artifact.size)})")
+        except (OSError, ValueError) as e:
+            artifact.status = '失败'
+            artifact.error = str(e)
+            self.log(f"❌ {artifact.name}: {e}")
+            return
+
+        try:
+            store = ModelStore()
+            digest = store.add_file(artifact.dest, digest)
+            store.link_into(digest, artifact.dest)
+        except OSError as e:
+            self.log(f"⚠️  {artifact.name}: 加入共享模型缓存失败: {e}")
+
+    def _report(self, total):
+        while not self.stop.wait(1.0):
+            rate = self.meter.rate()
+            done = sum(a.part.received for a in self.artifacts if a.part)
+            left = (total - done) / rate if rate > 0 else 0
+            with self._print_lock:
+                print(f"\r⬇️  {done / total * 100:5.1f}% ({format_size(done)}/{format_size(total)})  "
+                      f"{format_size(rate)}/s  连接 {self.active}/{self.connections}  "
+                      f"剩余 {format_duration(left)}\033[K", end='', flush=True)
+
+    def run(self):
+        """下载所有模型，返回是否全部成功"""
+        downloading = self.prepare()
+        total = sum(a.size for a in downloading)
+        started = time.monotonic()
+
+        if downloading:
+            print(f"\n开始下载 {len(downloading)} 个模型，共 {format_size(total)}，"
+                  f"{self.jobs.qsize()} 个分段，最多 {self.connections} 个连接")
+            reporter = threading.Thread(target=self._report, args=(total,), daemon=True)
+            reporter.start()
+            workers = [threading.Thread(target=self._worker, daemon=True) for _ in range(self.connections)]
+            for worker in workers:
+                worker.start()
+            try:
+                for worker in workers:
+                    while worker.is_alive():
+                        worker.join(0.5)
+                for thread in list(self._finalizers):
+                    thread.join()
+            except KeyboardInterrupt:
+                self.log("🛑 已中断，重新运行即可续传")
+            finally:
+                with self._lock:
+                    self.stop.set()
+                    finalizers = list(self._finalizers)
+                # 正在改名和校验的模型要等它完成，否则会关闭正在 commit() 的 .part 文件
+                for thread in finalizers:
+                    while thread.is_alive():
+                        thread.join(0.5)
+                for artifact in downloading:
+                    if artifact.status == '下载中':
+                        artifact.part.close()
+
+        self.summary(time.monotonic() - started)
+        return all(a.status in ('完成', '已存在', '共享缓存') for a in self.artifacts)
+
+    def summary(self, elapsed):
+        print("\n📊 下载汇总:")
+        for a in self.artifacts:
+            icon = {'完成': '✅', '已存在': '⏭️ ', '共享缓存': '📦', '失败': '❌', '未校验': '❌'}.get(a.status, '⏸️ ')
+            size = format_size(a.size) if a.size else '-'
+            line = f"  {icon} {a.name:<32} {size:>10}  {a.status}"
+            if a.status == '完成' and a.started is not None:
+                seconds = max(a.finished - a.started, 1e-3)
+                line += f"  {format_duration(seconds)}  {format_size(a.downloaded / seconds)}/s"
+            elif a.error:
+                line += f": {a.error}"
+            print(line)
+        if self.meter.total:
+            print(f"总计下载 {format_size(self.meter.total)}，用时 {format_duration(elapsed)}，"
+                  f"平均 {format_size(self.meter.total / max(elapsed, 1e-3))}/s")
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='按模型清单批量下载 PlantMeet 所需模型')
+    parser.add_argument('--manifest', '-m', default=str(DEFAULT_MANIFEST), help='模型清单 (JSON/YAML)')
+    parser.add_argument('--connections', '-c', type=int, default=DEFAULT_CONNECTIONS,
+                        help=f'全局最大并发连接数 (默认: {DEFAULT_CONNECTIONS})')
+    parser.add_argument('--order', choices=['priority', 'shortest'], default='priority',
+                        help='调度顺序: priority=按优先级再按大小, shortest=小文件优先 (默认: priority)')
+    parser.add_argument('--only', action='append', metavar='NAME', help='只下载指定名称的模型，可重复')
+    parser.add_argument('--dry-run', action='store_true', help='只显示下载计划')
+    parser.add_argument('--allow-unpinned', action='store_true',
+                        help='清单中没有 sha256 的模型也视为成功，只比较大小 (默认: 隔离为 .unverified、'
+                             '打印实际 sha256 并以状态码 1 退出；自带的 models.json 尚未填写 sha256)')
+    args = parser.parse_args()
+
+    artifacts = load_manifest(args.manifest)
+    if args.only:
+        unknown = set(args.only) - {a.name for a in artifacts}
+        if unknown:
+            print(f"❌ 清单中没有: {', '.join(sorted(unknown))}")
+            sys.exit(1)
+        artifacts = [a for a in artifacts if a.name in args.only]
+
+    print("🌱 PlantMeet 模型批量下载")
+    print(f"清单: {args.manifest} ({len(artifacts)} 个模型)")
+
+    unpinned = [a.name for a in artifacts if not a.sha256]
+    if unpinned and not args.allow_unpinned:
+        print(f"⚠️  清单中没有 sha256，下载后无法校验，将隔离并以状态码 1 退出: {', '.join(unpinned)}")
+        print("   在清单中填写 sha256，或确认来源可信后加 --allow-unpinned")
+
+    downloader = BatchDownloader(artifacts, args.connections, args.order, args.allow_unpinned)
+    if args.dry_run:
+        for artifact in artifacts:
+            if not artifact.is_complete(args.allow_unpinned):
+                downloader.probe(artifact)
+            size = format_size(artifact.size) if artifact.size else '未知大小'
+            if artifact.is_complete(args.allow_unpinned):
+                state = '已存在'
+            elif artifact.unverified_file():
+                state = '待校验'
+            else:
+                state = '可分段' if artifact.ranges else '单连接'
+            print(f"  [{artifact.priority}] {artifact.name:<32} {size:>10}  {state}  -> {artifact.dest}")
+        return
+
+    success = downloader.run()
+    sys.exit(0 if success else 1)
+
+if __name__ == "__main__":
+    main()
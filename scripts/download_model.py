@@ -5,22 +5,35 @@
 使用方法:
 python3 scripts/download_model.py
 
+增量更新（从本地模型服务器只下载变化的数据块）:
+python3 scripts/download_model.py --delta --url http://192.168.1.100:8001/gemma-3n-E4B-it-int4.task
+
 环境变量:
 HF_TOKEN - HuggingFace Access Token (可选，也可以在脚本中设置)
 """
 
 import os
 import sys
+import time
+import argparse
 import requests
 from pathlib import Path
 import hashlib
 from typing import Optional
+from urllib.parse import urlsplit, urlunsplit
+
+from chunk_index import CHUNKER, load_or_build_index, verify_blocks
+from download_storage import PartFile
+from model_store import ModelStore, link_from_store, resolve_model, share_with_store
 
 # 模型配置
 MODEL_URL = "https://huggingface.co/google/gemma-3n-E4B-it-litert-preview/resolve/main/gemma-3n-E4B-it-int4.task"
 MODEL_FILENAME = "gemma-3n-E4B-it-int4.task"
 EXPECTED_SIZE = 4405655031  # 约 4.1GB
 
+# 增量更新时单个范围请求最多合并的字节数
+MAX_DELTA_REQUEST = 64 * 1024 * 1024
+
 # HuggingFace Token (优先使用环境变量)
 HF_TOKEN = os.getenv('HF_TOKEN', 'your_hf_token_here')
 
@@ -57,7 +70,7 @@ def check_existing_file(file_path: Path) -> bool:
         print(f"⚠️  文件大小不匹配 (期望: {format_size(EXPECTED_SIZE)})")
         return False
 
-def download_model(url: str, output_path: Path, token: Optional[str] = None) -> bool:
+def download_model(url: str, output_path: Path, token: Optional[str] = None, direct: bool = False) -> bool:
     """下载模型文件"""
     headers = {
         'User-Agent': 'PlantMeet/1.0 Model Downloader'
@@ -83,57 +96,249 @@ def download_model(url: str, output_path: Path, token: Optional[str] = None) ->
         if remote_size != EXPECTED_SIZE:
             print(f"⚠️  远程文件大小异常 (期望: {format_size(EXPECTED_SIZE)})")
         
-        # 检查是否支持断点续传
-        downloaded_size = 0
-        mode = 'wb'
-        
-        if output_path.exists():
-            downloaded_size = output_path.stat().st_size
-            if downloaded_size > 0 and downloaded_size < remote_size:
-                print(f"检测到部分下载文件 ({format_size(downloaded_size)})，将续传")
-                headers['Range'] = f'bytes={downloaded_size}-'
-                mode = 'ab'
-            elif downloaded_size >= remote_size:
-                print("✅ 文件已完整下载")
-                return True
-        
-        # 开始下载
-        print(f"\n开始下载... (从 {format_size(downloaded_size)} 处继续)")
-        response = requests.get(url, headers=headers, stream=True)
-        response.raise_for_status()
+        if remote_size <= 0:
+            print("❌ 无法获取远程文件大小")
+            return False
         
-        # 创建目录
-        output_path.parent.mkdir(parents=True, exist_ok=True)
+        if output_path.exists() and output_path.stat().st_size >= remote_size:
+            print("✅ 文件已完整下载")
+            return True
         
-        total_size = downloaded_size + int(response.headers.get('content-length', 0))
+        # 本地模型服务器提供分块哈希表时边下载边校验，损坏的块单独重新下载
+        table = None
+        if 'X-Chunk-Size' in head_response.headers:
+            table = fetch_hash_table(url, headers)
+            if table and table.get('size') == remote_size:
+                print(f"将按 {format_size(table['block_size'])} 分块校验下载的数据")
+            else:
+                table = None
+        base_headers = dict(headers)
         
-        with open(output_path, mode) as f:
-            received = downloaded_size
-            chunk_size = 8192  # 8KB chunks
+        # 数据先写入 .part 文件（预分配完整大小），完成后原子改名
+        with PartFile(output_path, remote_size, identity=url, direct=direct) as part:
+            if part.offset:
+                print(f"检测到未完成的下载 ({format_size(part.offset)})，将续传")
+                headers['Range'] = f'bytes={part.offset}-'
+            
+            # 开始下载
+            print(f"\n开始下载... (从 {format_size(part.offset)} 处继续)")
+            response = requests.get(url, headers=headers, stream=True)
+            response.raise_for_status()
+            if part.offset and response.status_code != 206:
+                print("⚠️  服务器不支持续传，从头下载")
+                part.reset()
+            
+            chunks = response.iter_content(chunk_size=1024 * 1024)
+            if table:
+                chunks = verify_blocks(chunks, part.offset, table,
+                                       lambda start, length: fetch_range(url, base_headers, start, length))
+            for chunk in chunks:
+                part.write(chunk)
+                
+                # 显示进度
+                progress = (part.received / remote_size) * 100
+                print(f"\r下载进度: {progress:.1f}% ({format_size(part.received)}/{format_size(remote_size)})", 
+                      end='', flush=True)
             
-            for chunk in response.iter_content(chunk_size=chunk_size):
-                if chunk:
-                    f.write(chunk)
-                    received += len(chunk)
-                    
-                    # 显示进度
-                    if total_size > 0:
-                        progress = (received / total_size) * 100
-                        print(f"\r下载进度: {progress:.1f}% ({format_size(received)}/{format_size(total_size)})", 
-                              end='', flush=True)
+            part.commit()
+            received = part.received
         
         print(f"\n✅ 下载完成! 文件大小: {format_size(received)}")
         return True
         
     except requests.RequestException as e:
-        print(f"❌ 下载失败: {e}")
+        print(f"\n❌ 下载失败: {e}（已下载部分保留在 .part 文件中，重新运行即可续传）")
+        return False
+    except OSError as e:
+        print(f"\n❌ 写入失败: {e}")
+        return False
+    except ValueError as e:
+        print(f"\n❌ 下载失败: {e}（已通过校验的部分保留在 .part 文件中）")
         return False
     except Exception as e:
         print(f"❌ 未知错误: {e}")
         return False
 
+def hashes_url_for(url: str) -> str:
+    """模型文件URL对应的分块哈希表URL（本地模型服务器的 /hashes/<文件名>）"""
+    parts = urlsplit(url)
+    name = parts.path.rsplit('/', 1)[-1]
+    return urlunsplit((parts.scheme, parts.netloc, f'/hashes/{name}', '', ''))
+
+def fetch_hash_table(url: str, headers: dict) -> Optional[dict]:
+    """获取分块哈希表；服务器还没有建好时返回 None，不做分块校验"""
+    try:
+        response = requests.get(hashes_url_for(url), headers=headers, timeout=30)
+        response.raise_for_status()
+        return response.json()
+    except (requests.RequestException, ValueError):
+        return None
+
+def fetch_range(url: str, headers: dict, start: int, length: int) -> bytes:
+    """用范围请求重新下载一段数据"""
+    response = requests.get(url, headers={**headers, 'Range': f'bytes={start}-{start + length - 1}'},
+                            timeout=60)
+    response.raise_for_status()
+    if response.status_code != 206 or len(response.content) != length:
+        raise ValueError(f"重新下载 {start}-{start + length - 1} 失败")
+    return response.content
+
+def manifest_url_for(url: str) -> str:
+    """模型文件URL对应的分块清单URL（本地模型服务器的 /chunks/<文件名>）"""
+    parts = urlsplit(url)
+    name = parts.path.rsplit('/', 1)[-1]
+    return urlunsplit((parts.scheme, parts.netloc, f'/chunks/{name}', '', ''))
+
+def fetch_manifest(url: str, headers: dict, timeout: float = 900) -> dict:
+    """获取分块清单；服务器正在建立索引时按 Retry-After 等待"""
+    manifest_url = manifest_url_for(url)
+    deadline = time.monotonic() + timeout
+    waited = False
+    while True:
+        response = requests.get(manifest_url, headers=headers, timeout=30)
+        if response.status_code != 503 or time.monotonic() > deadline:
+            if waited:
+                print()
+            response.raise_for_status()
+            return response.json()
+        info = response.json()
+        waited = True
+        if info.get('size'):
+            print(f"\r服务器正在建立分块索引: {info['indexed_bytes'] / info['size'] * 100:.0f}%",
+                  end='', flush=True)
+        time.sleep(int(response.headers.get('Retry-After', 5)))
+
+def fetch_chunks(url: str, headers: dict, chunks: list, out, file_hash) -> int:
+    """用一个范围请求下载连续的若干块，逐块校验后写入 out，返回下载的字节数"""
+    start = chunks[0][0]
+    end = chunks[-1][0] + chunks[-1][1]
+    response = requests.get(url, headers={**headers, 'Range': f'bytes={start}-{end - 1}'},
+                            stream=True, timeout=60)
+    response.raise_for_status()
+    if response.status_code != 206:
+        raise ValueError("服务器不支持范围请求")
+
+    pending = iter(chunks)
+    offset, length, digest = next(pending)
+    buffer = bytearray()
+    for piece in response.iter_content(chunk_size=65536):
+        buffer += piece
+        while length is not None and len(buffer) >= length:
+            data = bytes(buffer[:length])
+            del buffer[:length]
+            if hashlib.sha256(data).hexdigest() != digest:
+                raise ValueError(f"数据块校验失败 (偏移 {offset})")
+            out.write(data)
+            file_hash.update(data)
+            offset, length, digest = next(pending, (None, None, None))
+    if length is not None:
+        raise ValueError(f"数据块下载不完整 (偏移 {offset})")
+    return end - start
+
+def download_model_delta(url: str, output_path: Path, base_path: Optional[Path] = None) -> bool:
+    """增量更新模型文件：本地已有的块从旧文件复制，只下载缺少的块，最后整体校验后替换"""
+    headers = {
+        'User-Agent': 'PlantMeet/1.0 Model Downloader'
+    }
+    # 检出目录中没有旧文件时复用共享缓存中的同名文件
+    base_path = base_path or resolve_model(output_path)
+    
+    print(f"开始增量更新:")
+    print(f"URL: {url}")
+    print(f"目标: {output_path}")
+    print(f"复用: {base_path if base_path.exists() else '无（完整下载）'}")
+    
+    try:
+        print("\n获取分块清单...")
+        manifest = fetch_manifest(url, headers)
+        if manifest.get('chunker') != CHUNKER:
+            print(f"❌ 服务器的分块参数与本地不一致: {manifest.get('chunker')}")
+            return False
+        chunks = manifest['chunks']
+        print(f"远程文件: {format_size(manifest['size'])}, {len(chunks)} 个块")
+        
+        # 共享缓存中已有这个版本时直接链接
+        store = ModelStore()
+        if store.has(manifest['sha256']):
+            method = store.link_into(manifest['sha256'], output_path)
+            print(f"✅ 共享模型缓存中已有该版本 ({method})")
+            return True
+        
+        local = {}
+        if base_path.exists():
+            print("索引本地文件...")
+            base_index = load_or_build_index(base_path)
+            if base_path == output_path and base_index['sha256'] == manifest['sha256']:
+                print("✅ 本地文件已是最新版本")
+                return True
+            local = {digest: offset for offset, _, digest in base_index['chunks']}
+        
+        missing = sum(length for _, length, digest in chunks if digest not in local)
+        print(f"可复用: {format_size(manifest['size'] - missing)}，需下载: {format_size(missing)}")
+        
+        file_hash = hashlib.sha256()
+        downloaded = 0
+        with PartFile(output_path, manifest['size'], identity=manifest['sha256'],
+                      adopt_legacy=False) as out, \
+                open(base_path if local else os.devnull, 'rb') as base:
+            # 整体校验需要从头计算哈希，增量更新不续传
+            out.reset()
+            i = 0
+            while i < len(chunks):
+                offset, length, digest = chunks[i]
+                if digest in local:
+                    base.seek(local[digest])
+                    data = base.read(length)
+                    if hashlib.sha256(data).hexdigest() != digest:
+                        raise ValueError("本地文件在建立索引后被修改，请重新运行")
+                    out.write(data)
+                    file_hash.update(data)
+                    i += 1
+                else:
+                    # 合并连续缺失的块为一个范围请求
+                    j = i
+                    while (j < len(chunks) and chunks[j][2] not in local and
+                           chunks[j][0] - offset < MAX_DELTA_REQUEST):
+                        j += 1
+                    downloaded += fetch_chunks(url, headers, chunks[i:j], out, file_hash)
+                    i = j
+                written = chunks[i - 1][0] + chunks[i - 1][1]
+                print(f"\r更新进度: {written / manifest['size'] * 100:.1f}% "
+                      f"(已下载 {format_size(downloaded)}/{format_size(missing)})", end='', flush=True)
+        
+            if file_hash.hexdigest() != manifest['sha256']:
+                print("\n❌ 文件校验失败 (SHA-256 不一致)")
+                return False
+            out.commit()
+        
+        try:
+            store.add_file(output_path, manifest['sha256'])
+        except OSError as e:
+            print(f"\n⚠️  加入共享模型缓存失败: {e}")
+        print(f"\n✅ 增量更新完成! 下载 {format_size(downloaded)}，"
+              f"复用 {format_size(manifest['size'] - downloaded)}")
+        return True
+        
+    except requests.RequestException as e:
+        print(f"\n❌ 下载失败: {e}")
+        return False
+    except (OSError, ValueError) as e:
+        print(f"\n❌ 增量更新失败: {e}")
+        return False
+
 def main():
     """主函数"""
+    parser = argparse.ArgumentParser(description='PlantMeet 模型下载器')
+    parser.add_argument('--url', default=MODEL_URL, help='模型文件URL (默认: HuggingFace)')
+    parser.add_argument('--delta', action='store_true',
+                        help='增量更新: 从本地模型服务器的分块清单只下载变化的数据块')
+    parser.add_argument('--base', type=Path,
+                        help='增量更新时复用的旧模型文件 (默认: 目标文件)')
+    parser.add_argument('--yes', '-y', action='store_true', help='不询问确认')
+    parser.add_argument('--direct', action='store_true',
+                        help='使用 O_DIRECT 写入，不占用页缓存 (仅 Linux)')
+    args = parser.parse_args()
+    
     print("=== PlantMeet 模型下载器 ===")
     print("用于 debug 阶段预下载模型到 assets 目录\n")
     
@@ -154,11 +359,27 @@ def main():
     # 目标文件路径
     model_path = assets_dir / MODEL_FILENAME
     
+    if args.delta:
+        # 增量更新只用于本地模型服务器，不发送 HuggingFace Token
+        if download_model_delta(args.url, model_path, args.base):
+            print(f"\n🎉 模型更新成功!")
+            print(f"文件位置: {model_path}")
+        else:
+            print("\n❌ 模型更新失败")
+            sys.exit(1)
+        return
+    
     # 检查已存在文件
     if check_existing_file(model_path):
+        share_with_store(model_path)
         print("\n✅ 模型文件已存在且完整，无需下载")
         return
     
+    # 其他检出目录已下载过时直接链接共享缓存
+    if link_from_store(model_path, EXPECTED_SIZE):
+        print("\n✅ 模型文件已就绪，无需下载")
+        return
+    
     # 确认下载
     print(f"\n准备下载模型文件:")
     print(f"- 文件: {MODEL_FILENAME}")
@@ -166,7 +387,7 @@ def main():
     print(f"- 保存: {model_path}")
     
     try:
-        confirm = input("\n继续下载? (y/N): ").strip().lower()
+        confirm = 'y' if args.yes else input("\n继续下载? (y/N): ").strip().lower()
         if confirm != 'y':
             print("取消下载")
             return
@@ -175,9 +396,10 @@ def main():
         return
     
     # 下载模型
-    success = download_model(MODEL_URL, model_path, HF_TOKEN)
+    success = download_model(args.url, model_path, HF_TOKEN, args.direct)
     
     if success:
+        share_with_store(model_path)
         print(f"\n🎉 模型下载成功!")
         print(f"文件位置: {model_path}")
         print(f"\n下次编译应用时，模型将自动从 assets 加载，无需重新下载。")
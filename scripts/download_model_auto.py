@@ -11,6 +11,9 @@ import sys
 import requests
 from pathlib import Path
 
+from download_storage import PartFile
+from model_store import link_from_store, share_with_store
+
 # 模型配置
 MODEL_URL = "https://huggingface.co/google/gemma-3n-E4B-it-litert-preview/resolve/main/gemma-3n-E4B-it-int4.task"
 MODEL_FILENAME = "gemma-3n-E4B-it-int4.task"
@@ -72,52 +75,52 @@ def download_model(url: str, output_path: Path, token: str) -> bool:
         remote_size = int(head_response.headers.get('content-length', 0))
         print(f"远程文件大小: {format_size(remote_size)}")
         
-        # 检查断点续传
-        downloaded_size = 0
-        mode = 'wb'
-        
-        if output_path.exists():
-            downloaded_size = output_path.stat().st_size
-            if downloaded_size > 0 and downloaded_size < remote_size:
-                print(f"检测到部分下载文件 ({format_size(downloaded_size)})，将续传")
-                headers['Range'] = f'bytes={downloaded_size}-'
-                mode = 'ab'
-            elif downloaded_size >= remote_size:
-                print("✅ 文件已完整下载")
-                return True
-        
-        # 开始下载
-        print(f"\n开始下载... (从 {format_size(downloaded_size)} 处继续)")
-        response = requests.get(url, headers=headers, stream=True, timeout=30)
-        response.raise_for_status()
+        if remote_size <= 0:
+            print("❌ 无法获取远程文件大小")
+            return False
         
-        # 创建目录
-        output_path.parent.mkdir(parents=True, exist_ok=True)
+        if output_path.exists() and output_path.stat().st_size >= remote_size:
+            print("✅ 文件已完整下载")
+            return True
         
-        total_size = downloaded_size + int(response.headers.get('content-length', 0))
-        
-        with open(output_path, mode) as f:
-            received = downloaded_size
+        # 数据先写入 .part 文件（预分配完整大小），完成后原子改名
+        with PartFile(output_path, remote_size, identity=url) as part:
+            if part.offset:
+                print(f"检测到部分下载文件 ({format_size(part.offset)})，将续传")
+                headers['Range'] = f'bytes={part.offset}-'
+            
+            # 开始下载
+            print(f"\n开始下载... (从 {format_size(part.offset)} 处继续)")
+            response = requests.get(url, headers=headers, stream=True, timeout=30)
+            response.raise_for_status()
+            if part.offset and response.status_code != 206:
+                print("⚠️  服务器不支持续传，从头下载")
+                part.reset()
+            
             chunk_size = 1024 * 1024  # 1MB chunks for faster download
             progress_counter = 0
             
             for chunk in response.iter_content(chunk_size=chunk_size):
                 if chunk:
-                    f.write(chunk)
-                    received += len(chunk)
+                    part.write(chunk)
                     progress_counter += 1
                     
                     # 每 10MB 显示一次进度
                     if progress_counter % 10 == 0:
-                        if total_size > 0:
-                            progress = (received / total_size) * 100
-                            print(f"下载进度: {progress:.1f}% ({format_size(received)}/{format_size(total_size)})")
+                        progress = (part.received / remote_size) * 100
+                        print(f"下载进度: {progress:.1f}% ({format_size(part.received)}/{format_size(remote_size)})")
+            
+            part.commit()
+            received = part.received
         
         print(f"\n✅ 下载完成! 文件大小: {format_size(received)}")
         return True
         
     except requests.RequestException as e:
-        print(f"❌ 下载失败: {e}")
+        print(f"\n❌ 下载失败: {e}（已下载部分保留在 .part 文件中，重新运行即可续传）")
+        return False
+    except OSError as e:
+        print(f"\n❌ 写入失败: {e}")
         return False
     except Exception as e:
         print(f"❌ 未知错误: {e}")
@@ -143,9 +146,15 @@ def main():
     
     # 检查已存在文件
     if check_existing_file(model_path):
+        share_with_store(model_path)
         print("\n✅ 模型文件已存在且完整，无需下载")
         return
     
+    # 其他检出目录已下载过时直接链接共享缓存
+    if link_from_store(model_path, EXPECTED_SIZE):
+        print("\n✅ 模型文件已就绪，无需下载")
+        return
+    
     # 显示下载信息
     print(f"\n开始自动下载模型文件:")
     print(f"- 文件: {MODEL_FILENAME}")
@@ -156,6 +165,7 @@ def main():
     success = download_model(MODEL_URL, model_path, HF_TOKEN)
     
     if success:
+        share_with_store(model_path)
         print(f"\n🎉 模型下载成功!")
         print(f"文件位置: {model_path}")
         print(f"\n下次编译应用时，模型将自动从 assets 加载，无需重新下载。")
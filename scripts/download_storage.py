@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+大文件下载的落盘层
+
+- 下载前检查剩余空间，不足时立即失败，而不是写到一半才报 ENOSPC
+- 用 posix_fallocate 一次预分配完整大小，避免文件边写边增长产生碎片
+- 数据凑满对齐的大块后用 os.pwrite 写到明确的偏移；可选 O_DIRECT 绕过页缓存
+- 数据写在 <目标>.part 中，已落盘的进度记录在 <目标>.part.json，中断后可以续传
+- 全部写完并 fsync 后才原子改名为目标文件，目标文件名下永远不会出现半个文件
+"""
+
+import errno
+import json
+import mmap
+import os
+import shutil
+import threading
+from pathlib import Path
+
+MB = 1024 * 1024
+
+# 写入块大小（O_DIRECT 要求偏移和长度按块设备扇区对齐，8MB 满足所有常见设备）
+BLOCK_SIZE = 8 * MB
+
+# 每写入多少字节 fdatasync 一次并更新进度记录
+SYNC_EVERY = 256 * MB
+
+def format_size(size_bytes):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size_bytes < 1024.0:
+            return f"{size_bytes:.1f} {unit}"
+        size_bytes /= 1024.0
+    return f"{size_bytes:.1f} TB"
+
+def contiguous_prefix(segments):
+    """从文件开头起连续写完的字节数"""
+    position = 0
+    for start, end, done in sorted(segments):
+        if start != position:
+            break
+        position = done
+        if done < end:
+            break
+    return position
+
+class PartFile:
+    """下载中的 .part 文件，用法:
+
+        with PartFile(target, size, identity=url) as part:
+            start = part.offset          # 续传位置
+            for data in ...:
+                part.write(data)
+            part.commit()                # 校验大小后原子改名
+    """
+
+    def __init__(self, target, size, identity=None, direct=False, block_size=BLOCK_SIZE,
+                 adopt_legacy=True):
+        self.target = Path(target)
+        self.size = size
+        self.identity = identity
+        self.direct = direct and hasattr(os, 'O_DIRECT')
+        self.block_size = block_size
+        # 目标文件是旧版本模型（如增量更新的基准）时不能当作半个文件接管
+        self.adopt_legacy = adopt_legacy
+        self.path = self.target.with_name(self.target.name + '.part')
+        self.state_path = self.target.with_name(self.target.name + '.part.json')
+        self.offset = 0
+        self.fd = None
+        self.committed = False
+        self._synced = 0
+        # 匿名映射按页对齐，可直接用于 O_DIRECT 写入
+        self._buffer = mmap.mmap(-1, block_size)
+        self._view = memoryview(self._buffer)
+        self._filled = 0
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def _read_state(self):
+        try:
+            with open(self.state_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _matches(self, state):
+        return bool(state) and state.get('size') == self.size and \
+            state.get('identity') == self.identity and self.path.exists()
+
+    def _load_state(self):
+        """读取上次中断时已落盘的位置；文件或来源不一致时从头开始"""
+        state = self._read_state()
+        if self._matches(state):
+            if 'segments' in state:
+                # 分段并发下载留下的进度，从头开始连续完成的部分可以续传
+                return contiguous_prefix(state['segments'])
+            return min(int(state.get('offset', 0)), self.size)
+
+        # 旧版本直接写在目标文件名下的半个文件，改名后接着下载
+        if not state and self.adopt_legacy and self.target.exists() and 0 < self.target.stat().st_size < self.size:
+            os.replace(self.target, self.path)
+            return self.path.stat().st_size
+        return 0
+
+    def _save_state(self):
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'size': self.size, 'identity': self.identity, 'offset': self.offset}, f)
+        os.replace(tmp_path, self.state_path)
+
+    def check_space(self):
+        """剩余空间不足以写完整个文件时抛出 OSError(ENOSPC)"""
+        allocated = 0
+        if self.path.exists():
+            allocated = self.path.stat().st_blocks * 512
+        free = shutil.disk_usage(self.path.parent).free
+        needed = self.size - allocated
+        if needed > free:
+            raise OSError(errno.ENOSPC,
+                          f"磁盘空间不足: 需要 {format_size(needed)}，可用 {format_size(free)} ({self.path.parent})")
+
+    def open(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.offset = self._load_state()
+        # 续传位置对齐到块边界，保证后续写入全部对齐
+        self.offset -= self.offset % self.block_size
+        if not self.offset and self.path.exists():
+            self.path.unlink()
+        self.check_space()
+
+        flags = os.O_WRONLY | os.O_CREAT
+        self.fd = self._allocate(flags)
+        if self.direct:
+            try:
+                os.close(self.fd)
+                self.fd = os.open(self.path, flags | os.O_DIRECT)
+            except OSError:
+                # 文件系统（如 tmpfs）不支持 O_DIRECT
+                self.direct = False
+                self.fd = os.open(self.path, flags)
+        self._synced = self.offset
+        self._save_state()
+        return self.offset
+
+    def _allocate(self, flags):
+        """打开 .part 文件并预分配完整大小"""
+        fd = os.open(self.path, flags, 0o644)
+        try:
+            if hasattr(os, 'posix_fallocate'):
+                try:
+                    os.posix_fallocate(fd, 0, self.size)
+                except OSError as e:
+                    if e.errno == errno.ENOSPC:
+                        raise
+                    # 文件系统不支持预分配时退化为设置文件长度
+                    os.ftruncate(fd, self.size)
+            else:
+                os.ftruncate(fd, self.size)
+        except OSError:
+            os.close(fd)
+            raise
+        return fd
+
+    def reset(self):
+        """服务器不支持续传时从头开始写"""
+        self._filled = 0
+        self.offset = 0
+        self._synced = 0
+        self._save_state()
+
+    def write(self, data):
+        """追加数据，凑满一个块后写入磁盘"""
+        data = memoryview(data)
+        while data:
+            n = min(len(data), self.block_size - self._filled)
+            self._view[self._filled:self._filled + n] = data[:n]
+            self._filled += n
+            data = data[n:]
+            if self._filled == self.block_size:
+                self._flush_block()
+
+    def _flush_block(self):
+        if self.offset + self._filled > self.size:
+            raise ValueError(f"写入超出预期大小 {self.size}")
+        view = self._view[:self._filled]
+        if self.direct and self._filled % self.block_size:
+            # 文件末尾不足一个块，关闭 O_DIRECT 后写入
+            import fcntl
+            fcntl.fcntl(self.fd, fcntl.F_SETFL, fcntl.fcntl(self.fd, fcntl.F_GETFL) & ~os.O_DIRECT)
+        written = 0
+        while written < len(view):
+            written += os.pwrite(self.fd, view[written:], self.offset + written)
+        self.offset += self._filled
+        self._filled = 0
+        if self.offset - self._synced >= SYNC_EVERY:
+            self.sync()
+
+    def sync(self):
+        """把已写入的数据落盘并记录进度，中断后从这里续传"""
+        if hasattr(os, 'fdatasync'):
+            os.fdatasync(self.fd)
+        else:
+            os.fsync(self.fd)
+        self._synced = self.offset
+        self._save_state()
+
+    @property
+    def received(self):
+        """已接收的字节数（含缓冲中尚未写入的数据）"""
+        return self.offset + self._filled
+
+    def commit(self):
+        """写完剩余数据，校验大小，落盘后原子改名为目标文件"""
+        if self._filled:
+            self._flush_block()
+        if self.offset != self.size:
+            raise ValueError(f"下载不完整: {self.offset}/{self.size} 字节")
+        os.fsync(self.fd)
+        os.close(self.fd)
+        self.fd = None
+        os.replace(self.path, self.target)
+        try:
+            self.state_path.unlink()
+        except OSError:
+            pass
+        # 改名本身也要落盘
+        try:
+            dir_fd = os.open(self.target.parent, os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+        except OSError:
+            pass
+        self.committed = True
+
+    def close(self):
+        """未完成时保留 .part 和进度记录（缓冲中不足一个块的数据丢弃，续传时重新下载）"""
+        if self.fd is not None:
+            try:
+                self.sync()
+            finally:
+                os.close(self.fd)
+                self.fd = None
+        self._view.release()
+        self._buffer.close()
+
+class SegmentedPartFile(PartFile):
+    """多个连接分段并发写入的 .part 文件，每段单独记录进度，用法:
+
+        with SegmentedPartFile(target, size, identity=url, segment_size=64 * MB) as part:
+            for segment in part.pending():      # [起点, 终点, 已写到的位置]
+                ... part.write_at(segment, data)   # 可在多个线程中调用
+            part.commit()
+
+    状态文件与 PartFile 通用：顺序下载留下的进度按分段接着下载，反之亦然（取开头连续完成的部分）。
+    """
+
+    def __init__(self, target, size, identity=None, segment_size=None):
+        # 数据直接按偏移 pwrite，不需要 PartFile 的对齐缓冲
+        super().__init__(target, size, identity, block_size=mmap.PAGESIZE)
+        self.segment_size = segment_size or max(size, 1)
+        self.segments = []
+        self._lock = threading.RLock()
+        self._unsynced = 0
+
+    def _plan(self, offset=0):
+        segments = []
+        for start in range(0, self.size, self.segment_size):
+            end = min(start + self.segment_size, self.size)
+            segments.append([start, end, max(start, min(end, offset))])
+        return segments
+
+    def open(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        state = self._read_state()
+        if self._matches(state) and 'segments' in state:
+            # 沿用上次的分段方式
+            self.segments = [list(segment) for segment in state['segments']]
+        else:
+            self.segments = self._plan(self._load_state())
+        if not self.received and self.path.exists():
+            self.path.unlink()
+        self.check_space()
+        self.fd = self._allocate(os.O_WRONLY | os.O_CREAT)
+        self._save_state()
+        return self.pending()
+
+    def pending(self):
+        """尚未写完的分段"""
+        return [segment for segment in self.segments if segment[2] < segment[1]]
+
+    def _save_state(self):
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'size': self.size, 'identity': self.identity, 'segments': self.segments}, f)
+        os.replace(tmp_path, self.state_path)
+
+    def reset_segment(self, segment):
+        """服务器忽略范围请求时该段从头写"""
+        with self._lock:
+            segment[2] = segment[0]
+
+    def write_at(self, segment, data):
+        """把 data 写到分段的当前位置"""
+        view = memoryview(data)
+        if segment[2] + len(view) > segment[1]:
+            raise ValueError(f"写入超出分段范围 {segment[0]}-{segment[1]}")
+        written = 0
+        while written < len(view):
+            written += os.pwrite(self.fd, view[written:], segment[2] + written)
+        with self._lock:
+            segment[2] += len(view)
+            self._unsynced += len(view)
+            if self._unsynced >= SYNC_EVERY:
+                self.sync()
+
+    def sync(self):
+        with self._lock:
+            if hasattr(os, 'fdatasync'):
+                os.fdatasync(self.fd)
+            else:
+                os.fsync(self.fd)
+            self._unsynced = 0
+            self._save_state()
+
+    @property
+    def received(self):
+        return sum(done - start for start, _, done in self.segments)
+
+    def commit(self):
+        if self.pending():
+            raise ValueError(f"下载不完整: {self.received}/{self.size} 字节")
+        self.offset = self.size
+        super().commit()
@@ -0,0 +1,769 @@
+#!/usr/bin/env python3
+"""
+遇见记录数据库基准测试 - 用合成数据评估 drift 表结构在大数据量下的查询性能和候选索引
+
+1. 按 lib/services/database.dart 的表结构（drift 生成的 SQL，蛇形列名、日期为 Unix 秒）建库
+2. 生成贴近真实使用的合成数据（默认 2000 个物种、10 万条遇见记录），在事务中批量插入:
+   物种出现频率呈长尾分布，坐标集中在若干城市周边，近期记录更多，部分记录未识别或手动归类
+3. 运行应用中典型的查询（图鉴、物种详情、未识别列表、今日记录、地图范围等），
+   统计耗时中位数/p95 并记录 EXPLAIN QUERY PLAN
+4. 逐个建立候选索引（包括经纬度网格分桶的表达式索引），重新测量查询，
+   记录建索引耗时、索引大小和插入开销，按加速效果给出推荐，最后同时建立推荐的索引再测一轮
+5. 输出 JSON 报告（含 schemaVersion），给出基线报告时逐项比较查询耗时
+
+只使用标准库 sqlite3。测量的是热缓存下的耗时，与设备上的绝对值不同，主要用于比较。
+
+使用方法:
+python3 scripts/encounter_db_bench.py                                     # 10 万条记录
+python3 scripts/encounter_db_bench.py --encounters 500000 --species 5000 -o db-report.json
+python3 scripts/encounter_db_bench.py --save-baseline db-baseline.json
+python3 scripts/encounter_db_bench.py --baseline db-baseline.json          # 与基线比较
+"""
+
+import argparse
+import json
+import platform
+import random
+import re
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+SCRIPT_DIR = Path(__file__).parent
+DATABASE_DART = SCRIPT_DIR.parent / 'lib' / 'services' / 'database.dart'
+
+# 与 drift 生成的建表语句一致（DateTime 存为 Unix 秒，bool 存为带 CHECK 的整数）
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS "plant_species_table" (
+        "id" TEXT NOT NULL,
+        "scientific_name" TEXT NOT NULL,
+        "common_name" TEXT NOT NULL,
+        "description" TEXT NULL,
+        "is_toxic" INTEGER NULL CHECK ("is_toxic" IN (0, 1)),
+        "toxicity_info" TEXT NULL,
+        "created_at" INTEGER NOT NULL,
+        "updated_at" INTEGER NOT NULL,
+        PRIMARY KEY ("id"))''',
+    '''CREATE TABLE IF NOT EXISTS "plant_encounter_table" (
+        "id" TEXT NOT NULL,
+        "species_id" TEXT NULL,
+        "encounter_date" INTEGER NOT NULL,
+        "location" TEXT NULL,
+        "latitude" REAL NULL,
+        "longitude" REAL NULL,
+        "photo_paths" TEXT NOT NULL,
+        "notes" TEXT NULL,
+        "source" INTEGER NOT NULL,
+        "method" INTEGER NOT NULL,
+        "user_defined_name" TEXT NULL,
+        "is_identified" INTEGER NOT NULL DEFAULT 0 CHECK ("is_identified" IN (0, 1)),
+        "merged_to_species_id" TEXT NULL,
+        "created_at" INTEGER NOT NULL,
+        "updated_at" INTEGER NOT NULL,
+        PRIMARY KEY ("id"))''',
+    '''CREATE TABLE IF NOT EXISTS "app_settings_table" (
+        "id" INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+        "base_url" TEXT NULL,
+        "api_key" TEXT NULL,
+        "enable_location" INTEGER NOT NULL DEFAULT 1 CHECK ("enable_location" IN (0, 1)),
+        "auto_save_location" INTEGER NOT NULL DEFAULT 1 CHECK ("auto_save_location" IN (0, 1)),
+        "save_original_photos" INTEGER NOT NULL DEFAULT 1 CHECK ("save_original_photos" IN (0, 1)),
+        "enable_local_recognition" INTEGER NOT NULL DEFAULT 1 CHECK ("enable_local_recognition" IN (0, 1)),
+        "created_at" INTEGER NOT NULL,
+        "updated_at" INTEGER NOT NULL)''',
+]
+
+# RecognitionSource / RecognitionMethod 的枚举下标（intEnum 按声明顺序存储）
+SOURCES = 2          # camera, gallery
+METHODS = 6          # embedded, local, cloud, hybrid, manual, none
+METHOD_WEIGHTS = [40, 10, 25, 15, 7, 3]
+
+# 坐标集中的城市: (纬度, 经度, 范围 度)
+HOTSPOTS = [
+    (39.90, 116.40, 0.30), (31.23, 121.47, 0.30), (23.13, 113.26, 0.25), (22.54, 114.06, 0.20),
+    (30.57, 104.07, 0.25), (30.27, 120.15, 0.20), (34.26, 108.94, 0.20), (25.04, 102.71, 0.20),
+    (29.56, 106.55, 0.25), (36.07, 120.38, 0.15), (24.48, 118.09, 0.15), (45.80, 126.53, 0.20),
+]
+
+GENERA = ['Acer', 'Rosa', 'Prunus', 'Quercus', 'Pinus', 'Camellia', 'Ficus', 'Magnolia', 'Salix', 'Ginkgo',
+          'Osmanthus', 'Rhododendron', 'Lilium', 'Iris', 'Viola', 'Begonia', 'Hibiscus', 'Jasminum',
+          'Paeonia', 'Chrysanthemum', 'Taraxacum', 'Trifolium', 'Plantago', 'Oxalis', 'Euphorbia']
+EPITHETS = ['japonica', 'chinensis', 'alba', 'rubra', 'vulgaris', 'officinalis', 'sinensis', 'major',
+            'minor', 'palmatum', 'grandiflora', 'indica', 'orientalis', 'repens', 'lanceolata',
+            'montana', 'sylvestris', 'fragrans', 'biloba', 'corniculata', 'mume', 'serrulata']
+NAME_PARTS = ['红', '白', '紫', '黄', '小', '大', '野', '山', '水', '金', '银', '香', '毛', '细叶', '长叶']
+NAME_KINDS = ['枫', '蔷薇', '樱', '栎', '松', '茶', '榕', '玉兰', '柳', '杏', '桂', '杜鹃', '百合', '鸢尾',
+              '堇菜', '海棠', '木槿', '茉莉', '牡丹', '菊', '蒲公英', '车轴草', '车前', '酢浆草', '大戟']
+LOCATIONS = ['公园', '小区', '校园', '植物园', '路边', '山上', '河边', '阳台', '办公室', '湿地']
+
+DAY = 86400
+
+# 网格分桶：0.1 度（约 11 公里），纬度和经度偏移到正数后合成一个整数
+GEO_CELL_SCALE = 10
+GEO_CELL_EXPR = ('(CAST(("latitude" + 90) * 10 AS INTEGER) * 3600 '
+                 '+ CAST(("longitude" + 180) * 10 AS INTEGER))')
+
+# 地图视野内网格数超过该值时不使用分桶查询
+MAX_GEO_CELLS = 400
+
+GALLERY_PAGE = 50
+
+# 推荐索引的条件：至少让一个查询加速这么多倍，且该查询原本耗时不低于 MIN_QUERY_MS
+MIN_SPEEDUP = 2.0
+MIN_QUERY_MS = 0.2
+
+# 与基线比较时的默认容差（查询耗时上升超过该比例视为回退）
+DEFAULT_TOLERANCE = 0.25
+
+# 应用中的典型查询: 名称 -> (说明, SQL)，参数由 QueryParams.params() 按名称生成
+QUERIES = {
+    'all_species': ('加载全部物种 (getAllSpecies)',
+                    'SELECT * FROM "plant_species_table"'),
+    'species_by_id': ('物种详情 (getSpecies)',
+                      'SELECT * FROM "plant_species_table" WHERE "id" = ?'),
+    'species_by_names': ('识别结果查找已有物种 (findSpeciesByNames)',
+                         'SELECT * FROM "plant_species_table" WHERE "scientific_name" = ? AND "common_name" = ?'),
+    'species_by_common_name': ('按俗名查找物种 (findSpeciesByCommonName)',
+                               'SELECT * FROM "plant_species_table" WHERE LOWER("common_name") = ?'),
+    'all_encounters': ('启动时加载全部遇见记录 (getAllEncounters)',
+                       'SELECT * FROM "plant_encounter_table"'),
+    'encounter_by_id': ('遇见记录详情 (getEncounter)',
+                        'SELECT * FROM "plant_encounter_table" WHERE "id" = ?'),
+    'encounters_by_species': ('物种的遇见记录，按时间倒序 (getSpeciesEncounters)',
+                              'SELECT * FROM "plant_encounter_table" WHERE "species_id" = ? '
+                              'ORDER BY "encounter_date" DESC'),
+    'encounters_for_species': ('物种的记录，含手动归类的记录 (getEncountersForSpecies)',
+                               'SELECT * FROM "plant_encounter_table" WHERE "species_id" = ? '
+                               'OR "merged_to_species_id" = ?'),
+    'species_encounter_count': ('物种的遇见次数 (getEncounterCount)',
+                                'SELECT COUNT(*) FROM "plant_encounter_table" WHERE "species_id" = ?'),
+    'species_first_last': ('物种首次/最近遇见时间',
+                           'SELECT MIN("encounter_date"), MAX("encounter_date") FROM "plant_encounter_table" '
+                           'WHERE "species_id" = ?'),
+    'gallery_page': ('相册分页，按时间倒序',
+                     f'SELECT * FROM "plant_encounter_table" ORDER BY "encounter_date" DESC '
+                     f'LIMIT {GALLERY_PAGE} OFFSET ?'),
+    'unidentified': ('未识别列表，按时间倒序 (getUnidentifiedEncounters)',
+                     'SELECT * FROM "plant_encounter_table" WHERE "is_identified" = 0 '
+                     'ORDER BY "encounter_date" DESC'),
+    'day_range': ('某一天的记录（今日分享）',
+                  'SELECT * FROM "plant_encounter_table" WHERE "encounter_date" >= ? AND "encounter_date" < ?'),
+    'map_bbox': ('地图视野内的记录',
+                 'SELECT "id", "species_id", "latitude", "longitude" FROM "plant_encounter_table" '
+                 'WHERE "latitude" BETWEEN ? AND ? AND "longitude" BETWEEN ? AND ?'),
+}
+
+# 候选索引: 名称 -> (建索引语句, 改写的查询 {查询名: SQL}, 同时需要的索引)
+# 分桶索引只对按网格查询的 SQL 有效，改写后的查询与原查询返回相同的行；
+# OR 条件只有两边的列都有索引时才能走索引，所以 merged_to_species_id 的索引要和 species_id 的一起测
+CANDIDATES = {
+    'idx_encounter_date': ('CREATE INDEX "idx_encounter_date" ON "plant_encounter_table" ("encounter_date")',
+                           {}, ()),
+    'idx_encounter_species_date': ('CREATE INDEX "idx_encounter_species_date" ON "plant_encounter_table" '
+                                   '("species_id", "encounter_date")', {}, ()),
+    'idx_encounter_merged': ('CREATE INDEX "idx_encounter_merged" ON "plant_encounter_table" '
+                             '("merged_to_species_id")', {}, ('idx_encounter_species_date',)),
+    'idx_encounter_identified_date': ('CREATE INDEX "idx_encounter_identified_date" ON "plant_encounter_table" '
+                                      '("is_identified", "encounter_date")', {}, ()),
+    'idx_encounter_lat_lng': ('CREATE INDEX "idx_encounter_lat_lng" ON "plant_encounter_table" '
+                              '("latitude", "longitude")', {}, ()),
+    'idx_encounter_geo_cell': (f'CREATE INDEX "idx_encounter_geo_cell" ON "plant_encounter_table" '
+                               f'({GEO_CELL_EXPR})',
+                               {'map_bbox': 'SELECT "id", "species_id", "latitude", "longitude" '
+                                            f'FROM "plant_encounter_table" WHERE {GEO_CELL_EXPR} IN '
+                                            '(SELECT value FROM json_each(?)) '
+                                            'AND "latitude" BETWEEN ? AND ? AND "longitude" BETWEEN ? AND ?'},
+                               ()),
+    'idx_species_common_name_lower': ('CREATE INDEX "idx_species_common_name_lower" ON "plant_species_table" '
+                                      '(LOWER("common_name"))', {}, ()),
+    'idx_species_names': ('CREATE INDEX "idx_species_names" ON "plant_species_table" '
+                          '("scientific_name", "common_name")', {}, ()),
+}
+
+def schema_version():
+    """database.dart 中的 schemaVersion，读不到时返回 None"""
+    try:
+        match = re.search(r'schemaVersion\s*=>\s*(\d+)', DATABASE_DART.read_text(encoding='utf-8'))
+    except OSError:
+        return None
+    return int(match.group(1)) if match else None
+
+def format_size(size_bytes):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size_bytes < 1024:
+            return f"{size_bytes:.1f}{unit}"
+        size_bytes /= 1024
+    return f"{size_bytes:.1f}TB"
+
+def geo_cell(latitude, longitude):
+    """与 GEO_CELL_EXPR 相同的网格编号"""
+    return int((latitude + 90) * GEO_CELL_SCALE) * 3600 + int((longitude + 180) * GEO_CELL_SCALE)
+
+def geo_cells(min_lat, max_lat, min_lng, max_lng):
+    """覆盖经纬度范围的所有网格，过多时返回 None"""
+    lat_cells = range(int((min_lat + 90) * GEO_CELL_SCALE), int((max_lat + 90) * GEO_CELL_SCALE) + 1)
+    lng_cells = range(int((min_lng + 180) * GEO_CELL_SCALE), int((max_lng + 180) * GEO_CELL_SCALE) + 1)
+    if len(lat_cells) * len(lng_cells) > MAX_GEO_CELLS:
+        return None
+    return [lat * 3600 + lng for lat in lat_cells for lng in lng_cells]
+
+# ---- 合成数据 ----
+
+def make_species(rng, count, now):
+    rows = []
+    seen = set()
+    for i in range(count):
+        scientific = f"{rng.choice(GENERA)} {rng.choice(EPITHETS)}"
+        common = f"{rng.choice(NAME_PARTS)}{rng.choice(NAME_KINDS)}"
+        # 学名和俗名的组合需要唯一（findSpeciesByNames 按组合查找）
+        if (scientific, common) in seen:
+            scientific = f"{scientific} var. {i}"
+        seen.add((scientific, common))
+        created = now - rng.randrange(3 * 365 * DAY)
+        toxic = rng.random() < 0.08
+        rows.append((
+            str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+            scientific,
+            common,
+            f"{common}（{scientific}）的描述。" * rng.randint(1, 6),
+            (1 if toxic else 0) if rng.random() < 0.7 else None,
+            '误食可能引起不适' if toxic else None,
+            created,
+            created + rng.randrange(30 * DAY),
+        ))
+    return rows
+
+def make_encounters(rng, count, species_ids, now, batch_size):
+    """按批次产出遇见记录"""
+    # 物种出现频率呈长尾分布（常见物种占大多数记录）
+    cum_weights = []
+    total = 0.0
+    for rank in range(len(species_ids)):
+        total += 1 / (rank + 1) ** 1.1
+        cum_weights.append(total)
+    span = 3 * 365 * DAY
+    batch = []
+    for _ in range(count):
+        # 近期记录更多
+        date = now - int(span * rng.random() ** 1.6)
+        identified = rng.random() >= 0.2
+        species_id = rng.choices(species_ids, cum_weights=cum_weights)[0] if identified else None
+        merged = None
+        if not identified and rng.random() < 0.15:
+            merged = rng.choices(species_ids, cum_weights=cum_weights)[0]
+            identified = True
+        if rng.random() < 0.85:
+            lat, lng, radius = rng.choice(HOTSPOTS)
+            latitude = round(rng.gauss(lat, radius / 2), 6)
+            longitude = round(rng.gauss(lng, radius / 2), 6)
+            location = f"{rng.choice(LOCATIONS)} {latitude:.4f}, {longitude:.4f}"
+        else:
+            latitude = longitude = location = None
+        photos = [f"/data/user/0/com.plantmeet.app/app_flutter/photos/{rng.getrandbits(64):016x}.jpg"
+                  for _ in range(rng.choices((1, 2, 3, 4), weights=(60, 25, 10, 5))[0])]
+        batch.append((
+            str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+            species_id,
+            date,
+            location,
+            latitude,
+            longitude,
+            json.dumps(photos),
+            '在路边看到的，花开得很好。' if rng.random() < 0.3 else None,
+            rng.randrange(SOURCES),
+            rng.choices(range(METHODS), weights=METHOD_WEIGHTS)[0] if species_id else METHODS - 1,
+            f"不认识的植物 {rng.randrange(1000)}" if species_id is None and rng.random() < 0.5 else None,
+            1 if identified else 0,
+            merged,
+            date,
+            date + (rng.randrange(7 * DAY) if rng.random() < 0.2 else 0),
+        ))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+ENCOUNTER_INSERT = 'INSERT INTO "plant_encounter_table" VALUES (' + ', '.join(['?'] * 15) + ')'
+
+def create_database(path, species_count, encounter_count, seed, batch_size):
+    """建库并批量插入合成数据，返回 (连接, 数据集信息)"""
+    rng = random.Random(seed)
+    # 固定“现在”，同一种子生成的数据在不同时间运行时相同
+    now = 1_750_000_000
+    conn = sqlite3.connect(path, isolation_level=None)
+    for statement in SCHEMA:
+        conn.execute(statement)
+
+    started = time.perf_counter()
+    species = make_species(rng, species_count, now)
+    conn.execute('BEGIN')
+    conn.executemany('INSERT INTO "plant_species_table" VALUES (?, ?, ?, ?, ?, ?, ?, ?)', species)
+    conn.execute('INSERT INTO "app_settings_table" ("created_at", "updated_at") VALUES (?, ?)', (now, now))
+    conn.execute('COMMIT')
+
+    species_ids = [row[0] for row in species]
+    inserted = 0
+    for batch in make_encounters(rng, encounter_count, species_ids, now, batch_size):
+        conn.execute('BEGIN')
+        conn.executemany(ENCOUNTER_INSERT, batch)
+        conn.execute('COMMIT')
+        inserted += len(batch)
+        print(f"\r  已插入 {inserted}/{encounter_count} 条遇见记录", end='', flush=True)
+    elapsed = time.perf_counter() - started
+    print()
+
+    dataset = {
+        'species': species_count,
+        'encounters': encounter_count,
+        'seed': seed,
+        'unidentified': conn.execute('SELECT COUNT(*) FROM "plant_encounter_table" '
+                                     'WHERE "is_identified" = 0').fetchone()[0],
+        'with_location': conn.execute('SELECT COUNT(*) FROM "plant_encounter_table" '
+                                      'WHERE "latitude" IS NOT NULL').fetchone()[0],
+        'insert_seconds': round(elapsed, 2),
+        'rows_per_second': round(encounter_count / elapsed) if elapsed > 0 else None,
+        'size_bytes': used_bytes(conn),
+    }
+    return conn, dataset
+
+def used_bytes(conn):
+    """数据库已用页的字节数（不含空闲页，删除索引后重建时会复用空闲页）"""
+    page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+    pages = conn.execute('PRAGMA page_count').fetchone()[0] - conn.execute('PRAGMA freelist_count').fetchone()[0]
+    return pages * page_size
+
+# ---- 查询 ----
+
+class QueryParams:
+    """从数据集中抽样生成查询参数，同一种子每轮得到相同的参数序列"""
+
+    def __init__(self, conn, seed):
+        self.rng = random.Random(seed)
+        species = conn.execute('SELECT "id", "scientific_name", "common_name" FROM "plant_species_table"').fetchall()
+        self.species = species
+        # 按记录数抽样物种，与用户实际打开物种详情的分布接近
+        self.encounter_species = [row[0] for row in conn.execute(
+            'SELECT "species_id" FROM "plant_encounter_table" WHERE "species_id" IS NOT NULL '
+            'ORDER BY RANDOM() LIMIT 2000')]
+        self.encounter_ids = [row[0] for row in conn.execute(
+            'SELECT "id" FROM "plant_encounter_table" ORDER BY RANDOM() LIMIT 2000')]
+        self.min_date, self.max_date, self.total = conn.execute(
+            'SELECT MIN("encounter_date"), MAX("encounter_date"), COUNT(*) FROM "plant_encounter_table"').fetchone()
+
+    def reset(self, seed):
+        self.rng = random.Random(seed)
+
+    def viewport(self):
+        """以某个城市为中心的地图视野（约 5～20 公里见方）"""
+        lat, lng, _ = self.rng.choice(HOTSPOTS)
+        half = self.rng.uniform(0.025, 0.1)
+        lat += self.rng.uniform(-0.1, 0.1)
+        lng += self.rng.uniform(-0.1, 0.1)
+        return lat - half, lat + half, lng - half, lng + half
+
+    def params(self, name, rewritten=False):
+        rng = self.rng
+        if name == 'species_by_id':
+            return (rng.choice(self.species)[0],)
+        if name == 'species_by_names':
+            row = rng.choice(self.species)
+            return (row[1], row[2])
+        if name == 'species_by_common_name':
+            return (rng.choice(self.species)[2].lower(),)
+        if name == 'encounter_by_id':
+            return (rng.choice(self.encounter_ids),)
+        if name in ('encounters_by_species', 'species_encounter_count', 'species_first_last'):
+            return (rng.choice(self.encounter_species),)
+        if name == 'encounters_for_species':
+            species_id = rng.choice(self.encounter_species)
+            return (species_id, species_id)
+        if name == 'gallery_page':
+            # 大多数时候只看前几页
+            page = min(int(rng.expovariate(0.3)), max(0, self.total // GALLERY_PAGE - 1))
+            return (page * GALLERY_PAGE,)
+        if name == 'day_range':
+            day = self.max_date - rng.randrange(max(1, (self.max_date - self.min_date) // DAY)) * DAY
+            day -= day % DAY
+            return (day, day + DAY)
+        if name == 'map_bbox':
+            box = self.viewport()
+            if rewritten:
+                cells = geo_cells(*box)
+                if cells is not None:
+                    return (json.dumps(cells),) + box
+            return box
+        return ()
+
+def query_plan(conn, sql, params):
+    return [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params)]
+
+def time_query(conn, sql, params_list):
+    """依次用每组参数执行查询并取出全部结果，返回 (耗时毫秒列表, 平均行数)"""
+    timings = []
+    rows = 0
+    for params in params_list:
+        started = time.perf_counter()
+        result = conn.execute(sql, params).fetchall()
+        timings.append((time.perf_counter() - started) * 1000)
+        rows += len(result)
+    return timings, rows / max(1, len(params_list))
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+def run_queries(conn, params, names, repeat, seed, rewrites=None):
+    """运行查询，返回 {名称: 结果}；rewrites 中的查询改用改写后的 SQL"""
+    rewrites = rewrites or {}
+    results = {}
+    for name in names:
+        sql = rewrites.get(name, QUERIES[name][1])
+        rewritten = name in rewrites
+        # 每个查询使用固定的参数序列，索引前后可比
+        params.reset(f'{seed}/{name}')
+        params_list = [params.params(name, rewritten) for _ in range(repeat)]
+        # 分桶查询的视野格子过多时回退为原查询
+        if rewritten and any(len(p) != len(params_list[0]) for p in params_list):
+            sql = QUERIES[name][1]
+            params.reset(f'{seed}/{name}')
+            params_list = [params.params(name) for _ in range(repeat)]
+            rewritten = False
+        # 第一次执行预热页缓存，不计时
+        conn.execute(sql, params_list[0]).fetchall()
+        timings, rows = time_query(conn, sql, params_list)
+        results[name] = {
+            'p50_ms': round(percentile(timings, 0.5), 3),
+            'p95_ms': round(percentile(timings, 0.95), 3),
+            'rows': round(rows, 1),
+            'plan': query_plan(conn, sql, params_list[0]),
+        }
+        if rewritten:
+            results[name]['sql'] = sql
+    return results
+
+def insert_cost(conn, rng_seed, species_ids, rows):
+    """在回滚的事务中插入 rows 条记录，返回每千条的毫秒数（取三次最小值）"""
+    # 与生成数据集的随机序列不同，避免主键冲突
+    rng = random.Random(f'{rng_seed}/insert')
+    batch = next(make_encounters(rng, rows, species_ids, 1_750_000_000, rows))
+    best = None
+    for _ in range(3):
+        conn.execute('BEGIN')
+        started = time.perf_counter()
+        conn.executemany(ENCOUNTER_INSERT, batch)
+        elapsed = time.perf_counter() - started
+        conn.execute('ROLLBACK')
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best * 1000 / rows * 1000, 2)
+
+def is_using_index(plan, index):
+    return any(index in step for step in plan)
+
+def print_queries(results, baseline=None):
+    for name, result in results.items():
+        line = f"  {name:<26} p50 {result['p50_ms']:>9.3f} ms  p95 {result['p95_ms']:>9.3f} ms  {result['rows']:>9} 行"
+        if baseline and name in baseline:
+            speedup = baseline[name]['p50_ms'] / max(result['p50_ms'], 1e-6)
+            line += f"  x{speedup:.1f}"
+        print(line + f"  | {'; '.join(result['plan'])}")
+
+def queries_using(conn, params, names, seed, rewrites, index):
+    """执行计划中用到 index 的查询"""
+    using = []
+    for name in names:
+        params.reset(f'{seed}/{name}')
+        sql = rewrites.get(name, QUERIES[name][1])
+        if is_using_index(query_plan(conn, sql, params.params(name, name in rewrites)), index):
+            using.append(name)
+    return using
+
+def evaluate_candidates(conn, params, names, repeat, seed, base_results, species_ids, insert_rows):
+    """逐个建立候选索引，测量用到它的查询、建索引耗时、大小和插入开销"""
+    base_insert = insert_cost(conn, seed, species_ids, insert_rows)
+    candidates = {}
+    for index, (ddl, rewrites, requires) in CANDIDATES.items():
+        for required in requires:
+            conn.execute(CANDIDATES[required][0])
+        size_before = used_bytes(conn)
+        started = time.perf_counter()
+        conn.execute(ddl)
+        create_ms = (time.perf_counter() - started) * 1000
+        size = used_bytes(conn) - size_before
+        # 只重新测量用到了该索引的查询
+        affected = run_queries(conn, params, queries_using(conn, params, names, seed, rewrites, index),
+                               repeat, seed, rewrites)
+        for name, result in affected.items():
+            result['speedup'] = round(base_results[name]['p50_ms'] / max(result['p50_ms'], 1e-6), 2)
+        with_index = insert_cost(conn, seed, species_ids, insert_rows)
+        for name in (index,) + tuple(requires):
+            conn.execute(f'DROP INDEX "{name}"')
+        candidates[index] = {
+            'ddl': ddl,
+            'requires': list(requires),
+            'create_ms': round(create_ms, 1),
+            'size_bytes': size,
+            'insert_ms_per_1k': with_index,
+            'insert_overhead_pct': round((with_index - base_insert) / base_insert * 100, 1) if base_insert else None,
+            'queries': affected,
+        }
+        print(f"  {index:<32} 大小 {format_size(size):>9}  建立 {create_ms:>7.1f} ms  "
+              f"插入开销 {candidates[index]['insert_overhead_pct']:>+6.1f}%  "
+              + (', '.join(f"{n} x{r['speedup']}" for n, r in affected.items()) if affected else '未被使用')
+              + (f"  (连同 {', '.join(requires)})" if requires else ''))
+    return base_insert, candidates
+
+def recommend(candidates, base_results, tolerance, excluded=()):
+    """每个查询选加速最多的候选索引，满足条件的索引（连同它需要的索引）合起来作为推荐
+
+    推荐的索引让别的查询变慢超过容差时，补上能让该查询不变慢、加速最多的候选（查询计划器会改用它）；
+    找不到这样的候选就放弃该索引，重新挑选。excluded 中的索引不参与推荐。
+    """
+    dropped = set(excluded)
+    while True:
+        best = {}
+        for index, candidate in candidates.items():
+            if index in dropped or dropped & set(candidate['requires']):
+                continue
+            for name, result in candidate['queries'].items():
+                if base_results[name]['p50_ms'] < MIN_QUERY_MS or result['speedup'] < MIN_SPEEDUP:
+                    continue
+                if name not in best or result['speedup'] > best[name][1]:
+                    best[name] = (index, result['speedup'])
+        recommended = {}
+        for name, (index, speedup) in best.items():
+            for required in CANDIDATES[index][2]:
+                recommended.setdefault(required, [])
+            recommended.setdefault(index, []).append(name)
+
+        pending = list(recommended)
+        failed = None
+        while pending and not failed:
+            index = pending.pop()
+            for name in slower_queries(candidates[index]['queries'], base_results, tolerance):
+                if any(name in queries for other, queries in recommended.items() if other != index):
+                    continue
+                fixes = [(candidate['queries'][name]['speedup'], other) for other, candidate in candidates.items()
+                         if other != index and other not in dropped and not dropped & set(candidate['requires'])
+                         and name in candidate['queries']
+                         and name not in slower_queries(candidate['queries'], base_results, tolerance)]
+                if not fixes:
+                    failed = index
+                    break
+                fix = max(fixes)[1]
+                for other in CANDIDATES[fix][2] + (fix,):
+                    if other not in recommended:
+                        recommended[other] = []
+                        pending.append(other)
+                recommended[fix].append(name)
+        if not failed:
+            return recommended
+        dropped.add(failed)
+
+def slower_queries(results, base_results, tolerance):
+    """建立索引后反而变慢的查询（查询计划器换用了不合适的索引）"""
+    return [name for name, result in results.items()
+            if result['p50_ms'] > base_results[name]['p50_ms'] * (1 + tolerance)
+            and result['p50_ms'] - base_results[name]['p50_ms'] > 0.05]
+
+def compare(report, baseline, tolerance):
+    """与基线比较查询耗时中位数，返回回退列表 [(查询, 基线毫秒, 当前毫秒)]"""
+    regressions = []
+    for section in ('queries', 'with_recommended'):
+        previous = baseline.get(section) or {}
+        for name, result in (report.get(section) or {}).items():
+            base = previous.get(name)
+            if not base or not base.get('p50_ms'):
+                continue
+            change = (result['p50_ms'] - base['p50_ms']) / base['p50_ms']
+            result['vs_baseline'] = round(change * 100, 1)
+            # 亚毫秒的查询波动大，只看绝对值也明显变慢的
+            if change > tolerance and result['p50_ms'] - base['p50_ms'] > 0.05:
+                regressions.append((f'{section}/{name}', base['p50_ms'], result['p50_ms']))
+    return regressions
+
+def environment():
+    """记录测试环境，便于判断两份报告是否可比"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SCRIPT_DIR,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'host': platform.node(),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'commit': commit,
+    }
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='遇见记录数据库的合成数据查询基准测试')
+    parser.add_argument('--encounters', type=int, default=100_000, help='遇见记录数 (默认: 100000)')
+    parser.add_argument('--species', type=int, default=2000, help='物种数 (默认: 2000)')
+    parser.add_argument('--seed', type=int, default=42, help='随机种子 (默认: 42)')
+    parser.add_argument('--batch-size', type=int, default=5000, help='每个插入事务的记录数 (默认: 5000)')
+    parser.add_argument('--repeat', type=int, default=20, help='每个查询执行的次数 (默认: 20)')
+    parser.add_argument('--queries', help=f"只运行这些查询，逗号分隔 (可选: {', '.join(QUERIES)})")
+    parser.add_argument('--insert-rows', type=int, default=2000, help='测量插入开销时插入的记录数 (默认: 2000)')
+    parser.add_argument('--analyze', action='store_true', help='建索引后运行 ANALYZE（应用目前不会运行）')
+    parser.add_argument('--db', help='数据库文件路径 (默认: 临时文件，结束后删除；已存在时直接使用)')
+    parser.add_argument('--output', '-o', help='JSON 报告输出路径')
+    parser.add_argument('--baseline', help='基线报告，比较查询耗时并在回退时以状态码 1 退出')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help=f'回退容差比例 (默认: {DEFAULT_TOLERANCE})')
+    parser.add_argument('--save-baseline', help='把本次报告保存为基线')
+    args = parser.parse_args()
+
+    names = [n.strip() for n in args.queries.split(',')] if args.queries else list(QUERIES)
+    unknown = [n for n in names if n not in QUERIES]
+    if unknown:
+        print(f"❌ 未知的查询: {', '.join(unknown)}")
+        sys.exit(1)
+
+    version = schema_version()
+    print("🗄️  PlantMeet 遇见记录数据库基准测试")
+    print(f"schemaVersion: {version}  SQLite {sqlite3.sqlite_version}")
+
+    temp_dir = None
+    if args.db:
+        db_path = Path(args.db)
+    else:
+        temp_dir = tempfile.TemporaryDirectory(prefix='plantmeet_db_bench_')
+        db_path = Path(temp_dir.name) / 'plantmeet.sqlite'
+
+    try:
+        if db_path.exists():
+            conn = sqlite3.connect(db_path, isolation_level=None)
+            dataset = {
+                'path': str(db_path),
+                'species': conn.execute('SELECT COUNT(*) FROM "plant_species_table"').fetchone()[0],
+                'encounters': conn.execute('SELECT COUNT(*) FROM "plant_encounter_table"').fetchone()[0],
+                'size_bytes': used_bytes(conn),
+            }
+            print(f"\n📂 使用已有数据库: {db_path} (物种 {dataset['species']}，遇见记录 {dataset['encounters']}，"
+                  f"{format_size(dataset['size_bytes'])})")
+            existing = [row[0] for row in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL")]
+            if existing:
+                print(f"⚠️  数据库中已有索引，基线结果会受影响: {', '.join(existing)}")
+        else:
+            print(f"\n🌱 生成合成数据: 物种 {args.species}，遇见记录 {args.encounters}，种子 {args.seed}")
+            conn, dataset = create_database(db_path, args.species, args.encounters, args.seed, args.batch_size)
+            print(f"  {dataset['insert_seconds']} 秒，{dataset['rows_per_second']} 行/秒，"
+                  f"数据库 {format_size(dataset['size_bytes'])}，未识别 {dataset['unidentified']} 条，"
+                  f"有坐标 {dataset['with_location']} 条")
+
+        params = QueryParams(conn, args.seed)
+        species_ids = [row[0] for row in params.species]
+
+        print(f"\n🔍 无索引（当前表结构），每个查询 {args.repeat} 次:")
+        base_results = run_queries(conn, params, names, args.repeat, args.seed)
+        print_queries(base_results)
+
+        print("\n🧪 候选索引（逐个建立后删除）:")
+        base_insert, candidates = evaluate_candidates(conn, params, names, args.repeat, args.seed, base_results,
+                                                      species_ids, args.insert_rows)
+
+        # 推荐的索引合在一起后仍有查询变慢时，去掉变慢查询的执行计划用到的索引，重新推荐并测量
+        excluded = []
+        while True:
+            recommended = recommend(candidates, base_results, args.tolerance, excluded)
+            with_recommended = {}
+            slower = []
+            insert_with_recommended = None
+            if not recommended:
+                print("\nℹ️  没有值得添加的索引")
+                break
+            print(f"\n✅ 推荐索引 (至少一个查询加速 {MIN_SPEEDUP:g} 倍以上，且不让其他查询变慢):")
+            rewrites = {}
+            for index, queries in recommended.items():
+                labels = [name if candidates[index]['queries'][name]['speedup'] >= MIN_SPEEDUP else f'{name} (防止变慢)'
+                          for name in queries]
+                print(f"  {CANDIDATES[index][0]};" + (f"  -- {', '.join(labels)}" if labels else ''))
+                conn.execute(CANDIDATES[index][0])
+                rewrites.update({name: sql for name, sql in CANDIDATES[index][1].items() if name in queries})
+            if args.analyze:
+                conn.execute('ANALYZE')
+            print("\n🔍 同时建立推荐的索引后:")
+            with_recommended = run_queries(conn, params, names, args.repeat, args.seed, rewrites)
+            print_queries(with_recommended, base_results)
+            slower = slower_queries(with_recommended, base_results, args.tolerance)
+            for name in slower:
+                print(f"  ⚠️  {name} 变慢: {base_results[name]['p50_ms']} ms -> {with_recommended[name]['p50_ms']} ms，"
+                      f"执行计划: {'; '.join(with_recommended[name]['plan'])}")
+            culprits = [index for index in recommended
+                        if any(is_using_index(with_recommended[name]['plan'], index) for name in slower)]
+            if not culprits:
+                insert_with_recommended = insert_cost(conn, args.seed, species_ids, args.insert_rows)
+                print(f"  插入 {insert_with_recommended} ms/千条 (无索引 {base_insert} ms/千条)")
+            for index in recommended:
+                conn.execute(f'DROP INDEX "{index}"')
+            if args.analyze:
+                conn.execute('DROP TABLE IF EXISTS "sqlite_stat1"')
+            if not culprits:
+                break
+            print(f"  ↩️  不再推荐 {', '.join(culprits)}，重新挑选")
+            excluded.extend(culprits)
+        conn.close()
+    except KeyboardInterrupt:
+        print("\n🛑 已中断")
+        sys.exit(1)
+    except sqlite3.Error as e:
+        print(f"❌ 数据库错误: {e}")
+        sys.exit(1)
+    finally:
+        if temp_dir:
+            temp_dir.cleanup()
+
+    report = {
+        'schema_version': version,
+        'environment': environment(),
+        'dataset': dataset,
+        'repeat': args.repeat,
+        'tolerance': args.tolerance,
+        'insert_ms_per_1k': base_insert,
+        'queries': base_results,
+        'candidates': candidates,
+        'recommended': {index: {'ddl': CANDIDATES[index][0], 'queries': queries}
+                        for index, queries in recommended.items()},
+        'excluded_after_recheck': excluded,
+        'with_recommended': with_recommended,
+        'slower_with_recommended': slower,
+        'insert_ms_per_1k_with_recommended': insert_with_recommended,
+    }
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        report['baseline'] = {'path': args.baseline, 'schema_version': baseline.get('schema_version'),
+                              'dataset': baseline.get('dataset'), 'environment': baseline.get('environment')}
+        report['regressions'] = [{'query': q, 'baseline_ms': old, 'current_ms': new} for q, old, new in regressions]
+        print(f"\n📊 与基线比较 ({args.baseline}，schemaVersion {baseline.get('schema_version')} -> {version}，"
+              f"容差 {args.tolerance:.0%}):")
+        if (baseline.get('dataset') or {}).get('encounters') != dataset.get('encounters'):
+            print("  ⚠️  数据量与基线不同，结果不可直接比较")
+        if regressions:
+            for query, old, new in regressions:
+                print(f"  ❌ {query}: {old} ms -> {new} ms")
+        else:
+            print("  ✅ 没有发现性能回退")
+
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"📄 报告已保存: {path}")
+
+    if regressions:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
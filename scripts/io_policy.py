@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+模型服务器 I/O 策略
+
+- 对正在发送的范围调用 posix_fadvise(SEQUENTIAL/WILLNEED) 或 madvise(WILLNEED) 提前读入
+- 按连接实测吞吐动态调整预读窗口：慢客户端不占用过多页缓存，快客户端不会等磁盘
+- 可选 mmap 方式读取：所有连接共享同一个映射和页缓存，发送时不额外拷贝。
+  注意：映射期间文件被原地截断（如 truncate、用 > 重定向覆盖、下载工具原地重写）时，
+  访问超出新长度的页会收到 SIGBUS，整个服务器进程直接退出；文件可能被原地改写时使用默认的 read 方式
+  （替换文件应写临时文件后 rename，旧映射仍指向旧文件，不受影响）
+- 可选启动时在后台线程预热页缓存
+
+posix_fadvise / madvise 仅在支持的平台（Linux）生效，其他平台自动退化为普通读取。
+"""
+
+import mmap
+import os
+import threading
+import time
+
+MB = 1024 * 1024
+
+# 预读窗口的上下限和按吞吐计算的预读时长（秒）
+MIN_READAHEAD = 2 * MB
+MAX_READAHEAD = 64 * MB
+READAHEAD_SECONDS = 2.0
+
+# 页缓存预热的读块大小
+WARM_BLOCK = 8 * MB
+
+def fadvise(fd, offset, length, advice_name):
+    """调用 posix_fadvise，平台不支持时静默忽略"""
+    advice = getattr(os, advice_name, None)
+    if advice is None or not hasattr(os, 'posix_fadvise'):
+        return False
+    try:
+        os.posix_fadvise(fd, offset, length, advice)
+        return True
+    except OSError:
+        return False
+
+def madvise(mapping, offset, length, advice_name):
+    """对映射区调用 madvise，起始位置按页对齐，平台不支持时静默忽略"""
+    advice = getattr(mmap, advice_name, None)
+    if advice is None or not hasattr(mapping, 'madvise') or length <= 0:
+        return False
+    aligned = offset - offset % mmap.PAGESIZE
+    length = min(length + (offset - aligned), len(mapping) - aligned)
+    try:
+        mapping.madvise(advice, aligned, length)
+        return True
+    except (OSError, ValueError):
+        return False
+
+class Readahead:
+    """按连接实测吞吐调整预读窗口，窗口消耗过半时提前预读下一段"""
+
+    def __init__(self, advise, start, end, min_window=MIN_READAHEAD,
+                 max_window=MAX_READAHEAD, horizon=READAHEAD_SECONDS):
+        self.advise = advise
+        self.start = start
+        self.end = end
+        self.min_window = min_window
+        self.max_window = max_window
+        self.horizon = horizon
+        self.window = min_window
+        self.started = time.monotonic()
+        self.advised_end = start
+        self._extend(start)
+
+    def _extend(self, position):
+        new_end = min(self.end, position + self.window)
+        if new_end > self.advised_end:
+            self.advise(self.advised_end, new_end - self.advised_end)
+            self.advised_end = new_end
+
+    def update(self, position):
+        """发送到 position 后调用"""
+        if position + self.window // 2 < self.advised_end or self.advised_end >= self.end:
+            return
+        elapsed = time.monotonic() - self.started
+        if elapsed > 0:
+            rate = (position - self.start) / elapsed
+            self.window = int(min(self.max_window, max(self.min_window, rate * self.horizon)))
+        self._extend(position)
+
+class RangeReader:
+    """按块读取文件的一个范围，每块以 memoryview 返回（下一次迭代前有效）"""
+
+    def __init__(self, policy, path, start, length):
+        self.policy = policy
+        self.path = path
+        self.start = start
+        self.length = length
+        self._file = None
+        self._mapping = None
+
+    def __enter__(self):
+        if self.policy.mode == 'mmap':
+            self._mapping = self.policy.mapping(self.path)
+        if self._mapping is None:
+            self._file = open(self.path, 'rb', buffering=0)
+            if self.policy.use_fadvise:
+                fadvise(self._file.fileno(), self.start, self.length, 'POSIX_FADV_SEQUENTIAL')
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._file is not None:
+            self._file.close()
+        return False
+
+    def _advise(self, offset, length):
+        if not self.policy.use_fadvise:
+            return
+        if self._mapping is not None:
+            madvise(self._mapping, offset, length, 'MADV_WILLNEED')
+        else:
+            fadvise(self._file.fileno(), offset, length, 'POSIX_FADV_WILLNEED')
+
+    def chunks(self, chunk_size=64 * 1024):
+        """逐块产出数据，同时按吞吐推进预读窗口"""
+        end = self.start + self.length
+        readahead = Readahead(self._advise, self.start, end,
+                              self.policy.min_readahead, self.policy.max_readahead,
+                              self.policy.readahead_seconds)
+        position = self.start
+
+        if self._mapping is not None:
+            view = memoryview(self._mapping)
+            try:
+                while position < end:
+                    size = min(chunk_size, end - position)
+                    yield view[position:position + size]
+                    position += size
+                    readahead.update(position)
+            finally:
+                view.release()
+            return
+
+        buffer = bytearray(chunk_size)
+        view = memoryview(buffer)
+        self._file.seek(position)
+        while position < end:
+            size = self._file.readinto(view[:min(chunk_size, end - position)])
+            if not size:
+                break
+            yield view[:size]
+            position += size
+            readahead.update(position)
+
+class IOPolicy:
+    """服务器级 I/O 策略，mmap 映射按文件共享（mmap 方式下文件被原地截断会导致 SIGBUS，见模块说明）"""
+
+    def __init__(self, mode='read', use_fadvise=True, min_readahead=MIN_READAHEAD,
+                 max_readahead=MAX_READAHEAD, readahead_seconds=READAHEAD_SECONDS):
+        self.mode = mode
+        self.use_fadvise = use_fadvise
+        self.min_readahead = min_readahead
+        self.max_readahead = max_readahead
+        self.readahead_seconds = readahead_seconds
+        self._mappings = {}
+        self._lock = threading.Lock()
+
+    def mapping(self, path):
+        """返回文件的共享只读映射，文件变化（大小/修改时间）后重新映射；失败时返回 None"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if stat.st_size == 0:
+            return None
+        key = (os.fspath(path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            mapping = self._mappings.get(key)
+            if mapping is None:
+                try:
+                    with open(path, 'rb') as f:
+                        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                except (OSError, ValueError):
+                    return None
+                # 旧映射可能仍被进行中的传输引用，交给垃圾回收释放
+                self._mappings = {k: v for k, v in self._mappings.items() if k[0] != key[0]}
+                self._mappings[key] = mapping
+        return mapping
+
+    def open_range(self, path, start, length):
+        """打开文件的一个范围用于发送，用法: with policy.open_range(...) as r: for chunk in r.chunks()"""
+        return RangeReader(self, path, start, length)
+
+    def warm(self, path, rate_mb=0):
+        """在后台线程中顺序读取文件以预热页缓存，rate_mb 为限速 MB/s（0 不限速）"""
+        thread = threading.Thread(target=warm_page_cache, args=(path, rate_mb),
+                                  name='page-cache-warmer', daemon=True)
+        thread.start()
+        return thread
+
+def warm_page_cache(path, rate_mb=0):
+    """顺序读取整个文件，把它读入页缓存"""
+    started = time.monotonic()
+    warmed = 0
+    try:
+        with open(path, 'rb', buffering=0) as f:
+            fd = f.fileno()
+            size = os.fstat(fd).st_size
+            fadvise(fd, 0, size, 'POSIX_FADV_SEQUENTIAL')
+            buffer = bytearray(WARM_BLOCK)
+            while True:
+                # 提前一个块提示内核异步读入
+                fadvise(fd, warmed + WARM_BLOCK, WARM_BLOCK, 'POSIX_FADV_WILLNEED')
+                read = f.readinto(buffer)
+                if not read:
+                    break
+                warmed += read
+                if rate_mb:
+                    ahead = warmed / (rate_mb * MB) - (time.monotonic() - started)
+                    if ahead > 0:
+                        time.sleep(ahead)
+    except OSError as e:
+        print(f"⚠️  页缓存预热失败: {e}")
+        return warmed
+
+    elapsed = time.monotonic() - started
+    print(f"🔥 页缓存预热完成: {warmed / MB / 1024:.2f} GB, 耗时 {elapsed:.1f} 秒 "
+          f"({warmed / MB / max(elapsed, 1e-6):.0f} MB/s)")
+    return warmed
+
+def attach_io_policy(server, mode='read', use_fadvise=True):
+    """为 HTTP 服务器挂载 I/O 策略，处理器通过 self.server.io_policy 访问"""
+    server.io_policy = IOPolicy(mode=mode, use_fadvise=use_fadvise)
+    return server.io_policy
@@ -11,29 +11,58 @@ python3 scripts/local_model_server.py [--port PORT] [--host HOST]
 flutter build apk --debug --dart-define=LOCAL_MODEL_SERVER=http://localhost:8000
 """
 
+import time
+
+# 启动计时从解释器加载本模块开始
+STARTED = time.perf_counter()
+
 import os
 import sys
 import argparse
-import socket
+import errno
 import subprocess
 from pathlib import Path
-from http.server import HTTPServer, SimpleHTTPRequestHandler
+from http.server import SimpleHTTPRequestHandler
 import threading
-import time
 
-class ModelFileHandler(SimpleHTTPRequestHandler):
+from bandwidth import BandwidthHandlerMixin, attach_shaper
+from chunk_index import ChunkIndexHandlerMixin, attach_chunk_index
+from io_policy import attach_io_policy
+from model_store import resolve_model
+from prefork import Supervisor, listen_sockets
+from pull_through import UpstreamError, attach_pull_through, upstream_headers, upstream_size
+from server_socket import (ModelHTTPServer, create_server, lan_addresses, parse_byte_range,
+                           send_range_not_satisfiable)
+from task_archive import TaskArchiveHandlerMixin, attach_task_archive
+from transfer_metrics import MetricsHandlerMixin, attach_metrics
+
+# 回源模式的默认上游
+MODEL_URL = "https://huggingface.co/google/gemma-3n-E4B-it-litert-preview/resolve/main/gemma-3n-E4B-it-int4.task"
+
+class ModelFileHandler(TaskArchiveHandlerMixin, ChunkIndexHandlerMixin, BandwidthHandlerMixin,
+                       MetricsHandlerMixin, SimpleHTTPRequestHandler):
     """自定义文件处理器，支持断点续传和CORS"""
     
-    def __init__(self, *args, model_dir=None, **kwargs):
+    def __init__(self, *args, model_dir=None, model_file=None, **kwargs):
         self.model_dir = model_dir
+        self.model_file = model_file or model_dir / 'gemma-3n-E4B-it-int4.task'
         super().__init__(*args, **kwargs)
     
     def do_GET(self):
         """处理GET请求"""
+        # 指标端点: /metrics, /stats.json；分块清单: /chunks/<文件名>；哈希表: /hashes/<文件名>；
+        # 归档成员: /<文件名>/members/<成员名>
+        if (self.serve_metrics_endpoint() or self.serve_bandwidth_admin()
+                or self.serve_chunk_manifest() or self.serve_task_member()):
+            return
+        
         # 仅处理模型文件请求
         if self.path.startswith('/gemma-3n-E4B-it-int4.task'):
-            model_file = self.model_dir / 'gemma-3n-E4B-it-int4.task'
-            if model_file.exists():
+            model_file = self.model_file
+            cache = getattr(self.server, 'pull_through', None)
+            if cache is not None and not cache.complete:
+                self.serve_pull_through(cache)
+            elif model_file.exists():
                 self.serve_model_file(model_file)
             else:
                 self.send_error(404, "Model file not found")
@@ -45,15 +74,25 @@ class ModelFileHandler(SimpleHTTPRequestHandler):
         self.send_response(200)
         self.send_header('Access-Control-Allow-Origin', '*')
         
-        model_file = self.model_dir / 'gemma-3n-E4B-it-int4.task'
-        if model_file.exists():
+        model_file = self.model_file
+        cache = getattr(self.server, 'pull_through', None)
+        if cache is not None and not cache.complete:
+            self.send_header('Content-Length', str(cache.size))
+            self.send_header('Accept-Ranges', 'bytes')
+        elif model_file.exists():
             file_size = model_file.stat().st_size
             self.send_header('Content-Length', str(file_size))
             self.send_header('Accept-Ranges', 'bytes')
+            self.send_digest_headers('gemma-3n-E4B-it-int4.task', model_file, 0, file_size)
         
         self.send_header('Content-Type', 'application/octet-stream')
         self.end_headers()
     
+    def do_POST(self):
+        """处理POST请求（仅管理端点）"""
+        if not self.serve_bandwidth_admin():
+            self.send_error(404, "File not found")
+    
     def do_OPTIONS(self):
         """处理OPTIONS请求（CORS预检）"""
         self.send_response(200)
@@ -62,60 +101,56 @@ class ModelFileHandler(SimpleHTTPRequestHandler):
         self.send_header('Access-Control-Allow-Headers', 'Range, Authorization, User-Agent')
         self.end_headers()
     
+    def send_file_headers(self, file_size, file_path=None):
+        """发送文件响应头（200 或 206），返回 (起点, 长度)；范围无法满足时发送 416 并返回 None；
+        给出 file_path 时附带分块校验值"""
+        range_header = self.headers.get('Range')
+        
+        if range_header:
+            # 处理范围请求（断点续传）
+            byte_range = parse_byte_range(range_header, file_size)
+            if byte_range is None:
+                send_range_not_satisfiable(self, file_size)
+                return None
+            start, end = byte_range
+            content_length = end - start + 1
+            
+            self.send_response(206)  # Partial Content
+            self.send_header('Content-Range', f'bytes {start}-{end}/{file_size}')
+            self.send_header('Content-Length', str(content_length))
+        else:
+            # 完整文件请求
+            start = 0
+            end = file_size - 1
+            content_length = file_size
+            
+            self.send_response(200)
+            self.send_header('Content-Length', str(content_length))
+        
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Cache-Control', 'public, max-age=3600')
+        # 添加CORS头
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'GET, HEAD, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Range, Authorization, User-Agent')
+        if file_path is not None:
+            self.send_digest_headers('gemma-3n-E4B-it-int4.task', file_path, start, content_length)
+        self.end_headers()
+        return start, content_length
+    
     def serve_model_file(self, file_path):
         """提供模型文件，支持断点续传"""
         try:
-            file_size = file_path.stat().st_size
-            range_header = self.headers.get('Range')
-            
-            if range_header:
-                # 处理范围请求（断点续传）
-                range_match = range_header.replace('bytes=', '').split('-')
-                start = int(range_match[0]) if range_match[0] else 0
-                end = int(range_match[1]) if range_match[1] else file_size - 1
-                
-                content_length = end - start + 1
-                
-                self.send_response(206)  # Partial Content
-                self.send_header('Content-Range', f'bytes {start}-{end}/{file_size}')
-                self.send_header('Content-Length', str(content_length))
-            else:
-                # 完整文件请求
-                start = 0
-                end = file_size - 1
-                content_length = file_size
-                
-                self.send_response(200)
-                self.send_header('Content-Length', str(content_length))
-            
-            self.send_header('Content-Type', 'application/octet-stream')
-            self.send_header('Accept-Ranges', 'bytes')
-            self.send_header('Cache-Control', 'public, max-age=3600')
-            # 添加CORS头
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.send_header('Access-Control-Allow-Methods', 'GET, HEAD, OPTIONS')
-            self.send_header('Access-Control-Allow-Headers', 'Range, Authorization, User-Agent')
-            self.end_headers()
+            headers = self.send_file_headers(file_path.stat().st_size, file_path)
+            if headers is None:
+                return
+            start, content_length = headers
             
             # 发送文件内容
-            with open(file_path, 'rb') as f:
-                f.seek(start)
-                remaining = content_length
-                
-                while remaining > 0:
-                    chunk_size = min(65536, remaining)  # 64KB chunks
-                    chunk = f.read(chunk_size)
-                    if not chunk:
-                        break
-                    
-                    try:
-                        self.wfile.write(chunk)
-                        remaining -= len(chunk)
-                    except (BrokenPipeError, ConnectionResetError):
-                        # 客户端断开连接，正常情况，不需要记录错误
-                        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] Client disconnected during download")
-                        break
-                    
+            with self.server.io_policy.open_range(file_path, start, content_length) as reader:
+                self.send_chunks(reader.chunks(65536), start)  # 64KB chunks
+        
         except (BrokenPipeError, ConnectionResetError):
             # 客户端断开连接，正常情况
             print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] Client disconnected")
@@ -127,14 +162,49 @@ class ModelFileHandler(SimpleHTTPRequestHandler):
                 # 发送错误响应时客户端已断开
                 pass
     
-    def log_message(self, format, *args):
-        """自定义日志格式"""
-        client_ip = self.address_string()
-        timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
-        print(f"[{timestamp}] {client_ip} - {format % args}")
-
+    def serve_pull_through(self, cache):
+        """回源模式：已下载的部分立即发送，其余部分等待上游下载"""
+        try:
+            range_header = self.headers.get('Range')
+            byte_range = parse_byte_range(range_header, cache.size) if range_header else None
+            first = byte_range[0] if byte_range else 0
+            # 先等到首字节就绪，上游不可用时还能返回 502
+            if first < cache.size:
+                cache.wait_available(first)
+        except OSError as e:
+            self.send_error(502, f"Upstream unavailable: {e}")
+            return
+        
+        try:
+            headers = self.send_file_headers(cache.size)
+            if headers is None:
+                return
+            start, content_length = headers
+            self.send_chunks(cache.chunks(start, content_length), start)
+        except (BrokenPipeError, ConnectionResetError):
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] Client disconnected")
+        except OSError as e:
+            # 响应头已经发出，只能断开连接让客户端续传
+            print(f"Error serving file: {e}")
+            self.close_connection = True
+    
+    def send_chunks(self, chunks, start):
+        """限速发送数据块并记录传输指标"""
+        with self.track_transfer(bool(self.headers.get('Range')), start) as transfer, \
+                self.open_flow() as flow:
+            for chunk in chunks:
+                try:
+                    flow.acquire(len(chunk))
+                    self.wfile.write(chunk)
+                    transfer.sent(len(chunk))
+                except (BrokenPipeError, ConnectionResetError):
+                    # 客户端断开连接，正常情况，不需要记录错误
+                    transfer.abort()
+                    self.log_message("Client disconnected during download at offset %d", start + transfer.sent_bytes)
+                    break
+    
 def kill_port_process(port):
-    """杀掉占用指定端口的进程"""
+    """杀掉所有使用指定端口的进程（旧的启动方式，需要 lsof）"""
     try:
         # 查找占用端口的进程
         result = subprocess.run(['lsof', '-ti', f':{port}'], 
@@ -150,19 +220,8 @@ def kill_port_process(port):
         print(f"清理端口 {port} 时出错: {e}")
     return False
 
-def get_local_ip():
-    """获取本机IP地址"""
-    try:
-        # 连接到外部地址来获取本机IP
-        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
-            s.connect(("8.8.8.8", 80))
-            return s.getsockname()[0]
-    except:
-        return "127.0.0.1"
-
-def check_model_file(model_dir):
-    """检查模型文件是否存在"""
-    model_file = model_dir / 'gemma-3n-E4B-it-int4.task'
+def check_model_file(model_file, expected_size=4405655031):
+    """检查模型文件是否存在；expected_size 为 None 时不检查大小"""
     if not model_file.exists():
         print(f"❌ 模型文件不存在: {model_file}")
         print("请先运行下载脚本:")
@@ -170,9 +229,8 @@ def check_model_file(model_dir):
         return False
     
     file_size = model_file.stat().st_size
-    expected_size = 4405655031  # 约4.1GB (E4B model)
     
-    if file_size != expected_size:
+    if expected_size is not None and file_size != expected_size:
         print(f"⚠️  模型文件大小异常:")
         print(f"  实际: {file_size:,} bytes ({file_size/1024/1024/1024:.2f} GB)")
         print(f"  期望: {expected_size:,} bytes ({expected_size/1024/1024/1024:.2f} GB)")
@@ -185,52 +243,160 @@ def main():
     parser = argparse.ArgumentParser(description='本地模型文件服务器')
     parser.add_argument('--port', type=int, default=8001, help='服务器端口 (默认: 8001)')
     parser.add_argument('--host', default='0.0.0.0', help='绑定主机 (默认: 0.0.0.0)')
+    parser.add_argument('--log-sample', type=int, default=1,
+                        help='访问日志采样: 每 N 个请求打印 1 条，0 关闭 (默认: 1)')
+    parser.add_argument('--quiet', '-q', action='store_true', help='关闭访问日志 (等同 --log-sample 0)')
+    parser.add_argument('--global-rate', type=float, default=0,
+                        help='全局带宽上限 MB/s，0 不限速 (默认: 0)；多进程模式下平均分给各工作进程，'
+                             '连接分配不均时总速率可能低于上限')
+    parser.add_argument('--client-rate', type=float, default=0,
+                        help='单客户端带宽上限 MB/s，0 不限速 (默认: 0)；多进程模式下按工作进程分别计算，'
+                             '同一客户端的多个连接分到不同进程时可超过该上限')
+    parser.add_argument('--admin-token', help='/admin/bandwidth 管理端点令牌，不设置时仅允许本机访问'
+                        '（多进程模式下调整在 1 秒内同步到所有工作进程）')
+    parser.add_argument('--io-mode', choices=['mmap', 'read'], default='mmap',
+                        help='文件读取方式: mmap 共享映射或普通读取 (默认: mmap)；'
+                             'mmap 方式下模型文件被原地截断或覆盖写入时进程会因 SIGBUS 退出，'
+                             '更新模型应写临时文件后改名，否则使用 read')
+    parser.add_argument('--no-fadvise', action='store_true',
+                        help='不调用 posix_fadvise/madvise 预读提示')
+    parser.add_argument('--warm-cache', action='store_true',
+                        help='启动后在后台线程预热模型文件的页缓存')
+    parser.add_argument('--warm-rate', type=float, default=0,
+                        help='页缓存预热限速 MB/s，0 不限速 (默认: 0)')
+    parser.add_argument('--reuse-port', action='store_true',
+                        help='绑定时设置 SO_REUSEPORT，允许多个进程监听同一端口')
+    parser.add_argument('--listen-fd', type=int,
+                        help='使用继承的已监听套接字描述符 (systemd socket activation 时自动使用 LISTEN_FDS)')
+    parser.add_argument('--no-kill', action='store_true',
+                        help='端口被占用时直接报错，不终止占用进程')
+    parser.add_argument('--legacy-kill', action='store_true',
+                        help='启动前用 lsof 终止所有使用该端口的进程并等待 1 秒（旧行为）')
+    parser.add_argument('--workers', '-w', type=int, default=1,
+                        help='工作进程数，0 表示 CPU 核心数 (默认: 1，单进程)')
+    parser.add_argument('--drain-timeout', type=float, default=0,
+                        help='多进程模式退出时等待传输完成的最长秒数，0 一直等待 (默认: 0)')
+    parser.add_argument('--model-dir',
+                        help='模型目录 (默认: assets/models)；指定时不检查模型文件大小，用于测试和基准测试')
+    parser.add_argument('--upstream', nargs='?', const=MODEL_URL, metavar='URL',
+                        help='回源模式：本地没有模型时从上游下载并边下边提供服务 (不带 URL 时使用 HuggingFace，'
+                             '令牌取自 HF_TOKEN)')
+    parser.add_argument('--upstream-connections', type=int, default=4,
+                        help='回源并发连接数 (默认: 4)')
+    parser.add_argument('--no-prefetch', action='store_true',
+                        help='回源模式只下载客户端请求到的部分，不在后台补齐整个文件')
     args = parser.parse_args()
     
     # 获取项目目录
     script_dir = Path(__file__).parent
     project_root = script_dir.parent
-    model_dir = project_root / 'assets' / 'models'
+    model_dir = Path(args.model_dir).resolve() if args.model_dir else project_root / 'assets' / 'models'
     
     print("=== PlantMeet 本地模型服务器 ===")
     print(f"项目目录: {project_root}")
     print(f"模型目录: {model_dir}")
     
+    # 检出目录中没有模型时直接使用共享模型缓存中的文件
+    model_file = resolve_model(model_dir / 'gemma-3n-E4B-it-int4.task')
+    if model_file.parent != model_dir:
+        print(f"📦 使用共享模型缓存: {model_file}")
+    
+    workers = args.workers or os.cpu_count() or 1
+    
+    # 回源模式：模型不存在时从上游边下载边提供服务
+    upstream = None
+    if args.upstream and not model_file.exists():
+        if workers > 1:
+            print("❌ 回源模式只支持单进程，请去掉 --workers")
+            sys.exit(1)
+        headers = upstream_headers(os.getenv('HF_TOKEN'))
+        try:
+            upstream = (args.upstream, upstream_size(model_file, args.upstream, headers), headers)
+        except UpstreamError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+        print(f"🔁 回源模式: {args.upstream} ({upstream[1]/1024/1024/1024:.2f} GB)")
     # 检查模型文件
-    if not check_model_file(model_dir):
+    elif not check_model_file(model_file, None if args.model_dir else 4405655031):
         sys.exit(1)
     
-    # 如果端口被占用，自动清理
-    print(f"🔍 检查端口 {args.port} 是否被占用...")
-    if kill_port_process(args.port):
-        print(f"✅ 端口 {args.port} 已清理")
-        time.sleep(1)  # 等待进程完全退出
+    if args.legacy_kill:
+        print(f"🔍 检查端口 {args.port} 是否被占用...")
+        if kill_port_process(args.port):
+            print(f"✅ 端口 {args.port} 已清理")
+            time.sleep(1)  # 等待进程完全退出
     
     # 创建服务器
     def handler_factory(*args, **kwargs):
-        return ModelFileHandler(*args, model_dir=model_dir, **kwargs)
+        return ModelFileHandler(*args, model_dir=model_dir, model_file=model_file, **kwargs)
+    
+    def build_server(listen_socket=None, index=0):
+        """创建并配置服务器；多进程模式下在每个工作进程中用分配的监听套接字调用"""
+        if listen_socket is None:
+            # 先直接绑定，只有端口确实被占用时才查找并终止占用进程
+            server = create_server(args.host, args.port, handler_factory,
+                                   reuse_port=args.reuse_port, listen_fd=args.listen_fd,
+                                   kill_existing=not args.no_kill)
+        else:
+            server = ModelHTTPServer((args.host, args.port), handler_factory, listen_socket=listen_socket)
+        attach_metrics(server, 0 if args.quiet else args.log_sample)
+        # 多进程模式下每个工作进程分得全局带宽的 1/N，单客户端限速按工作进程计算
+        attach_shaper(server, args.global_rate, args.client_rate, args.admin_token, workers)
+        io_policy = attach_io_policy(server, args.io_mode, not args.no_fadvise)
+        # 启动时加载哈希表，文件响应才能带上分块校验值
+        attach_chunk_index(server, model_dir, {'gemma-3n-E4B-it-int4.task': model_file}).warm()
+        attach_task_archive(server, {'gemma-3n-E4B-it-int4.task': model_file})
+        if upstream is not None:
+            url, size, headers = upstream
+            attach_pull_through(server, model_file, url, size, headers,
+                                args.upstream_connections, not args.no_prefetch)
+        if args.warm_cache and index == 0:
+            io_policy.warm(model_file, args.warm_rate)
+        return server
     
     try:
-        server = HTTPServer((args.host, args.port), handler_factory)
+        if workers > 1:
+            sockets = listen_sockets(args.host, args.port, workers, args.listen_fd, not args.no_kill)
+            supervisor = Supervisor(build_server, sockets, args.drain_timeout)
+            port = sockets[0].getsockname()[1]
+        else:
+            server = build_server()
+            port = server.server_address[1]
         
-        local_ip = get_local_ip()
-        print(f"\n🚀 服务器已启动:")
-        print(f"  本地访问: http://localhost:{args.port}")
-        print(f"  网络访问: http://{local_ip}:{args.port}")
+        addresses = lan_addresses()
+        local_ip = addresses[0][1] if addresses else "127.0.0.1"
+        print(f"\n🚀 服务器已启动 (启动耗时 {(time.perf_counter() - STARTED) * 1000:.0f} ms):")
+        print(f"  本地访问: http://localhost:{port}")
+        for name, address in addresses or [(None, local_ip)]:
+            print(f"  网络访问: http://{address}:{port}" + (f" ({name})" if name else ""))
+        if workers > 1:
+            print(f"  工作进程: {workers} 个")
         print(f"\n📱 编译应用时使用:")
-        print(f"  flutter build apk --debug --dart-define=LOCAL_MODEL_SERVER=http://{local_ip}:{args.port}")
+        print(f"  flutter build apk --debug --dart-define=LOCAL_MODEL_SERVER=http://{local_ip}:{port}")
         print(f"\n📄 模型文件URL:")
-        print(f"  http://{local_ip}:{args.port}/gemma-3n-E4B-it-int4.task")
+        print(f"  http://{local_ip}:{port}/gemma-3n-E4B-it-int4.task")
+        print(f"  http://{local_ip}:{port}/chunks/gemma-3n-E4B-it-int4.task (分块清单，用于增量更新)")
+        print(f"  http://{local_ip}:{port}/hashes/gemma-3n-E4B-it-int4.task (8MB 分块哈希表，用于校验)")
+        print(f"  http://{local_ip}:{port}/gemma-3n-E4B-it-int4.task/members/ (归档成员，可单独下载)")
+        print(f"\n📊 运行指标:")
+        print(f"  http://{local_ip}:{port}/metrics (Prometheus)")
+        print(f"  http://{local_ip}:{port}/stats.json")
         
         print(f"\n按 Ctrl+C 停止服务器")
         print("-" * 50)
         
-        server.serve_forever()
+        if workers > 1:
+            supervisor.run()
+        else:
+            server.serve_forever()
         
     except KeyboardInterrupt:
         print("\n\n🛑 服务器已停止")
+        if upstream is not None:
+            # 保存回源下载进度，下次启动接着下载
+            server.pull_through.close()
     except OSError as e:
-        if e.errno == 48:  # Address already in use
+        if e.errno == errno.EADDRINUSE:
             print(f"❌ 端口 {args.port} 已被占用，请尝试其他端口:")
             print(f"python3 scripts/local_model_server.py --port {args.port + 1}")
         else:
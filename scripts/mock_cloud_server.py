@@ -0,0 +1,878 @@
+#!/usr/bin/env python3
+"""
+云端识别模拟服务器 - 模拟 recognition_service.dart 调用的云端视觉接口，用于在本机测量识别链路的延迟和重试放大
+
+实现应用使用的三种云端接口：
+- POST /v1beta/models/<模型>:generateContent?key=...   Gemini（gemini_plant_recognition_service.dart）
+- POST /v1/chat/completions                           OpenAI 兼容的视觉对话（image_url 为 data URL）
+- POST /identify   GET /health                        BYOK 自建接口（_identifyWithAPI，multipart 上传 image）
+- GET  /metrics /stats.json                           模拟服务器自身的指标
+- GET/POST /admin/profile                             查看/临时修改延迟和失败注入参数
+
+每个请求的处理过程：
+1. 按上行带宽模拟图片上传时间
+2. 等待服务端并发槽位（--slots，超出的排队）
+3. 按图片内容的 SHA-256 查结果缓存：命中时按缓存延迟返回，否则按延迟分布模拟推理
+4. 按概率注入失败（HTTP 429/500/503 等）或超时（接受请求后不响应）
+同一张图片在重试窗口内再次请求视为重试，统计重试放大倍数；每个请求的各阶段耗时写入 JSONL。
+
+延迟分布（单位 ms），可以用 | 组合多个分布模拟长尾:
+  fixed:800   uniform:500-2000   normal:1500,300   lognormal:1500,0.5（中位数, sigma）   exponential:1000
+  0.95*lognormal:1200,0.4|0.05*uniform:5000-15000
+
+--script 指定 JSON 文件按时间切换参数，例如先正常 60 秒、再限流 30 秒:
+  [{"duration": 60}, {"duration": 30, "error_rate": 0.3, "error_codes": [429]}, {"latency": "lognormal:4000,0.6"}]
+
+--load N 在同一进程内启动 N 个虚拟用户，按应用的重试策略（失败后等待 1s、2s 重试两次，单次超时 30s）
+连续识别，结束后输出端到端延迟和重试放大。
+
+使用方法:
+python3 scripts/mock_cloud_server.py                                  # 监听 8090
+python3 scripts/mock_cloud_server.py --latency 'lognormal:1800,0.5' --error-rate 0.05 --timeout-rate 0.01
+python3 scripts/mock_cloud_server.py --load 20 --duration 60 --error-rate 0.1 -o cloud-load.json
+python3 scripts/mock_cloud_server.py --script phases.json --timings /tmp/cloud-timings.jsonl
+
+flutter run --dart-define=... 后在应用设置中把云端地址设为 http://<本机IP>:8090
+"""
+
+import argparse
+import asyncio
+import base64
+import collections
+import email.parser
+import email.policy
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import sys
+import time
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+from mock_llm_server import AsyncHTTPServer, HTTPError
+from transfer_metrics import render_prometheus
+
+GEMINI_PATH = re.compile(r'^/v1(?:beta)?/models/([^/:]+):generateContent$')
+OPENAI_PATH = '/v1/chat/completions'
+IDENTIFY_PATH = '/identify'
+HEALTH_PATHS = {'/health', '/v1/health'}
+ADMIN_PATH = '/admin/profile'
+
+# 请求耗时直方图边界（秒）
+REQUEST_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0)
+
+# 超时注入时挂起的最长时间（秒），客户端超时后连接随之关闭
+HANG_SECONDS = 600
+
+# /stats.json 计算分位数时保留的最近请求数
+RECENT_REQUESTS = 10000
+
+# 应用的重试策略（_tryRecognitionWithFallback: maxRetries=2，第 n 次重试前等待 n 秒；Gemini 客户端超时 30 秒）
+APP_RETRIES = 2
+APP_TIMEOUT = 30.0
+
+# 识别结果：按图片哈希固定选取，同一张图片每次返回相同的植物
+CATALOG = [
+    {
+        'id': 'epipremnum-aureum', 'name': '绿萝', 'nickname': '黄金葛',
+        'scientific_name': 'Epipremnum aureum', 'family': '天南星科',
+        'description': '常见的室内观叶植物，叶片心形，藤蔓可垂吊或攀爬。',
+        'features': ['心形叶片，表面有光泽', '叶面常有黄白色斑纹', '茎节上有气生根'],
+        'safety': {'level': 'caution', 'description': '全株含草酸钙针晶，误食会刺激口腔和消化道。',
+                   'warnings': ['避免儿童和宠物啃咬']},
+        'care': {'difficulty': '简单', 'water': '盆土表面干了再浇透', 'light': '明亮散射光',
+                 'temperature': '15-30°C', 'tips': ['藤蔓过长时剪下可直接水培扦插']},
+        'season': '四季常绿', 'locations': ['室内', '办公室'], 'fun_fact': '在原产地可以攀爬到十几米高。',
+        'tags': ['观叶植物', '耐阴'],
+    },
+    {
+        'id': 'monstera-deliciosa', 'name': '龟背竹', 'nickname': '蓬莱蕉',
+        'scientific_name': 'Monstera deliciosa', 'family': '天南星科',
+        'description': '大型观叶植物，成熟叶片有羽状深裂和穿孔，形似龟背。',
+        'features': ['叶片大而厚，有规则的孔洞', '粗壮的气生根'],
+        'safety': {'level': 'caution', 'description': '叶和茎含草酸钙，误食会引起口腔肿痛。',
+                   'warnings': ['放在宠物够不到的地方']},
+        'care': {'difficulty': '简单', 'water': '保持盆土微湿', 'light': '明亮散射光',
+                 'temperature': '18-30°C', 'tips': ['定期擦拭叶面灰尘']},
+        'season': '四季常绿', 'locations': ['室内', '庭院'], 'fun_fact': '成熟的果实可以食用，味道像菠萝和香蕉。',
+        'tags': ['观叶植物', '热带植物'],
+    },
+    {
+        'id': 'rosa-chinensis', 'name': '月季', 'nickname': '月月红',
+        'scientific_name': 'Rosa chinensis', 'family': '蔷薇科',
+        'description': '常见的观花灌木，花期长，花色丰富，茎上有皮刺。',
+        'features': ['奇数羽状复叶', '茎上有钩状皮刺', '花重瓣，有香气'],
+        'safety': {'level': 'safe', 'description': '无毒，注意茎上的刺。', 'warnings': ['修剪时戴手套']},
+        'care': {'difficulty': '中等', 'water': '见干见湿', 'light': '全日照',
+                 'temperature': '15-26°C', 'tips': ['花后及时修剪残花']},
+        'season': '春夏秋', 'locations': ['公园', '庭院', '阳台'], 'fun_fact': '被称为“花中皇后”，几乎月月开花。',
+        'tags': ['观花植物', '灌木'],
+    },
+    {
+        'id': 'ginkgo-biloba', 'name': '银杏', 'nickname': '白果树',
+        'scientific_name': 'Ginkgo biloba', 'family': '银杏科',
+        'description': '落叶乔木，叶片扇形，秋季变为金黄色，是著名的孑遗植物。',
+        'features': ['扇形叶片，叶脉二叉分枝', '秋季叶片金黄'],
+        'safety': {'level': 'caution', 'description': '种子（白果）生食或多食可能中毒。',
+                   'warnings': ['白果需煮熟并少量食用']},
+        'care': None,
+        'season': '秋季观叶', 'locations': ['公园', '路边', '校园'], 'fun_fact': '银杏在地球上已经存在了约两亿年。',
+        'tags': ['乔木', '行道树'],
+    },
+    {
+        'id': 'taraxacum-mongolicum', 'name': '蒲公英', 'nickname': '婆婆丁',
+        'scientific_name': 'Taraxacum mongolicum', 'family': '菊科',
+        'description': '多年生草本，开黄色头状花，果实带白色冠毛随风飘散。',
+        'features': ['叶片倒披针形，边缘有齿', '黄色头状花序', '白色绒球状果序'],
+        'safety': {'level': 'safe', 'description': '可食用的野菜，少数人可能过敏。', 'warnings': []},
+        'care': None,
+        'season': '春季', 'locations': ['草地', '路边', '田野'], 'fun_fact': '一朵花可以产生约两百颗种子。',
+        'tags': ['野花', '草本植物'],
+    },
+]
+
+def format_size(size_bytes):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size_bytes < 1024:
+            return f"{size_bytes:.1f}{unit}"
+        size_bytes /= 1024
+    return f"{size_bytes:.1f}TB"
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+class LatencyDistribution:
+    """可组合的延迟分布，规格见模块说明（单位 ms），sample() 返回秒"""
+
+    KINDS = {'fixed': 1, 'uniform': 2, 'normal': 2, 'lognormal': 2, 'exponential': 1}
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.parts = []
+        for part in spec.split('|'):
+            weight = 1.0
+            if '*' in part:
+                weight, part = part.split('*', 1)
+                weight = float(weight)
+            kind, _, args = part.strip().partition(':')
+            kind = kind.strip().lower()
+            values = [float(v) for v in re.split(r'[,-]', args) if v.strip()]
+            if kind not in self.KINDS or len(values) != self.KINDS[kind]:
+                raise ValueError(f"无法解析延迟分布 '{part}'，"
+                                 f"可用: {', '.join(f'{k}({n} 个参数)' for k, n in self.KINDS.items())}")
+            if weight < 0 or any(v < 0 for v in values):
+                raise ValueError(f"延迟分布 '{part}' 的参数不能为负数")
+            self.parts.append((weight, kind, values))
+        self.weights = [weight for weight, _, _ in self.parts]
+        if not sum(self.weights):
+            raise ValueError(f"延迟分布 '{spec}' 的权重之和为 0")
+
+    def sample(self, rng):
+        _, kind, values = rng.choices(self.parts, weights=self.weights)[0]
+        if kind == 'fixed':
+            ms = values[0]
+        elif kind == 'uniform':
+            ms = rng.uniform(*values)
+        elif kind == 'normal':
+            ms = rng.gauss(*values)
+        elif kind == 'lognormal':
+            ms = values[0] * math.exp(rng.gauss(0, values[1]))
+        else:
+            ms = rng.expovariate(1 / values[0]) if values[0] else 0
+        return max(0.0, ms) / 1000
+
+    def __str__(self):
+        return self.spec
+
+class Profile:
+    """一组延迟和失败注入参数"""
+
+    FIELDS = ('latency', 'cache_latency', 'error_rate', 'error_codes', 'timeout_rate', 'upload_mbps')
+
+    def __init__(self, latency='lognormal:1500,0.4', cache_latency='fixed:30', error_rate=0.0,
+                 error_codes=(500, 503, 429), timeout_rate=0.0, upload_mbps=0.0):
+        self.latency = LatencyDistribution(str(latency))
+        self.cache_latency = LatencyDistribution(str(cache_latency))
+        self.error_rate = float(error_rate)
+        self.error_codes = tuple(int(c) for c in error_codes)
+        self.timeout_rate = float(timeout_rate)
+        self.upload_mbps = float(upload_mbps)
+        if not 0 <= self.error_rate + self.timeout_rate <= 1:
+            raise ValueError("error_rate + timeout_rate 必须在 0 到 1 之间")
+        if self.error_rate and not self.error_codes:
+            raise ValueError("error_codes 不能为空")
+
+    def updated(self, changes):
+        """返回应用了 changes 的新参数，未知字段报错"""
+        unknown = set(changes) - set(self.FIELDS) - {'duration'}
+        if unknown:
+            raise ValueError(f"未知参数: {', '.join(sorted(unknown))}")
+        values = self.to_dict()
+        values.update({k: v for k, v in changes.items() if k != 'duration'})
+        return Profile(**values)
+
+    def to_dict(self):
+        return {
+            'latency': str(self.latency),
+            'cache_latency': str(self.cache_latency),
+            'error_rate': self.error_rate,
+            'error_codes': list(self.error_codes),
+            'timeout_rate': self.timeout_rate,
+            'upload_mbps': self.upload_mbps,
+        }
+
+class ProfileScript:
+    """按时间切换的参数阶段；最后一个阶段一直保持，admin 修改的参数叠加在当前阶段之上"""
+
+    def __init__(self, base, phases=None):
+        self.base = base
+        self.phases = []
+        for phase in phases or [{}]:
+            self.phases.append((float(phase.get('duration') or 0), base.updated(phase)))
+        self.overrides = {}
+        self._override_profile = None
+        self.started = time.monotonic()
+
+    def current(self):
+        """返回 (阶段序号, 参数)"""
+        elapsed = time.monotonic() - self.started
+        index = len(self.phases) - 1
+        for i, (duration, _) in enumerate(self.phases[:-1]):
+            if elapsed < duration:
+                index = i
+                break
+            elapsed -= duration
+        profile = self.phases[index][1]
+        if self.overrides:
+            # 同一阶段内只构造一次叠加后的参数
+            if self._override_profile is None or self._override_profile[0] != index:
+                self._override_profile = (index, profile.updated(self.overrides))
+            profile = self._override_profile[1]
+        return index, profile
+
+    def override(self, changes):
+        # 先校验，失败时不修改当前参数
+        self.phases[-1][1].updated({**self.overrides, **changes})
+        self.overrides.update(changes)
+        self._override_profile = None
+
+class ResultCache:
+    """按图片 SHA-256 缓存识别结果（LRU）"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.entries = collections.OrderedDict()
+
+    def get(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        return None
+
+    def put(self, key, value):
+        if not self.capacity:
+            return
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+class TimingLog:
+    """每个请求一行 JSON 的耗时记录"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.file = open(self.path, 'a', buffering=1, encoding='utf-8')
+
+    def write(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+
+    def close(self):
+        self.file.close()
+
+# ---- 请求解析 ----
+
+def image_from_gemini(request):
+    for content in request.get('contents') or []:
+        for part in (content or {}).get('parts') or []:
+            inline = part.get('inline_data') or part.get('inlineData') if isinstance(part, dict) else None
+            if inline and inline.get('data'):
+                return base64.b64decode(inline['data'], validate=False)
+    return None
+
+def image_from_openai(request):
+    for message in request.get('messages') or []:
+        content = message.get('content') if isinstance(message, dict) else None
+        if not isinstance(content, list):
+            continue
+        for part in content:
+            if isinstance(part, dict) and part.get('type') == 'image_url':
+                url = (part.get('image_url') or {}).get('url', '')
+                if url.startswith('data:') and ',' in url:
+                    return base64.b64decode(url.split(',', 1)[1], validate=False)
+                # 远程图片按 URL 计算哈希
+                return url.encode('utf-8') if url else None
+    return None
+
+def image_from_multipart(content_type, body):
+    """解析 multipart/form-data，返回 image 字段的内容"""
+    message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        b'Content-Type: ' + content_type.encode('latin-1') + b'\r\n\r\n' + body)
+    if not message.is_multipart():
+        return None
+    for part in message.iter_parts():
+        if part.get_param('name', header='content-disposition') == 'image':
+            return part.get_payload(decode=True)
+    return None
+
+def gemini_text(plant, confidence):
+    """gemini_plant_recognition_service.dart 提示词要求的格式"""
+    return (f"植物名称: {plant['name']}\n学名: {plant['scientific_name']}\n"
+            f"置信度: {confidence:.2f}\n描述: {plant['description']}")
+
+# ---- 服务器 ----
+
+class MockCloudServer(AsyncHTTPServer):
+    """模拟云端识别服务：按参数注入延迟、失败和超时，按图片哈希缓存结果"""
+
+    def __init__(self, script, slots=0, cache_size=10000, retry_window=60.0, api_key=None,
+                 timings=None, seed=None, quiet=False):
+        super().__init__('mock_cloud', quiet)
+        self.script = script
+        self.slots = asyncio.Semaphore(slots) if slots > 0 else None
+        self.slot_count = slots
+        self.cache = ResultCache(cache_size)
+        self.retry_window = retry_window
+        self.api_key = api_key
+        self.timings = timings
+        self.random = random.Random(seed)
+        # 图片哈希 -> (本轮识别已请求次数, 最近一次请求时间)；成功后清除
+        self.attempts = {}
+        self.recent = collections.deque(maxlen=RECENT_REQUESTS)
+        self.started = time.time()
+
+        self.active = self.registry.gauge('active_requests', '正在处理的识别请求数')
+        self.queued = self.registry.gauge('queued_requests', '等待服务端槽位的请求数')
+        self.first_attempts = self.registry.counter('recognitions_total', '首次请求数（不含重试）')
+        self.retries = self.registry.counter('retries_total', '重试窗口内同一图片的重复请求数')
+        self.cache_hits = self.registry.counter('cache_hits_total', '结果缓存命中次数')
+        self.cache_misses = self.registry.counter('cache_misses_total', '结果缓存未命中次数')
+        self.request_seconds = self.registry.histogram('request_seconds', '识别请求耗时（含上传和排队）',
+                                                       REQUEST_BUCKETS)
+
+    async def _dispatch(self, writer, method, path, headers, body, query=''):
+        if method == 'OPTIONS':
+            await self._send(writer, 204, b'', extra={
+                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, Authorization, x-goog-api-key'})
+            return True
+        if method == 'GET':
+            if path in HEALTH_PATHS:
+                await self._send_json(writer, {'status': 'ok'})
+            elif path == '/metrics':
+                await self._send(writer, 200, render_prometheus(self.registry.snapshot()).encode('utf-8'),
+                                 'text/plain; version=0.0.4')
+            elif path == '/stats.json':
+                await self._send_json(writer, self.stats())
+            elif path == ADMIN_PATH:
+                await self._send_json(writer, self.profile_info())
+            else:
+                raise HTTPError(404, f'未知端点 {path}')
+            return True
+        if method == 'POST':
+            if path == ADMIN_PATH:
+                try:
+                    self.script.override(json.loads(body or b'{}'))
+                except (ValueError, TypeError) as e:
+                    raise HTTPError(400, f'参数无效: {e}')
+                self.log(f"参数已修改: {self.script.overrides}")
+                await self._send_json(writer, self.profile_info())
+                return True
+            match = GEMINI_PATH.match(path)
+            if match:
+                return await self.recognize(writer, 'gemini', headers, body, query, model=match.group(1))
+            if path == OPENAI_PATH:
+                return await self.recognize(writer, 'openai', headers, body, query)
+            if path == IDENTIFY_PATH:
+                return await self.recognize(writer, 'identify', headers, body, query)
+        raise HTTPError(405 if method not in ('GET', 'POST') else 404, f'不支持 {method} {path}')
+
+    def profile_info(self):
+        phase, profile = self.script.current()
+        return {'phase': phase, 'phases': len(self.script.phases), 'profile': profile.to_dict(),
+                'overrides': self.script.overrides}
+
+    # ---- 识别 ----
+
+    def _authorized(self, endpoint, headers, query):
+        if not self.api_key:
+            return True
+        if endpoint == 'gemini':
+            key = parse_qs(query).get('key', [headers.get('x-goog-api-key')])[0]
+        else:
+            key = headers.get('authorization', '').removeprefix('Bearer ').strip()
+        return key == self.api_key
+
+    def _parse_image(self, endpoint, headers, body):
+        if endpoint == 'identify':
+            content_type = headers.get('content-type', '')
+            if 'multipart/form-data' not in content_type:
+                raise ValueError('需要 multipart/form-data 请求体')
+            return image_from_multipart(content_type, body)
+        request = json.loads(body or b'{}')
+        if not isinstance(request, dict):
+            raise ValueError('请求体必须是 JSON 对象')
+        return image_from_gemini(request) if endpoint == 'gemini' else image_from_openai(request)
+
+    def _attempt(self, image_hash, now):
+        """本次请求是这张图片本轮识别的第几次请求"""
+        count, last = self.attempts.get(image_hash, (0, 0.0))
+        if now - last > self.retry_window:
+            count = 0
+        self.attempts[image_hash] = (count + 1, now)
+        # 定期清理过期的记录
+        if len(self.attempts) > 2 * RECENT_REQUESTS:
+            self.attempts = {k: v for k, v in self.attempts.items() if now - v[1] <= self.retry_window}
+        return count + 1
+
+    def _outcome(self, profile):
+        roll = self.random.random()
+        if roll < profile.error_rate:
+            return 'error'
+        if roll < profile.error_rate + profile.timeout_rate:
+            return 'timeout'
+        return 'ok'
+
+    async def recognize(self, writer, endpoint, headers, body, query, model=None):
+        received = time.monotonic()
+        phase, profile = self.script.current()
+        record = {'t': round(time.time(), 3), 'endpoint': endpoint, 'bytes': len(body), 'phase': phase}
+
+        if not self._authorized(endpoint, headers, query):
+            record.update(outcome='unauthorized', status=401 if endpoint != 'gemini' else 403)
+            self._finish(record, received)
+            await self._send_failure(writer, endpoint, record['status'], 'API 密钥无效')
+            return True
+        try:
+            image = self._parse_image(endpoint, headers, body)
+        except (ValueError, TypeError) as e:
+            image = None
+            record['error'] = str(e)
+        if not image:
+            record.update(outcome='bad_request', status=400)
+            self._finish(record, received)
+            await self._send_failure(writer, endpoint, 400, record.get('error') or '请求中没有图片')
+            return True
+
+        image_hash = hashlib.sha256(image).hexdigest()
+        attempt = self._attempt(image_hash, received)
+        (self.first_attempts if attempt == 1 else self.retries).inc()
+        record.update(image=image_hash[:16], image_bytes=len(image), attempt=attempt)
+
+        # 上传：按上行带宽折算
+        if profile.upload_mbps:
+            upload = len(body) * 8 / (profile.upload_mbps * 1e6)
+            await asyncio.sleep(upload)
+            record['upload_ms'] = round(upload * 1000, 1)
+
+        outcome = self._outcome(profile)
+        if outcome == 'timeout':
+            # 不响应（响应在网络中丢失）：先记录，不占用服务端槽位，客户端超时断开后连接关闭
+            record.update(outcome='timeout', status=None)
+            self._finish(record, received)
+            await asyncio.sleep(HANG_SECONDS)
+            return False
+
+        self.queued.inc()
+        queue_started = time.monotonic()
+        if self.slots:
+            await self.slots.acquire()
+        self.queued.dec()
+        record['queue_ms'] = round((time.monotonic() - queue_started) * 1000, 1)
+        self.active.inc()
+        try:
+            status = self.random.choice(profile.error_codes) if outcome == 'error' else 200
+            cached = None
+            if status != 429:
+                # 限流在入口直接拒绝，其他错误在处理之后返回
+                cached = self.cache.get(image_hash)
+                record['cache'] = 'hit' if cached else 'miss'
+                (self.cache_hits if cached else self.cache_misses).inc()
+                service = (profile.cache_latency if cached else profile.latency).sample(self.random)
+                await asyncio.sleep(service)
+                record['service_ms'] = round(service * 1000, 1)
+
+            if outcome == 'error':
+                record.update(outcome='error', status=status)
+                self._finish(record, received)
+                await self._send_failure(writer, endpoint, status, '模拟的服务端错误')
+                return True
+
+            if not cached:
+                # 同一张图片每次得到相同的植物，置信度在 0.75～0.98 之间
+                seed = int(image_hash[:8], 16)
+                cached = (seed % len(CATALOG), 0.75 + (seed >> 8) % 24 / 100)
+                self.cache.put(image_hash, cached)
+            record.update(outcome='ok', status=200)
+            self.attempts.pop(image_hash, None)
+            self._finish(record, received)
+            await self._send_json(writer, self.response(endpoint, CATALOG[cached[0]], cached[1], model),
+                                  extra={'X-Cache': record['cache'].upper(), 'X-Attempt': attempt})
+            return True
+        finally:
+            self.active.dec()
+            if self.slots:
+                self.slots.release()
+
+    def _finish(self, record, received):
+        total = time.monotonic() - received
+        record['total_ms'] = round(total * 1000, 1)
+        self.registry.counter('requests_total', '识别请求数', endpoint=record['endpoint'],
+                              outcome=record['outcome']).inc()
+        if record['outcome'] != 'timeout':
+            self.request_seconds.observe(total)
+        self.recent.append(record)
+        if self.timings:
+            self.timings.write(record)
+        self.log(f"{record['endpoint']} {record['outcome']} {record.get('status') or '-'} "
+                 f"第 {record.get('attempt', '-')} 次 {record.get('cache') or ''} {record['total_ms']}ms")
+
+    async def _send_json(self, writer, data, status=200, extra=None):
+        await self._send(writer, status, json.dumps(data, ensure_ascii=False).encode('utf-8'),
+                         'application/json; charset=utf-8', extra)
+
+    async def _send_failure(self, writer, endpoint, status, message):
+        """按各接口的错误格式返回"""
+        extra = {'Retry-After': 1} if status == 429 else None
+        if endpoint == 'gemini':
+            codes = {400: 'INVALID_ARGUMENT', 403: 'PERMISSION_DENIED', 429: 'RESOURCE_EXHAUSTED',
+                     500: 'INTERNAL', 503: 'UNAVAILABLE', 504: 'DEADLINE_EXCEEDED'}
+            data = {'error': {'code': status, 'message': message, 'status': codes.get(status, 'UNKNOWN')}}
+        elif endpoint == 'openai':
+            data = {'error': {'message': message, 'type': 'server_error' if status >= 500 else 'invalid_request_error',
+                              'code': status}}
+        else:
+            data = {'success': False, 'message': message}
+        await self._send_json(writer, data, status, extra)
+
+    def response(self, endpoint, plant, confidence, model=None):
+        if endpoint == 'gemini':
+            return {
+                'candidates': [{'content': {'role': 'model', 'parts': [{'text': gemini_text(plant, confidence)}]},
+                                'finishReason': 'STOP', 'index': 0}],
+                'modelVersion': model,
+            }
+        result = {**plant, 'confidence': confidence}
+        if endpoint == 'openai':
+            return {
+                'id': f"chatcmpl-{self.random.getrandbits(64):016x}",
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': 'mock-vision',
+                'choices': [{'index': 0, 'finish_reason': 'stop',
+                             'message': {'role': 'assistant', 'content': json.dumps(result, ensure_ascii=False)}}],
+            }
+        # /identify 返回 RecognitionResult.fromJson 可以解析的结构
+        return {'success': True, 'plants': [result]}
+
+    def stats(self):
+        snapshot = self.registry.snapshot()
+        value = lambda name: snapshot.get(f'mock_cloud_{name}', {}).get('value', 0)
+        recent = list(self.recent)
+        answered = [r['total_ms'] for r in recent if r['outcome'] == 'ok']
+        first = value('recognitions_total')
+        requests = first + value('retries_total')
+        hits, misses = value('cache_hits_total'), value('cache_misses_total')
+        return {
+            'uptime_seconds': round(time.time() - self.started, 1),
+            'requests': {f"{entry['labels']['endpoint']}/{entry['labels']['outcome']}": entry['value']
+                         for entry in snapshot.values() if entry['name'] == 'mock_cloud_requests_total'},
+            'recognitions': first,
+            'retries': value('retries_total'),
+            'retry_amplification': round(requests / first, 3) if first else None,
+            'cache': {'hits': hits, 'misses': misses, 'entries': len(self.cache.entries),
+                      'hit_rate': round(hits / (hits + misses), 3) if hits + misses else None},
+            'active_requests': value('active_requests'),
+            'queued_requests': value('queued_requests'),
+            'ok_latency_ms': {
+                'p50': percentile(answered, 0.5),
+                'p95': percentile(answered, 0.95),
+                'p99': percentile(answered, 0.99),
+            },
+            **self.profile_info(),
+        }
+
+# ---- 负载 ----
+
+def load_images(directory, count, size, seed):
+    """测试图片：目录中的图片，或 count 张指定大小的随机数据（以 JPEG 文件头开始）"""
+    if directory:
+        paths = sorted(p for p in Path(directory).rglob('*')
+                       if p.suffix.lower() in ('.jpg', '.jpeg', '.png', '.webp'))[:count]
+        if not paths:
+            raise ValueError(f"{directory} 中没有图片")
+        return [p.read_bytes() for p in paths]
+    rng = random.Random(seed)
+    return [b'\xff\xd8\xff\xe0' + rng.randbytes(max(0, size - 4)) for _ in range(count)]
+
+def build_request(endpoint, image, host, api_key):
+    """按应用的请求格式构造 (路径, 请求头, 请求体)"""
+    encoded = base64.b64encode(image).decode('ascii')
+    if endpoint == 'gemini':
+        body = json.dumps({
+            'contents': [{'parts': [{'text': '请仔细分析这张图片中的植物，识别植物种类。'},
+                                    {'inline_data': {'mime_type': 'image/jpeg', 'data': encoded}}]}],
+            'generationConfig': {'temperature': 0.1, 'maxOutputTokens': 2048, 'candidateCount': 1},
+        }).encode('utf-8')
+        return (f'/v1beta/models/gemini-pro-vision:generateContent?key={api_key or "test"}',
+                {'Content-Type': 'application/json'}, body)
+    if endpoint == 'openai':
+        body = json.dumps({
+            'model': 'mock-vision',
+            'messages': [{'role': 'user', 'content': [
+                {'type': 'text', 'text': '识别这张图片中的植物，返回 JSON。'},
+                {'type': 'image_url', 'image_url': {'url': f'data:image/jpeg;base64,{encoded}'}}]}],
+        }).encode('utf-8')
+        return OPENAI_PATH, {'Content-Type': 'application/json',
+                             'Authorization': f'Bearer {api_key or "test"}'}, body
+    boundary = f'plantmeet-{os.urandom(8).hex()}'
+    fields = [('format', 'detailed'), ('include_safety', 'true'), ('include_care', 'true')]
+    parts = [f'--{boundary}\r\nContent-Disposition: form-data; name="{k}"\r\n\r\n{v}\r\n'.encode('utf-8')
+             for k, v in fields]
+    parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="image"; filename="photo.jpg"\r\n'
+                 f'Content-Type: image/jpeg\r\n\r\n'.encode('utf-8') + image + b'\r\n')
+    body = b''.join(parts) + f'--{boundary}--\r\n'.encode('utf-8')
+    return IDENTIFY_PATH, {'Content-Type': f'multipart/form-data; boundary={boundary}',
+                           'Authorization': f'Bearer {api_key or "test"}'}, body
+
+async def http_post(host, port, path, headers, body):
+    """发送一个 POST 请求（每次新建连接，与应用的 http.post 一致），返回状态码"""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        head = [f'POST {path} HTTP/1.1', f'Host: {host}:{port}', f'Content-Length: {len(body)}',
+                'Connection: close'] + [f'{k}: {v}' for k, v in headers.items()]
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body)
+        await writer.drain()
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError('服务器关闭了连接')
+        status = int(status_line.split()[1])
+        length = 0
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            if name.strip().lower() == 'content-length':
+                length = int(value)
+        await reader.readexactly(length)
+        return status
+    finally:
+        writer.close()
+
+async def virtual_user(index, target, endpoint, images, deadline, retries, timeout, think, api_key, results):
+    """一个虚拟用户：连续识别，每次识别按应用的策略重试"""
+    host, port = target
+    rng = random.Random(index)
+    while time.monotonic() < deadline:
+        image = rng.choice(images)
+        path, headers, body = build_request(endpoint, image, host, api_key)
+        started = time.monotonic()
+        attempts = []
+        ok = False
+        for retry in range(retries + 1):
+            if retry:
+                # Future.delayed(Duration(seconds: retry + 1))，retry 从 0 开始
+                await asyncio.sleep(retry)
+            attempt_started = time.monotonic()
+            try:
+                status = await asyncio.wait_for(http_post(host, port, path, headers, body), timeout)
+            except asyncio.TimeoutError:
+                status = 'timeout'
+            except (OSError, ValueError, IndexError, asyncio.IncompleteReadError):
+                status = 'connection_error'
+            attempts.append({'status': status, 'ms': round((time.monotonic() - attempt_started) * 1000, 1)})
+            if status == 200:
+                ok = True
+                break
+        results.append({'user': index, 'ok': ok, 'ms': round((time.monotonic() - started) * 1000, 1),
+                        'attempts': attempts})
+        if think:
+            await asyncio.sleep(rng.expovariate(1 / think))
+
+def summarize_load(results, duration):
+    if not results:
+        return {'recognitions': 0}
+    latencies = [r['ms'] for r in results]
+    ok = [r['ms'] for r in results if r['ok']]
+    attempts = collections.Counter(len(r['attempts']) for r in results)
+    statuses = collections.Counter(str(a['status']) for r in results for a in r['attempts'])
+    total_attempts = sum(len(r['attempts']) for r in results)
+    return {
+        'recognitions': len(results),
+        'succeeded': len(ok),
+        'success_rate': round(len(ok) / len(results), 4),
+        'recognitions_per_second': round(len(results) / duration, 2),
+        'requests': total_attempts,
+        'retry_amplification': round(total_attempts / len(results), 3),
+        'attempts_histogram': {str(k): attempts[k] for k in sorted(attempts)},
+        'statuses': dict(statuses),
+        'e2e_ms': {
+            'p50': percentile(latencies, 0.5),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+            'max': max(latencies),
+        },
+        'e2e_ok_ms': {'p50': percentile(ok, 0.5), 'p95': percentile(ok, 0.95)} if ok else None,
+    }
+
+async def run_load(args, server, target):
+    images = load_images(args.images, args.image_count, args.image_size, args.seed)
+    print(f"🏋️  负载: {args.load} 个虚拟用户，{args.duration:g} 秒，接口 {args.endpoint}，"
+          f"{len(images)} 张图片（平均 {format_size(sum(map(len, images)) / len(images))}），"
+          f"重试 {args.retries} 次，超时 {args.client_timeout:g} 秒")
+    results = []
+    started = time.monotonic()
+    deadline = started + args.duration
+    users = [asyncio.create_task(virtual_user(i, target, args.endpoint, images, deadline, args.retries,
+                                              args.client_timeout, args.think, args.api_key, results))
+             for i in range(args.load)]
+    # 截止后不再开始新的识别，等待进行中的识别完成
+    await asyncio.gather(*users)
+    elapsed = time.monotonic() - started
+    summary = summarize_load(results, elapsed)
+    summary['elapsed_seconds'] = round(elapsed, 1)
+    report = {
+        'config': {k: getattr(args, k) for k in ('load', 'duration', 'endpoint', 'retries', 'client_timeout',
+                                                  'think', 'image_count', 'image_size', 'slots', 'seed')},
+        'load': summary,
+        'server': server.stats() if server else None,
+        'recognitions': results if args.output else None,
+    }
+
+    print(f"\n📊 {summary['recognitions']} 次识别，成功率 {summary.get('success_rate', 0):.1%}，"
+          f"{summary.get('recognitions_per_second', 0)} 次/秒")
+    if results:
+        e2e = summary['e2e_ms']
+        print(f"  端到端延迟 p50 {e2e['p50']}ms  p95 {e2e['p95']}ms  p99 {e2e['p99']}ms  最大 {e2e['max']}ms")
+        print(f"  请求数 {summary['requests']}，重试放大 x{summary['retry_amplification']}  "
+              f"尝试次数分布 {summary['attempts_histogram']}  状态 {summary['statuses']}")
+    if server:
+        stats = report['server']
+        print(f"  服务端: 缓存命中率 {stats['cache']['hit_rate']}  "
+              f"成功请求 p50 {stats['ok_latency_ms']['p50']}ms p95 {stats['ok_latency_ms']['p95']}ms")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"📄 报告已保存: {args.output}")
+    return report
+
+async def serve(args):
+    phases = None
+    if args.script:
+        with open(args.script, 'r') as f:
+            phases = json.load(f)
+        if not isinstance(phases, list) or not phases:
+            raise ValueError(f"{args.script} 应为非空的阶段列表")
+    base = Profile(latency=args.latency, cache_latency=args.cache_latency, error_rate=args.error_rate,
+                   error_codes=[int(c) for c in args.error_codes.split(',') if c.strip()],
+                   timeout_rate=args.timeout_rate, upload_mbps=args.upload_mbps)
+    script = ProfileScript(base, phases)
+
+    if args.target:
+        url = urlsplit(args.target)
+        return await run_load(args, None, (url.hostname, url.port or 80))
+
+    timings = TimingLog(args.timings) if args.timings else None
+    server = MockCloudServer(script, slots=args.slots, cache_size=args.cache_size, retry_window=args.retry_window,
+                             api_key=args.api_key, timings=timings, seed=args.seed,
+                             quiet=args.quiet or bool(args.load))
+    listener = await asyncio.start_server(server.handle, args.host, args.port,
+                                          backlog=args.backlog, reuse_address=True)
+    port = listener.sockets[0].getsockname()[1]
+
+    print("☁️  云端识别模拟服务器已启动")
+    print(f"📍 地址: http://{args.host}:{port}")
+    print("   Gemini:   POST /v1beta/models/gemini-pro-vision:generateContent?key=...")
+    print(f"   OpenAI:   POST {OPENAI_PATH}")
+    print(f"   自建接口: POST {IDENTIFY_PATH}  GET /health")
+    for i, (duration, profile) in enumerate(script.phases):
+        prefix = f"阶段 {i + 1}" + (f" ({duration:g} 秒)" if duration and i < len(script.phases) - 1 else "")
+        print(f"⏱️  {prefix}: 延迟 {profile.latency}，缓存命中 {profile.cache_latency}，"
+              f"错误 {profile.error_rate:.0%} {list(profile.error_codes)}，超时 {profile.timeout_rate:.0%}"
+              + (f"，上行 {profile.upload_mbps:g} Mbps" if profile.upload_mbps else ""))
+    if args.slots:
+        print(f"🎰 服务端槽位: {args.slots}（超出的请求排队）")
+    if timings:
+        print(f"📝 请求耗时记录: {timings.path}")
+
+    try:
+        async with listener:
+            if args.load:
+                await run_load(args, server, (args.host if args.host != '0.0.0.0' else '127.0.0.1', port))
+            else:
+                print("🛑 按 Ctrl+C 停止服务器")
+                await listener.serve_forever()
+    finally:
+        if timings:
+            timings.close()
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='云端识别模拟服务器 (Gemini / OpenAI 兼容 / 自建接口)')
+    parser.add_argument('--port', type=int, default=8090, help='服务器端口，0 表示随机 (默认: 8090)')
+    parser.add_argument('--host', default='127.0.0.1', help='绑定主机 (默认: 127.0.0.1；真机测试用 0.0.0.0)')
+    parser.add_argument('--latency', default='lognormal:1500,0.4',
+                        help='推理延迟分布，单位 ms (默认: lognormal:1500,0.4)')
+    parser.add_argument('--cache-latency', default='fixed:30', help='缓存命中时的延迟分布 (默认: fixed:30)')
+    parser.add_argument('--error-rate', type=float, default=0, help='返回错误状态码的概率 (默认: 0)')
+    parser.add_argument('--error-codes', default='500,503,429', help='错误状态码，随机选取 (默认: 500,503,429)')
+    parser.add_argument('--timeout-rate', type=float, default=0, help='接受请求后不响应的概率 (默认: 0)')
+    parser.add_argument('--upload-mbps', type=float, default=0, help='模拟的上行带宽 Mbps，0 不限制 (默认: 0)')
+    parser.add_argument('--script', help='按时间切换参数的 JSON 阶段列表')
+    parser.add_argument('--slots', type=int, default=0, help='同时处理的请求数上限，超出的排队；0 不限制 (默认: 0)')
+    parser.add_argument('--cache-size', type=int, default=10000, help='结果缓存的图片数，0 关闭 (默认: 10000)')
+    parser.add_argument('--retry-window', type=float, default=60,
+                        help='同一图片在该时间内（秒）再次请求视为重试 (默认: 60)')
+    parser.add_argument('--api-key', help='要求请求携带该密钥（Gemini 用 ?key=，其他用 Bearer）')
+    parser.add_argument('--timings', help='每个请求的耗时追加写入该 JSONL 文件')
+    parser.add_argument('--seed', type=int, help='随机种子，固定后延迟和失败注入可复现')
+    parser.add_argument('--backlog', type=int, default=1024, help='监听队列长度 (默认: 1024)')
+    parser.add_argument('--quiet', '-q', action='store_true', help='关闭访问日志')
+    load = parser.add_argument_group('负载测试')
+    load.add_argument('--load', type=int, default=0, help='虚拟用户数，大于 0 时运行负载测试后退出')
+    load.add_argument('--target', help='对已运行的服务器施加负载（如 http://127.0.0.1:8090），不启动本地服务器')
+    load.add_argument('--duration', type=float, default=30, help='负载持续时间（秒）(默认: 30)')
+    load.add_argument('--endpoint', choices=('gemini', 'openai', 'identify'), default='gemini',
+                      help='负载使用的接口 (默认: gemini)')
+    load.add_argument('--retries', type=int, default=APP_RETRIES, help=f'失败后的重试次数 (默认: {APP_RETRIES})')
+    load.add_argument('--client-timeout', type=float, default=APP_TIMEOUT,
+                      help=f'单次请求超时（秒）(默认: {APP_TIMEOUT:g}，与 Gemini 客户端相同)')
+    load.add_argument('--think', type=float, default=0, help='两次识别之间的平均间隔（秒）(默认: 0)')
+    load.add_argument('--images', help='测试图片目录 (默认: 生成随机数据)')
+    load.add_argument('--image-count', type=int, default=50, help='使用的图片数，越少缓存命中越多 (默认: 50)')
+    load.add_argument('--image-size', type=int, default=300 * 1024, help='生成的图片字节数 (默认: 307200)')
+    load.add_argument('--output', '-o', help='负载测试的 JSON 报告输出路径')
+    args = parser.parse_args()
+    if args.target and not args.load:
+        parser.error('--target 需要同时指定 --load')
+
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        print("\n🛑 服务器已停止")
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    except OSError as e:
+        print(f"❌ 服务器启动失败: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
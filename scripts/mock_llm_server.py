@@ -0,0 +1,488 @@
+#!/usr/bin/env python3
+"""
+MNN Chat 模拟服务器 - OpenAI 兼容接口，用于在 Linux 上测试 mnn_chat_service.dart 的延迟和流式行为
+
+实现 mnn_chat_service.dart 调用的全部端点：
+- GET  /health /status /ping /api/health                 健康检查
+- GET  /v1/models /api/models /models /api/v1/models      模型列表（qwen2.5-vl-3b）
+- GET  /v1/models/<id> /api/models/<id> /model/info       模型信息
+- POST /v1/chat/completions                              对话补全，stream=true 时以 SSE 逐 token 返回
+- GET  /metrics /stats.json                              模拟服务器自身的指标
+
+生成速度按参数模拟：首 token 延迟、每秒 token 数、随机抖动，以及按图片和文本估算的预填充时间；
+可注入失败（HTTP 500、流中途断开、不响应）。基于 asyncio，单进程可同时维持数百个流。
+返回内容是符合应用提示词格式的植物识别 JSON（快速/详细两种），应用可以正常解析。
+
+使用方法:
+python3 scripts/mock_llm_server.py
+python3 scripts/mock_llm_server.py --ttft 1200 --tps 15 --jitter 0.3 --error-rate 0.05
+python3 scripts/mock_llm_server.py --slots 1          # 模拟手机上一次只能跑一个推理
+
+curl -N http://127.0.0.1:8080/v1/chat/completions \\
+  -d '{"model": "qwen2.5-vl-3b", "stream": true, "messages": [{"role": "user", "content": "你好"}]}'
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+import uuid
+from urllib.parse import urlsplit
+
+from transfer_metrics import MetricsRegistry, render_prometheus
+
+MODEL_ID = 'qwen2.5-vl-3b'
+CONTEXT_LENGTH = 8192
+
+# 每张图片折算的 prompt token 数（Qwen2.5-VL 768x768 输入约 750 个视觉 token）
+IMAGE_TOKENS = 750
+
+# 请求体上限（base64 图片）
+MAX_BODY = 32 * 1024 * 1024
+
+# 首 token 延迟直方图边界（秒）
+TTFT_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0)
+
+# 不响应的请求最多挂起的时间（秒），客户端超时后连接随之关闭
+HANG_SECONDS = 600
+
+HEALTH_PATHS = {'/health', '/status', '/ping', '/api/health'}
+MODELS_PATHS = {'/v1/models', '/api/models', '/models', '/api/v1/models'}
+MODEL_INFO_PREFIXES = ('/v1/models/', '/api/models/')
+
+QUICK_REPLY = {
+    'name': '绿萝',
+    'confidence': '比较确定',
+    'safety_level': 'caution',
+    'brief_description': '常见的室内观叶植物，叶片心形，藤蔓可垂吊或攀爬。',
+    'key_tip': '汁液对猫狗有轻微毒性，放在宠物够不到的地方；保持盆土微湿即可。',
+}
+
+DETAILED_REPLY = {
+    'name': '绿萝',
+    'nickname': '黄金葛',
+    'confidence': '比较确定',
+    'description': '绿萝是天南星科的常绿藤本植物，叶片心形、有光泽，常带黄色斑纹，'
+                   '是办公室和家里最常见的"懒人植物"之一，耐阴又好养。',
+    'key_features': ['心形叶片，表面有光泽', '叶面常有黄白色斑纹', '茎节上有气生根'],
+    'safety': {
+        'level': 'caution',
+        'description': '全株含草酸钙针晶，误食会刺激口腔和消化道。',
+        'warnings': ['避免儿童和宠物啃咬', '修剪后洗手'],
+    },
+    'care': {
+        'difficulty': '简单',
+        'water': '盆土表面干了再浇透，冬季减少浇水',
+        'light': '明亮散射光，避免夏季直晒',
+        'tips': ['每月施一次稀薄液肥', '藤蔓过长时剪下可直接水培扦插'],
+    },
+    'fun_fact': '绿萝在原产地可以攀爬到十几米高，叶片能长到一米长。',
+    'season': '四季常绿',
+    'locations': ['室内', '办公室', '阳台'],
+    'tags': ['观叶植物', '耐阴', '易养护'],
+}
+
+TEXT_REPLY = ('这是一段来自模拟服务器的回复，用于测试客户端的流式显示、首字延迟和超时处理。'
+              '生成速度、抖动和失败率都可以通过命令行参数调整。')
+
+TOKEN_PATTERN = re.compile(r'[一-鿿]|[A-Za-z0-9_]+|\s+|.', re.S)
+
+def tokenize(text):
+    """近似的分词：每个汉字、每个单词或数字、每段空白、每个符号各算一个 token"""
+    return TOKEN_PATTERN.findall(text)
+
+def prompt_stats(messages):
+    """估算 prompt 的 token 数，并返回拼接后的文本和图片数"""
+    texts = []
+    images = 0
+    for message in messages or []:
+        content = message.get('content') if isinstance(message, dict) else None
+        if isinstance(content, str):
+            texts.append(content)
+        elif isinstance(content, list):
+            for part in content:
+                if not isinstance(part, dict):
+                    continue
+                if part.get('type') == 'text':
+                    texts.append(part.get('text', ''))
+                elif part.get('type') == 'image_url':
+                    images += 1
+    text = '\n'.join(texts)
+    return text, images, len(tokenize(text)) + images * IMAGE_TOKENS
+
+def reply_for(request, text):
+    """按应用提示词的格式生成回复内容"""
+    wants_json = (request.get('response_format') or {}).get('type') == 'json_object' or 'JSON' in text
+    if not wants_json:
+        return TEXT_REPLY
+    reply = QUICK_REPLY if '快速识别' in text else DETAILED_REPLY
+    return json.dumps(reply, ensure_ascii=False, indent=2)
+
+class HTTPError(Exception):
+    def __init__(self, status, message, error_type='invalid_request_error'):
+        super().__init__(message)
+        self.status = status
+        self.error_type = error_type
+
+def max_tokens_of(request, default=2048):
+    """请求的生成上限（max_tokens 优先，其次 max_completion_tokens）；给出的值不是正整数时返回 400"""
+    limits = []
+    for key in ('max_tokens', 'max_completion_tokens'):
+        value = request.get(key)
+        if value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, int) or value <= 0:
+            raise HTTPError(400, f'{key} 必须是正整数')
+        limits.append(value)
+    return limits[0] if limits else default
+
+REASONS = {
+    200: 'OK', 204: 'No Content', 400: 'Bad Request', 401: 'Unauthorized', 403: 'Forbidden',
+    404: 'Not Found', 405: 'Method Not Allowed', 411: 'Length Required', 413: 'Payload Too Large',
+    429: 'Too Many Requests', 500: 'Internal Server Error', 502: 'Bad Gateway', 503: 'Service Unavailable',
+    504: 'Gateway Timeout',
+}
+
+class AsyncHTTPServer:
+    """基于 asyncio 的最小 HTTP/1.1 服务器，子类实现 _dispatch() 处理请求"""
+
+    def __init__(self, prefix, quiet=False):
+        self.quiet = quiet
+        self.registry = MetricsRegistry(prefix=prefix)
+        self.active_connections = self.registry.gauge('active_connections', '当前连接数')
+
+    def log(self, message):
+        if not self.quiet:
+            print(f"[{time.strftime('%H:%M:%S')}] {message}")
+
+    async def _dispatch(self, writer, method, path, headers, body, query=''):
+        """处理一个请求，返回连接能否继续复用"""
+        raise NotImplementedError
+
+    async def handle(self, reader, writer):
+        """一个连接：HTTP/1.1 keep-alive，依次处理请求"""
+        peer = writer.get_extra_info('peername')
+        self.active_connections.inc()
+        try:
+            while True:
+                request = await self._read_request(reader, writer)
+                if request is None:
+                    break
+                method, path, query, headers, body = request
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                try:
+                    keep_alive = await self._dispatch(writer, method, path, headers, body, query) and keep_alive
+                except HTTPError as e:
+                    await self._send_error(writer, e)
+                self.log(f"{peer[0] if peer else '-'} {method} {path}")
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except asyncio.CancelledError:
+            # 事件循环退出时取消挂起的连接（如注入的不响应请求）
+            pass
+        finally:
+            self.active_connections.dec()
+            writer.close()
+
+    async def _read_request(self, reader, writer):
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            return None
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, _ = lines[0].split(' ', 2)
+        except ValueError:
+            return None
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+
+        body = b''
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            await self._send_error(writer, HTTPError(411, '不支持分块请求体，请提供 Content-Length'))
+            return None
+        try:
+            length = int(headers.get('content-length', 0) or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            await self._send_error(writer, HTTPError(400, 'Content-Length 不是合法的非负整数'))
+            return None
+        if length > MAX_BODY:
+            await self._send_error(writer, HTTPError(413, f'请求体超过 {MAX_BODY} 字节'))
+            return None
+        if length:
+            body = await reader.readexactly(length)
+        url = urlsplit(target)
+        return method.upper(), url.path, url.query, headers, body
+
+    async def _send(self, writer, status, body, content_type='application/json', extra=None):
+        head = [f"HTTP/1.1 {status} {REASONS.get(status, '')}",
+                f"Content-Type: {content_type}",
+                f"Content-Length: {len(body)}",
+                "Access-Control-Allow-Origin: *"]
+        head += [f"{k}: {v}" for k, v in (extra or {}).items()]
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body)
+        await writer.drain()
+
+    async def _send_json(self, writer, data, status=200):
+        await self._send(writer, status, json.dumps(data, ensure_ascii=False).encode('utf-8'),
+                         'application/json; charset=utf-8')
+
+    async def _send_error(self, writer, error):
+        await self._send_json(writer, {'error': {'message': str(error), 'type': error.error_type,
+                                                 'code': error.status}}, error.status)
+
+class MockLLMServer(AsyncHTTPServer):
+    """模拟推理服务：按配置的速度生成 token，并按概率注入失败"""
+
+    def __init__(self, ttft=0.8, tps=20.0, jitter=0.2, prefill_tps=0.0, error_rate=0.0,
+                 disconnect_rate=0.0, hang_rate=0.0, slots=0, seed=None, quiet=False):
+        super().__init__('mock_llm', quiet)
+        self.ttft = ttft
+        self.tps = tps
+        self.jitter = jitter
+        self.prefill_tps = prefill_tps
+        self.error_rate = error_rate
+        self.disconnect_rate = disconnect_rate
+        self.hang_rate = hang_rate
+        self.random = random.Random(seed)
+        # 限制同时生成的请求数，超出的请求排队（排队时间计入首 token 延迟）
+        self.slots = asyncio.Semaphore(slots) if slots > 0 else None
+
+        self.active_streams = self.registry.gauge('active_generations', '正在生成的请求数')
+        self.queued = self.registry.gauge('queued_requests', '等待推理槽位的请求数')
+        self.tokens = self.registry.counter('completion_tokens_total', '已生成的 token 数')
+        self.ttft_hist = self.registry.histogram('ttft_seconds', '首 token 延迟（含排队）', TTFT_BUCKETS)
+
+    def _jittered(self, seconds):
+        if not self.jitter:
+            return seconds
+        return max(0.0, seconds * (1 + self.random.uniform(-self.jitter, self.jitter)))
+
+    async def _dispatch(self, writer, method, path, headers, body, query=''):
+        if method == 'OPTIONS':
+            await self._send(writer, 204, b'', extra={
+                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, Authorization'})
+            return True
+        if method == 'GET':
+            if path in HEALTH_PATHS:
+                await self._send_json(writer, {'status': 'ok', 'model': MODEL_ID})
+            elif path in MODELS_PATHS:
+                await self._send_json(writer, {'object': 'list', 'data': [self.model_info()]})
+            elif path == '/model/info' or path.startswith(MODEL_INFO_PREFIXES):
+                await self._send_json(writer, self.model_info())
+            elif path == '/metrics':
+                await self._send(writer, 200, render_prometheus(self.registry.snapshot()).encode('utf-8'),
+                                 'text/plain; version=0.0.4')
+            elif path == '/stats.json':
+                await self._send_json(writer, self.stats())
+            else:
+                raise HTTPError(404, f'未知端点 {path}')
+            return True
+        if method == 'POST' and path == '/v1/chat/completions':
+            try:
+                request = json.loads(body or b'{}')
+            except ValueError:
+                raise HTTPError(400, '请求体不是合法的 JSON')
+            if not isinstance(request, dict) or not isinstance(request.get('messages'), list):
+                raise HTTPError(400, '缺少 messages 字段')
+            return await self.chat_completion(writer, request)
+        raise HTTPError(405 if path == '/v1/chat/completions' else 404, f'不支持 {method} {path}')
+
+    def model_info(self):
+        return {
+            'id': MODEL_ID,
+            'object': 'model',
+            'owned_by': 'mock-mnn-chat',
+            'context_length': CONTEXT_LENGTH,
+            'max_tokens': 2048,
+            'supports_vision': True,
+        }
+
+    def stats(self):
+        snapshot = self.registry.snapshot()
+        ttft = snapshot.get('mock_llm_ttft_seconds', {})
+        return {
+            'requests': {key: entry['value'] for key, entry in snapshot.items()
+                         if entry['name'] == 'mock_llm_requests_total'},
+            'active_connections': snapshot.get('mock_llm_active_connections', {}).get('value', 0),
+            'active_generations': snapshot.get('mock_llm_active_generations', {}).get('value', 0),
+            'queued_requests': snapshot.get('mock_llm_queued_requests', {}).get('value', 0),
+            'completion_tokens': snapshot.get('mock_llm_completion_tokens_total', {}).get('value', 0),
+            'ttft_mean_seconds': ttft['sum'] / ttft['count'] if ttft.get('count') else None,
+        }
+
+    # ---- 生成 ----
+
+    def _outcome(self):
+        """按概率抽取本次请求注入的失败: None / error / disconnect / hang"""
+        roll = self.random.random()
+        for outcome, rate in (('error', self.error_rate), ('disconnect', self.disconnect_rate),
+                              ('hang', self.hang_rate)):
+            if roll < rate:
+                return outcome
+            roll -= rate
+        return None
+
+    async def chat_completion(self, writer, request):
+        received = time.monotonic()
+        stream = bool(request.get('stream'))
+        max_tokens = max_tokens_of(request)
+        outcome = self._outcome()
+        self.registry.counter('requests_total', '对话补全请求数',
+                              stream=str(stream).lower(), outcome=outcome or 'ok').inc()
+
+        if outcome == 'error':
+            await asyncio.sleep(self._jittered(self.ttft))
+            raise HTTPError(500, '模拟的推理失败', 'server_error')
+        if outcome == 'hang':
+            await asyncio.sleep(HANG_SECONDS)
+            return False
+
+        text, images, prompt_tokens = prompt_stats(request['messages'])
+        tokens = tokenize(reply_for(request, text))
+        finish_reason = 'length' if len(tokens) > max_tokens else 'stop'
+        tokens = tokens[:max_tokens]
+        # 流式请求在随机位置断开；非流式请求在首 token 之后断开
+        cut = self.random.randrange(len(tokens) + 1) if outcome == 'disconnect' else None
+
+        self.queued.inc()
+        if self.slots:
+            await self.slots.acquire()
+        self.queued.dec()
+        self.active_streams.inc()
+        try:
+            first = self.ttft + (prompt_tokens / self.prefill_tps if self.prefill_tps else 0)
+            started = time.monotonic()
+            due = started + self._jittered(first)
+            completion = {
+                'id': f"chatcmpl-{uuid.uuid4().hex[:24]}",
+                'created': int(time.time()),
+                'model': request.get('model') or MODEL_ID,
+            }
+            usage = {'prompt_tokens': prompt_tokens, 'completion_tokens': len(tokens),
+                     'total_tokens': prompt_tokens + len(tokens)}
+            if stream:
+                return await self._stream(writer, request, completion, tokens, due, received,
+                                          finish_reason, usage, cut)
+
+            # 非流式：所有 token 生成完后一次返回
+            await asyncio.sleep(max(0.0, due - time.monotonic()))
+            self.ttft_hist.observe(time.monotonic() - received)
+            if cut is not None:
+                return False
+            for _ in tokens:
+                due += self._jittered(1 / self.tps) if self.tps else 0
+            await asyncio.sleep(max(0.0, due - time.monotonic()))
+            self.tokens.inc(len(tokens))
+            await self._send_json(writer, {
+                **completion,
+                'object': 'chat.completion',
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': ''.join(tokens)},
+                             'finish_reason': finish_reason}],
+                'usage': usage,
+            })
+            return True
+        finally:
+            self.active_streams.dec()
+            if self.slots:
+                self.slots.release()
+
+    async def _stream(self, writer, request, completion, tokens, due, received, finish_reason, usage, cut):
+        """SSE 流式返回，token 按计划时间发送（基于绝对时间，不累积 sleep 误差）"""
+        writer.write(('HTTP/1.1 200 OK\r\n'
+                      'Content-Type: text/event-stream; charset=utf-8\r\n'
+                      'Cache-Control: no-cache\r\n'
+                      'Transfer-Encoding: chunked\r\n'
+                      'Access-Control-Allow-Origin: *\r\n\r\n').encode('latin-1'))
+
+        def event(choice, extra=None):
+            data = {**completion, 'object': 'chat.completion.chunk', 'choices': [choice], **(extra or {})}
+            payload = f"data: {json.dumps(data, ensure_ascii=False)}\n\n".encode('utf-8')
+            writer.write(b'%x\r\n%s\r\n' % (len(payload), payload))
+
+        event({'index': 0, 'delta': {'role': 'assistant', 'content': ''}, 'finish_reason': None})
+        await writer.drain()
+
+        for i, token in enumerate(tokens):
+            if i == cut:
+                # 模拟推理进程崩溃：直接断开，不发送结束标记
+                writer.transport.abort()
+                return False
+            await asyncio.sleep(max(0.0, due - time.monotonic()))
+            if i == 0:
+                self.ttft_hist.observe(time.monotonic() - received)
+            event({'index': 0, 'delta': {'content': token}, 'finish_reason': None})
+            self.tokens.inc()
+            await writer.drain()
+            due += self._jittered(1 / self.tps) if self.tps else 0
+
+        include_usage = (request.get('stream_options') or {}).get('include_usage')
+        event({'index': 0, 'delta': {}, 'finish_reason': finish_reason},
+              {'usage': usage} if include_usage else None)
+        payload = b'data: [DONE]\n\n'
+        writer.write(b'%x\r\n%s\r\n0\r\n\r\n' % (len(payload), payload))
+        await writer.drain()
+        return True
+
+async def serve(args):
+    server = MockLLMServer(
+        ttft=args.ttft / 1000, tps=args.tps, jitter=args.jitter, prefill_tps=args.prefill_tps,
+        error_rate=args.error_rate, disconnect_rate=args.disconnect_rate, hang_rate=args.hang_rate,
+        slots=args.slots, seed=args.seed, quiet=args.quiet)
+    listener = await asyncio.start_server(server.handle, args.host, args.port,
+                                          backlog=args.backlog, reuse_address=True)
+
+    print("🤖 MNN Chat 模拟服务器已启动")
+    print(f"📍 地址: http://{args.host}:{args.port}  模型: {MODEL_ID}")
+    print(f"⏱️  首 token {args.ttft:.0f}ms，{args.tps:g} token/s，抖动 ±{args.jitter * 100:.0f}%"
+          + (f"，预填充 {args.prefill_tps:g} token/s" if args.prefill_tps else ""))
+    if args.error_rate or args.disconnect_rate or args.hang_rate:
+        print(f"💥 失败注入: 500 {args.error_rate:.0%}，中途断开 {args.disconnect_rate:.0%}，"
+              f"不响应 {args.hang_rate:.0%}")
+    if args.slots:
+        print(f"🎰 推理槽位: {args.slots}（超出的请求排队）")
+    print("🛑 按 Ctrl+C 停止服务器")
+    async with listener:
+        await listener.serve_forever()
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='MNN Chat 模拟服务器 (OpenAI 兼容接口)')
+    parser.add_argument('--port', type=int, default=8080, help='服务器端口 (默认: 8080，与 MNN Chat 相同)')
+    parser.add_argument('--host', default='127.0.0.1', help='绑定主机 (默认: 127.0.0.1)')
+    parser.add_argument('--ttft', type=float, default=800, help='首 token 延迟 ms (默认: 800)')
+    parser.add_argument('--tps', type=float, default=20, help='每秒生成 token 数，0 不限速 (默认: 20)')
+    parser.add_argument('--jitter', type=float, default=0.2,
+                        help='延迟随机抖动比例，0.2 表示 ±20%% (默认: 0.2)')
+    parser.add_argument('--prefill-tps', type=float, default=0,
+                        help=f'预填充速度 token/s，首 token 延迟额外加上 prompt 处理时间，'
+                             f'每张图片按 {IMAGE_TOKENS} token 计；0 关闭 (默认: 0)')
+    parser.add_argument('--error-rate', type=float, default=0, help='返回 HTTP 500 的概率 (默认: 0)')
+    parser.add_argument('--disconnect-rate', type=float, default=0, help='生成中途断开连接的概率 (默认: 0)')
+    parser.add_argument('--hang-rate', type=float, default=0, help='接受请求后不响应的概率 (默认: 0)')
+    parser.add_argument('--slots', type=int, default=0,
+                        help='同时生成的请求数上限，超出的排队；0 不限制 (默认: 0)')
+    parser.add_argument('--seed', type=int, help='随机种子，固定后抖动和失败注入可复现')
+    parser.add_argument('--backlog', type=int, default=1024, help='监听队列长度 (默认: 1024)')
+    parser.add_argument('--quiet', '-q', action='store_true', help='关闭访问日志')
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        print("\n🛑 服务器已停止")
+    except OSError as e:
+        print(f"❌ 服务器启动失败: {e}")
+
+if __name__ == "__main__":
+    main()
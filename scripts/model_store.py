@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""
+共享模型缓存（按内容寻址）
+
+所有检出目录、工作树和脚本共用一份模型文件:
+  ~/.cache/plantmeet/blobs/sha256/<前两位>/<sha256>   模型数据（只读）
+  ~/.cache/plantmeet/index.json                       文件名、大小、最近使用时间
+
+assets/models/ 中的模型文件是指向缓存的硬链接（跨文件系统时尝试 reflink，最后退化为复制），
+不额外占用磁盘。缓存文件设为只读，避免通过硬链接被意外改写。
+超出容量上限时按最近使用时间淘汰，仍被检出目录链接的文件不会被淘汰。
+
+环境变量:
+PLANTMEET_STORE         缓存目录 (默认: ~/.cache/plantmeet)
+PLANTMEET_STORE_BUDGET  容量上限 GB (默认: 20)
+
+使用方法:
+python3 scripts/model_store.py status
+python3 scripts/model_store.py adopt assets/models/gemma-3n-E4B-it-int4.task
+python3 scripts/model_store.py link gemma-3n-E4B-it-int4.task assets/models/gemma-3n-E4B-it-int4.task
+python3 scripts/model_store.py evict --budget 10
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+GB = 1024 * 1024 * 1024
+
+INDEX_VERSION = 1
+DEFAULT_BUDGET_GB = 20
+
+# Linux ioctl: 共享数据块的文件克隆 (btrfs/xfs)
+FICLONE = 0x40049409
+
+HASH_BLOCK = 8 * 1024 * 1024
+
+def default_root():
+    """缓存根目录"""
+    if os.environ.get('PLANTMEET_STORE'):
+        return Path(os.environ['PLANTMEET_STORE']).expanduser()
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return Path(base) / 'plantmeet'
+
+def default_budget():
+    """容量上限（字节）"""
+    try:
+        return int(float(os.environ.get('PLANTMEET_STORE_BUDGET', DEFAULT_BUDGET_GB)) * GB)
+    except ValueError:
+        return DEFAULT_BUDGET_GB * GB
+
+def file_sha256(path):
+    """计算文件的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb', buffering=0) as f:
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        buffer = bytearray(HASH_BLOCK)
+        view = memoryview(buffer)
+        while True:
+            read = f.readinto(buffer)
+            if not read:
+                break
+            digest.update(view[:read])
+    return digest.hexdigest()
+
+def _clone_or_copy(src, dst):
+    """尽量用 reflink 克隆文件，不支持时复制；返回使用的方式"""
+    try:
+        import fcntl
+
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        return 'reflink'
+    except (ImportError, OSError):
+        pass
+    shutil.copyfile(src, dst)
+    return 'copy'
+
+class ModelStore:
+    """按 SHA-256 寻址的本地模型缓存"""
+
+    def __init__(self, root=None, budget=None):
+        self.root = Path(root) if root else default_root()
+        self.budget = budget if budget is not None else default_budget()
+        self.blob_dir = self.root / 'blobs' / 'sha256'
+        self.index_path = self.root / 'index.json'
+
+    def blob_path(self, digest):
+        return self.blob_dir / digest[:2] / digest
+
+    def has(self, digest):
+        return self.blob_path(digest).is_file()
+
+    @contextmanager
+    def _index(self, write=True):
+        """加锁读取索引，退出时写回；多个脚本/进程可以同时使用缓存"""
+        self.root.mkdir(parents=True, exist_ok=True)
+        with open(self.root / 'index.lock', 'w') as lock:
+            try:
+                import fcntl
+                fcntl.flock(lock, fcntl.LOCK_EX if write else fcntl.LOCK_SH)
+            except ImportError:
+                pass
+            try:
+                with open(self.index_path, 'r') as f:
+                    index = json.load(f)
+                if index.get('version') != INDEX_VERSION:
+                    raise ValueError(index.get('version'))
+            except (OSError, ValueError):
+                index = {'version': INDEX_VERSION, 'blobs': {}}
+            yield index
+            if write:
+                tmp_path = f"{self.index_path}.tmp{os.getpid()}"
+                with open(tmp_path, 'w') as f:
+                    json.dump(index, f, indent=2)
+                os.replace(tmp_path, self.index_path)
+
+    def _record(self, index, digest, name=None):
+        entry = index['blobs'].setdefault(digest, {
+            'size': self.blob_path(digest).stat().st_size,
+            'names': [],
+            'added': time.time(),
+        })
+        if name and name not in entry['names']:
+            entry['names'].append(name)
+        entry['last_used'] = time.time()
+        return entry
+
+    def find(self, name, size=None):
+        """按文件名（和大小）查找最近使用的缓存文件，返回 sha256 或 None"""
+        with self._index(write=False) as index:
+            matches = [(entry.get('last_used', 0), digest) for digest, entry in index['blobs'].items()
+                       if name in entry['names'] and (size is None or entry['size'] == size)
+                       and self.has(digest)]
+        return max(matches)[1] if matches else None
+
+    def add_file(self, path, digest=None, name=None):
+        """把文件加入缓存（同一文件系统时直接硬链接，不复制数据），返回 sha256"""
+        path = Path(path)
+        digest = digest or file_sha256(path)
+        blob = self.blob_path(digest)
+        with self._index() as index:
+            if not blob.is_file():
+                blob.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = blob.with_name(f".{digest}.tmp{os.getpid()}")
+                try:
+                    os.link(path, tmp_path)
+                except OSError:
+                    _clone_or_copy(path, tmp_path)
+                os.chmod(tmp_path, 0o444)
+                os.replace(tmp_path, blob)
+            self._record(index, digest, name or path.name)
+            self._evict(index, keep=digest)
+        return digest
+
+    def link_into(self, digest, dest):
+        """让 dest 指向缓存文件，返回方式: existing / hardlink / reflink / copy"""
+        dest = Path(dest)
+        blob = self.blob_path(digest)
+        with self._index() as index:
+            if not blob.is_file():
+                raise FileNotFoundError(f"缓存中没有 {digest}")
+            self._record(index, digest, dest.name)
+            if dest.exists() and os.path.samefile(dest, blob):
+                return 'existing'
+
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = dest.with_name(f".{dest.name}.tmp{os.getpid()}")
+            try:
+                os.link(blob, tmp_path)
+                method = 'hardlink'
+            except OSError:
+                method = _clone_or_copy(blob, tmp_path)
+            os.replace(tmp_path, dest)
+            return method
+
+    def adopt(self, path):
+        """把检出目录中已有的模型文件加入缓存并替换为硬链接，返回 (sha256, 方式)"""
+        digest = self.add_file(path)
+        return digest, self.link_into(digest, path)
+
+    def _evict(self, index, keep=None, budget=None):
+        """按最近使用时间淘汰，直到总大小不超过上限；返回被淘汰的 sha256 列表"""
+        budget = self.budget if budget is None else budget
+        blobs = index['blobs']
+        for digest in [d for d in blobs if not self.has(d)]:
+            del blobs[digest]
+
+        total = sum(entry['size'] for entry in blobs.values())
+        evicted = []
+        for digest, entry in sorted(blobs.items(), key=lambda item: item[1].get('last_used', 0)):
+            if total <= budget:
+                break
+            blob = self.blob_path(digest)
+            # 仍被检出目录硬链接的文件删除后也不会释放空间
+            if digest == keep or blob.stat().st_nlink > 1:
+                continue
+            blob.unlink()
+            del blobs[digest]
+            total -= entry['size']
+            evicted.append(digest)
+        return evicted
+
+    def evict(self, budget=None):
+        with self._index() as index:
+            return self._evict(index, budget=budget)
+
+    def status(self):
+        """缓存内容列表，按最近使用时间排序"""
+        with self._index(write=False) as index:
+            entries = []
+            for digest, entry in index['blobs'].items():
+                blob = self.blob_path(digest)
+                if not blob.is_file():
+                    continue
+                entries.append({
+                    'sha256': digest,
+                    'size': entry['size'],
+                    'names': entry['names'],
+                    'last_used': entry.get('last_used', 0),
+                    'links': blob.stat().st_nlink - 1,
+                })
+        return sorted(entries, key=lambda e: e['last_used'], reverse=True)
+
+def resolve_model(path, store=None):
+    """检出目录中有模型文件时返回它，否则返回共享缓存中同名的文件；都没有时返回原路径"""
+    path = Path(path)
+    if path.exists():
+        return path
+    try:
+        store = store or ModelStore()
+        digest = store.find(path.name)
+    except OSError:
+        return path
+    return store.blob_path(digest) if digest else path
+
+def link_from_store(dest, size=None, digest=None):
+    """共享缓存中有同名（且大小相同）的模型时链接到 dest，返回是否成功；给出 digest 时只接受该内容"""
+    try:
+        store = ModelStore()
+        if digest:
+            digest = digest.lower() if store.has(digest.lower()) else None
+        else:
+            digest = store.find(Path(dest).name, size)
+        if not digest:
+            return False
+        method = store.link_into(digest, dest)
+    except OSError as e:
+        print(f"⚠️  共享模型缓存不可用: {e}")
+        return False
+    print(f"📦 已从共享模型缓存链接: {store.blob_path(digest)} ({method})")
+    return True
+
+def share_with_store(path):
+    """把检出目录中的模型加入共享缓存并替换为硬链接；已是硬链接的文件跳过"""
+    path = Path(path)
+    try:
+        if path.stat().st_nlink > 1:
+            return
+        print("📦 正在加入共享模型缓存...")
+        digest, method = ModelStore().adopt(path)
+    except OSError as e:
+        print(f"⚠️  加入共享模型缓存失败: {e}")
+        return
+    print(f"📦 已加入共享模型缓存: {digest[:12]} ({method})")
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='PlantMeet 共享模型缓存')
+    parser.add_argument('--root', help='缓存目录 (默认: $PLANTMEET_STORE 或 ~/.cache/plantmeet)')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('status', help='列出缓存内容')
+    adopt_parser = subparsers.add_parser('adopt', help='把已有模型文件加入缓存并替换为硬链接')
+    adopt_parser.add_argument('files', nargs='+')
+    link_parser = subparsers.add_parser('link', help='把缓存中的模型链接到指定位置')
+    link_parser.add_argument('name', help='文件名或 sha256')
+    link_parser.add_argument('dest')
+    evict_parser = subparsers.add_parser('evict', help='按最近使用时间淘汰到容量上限以内')
+    evict_parser.add_argument('--budget', type=float, help='容量上限 GB')
+    args = parser.parse_args()
+
+    store = ModelStore(args.root)
+    if args.command == 'adopt':
+        for file in args.files:
+            digest, method = store.adopt(file)
+            print(f"📦 {file} -> {digest[:12]} ({method})")
+    elif args.command == 'link':
+        digest = args.name if store.has(args.name) else store.find(args.name)
+        if not digest:
+            print(f"❌ 缓存中没有 {args.name}")
+            raise SystemExit(1)
+        print(f"🔗 {args.dest} -> {digest[:12]} ({store.link_into(digest, args.dest)})")
+    elif args.command == 'evict':
+        evicted = store.evict(int(args.budget * GB) if args.budget is not None else None)
+        print(f"🧹 已淘汰 {len(evicted)} 个文件")
+    else:
+        entries = store.status()
+        total = sum(e['size'] for e in entries)
+        print(f"📦 共享模型缓存: {store.root}")
+        print(f"  {len(entries)} 个文件, {total / GB:.2f} GB / 上限 {store.budget / GB:.0f} GB")
+        for e in entries:
+            used = time.strftime('%Y-%m-%d %H:%M', time.localtime(e['last_used']))
+            print(f"  {e['sha256'][:12]}  {e['size'] / GB:6.2f} GB  {used}  链接 {e['links']}  "
+                  f"{', '.join(e['names'])}")
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,8 @@ PlantMeet 日志监控脚本
 
 使用方法:
 python3 scripts/monitor_logs.py [--package PACKAGE] [--output OUTPUT] [--level LEVEL]
+python3 scripts/monitor_logs.py --sample-interval 2      # 同时采集 CPU/内存/帧/温度到 *.samples.csv
+python3 scripts/monitor_logs.py --lag-budget 1           # 处理延迟超过 1 秒时聚合 V/D/I 日志，错误行始终保留
 """
 
 import os
@@ -18,92 +20,408 @@ from pathlib import Path
 from datetime import datetime
 import re
 import signal
+import csv
+import queue
+from collections import Counter, deque
+
+# 错误关键词匹配
+ERROR_PATTERNS = [
+    r'FATAL',
+    r'ERROR',
+    r'Exception',
+    r'Error',
+    r'failed',
+    r'Failed',
+    r'Crash',
+    r'crash',
+    r'ANR',
+    r'OutOfMemory',
+    r'StackOverflow',
+    r'NetworkError',
+    r'TimeoutException',
+    r'ConnectionError',
+    r'HttpException',
+    r'ClientException',
+    r'SocketException',
+    r'FormatException',
+    r'StateError',
+    r'ArgumentError',
+    r'FileSystemException',
+    r'PlatformException',
+    r'UnimplementedError',
+    r'UnsupportedError',
+    r'AssertionError',
+    r'NoSuchMethodError',
+    r'RangeError',
+    r'TypeError',
+    r'CastError',
+    r'NullPointerException',
+    r'IllegalArgumentException',
+    r'IllegalStateException',
+    r'SecurityException',
+    r'RuntimeException',
+    r'下载失败',
+    r'连接失败',
+    r'网络错误',
+    r'解析错误',
+    r'初始化失败',
+    r'加载失败'
+]
+
+# 过载降级
+DEFAULT_LAG_BUDGET = 2.0
+DEFAULT_SHED_SAMPLE = 20
+DEFAULT_CONTEXT_LINES = 20
+# 降级时聚合的日志级别，W/E/F 始终逐行写入
+SHED_LEVELS = ('V', 'D', 'I')
+SHED_REPORT_INTERVAL = 5
+STATS_INTERVAL = 5
+
+READ_CHUNK = 256 * 1024
+MAX_PENDING_CHUNKS = 256
+WRITE_BUFFER = 1024 * 1024
+
+# brief 格式 "I/Tag( 1234): msg"
+_LOGCAT_BRIEF_RE = re.compile(r'^([VDIWEF])/(.*?)\s*\(')
+# chatty 合并重复行 "uid=10082(com.x) RenderThread identical 12 lines" 或清理 "expire 3 lines"
+_DROPPED_RE = re.compile(r'\b(?:identical|expire) (\d+) lines?')
+
+# 资源采样：一次 adb shell 调用采集进程、内存、帧和温度信息，各段以 @@ 标记分隔
+SAMPLE_SCRIPT = (
+    'pid=$(pidof {package} | cut -d" " -f1); echo "@@pid $pid"; '
+    'echo @@uptime; cat /proc/uptime; '
+    'if [ -n "$pid" ]; then '
+    'echo @@stat; cat /proc/$pid/stat; '
+    'echo @@meminfo; dumpsys meminfo $pid; '
+    'echo @@gfxinfo; dumpsys gfxinfo {package} reset; '
+    'fi; '
+    'echo @@thermal; dumpsys thermalservice'
+)
+
+SAMPLE_COLUMNS = [
+    'time', 'pid', 'cpu_pct', 'threads', 'rss_kb', 'pss_kb', 'java_heap_kb', 'native_heap_kb',
+    'graphics_kb', 'frames', 'janky_frames', 'frame_p50_ms', 'frame_p90_ms', 'frame_p99_ms',
+    'thermal_status', 'max_temp_c', 'sample_ms',
+]
+
+_MEMINFO_PATTERNS = {
+    'java_heap_kb': re.compile(r'^\s*Java Heap:\s+(\d+)', re.MULTILINE),
+    'native_heap_kb': re.compile(r'^\s*Native Heap:\s+(\d+)', re.MULTILINE),
+    'graphics_kb': re.compile(r'^\s*Graphics:\s+(\d+)', re.MULTILINE),
+    'pss_kb': re.compile(r'^\s*TOTAL(?: PSS:)?\s+(\d+)', re.MULTILINE),
+}
+_GFXINFO_PATTERNS = {
+    'frames': re.compile(r'Total frames rendered:\s*(\d+)'),
+    'janky_frames': re.compile(r'Janky frames:\s*(\d+)'),
+    'frame_p50_ms': re.compile(r'50th percentile:\s*(\d+)ms'),
+    'frame_p90_ms': re.compile(r'90th percentile:\s*(\d+)ms'),
+    'frame_p99_ms': re.compile(r'99th percentile:\s*(\d+)ms'),
+}
+_THERMAL_STATUS_RE = re.compile(r'Thermal Status:\s*(\d+)')
+_TEMPERATURE_RE = re.compile(r'Temperature\{mValue=([-\d.]+)')
+
+def split_sections(output):
+    """按 @@ 标记把采样输出拆成 {段名: 内容}"""
+    sections = {}
+    name = None
+    for line in output.splitlines():
+        if line.startswith('@@'):
+            name, _, rest = line[2:].partition(' ')
+            sections[name] = rest.strip()
+            continue
+        if name:
+            sections[name] += line + '\n'
+    return sections
+
+def parse_proc_stat(text):
+    """解析 /proc/<pid>/stat，返回 (CPU 时钟节拍数, 线程数, RSS 页数)"""
+    # 进程名可能含空格和括号，从最后一个 ')' 之后开始按字段切分（第 3 个字段起）
+    fields = text[text.rfind(')') + 2:].split()
+    if len(fields) < 22:
+        return None
+    utime, stime = int(fields[11]), int(fields[12])
+    return utime + stime, int(fields[17]), int(fields[21])
+
+def parse_meminfo(text):
+    """解析 dumpsys meminfo 的 App Summary 和 TOTAL 行（单位 KB）"""
+    result = {}
+    for key, pattern in _MEMINFO_PATTERNS.items():
+        match = pattern.search(text)
+        if match:
+            result[key] = int(match.group(1))
+    return result
+
+def parse_gfxinfo(text):
+    """解析 dumpsys gfxinfo：上次 reset 以来的帧数、卡顿帧数和帧耗时分位数"""
+    result = {}
+    for key, pattern in _GFXINFO_PATTERNS.items():
+        match = pattern.search(text)
+        if match:
+            result[key] = int(match.group(1))
+    return result
+
+def parse_thermal(text):
+    """解析 dumpsys thermalservice：温控状态（0 无 ~ 6 关机）和 HAL 报告的最高温度"""
+    result = {}
+    match = _THERMAL_STATUS_RE.search(text)
+    if match:
+        result['thermal_status'] = int(match.group(1))
+    # 只看 HAL 当前温度，不看缓存的历史值
+    current = text.split('Current temperatures from HAL:', 1)
+    if len(current) == 2:
+        section = current[1].split('\n\n', 1)[0]
+        values = [float(v) for v in _TEMPERATURE_RE.findall(section)]
+        if values:
+            result['max_temp_c'] = max(values)
+    return result
+
+class ResourceSampler:
+    """在后台线程中定时采集应用进程的 CPU、内存、帧和温度，写入 CSV 时间序列"""
+
+    def __init__(self, package_name, output_file, interval=2.0, timestamp=None):
+        self.package_name = package_name
+        self.output_file = Path(output_file)
+        self.interval = interval
+        # 与日志文件使用同一个时间戳函数，便于两份文件按时间对齐
+        self.timestamp = timestamp or (lambda: datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3])
+        # 采样线程不直接写日志文件，事件由读取日志的主线程取出写入
+        self.events = queue.SimpleQueue()
+        self.stop_event = threading.Event()
+        self.thread = None
+        # 单次采样的 adb 超时；停止时最多等待这么久再加一点余量
+        self.sample_timeout = max(10, interval * 3)
+        self.process = None
+        self.clock_ticks = 100
+        self.page_kb = 4
+        self.previous = None
+        self.samples = 0
+        self.failures = 0
+        self.last = {}
+
+    def start(self):
+        self.output_file.parent.mkdir(parents=True, exist_ok=True)
+        new_file = not self.output_file.exists() or self.output_file.stat().st_size == 0
+        self.file = open(self.output_file, 'a', encoding='utf-8', newline='')
+        self.writer = csv.DictWriter(self.file, fieldnames=SAMPLE_COLUMNS, extrasaction='ignore')
+        if new_file:
+            self.writer.writeheader()
+        try:
+            result = subprocess.run(['adb', 'shell', 'getconf CLK_TCK; getconf PAGESIZE'],
+                                    capture_output=True, text=True, timeout=5)
+            clock_ticks, page_size = result.stdout.split()
+            self.clock_ticks, self.page_kb = int(clock_ticks), int(page_size) // 1024
+        except (subprocess.TimeoutExpired, OSError, ValueError):
+            pass
+        self.thread = threading.Thread(target=self._run, name='resource-sampler', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if not self.thread:
+            return
+        # 结束正在运行的 adb，采样线程不必等到超时
+        process = self.process
+        if process and process.poll() is None:
+            process.kill()
+        self.thread.join(timeout=self.sample_timeout + 5)
+        if self.thread.is_alive():
+            # 线程仍可能写入，不关闭文件；守护线程随进程退出
+            print("⚠️  资源采样线程未能按时结束")
+            return
+        self.thread = None
+        self.file.close()
+
+    def _run(self):
+        # 按固定节拍采样；一次采样超过间隔时跳过错过的节拍，不连续补采
+        next_at = time.monotonic()
+        while not self.stop_event.is_set():
+            self.sample()
+            next_at += self.interval
+            now = time.monotonic()
+            if next_at < now:
+                next_at = now + self.interval - (now - next_at) % self.interval
+            self.stop_event.wait(next_at - now)
+
+    def sample(self):
+        """采集一次并写入一行"""
+        row = {'time': self.timestamp()}
+        started = time.monotonic()
+        output = ''
+        try:
+            self.process = subprocess.Popen(['adb', 'shell', SAMPLE_SCRIPT.format(package=self.package_name)],
+                                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+            try:
+                output, _ = self.process.communicate(timeout=self.sample_timeout)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.communicate()
+                output = ''
+        except OSError:
+            pass
+        finally:
+            self.process = None
+        # 停止时被结束的 adb 只有部分输出，不再写入
+        if self.stop_event.is_set():
+            return None
+        # 设备断开或 adb 被中断时没有输出，不写空行
+        if '@@pid' not in output:
+            self.failures += 1
+            return None
+        row['sample_ms'] = round((time.monotonic() - started) * 1000)
+
+        sections = split_sections(output)
+        pid = sections.get('pid') or None
+        row['pid'] = pid
+        if pid != (self.previous or {}).get('pid') and self.samples:
+            self.events.put(f"应用进程变化: {(self.previous or {}).get('pid') or '未运行'} → {pid or '未运行'}")
+
+        stat = parse_proc_stat(sections.get('stat', '')) if pid else None
+        try:
+            uptime = float(sections.get('uptime', '').split()[0])
+        except (IndexError, ValueError):
+            uptime = None
+        if stat:
+            ticks, row['threads'], rss_pages = stat
+            row['rss_kb'] = rss_pages * self.page_kb
+            prev = self.previous
+            if prev and prev.get('pid') == pid and uptime and prev.get('uptime') and uptime > prev['uptime']:
+                row['cpu_pct'] = round((ticks - prev['ticks']) / self.clock_ticks / (uptime - prev['uptime']) * 100, 1)
+            self.previous = {'pid': pid, 'ticks': ticks, 'uptime': uptime}
+        else:
+            self.previous = {'pid': pid}
+
+        if pid:
+            row.update(parse_meminfo(sections.get('meminfo', '')))
+            row.update(parse_gfxinfo(sections.get('gfxinfo', '')))
+        row.update(parse_thermal(sections.get('thermal', '')))
+
+        self.writer.writerow(row)
+        self.file.flush()
+        self.samples += 1
+        self.last = row
+        return row
 
 class LogMonitor:
-    def __init__(self, package_name, output_file, log_level='V'):
+    def __init__(self, package_name, output_file, log_level='V', sample_interval=0, samples_file=None,
+                 lag_budget=DEFAULT_LAG_BUDGET, shed_sample=DEFAULT_SHED_SAMPLE, context_lines=DEFAULT_CONTEXT_LINES):
         self.package_name = package_name
         self.output_file = Path(output_file)
         self.log_level = log_level
         self.running = False
+        self.stopped = False
         self.process = None
+        self.log_handle = None
+
+        # 资源采样（间隔为 0 时不采样）
+        self.sampler = None
+        if sample_interval > 0 and package_name != '*':
+            self.sampler = ResourceSampler(
+                package_name,
+                samples_file or self.output_file.with_suffix('.samples.csv'),
+                interval=sample_interval,
+                timestamp=self.get_timestamp,
+            )
+
+        # 过载降级：处理延迟超过预算（秒，0 为关闭）时聚合低级别日志，错误行及其前后的日志全部保留
+        self.lag_budget = lag_budget
+        self.shed_sample = max(1, shed_sample)
+        self.context_lines = context_lines
+        self.shedding = False
+        self.shed_seen = 0
+        self.shed_counts = Counter()
+        self.last_shed_report = 0
+        # 降级期间所有非错误行按原顺序经过这个缓冲: (行, 时间戳, 是否保留)
+        self.context = deque()
+        self.post_context = 0
+        self.last_stats_print = 0
+
+        # 读取线程把 logcat 输出按块放入队列，队列满时才阻塞 logcat
+        self.chunks = queue.Queue(maxsize=MAX_PENDING_CHUNKS)
         
         # 确保输出目录存在
         self.output_file.parent.mkdir(parents=True, exist_ok=True)
         
         # 错误关键词匹配
-        self.error_patterns = [
-            r'FATAL',
-            r'ERROR',
-            r'Exception',
-            r'Error',
-            r'failed',
-            r'Failed',
-            r'Crash',
-            r'crash',
-            r'ANR',
-            r'OutOfMemory',
-            r'StackOverflow',
-            r'NetworkError',
-            r'TimeoutException',
-            r'ConnectionError',
-            r'HttpException',
-            r'ClientException',
-            r'SocketException',
-            r'FormatException',
-            r'StateError',
-            r'ArgumentError',
-            r'FileSystemException',
-            r'PlatformException',
-            r'UnimplementedError',
-            r'UnsupportedError',
-            r'AssertionError',
-            r'NoSuchMethodError',
-            r'RangeError',
-            r'TypeError',
-            r'CastError',
-            r'NullPointerException',
-            r'IllegalArgumentException',
-            r'IllegalStateException',
-            r'SecurityException',
-            r'RuntimeException',
-            r'下载失败',
-            r'连接失败',
-            r'网络错误',
-            r'解析错误',
-            r'初始化失败',
-            r'加载失败'
-        ]
+        self.error_patterns = list(ERROR_PATTERNS)
         self.error_regex = re.compile('|'.join(self.error_patterns), re.IGNORECASE)
+        # 关键词都是普通字符串时，转小写后只匹配不包含其他关键词的那些（如 NetworkError 已被 Error 覆盖），
+        # 结果相同，但比忽略大小写的长正则快一个数量级
+        self.error_keywords = None
+        if all(re.escape(p) == p for p in self.error_patterns):
+            lowered = {p.lower() for p in self.error_patterns}
+            minimal = sorted(k for k in lowered if not any(o != k and o in k for o in lowered))
+            self.error_keywords = re.compile('|'.join(minimal))
         
         # 统计信息
         self.stats = {
             'total_lines': 0,
             'error_lines': 0,
             'start_time': None,
-            'last_error_time': None
+            'last_error_time': None,
+            'shed_lines': 0,
+            'sampled_lines': 0,
+            'shed_episodes': 0,
+            'logcat_dropped': 0,
+            'max_lag': 0.0,
+            'reader_blocked': 0.0,
         }
     
     def get_timestamp(self):
         """获取格式化时间戳"""
         return datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
     
-    def write_log(self, content, is_error=False):
+    def write_log(self, content, is_error=False, timestamp=None, prefix=None):
         """写入日志文件"""
-        timestamp = self.get_timestamp()
-        prefix = "[ERROR]" if is_error else "[INFO]"
+        timestamp = timestamp or self.get_timestamp()
+        prefix = prefix or ("[ERROR]" if is_error else "[INFO]")
         
         try:
-            with open(self.output_file, 'a', encoding='utf-8') as f:
-                f.write(f"{timestamp} {prefix} {content}\n")
-                f.flush()
+            # 文件保持打开，按块读取的日志处理完一块后统一 flush
+            if self.log_handle is None:
+                self.log_handle = open(self.output_file, 'a', encoding='utf-8', buffering=WRITE_BUFFER)
+            self.log_handle.write(f"{timestamp} {prefix} {content}\n")
+            if is_error:
+                self.log_handle.flush()
         except Exception as e:
             print(f"写入日志文件失败: {e}")
+
+    def flush_log(self):
+        if self.log_handle:
+            try:
+                self.log_handle.flush()
+            except Exception as e:
+                print(f"写入日志文件失败: {e}")
     
     def is_error_line(self, line):
         """判断是否为错误行"""
+        if self.error_keywords:
+            return bool(self.error_keywords.search(line.lower()))
         return bool(self.error_regex.search(line))
+
+    def parse_level_tag(self, line):
+        """解析 logcat 行的级别和标签，无法解析时返回 (None, None)"""
+        # threadtime 格式: 日期 时间 PID TID 级别 标签: 消息（按空白切分比正则快）
+        parts = line.split(None, 6)
+        if len(parts) >= 6 and len(parts[4]) == 1 and parts[0][2:3] == '-':
+            return parts[4], parts[5].rstrip(':')
+        match = _LOGCAT_BRIEF_RE.match(line)
+        if match:
+            return match.group(1), match.group(2)
+        return None, None
+
+    def count_logcat_dropped(self, line):
+        """统计 logcat 自身丢弃的日志（chatty 合并的重复行和被清理的行）"""
+        if 'chatty' in line:
+            match = _DROPPED_RE.search(line)
+            if match:
+                self.stats['logcat_dropped'] += int(match.group(1))
     
-    def process_log_line(self, line):
+    def write_sampler_events(self):
+        """写入采样线程记录的事件（进程重启等）"""
+        while self.sampler and not self.sampler.events.empty():
+            self.write_log(self.sampler.events.get())
+
+    def process_log_line(self, line, timestamp=None):
         """处理单行日志"""
         line = line.strip()
         if not line:
@@ -115,15 +433,113 @@ class LogMonitor:
         if is_error:
             self.stats['error_lines'] += 1
             self.stats['last_error_time'] = datetime.now()
-            self.write_log(line, is_error=True)
+            # 降级时缓冲中的前文（含被聚合的行）按原顺序一并写入
+            self.drain_context(write_all=True)
+            self.write_log(line, is_error=True, timestamp=timestamp)
+            self.post_context = self.context_lines
             print(f"🔴 ERROR: {line}")
+        elif self.post_context:
+            self.post_context -= 1
+            self.write_log(line, is_error=False, timestamp=timestamp)
+        elif self.shedding:
+            self.shed_line(line, timestamp)
         else:
             # 普通日志也记录，但不在控制台显示
-            self.write_log(line, is_error=False)
+            self.write_log(line, is_error=False, timestamp=timestamp)
         
-        # 每1000行显示一次统计
-        if self.stats['total_lines'] % 1000 == 0:
+        # 每1000行显示一次统计（日志很多时至少间隔几秒，避免终端输出拖慢处理）
+        if self.stats['total_lines'] % 1000 == 0 and time.monotonic() - self.last_stats_print >= STATS_INTERVAL:
+            self.last_stats_print = time.monotonic()
             self.print_stats()
+
+    def shed_line(self, line, timestamp):
+        """降级时处理一行非错误日志：低级别日志按标签计数、按比例采样，其余行照常保留
+
+        所有行都按原顺序经过上文缓冲，保留的行移出缓冲时写入，日志文件中的顺序不会被打乱
+        """
+        level, tag = self.parse_level_tag(line)
+        keep = level not in SHED_LEVELS
+        if not keep:
+            self.shed_counts[tag] += 1
+            self.shed_seen += 1
+            if self.shed_seen % self.shed_sample == 0:
+                self.stats['sampled_lines'] += 1
+                keep = True
+        self.context.append((line, timestamp, keep))
+        if len(self.context) > self.context_lines:
+            self.release_line(*self.context.popleft())
+
+    def release_line(self, line, timestamp, keep):
+        """一行移出上文缓冲：保留的行写入，被聚合的行到这时才算作未写入"""
+        if keep:
+            self.write_log(line, is_error=False, timestamp=timestamp)
+        else:
+            self.stats['shed_lines'] += 1
+
+    def drain_context(self, write_all=False):
+        """清空上文缓冲；write_all 时（错误行之前的上文）被聚合的行也写入"""
+        while self.context:
+            line, timestamp, keep = self.context.popleft()
+            self.release_line(line, timestamp, keep or write_all)
+
+    def update_shedding(self, lag):
+        """根据处理延迟进入或退出降级模式（退出阈值为预算的一半，避免来回切换）"""
+        self.stats['max_lag'] = max(self.stats['max_lag'], lag)
+        if not self.lag_budget:
+            return
+        now = time.monotonic()
+        if not self.shedding and lag > self.lag_budget:
+            self.shedding = True
+            self.stats['shed_episodes'] += 1
+            self.last_shed_report = now
+            message = (f"处理延迟 {lag:.1f} 秒超过预算 {self.lag_budget:g} 秒，开始聚合 {'/'.join(SHED_LEVELS)} 级别日志"
+                       f"（每 {self.shed_sample} 行保留 1 行，错误行及前后 {self.context_lines} 行全部保留）")
+            self.write_log(message, prefix='[SHED]')
+            print(f"⚠️  {message}")
+        elif self.shedding and lag < self.lag_budget / 2:
+            self.drain_context()
+            self.write_shed_summary()
+            self.shedding = False
+            message = f"处理延迟恢复到 {lag:.1f} 秒，停止聚合"
+            self.write_log(message, prefix='[SHED]')
+            print(f"✅ {message}")
+        elif self.shedding and now - self.last_shed_report >= SHED_REPORT_INTERVAL:
+            self.last_shed_report = now
+            self.write_shed_summary()
+
+    def write_shed_summary(self, top=10):
+        """把聚合的日志按标签计数写入日志文件"""
+        if not self.shed_counts:
+            return
+        total = sum(self.shed_counts.values())
+        common = self.shed_counts.most_common(top)
+        text = ', '.join(f"{tag}×{count}" for tag, count in common)
+        rest = len(self.shed_counts) - len(common)
+        if rest:
+            text += f", 其他 {rest} 个标签×{total - sum(count for _, count in common)}"
+        self.write_log(f"聚合 {total} 行: {text}", prefix='[SHED]')
+        self.shed_counts.clear()
+
+    def read_chunks(self, stream):
+        """读取线程：按块读取 logcat 输出，切分成行后放入队列"""
+        fd = stream.fileno()
+        pending = b''
+        try:
+            while True:
+                data = os.read(fd, READ_CHUNK)
+                if not data:
+                    break
+                lines = (pending + data).split(b'\n')
+                pending = lines.pop()
+                item = (time.monotonic(), self.get_timestamp(), [l.decode('utf-8', 'replace') for l in lines])
+                started = time.monotonic()
+                self.chunks.put(item)
+                self.stats['reader_blocked'] += time.monotonic() - started
+        except OSError:
+            pass
+        if pending:
+            self.chunks.put((time.monotonic(), self.get_timestamp(), [pending.decode('utf-8', 'replace')]))
+        self.chunks.put(None)
     
     def print_stats(self):
         """打印统计信息"""
@@ -134,6 +550,19 @@ class LogMonitor:
         if self.stats['last_error_time']:
             print(f"  最后错误时间: {self.stats['last_error_time'].strftime('%H:%M:%S')}")
         print(f"  日志文件: {self.output_file}")
+        if self.stats['shed_episodes'] or self.stats['logcat_dropped']:
+            print(f"  聚合未写入: {self.stats['shed_lines']} 行 (降级 {self.stats['shed_episodes']} 次，"
+                  f"采样写入 {self.stats['sampled_lines']} 行)")
+            print(f"  logcat 丢弃: {self.stats['logcat_dropped']} 行 (chatty)")
+        print(f"  最大处理延迟: {self.stats['max_lag']:.1f} 秒")
+        if self.stats['reader_blocked'] >= 1:
+            print(f"  ⚠️  读取等待: {self.stats['reader_blocked']:.1f} 秒 (期间设备端缓冲区可能溢出)")
+        if self.sampler:
+            last = self.sampler.last
+            print(f"  资源采样: {self.sampler.samples} 次 (失败 {self.sampler.failures} 次) → {self.sampler.output_file}")
+            if last.get('pss_kb') is not None:
+                print(f"  最近采样: PSS {last['pss_kb'] // 1024}MB, CPU {last.get('cpu_pct', '-')}%, "
+                      f"温控状态 {last.get('thermal_status', '-')}")
         print("-" * 50)
     
     def start_monitoring(self):
@@ -142,6 +571,8 @@ class LogMonitor:
         print(f"  应用包名: {self.package_name}")
         print(f"  日志级别: {self.log_level}")
         print(f"  输出文件: {self.output_file}")
+        if self.lag_budget:
+            print(f"  过载降级: 延迟超过 {self.lag_budget:g} 秒时聚合 {'/'.join(SHED_LEVELS)} 级别日志")
         print(f"  开始时间: {self.get_timestamp()}")
         print("  按 Ctrl+C 停止监控")
         print("=" * 60)
@@ -154,6 +585,12 @@ class LogMonitor:
         
         self.stats['start_time'] = datetime.now()
         self.running = True
+
+        # 资源采样在后台线程中运行，不阻塞日志读取
+        if self.sampler:
+            print(f"  资源采样: 每 {self.sampler.interval:g} 秒 → {self.sampler.output_file}")
+            self.write_log(f"资源采样: 每 {self.sampler.interval:g} 秒 → {self.sampler.output_file}")
+            self.sampler.start()
         
         try:
             # 清除旧日志缓冲区
@@ -166,25 +603,41 @@ class LogMonitor:
                 # 过滤特定应用（如果指定了包名）
                 cmd.extend(['--pid', f"$(adb shell pidof {self.package_name})"])
             
-            # 启动logcat进程
+            # 启动logcat进程（二进制管道，由读取线程按块读取，避免逐行读取跟不上 logcat 的输出）
             self.process = subprocess.Popen(
                 ['adb', 'logcat', f'*:{self.log_level}'],
                 stdout=subprocess.PIPE,
                 stderr=subprocess.STDOUT,
-                universal_newlines=True,
-                bufsize=1
+                bufsize=0
             )
+            reader = threading.Thread(target=self.read_chunks, args=(self.process.stdout,),
+                                      name='logcat-reader', daemon=True)
+            reader.start()
             
-            # 读取日志行
-            for line in iter(self.process.stdout.readline, ''):
-                if not self.running:
-                    break
-                
-                # 过滤应用相关日志（如果指定了包名且不是通配符）
-                if self.package_name != '*' and self.package_name not in line:
+            # 处理日志行
+            while self.running:
+                try:
+                    item = self.chunks.get(timeout=1)
+                except queue.Empty:
+                    self.update_shedding(0)
+                    self.write_sampler_events()
+                    self.flush_log()
                     continue
-                
-                self.process_log_line(line)
+                if item is None:
+                    break
+
+                received, timestamp, lines = item
+                self.update_shedding(time.monotonic() - received)
+                self.write_sampler_events()
+                for line in lines:
+                    self.count_logcat_dropped(line)
+                    
+                    # 过滤应用相关日志（如果指定了包名且不是通配符）
+                    if self.package_name != '*' and self.package_name not in line:
+                        continue
+                    
+                    self.process_log_line(line, timestamp)
+                self.flush_log()
         
         except KeyboardInterrupt:
             print("\n\n⏹️  收到停止信号")
@@ -198,7 +651,14 @@ class LogMonitor:
     
     def stop_monitoring(self):
         """停止监控"""
+        if self.stopped:
+            return
+        self.stopped = True
         self.running = False
+
+        if self.sampler:
+            self.sampler.stop()
+            self.write_sampler_events()
         
         if self.process:
             try:
@@ -208,9 +668,20 @@ class LogMonitor:
                 self.process.kill()
             except:
                 pass
+
+        if self.shedding:
+            self.drain_context()
+            self.write_shed_summary()
+        if self.stats['shed_episodes'] or self.stats['logcat_dropped']:
+            self.write_log(f"聚合未写入 {self.stats['shed_lines']} 行，采样写入 {self.stats['sampled_lines']} 行，"
+                           f"降级 {self.stats['shed_episodes']} 次，logcat 丢弃 {self.stats['logcat_dropped']} 行，"
+                           f"最大处理延迟 {self.stats['max_lag']:.1f} 秒", prefix='[SHED]')
         
         # 写入监控结束标记
         self.write_log(f"=== 日志监控结束 ===")
+        if self.log_handle:
+            self.log_handle.close()
+            self.log_handle = None
         
         # 显示最终统计
         print("\n📈 最终统计:")
@@ -218,10 +689,10 @@ class LogMonitor:
         print(f"\n💾 日志已保存到: {self.output_file.absolute()}")
 
 def signal_handler(signum, frame, monitor):
-    """信号处理器"""
+    """信号处理器：在主线程中结束处理循环，由 start_monitoring 收尾"""
     print(f"\n收到信号 {signum}")
-    monitor.stop_monitoring()
-    sys.exit(0)
+    monitor.running = False
+    raise KeyboardInterrupt
 
 def check_adb_connection():
     """检查ADB连接"""
@@ -286,6 +757,16 @@ def main():
                        help='仅检查ADB连接状态，不开始监控')
     parser.add_argument('--auto-start', action='store_true',
                        help='自动开始监控，不等待用户确认')
+    parser.add_argument('--sample-interval', type=float, default=0,
+                       help='资源采样间隔秒数，采集 CPU/内存/帧/温度 (默认: 0 不采样)')
+    parser.add_argument('--samples',
+                       help='资源采样输出文件 (默认: <输出日志文件>.samples.csv)')
+    parser.add_argument('--lag-budget', type=float, default=DEFAULT_LAG_BUDGET,
+                       help=f'处理延迟预算秒数，超过时聚合 V/D/I 级别日志 (默认: {DEFAULT_LAG_BUDGET:g}，0 为关闭)')
+    parser.add_argument('--shed-sample', type=int, default=DEFAULT_SHED_SAMPLE,
+                       help=f'降级时每 N 行聚合的日志保留 1 行 (默认: {DEFAULT_SHED_SAMPLE})')
+    parser.add_argument('--context', type=int, default=DEFAULT_CONTEXT_LINES,
+                       help=f'降级时错误行前后完整保留的行数 (默认: {DEFAULT_CONTEXT_LINES})')
     
     args = parser.parse_args()
     
@@ -325,7 +806,10 @@ def main():
                 print("自动开始模式：继续监控")
     
     # 创建监控器
-    monitor = LogMonitor(args.package, args.output, args.level)
+    if args.sample_interval > 0 and args.package == '*':
+        print("⚠️  监控所有应用时不进行资源采样")
+    monitor = LogMonitor(args.package, args.output, args.level, args.sample_interval, args.samples,
+                         lag_budget=args.lag_budget, shed_sample=args.shed_sample, context_lines=args.context)
     
     # 设置信号处理
     signal.signal(signal.SIGINT, lambda s, f: signal_handler(s, f, monitor))
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+模型服务器多进程（pre-fork）模式
+
+单个 Python 进程受 GIL 限制，发送循环最多只能用满一个 CPU 核心。多进程模式下：
+
+- 监管进程为每个工作进程预先绑定一个 SO_REUSEPORT 监听套接字，由内核按连接分配，
+  工作进程崩溃重启时沿用同一个套接字，排队中的连接不会丢失
+- 继承的监听套接字（socket activation）或平台不支持 SO_REUSEPORT 时，所有工作进程共享同一个套接字
+- 工作进程异常退出后自动重启（启动后立即退出时延迟重启，避免反复崩溃占满 CPU）
+- 每个工作进程每秒把指标快照写入状态目录，/metrics 和 /stats.json 返回所有工作进程的合并值；
+  已退出工作进程的计数累计保留，仪表（连接数等）随进程退出清零
+- /admin/bandwidth 的调整写入状态目录的 bandwidth.json，其他工作进程每秒检查并同步
+- SIGTERM / Ctrl+C 时优雅退出：停止接受新连接，等待正在进行的传输完成；再次发送信号立即终止
+"""
+
+import errno
+import json
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from server_socket import inherited_listen_socket, port_in_use, free_port, reuseport_socket
+from transfer_metrics import MetricsRegistry, merge_snapshots
+
+# 工作进程发布指标快照的间隔（秒）
+PUBLISH_INTERVAL = 1.0
+
+# 运行时间短于此值的工作进程视为启动即崩溃，延迟重启（秒）
+CRASH_LOOP_SECONDS = 5.0
+RESTART_DELAY = 1.0
+
+def listen_sockets(host, port, count, listen_fd=None, kill_existing=True):
+    """为 count 个工作进程准备监听套接字，返回列表（共享模式下为同一个套接字）"""
+    inherited = inherited_listen_socket(listen_fd)
+    if inherited is not None or not hasattr(socket, 'SO_REUSEPORT'):
+        if inherited is None:
+            inherited = reuseport_socket(host, port)
+        # 多个进程在同一个套接字上 accept，非阻塞避免未抢到连接的进程卡在 accept()
+        inherited.setblocking(False)
+        return [inherited] * count
+
+    if port_in_use(port):
+        if not kill_existing:
+            raise OSError(errno.EADDRINUSE, f"端口 {port} 已被占用")
+        if free_port(port):
+            print(f"✅ 端口 {port} 已清理")
+    return [reuseport_socket(host, port) for _ in range(count)]
+
+def _write_json(path, data):
+    """原子写入 JSON，读取方不会读到半个文件"""
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+def _read_json(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _without_gauges(snapshot):
+    return {key: entry for key, entry in snapshot.items() if entry['type'] != 'gauge'}
+
+class WorkerMetrics:
+    """工作进程侧：定期发布本进程快照，并合并其他工作进程的快照；同步带宽设置"""
+
+    def __init__(self, server, state_dir, index):
+        self.server = server
+        self.state_dir = Path(state_dir)
+        self.path = self.state_dir / f"worker-{index}.json"
+        self.bandwidth_path = self.state_dir / 'bandwidth.json'
+        self.bandwidth_version = None
+        self._stop = threading.Event()
+        server.metrics.registry.gauge('workers', '存活的工作进程数').inc()
+
+    def start(self):
+        thread = threading.Thread(target=self._run, name='metrics-publisher', daemon=True)
+        thread.start()
+        return thread
+
+    def _run(self):
+        while not self._stop.wait(PUBLISH_INTERVAL):
+            self.publish()
+            self.sync_bandwidth()
+
+    def publish_bandwidth(self, limits):
+        """本进程收到的带宽调整写入状态目录，供其他工作进程同步"""
+        version = f"{os.getpid()}-{time.time_ns()}"
+        self.bandwidth_version = version
+        try:
+            _write_json(self.bandwidth_path, {'version': version, **limits})
+        except OSError:
+            pass
+
+    def sync_bandwidth(self):
+        """应用其他工作进程写入的带宽设置"""
+        shaper = getattr(self.server, 'shaper', None)
+        settings = _read_json(self.bandwidth_path) if shaper is not None else None
+        if not settings or settings.get('version') == self.bandwidth_version:
+            return
+        self.bandwidth_version = settings['version']
+        shaper.set_limits(settings['global_rate'], settings['client_rate'], settings['weights'])
+
+    def publish(self):
+        try:
+            _write_json(self.path, self.server.metrics.snapshot())
+        except OSError:
+            pass
+
+    def stop(self):
+        self._stop.set()
+        self.publish()
+
+    def collect(self, own_snapshot):
+        """合并本进程的实时快照与状态目录中其他进程（含已退出进程累计值）的快照"""
+        snapshots = [own_snapshot]
+        # 状态目录中还有 bandwidth.json 等非指标文件，只读取工作进程快照和已退出进程的累计值
+        paths = [*self.state_dir.glob('worker-*.json'), self.state_dir / 'retired.json']
+        for path in paths:
+            if path != self.path and path.exists():
+                snapshot = _read_json(path)
+                if snapshot:
+                    snapshots.append(snapshot)
+        return merge_snapshots(snapshots)
+
+def serve_worker(build_server, sock, index, state_dir, all_sockets):
+    """在工作进程中运行服务器，收到 SIGTERM 后停止接受连接并等待传输完成；不会返回"""
+    code = 0
+    try:
+        # 关闭其他工作进程的套接字，否则它们在对应进程退出后仍会接收连接
+        for other in set(all_sockets):
+            if other is not sock:
+                other.close()
+        # 不继承监管进程的信号处理函数；Ctrl+C 由监管进程统一处理
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+        server = build_server(sock, index)
+        publisher = WorkerMetrics(server, state_dir, index)
+        server.collect_metrics = publisher.collect
+        server.publish_bandwidth = publisher.publish_bandwidth
+        publisher.start()
+
+        def drain(signum, frame):
+            # shutdown() 会等待 serve_forever() 返回，不能在运行 serve_forever 的线程里直接调用
+            threading.Thread(target=server.shutdown, daemon=True).start()
+
+        signal.signal(signal.SIGTERM, drain)
+        server.serve_forever()
+
+        server.socket.close()
+        while server.metrics.active_transfers.value() > 0:
+            time.sleep(0.2)
+        publisher.stop()
+    except Exception as e:
+        print(f"❌ 工作进程 #{index} 出错: {e}")
+        code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(code)
+
+class Supervisor:
+    """监管进程：启动、重启工作进程，处理优雅退出，汇总已退出进程的指标"""
+
+    def __init__(self, build_server, sockets, drain_timeout=0):
+        self.build_server = build_server
+        self.sockets = sockets
+        self.drain_timeout = drain_timeout
+        self.state_dir = Path(tempfile.mkdtemp(prefix='plantmeet_workers_'))
+        self.registry = MetricsRegistry()
+        self.restarts = self.registry.counter('worker_restarts_total', '工作进程异常退出后的重启次数')
+        self.retired = {}
+        self.workers = {}
+        self.started_at = {}
+        self.draining = False
+        self.drain_started = None
+        self.force = False
+
+    def _spawn(self, index):
+        # 先刷新输出缓冲，避免子进程重复输出
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            serve_worker(self.build_server, self.sockets[index], index, self.state_dir, self.sockets)
+        self.workers[pid] = index
+        self.started_at[index] = time.monotonic()
+        return pid
+
+    def _retire(self, index):
+        """把已退出工作进程的计数和直方图并入累计值"""
+        path = self.state_dir / f"worker-{index}.json"
+        snapshot = _read_json(path)
+        if snapshot:
+            self.retired = merge_snapshots([self.retired, _without_gauges(snapshot)])
+        try:
+            path.unlink()
+        except OSError:
+            pass
+        _write_json(self.state_dir / 'retired.json',
+                    merge_snapshots([self.retired, self.registry.snapshot()]))
+
+    def _on_signal(self, signum, frame):
+        if self.draining:
+            self.force = True
+            return
+        self.draining = True
+        self.drain_started = time.monotonic()
+        print(f"\n🛑 收到退出信号，等待 {len(self.workers)} 个工作进程完成正在进行的传输..."
+              "（再次按 Ctrl+C 立即退出）")
+        self._signal_workers(signal.SIGTERM)
+        # 监管进程持有的套接字也要关闭，否则新连接会在无人处理的队列中等待
+        for sock in set(self.sockets):
+            sock.close()
+
+    def _signal_workers(self, signum):
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signum)
+            except OSError:
+                pass
+
+    def run(self):
+        """启动所有工作进程并监管，直到全部退出"""
+        signal.signal(signal.SIGTERM, self._on_signal)
+        signal.signal(signal.SIGINT, self._on_signal)
+        for index in range(len(self.sockets)):
+            self._spawn(index)
+
+        pending = {}
+        try:
+            while self.workers or (pending and not self.draining):
+                if self.force or (self.draining and self.drain_timeout and
+                                  time.monotonic() - self.drain_started > self.drain_timeout):
+                    print("⚠️  强制终止工作进程")
+                    self._signal_workers(signal.SIGKILL)
+                    self.force = False
+                    self.drain_timeout = 0
+
+                try:
+                    pid, status = os.waitpid(-1, os.WNOHANG)
+                except ChildProcessError:
+                    pid = 0
+                if pid == 0:
+                    # 延迟重启到期的工作进程
+                    now = time.monotonic()
+                    for index, due in list(pending.items()):
+                        if now >= due and not self.draining:
+                            del pending[index]
+                            self._spawn(index)
+                    time.sleep(0.1)
+                    continue
+
+                index = self.workers.pop(pid, None)
+                if index is None:
+                    continue
+                if not self.draining:
+                    self.restarts.inc()
+                self._retire(index)
+                if self.draining:
+                    continue
+
+                code = os.waitstatus_to_exitcode(status)
+                uptime = time.monotonic() - self.started_at[index]
+                print(f"⚠️  工作进程 #{index} (PID {pid}) 异常退出 (退出码 {code})，正在重启")
+                delay = RESTART_DELAY if uptime < CRASH_LOOP_SECONDS else 0
+                pending[index] = time.monotonic() + delay
+        finally:
+            shutil.rmtree(self.state_dir, ignore_errors=True)
+        print("🛑 所有工作进程已退出")
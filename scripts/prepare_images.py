@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+"""
+批量生成识别基准测试用的模型输入图片
+
+遍历照片目录，用进程池并行生成与应用一致的模型输入变体:
+  test-512   TestImageManager.saveUserTestImage        拉伸到 512x512，JPEG 质量 85
+  gemma-384  GemmaInferenceService._processImage       拉伸到 384x384，PNG
+  llm-768    LLMPerformanceOptimizer.optimizeImageForLLM
+             最长边缩到 768（保持宽高比，三次插值，不放大），对比度 1.1 / 亮度 1.05 / 饱和度 1.1，JPEG 质量 85
+
+结果按 SHA-256(源文件内容 + 变体参数 + Pillow 版本) 寻址保存在 <输出目录>/objects/ 下，
+<输出目录>/<变体>/ 中按源文件的相对路径建立硬链接。重复运行只处理新增或改动的照片，
+源文件的大小和修改时间不变时直接复用上次清单中的哈希，不重新读取。
+清单 <输出目录>/manifest.json 记录每张照片和每个变体的字节数、尺寸和耗时。
+
+Dart image 包和 Pillow 的缩放、调色和 JPEG 编码实现不同，生成的图片尺寸、格式和质量参数与应用一致，
+但不保证逐字节相同。
+
+使用方法:
+python3 scripts/prepare_images.py ~/plant-photos
+python3 scripts/prepare_images.py ~/plant-photos --output-dir /data/corpus --jobs 8
+python3 scripts/prepare_images.py ~/plant-photos --variants test-512,gemma-384
+python3 scripts/prepare_images.py ~/plant-photos --variant thumb=256x256:jpeg70 --variant big=max1024:png
+python3 scripts/prepare_images.py ~/plant-photos --prune           # 删除清单不再引用的文件
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+
+MANIFEST_VERSION = 1
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.bmp'}
+
+# 与应用代码一致的预设变体
+# resize: stretch 为直接缩放到 width x height（img.copyResize 同时给出宽高，默认最近邻插值），
+#         max 为最长边不超过 width 并保持宽高比
+PRESETS = {
+    'test-512': {
+        'resize': 'stretch', 'width': 512, 'height': 512, 'interpolation': 'nearest',
+        'format': 'jpeg', 'quality': 85,
+    },
+    'gemma-384': {
+        'resize': 'stretch', 'width': 384, 'height': 384, 'interpolation': 'nearest',
+        'format': 'png',
+    },
+    'llm-768': {
+        'resize': 'max', 'width': 768, 'height': 768, 'interpolation': 'cubic',
+        'enhance': {'contrast': 1.1, 'brightness': 1.05, 'saturation': 1.1},
+        'format': 'jpeg', 'quality': 85,
+    },
+}
+
+EXTENSIONS = {'jpeg': '.jpg', 'png': '.png'}
+
+VARIANT_SPEC = re.compile(r'^(?P<name>[\w.-]+)=(?:(?P<w>\d+)x(?P<h>\d+)|max(?P<max>\d+))'
+                          r'(?::(?P<format>jpeg|png)(?P<quality>\d+)?)?$')
+
+HASH_BLOCK = 1024 * 1024
+
+def _pillow():
+    try:
+        from PIL import Image, ImageEnhance, ImageOps
+    except ImportError:
+        raise SystemExit("❌ 处理图片需要 Pillow: pip install pillow")
+    return Image, ImageEnhance, ImageOps
+
+def format_size(size):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1024.0:
+            return f"{size:.1f}{unit}"
+        size /= 1024.0
+    return f"{size:.1f}TB"
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def parse_variant(spec):
+    """解析 name=WxH[:jpeg<质量>|:png] 或 name=max<边长>[...] 形式的自定义变体"""
+    match = VARIANT_SPEC.match(spec)
+    if not match:
+        raise argparse.ArgumentTypeError(f"无效的变体: {spec} (例如 thumb=256x256:jpeg70 或 big=max1024:png)")
+    if match['max']:
+        params = {'resize': 'max', 'width': int(match['max']), 'height': int(match['max']),
+                  'interpolation': 'cubic'}
+    else:
+        params = {'resize': 'stretch', 'width': int(match['w']), 'height': int(match['h']),
+                  'interpolation': 'nearest'}
+    params['format'] = match['format'] or 'jpeg'
+    if params['format'] == 'jpeg':
+        params['quality'] = int(match['quality'] or 85)
+        if not 1 <= params['quality'] <= 100:
+            raise argparse.ArgumentTypeError(f"JPEG 质量应在 1-100 之间: {spec}")
+    if min(params['width'], params['height']) < 1:
+        raise argparse.ArgumentTypeError(f"尺寸无效: {spec}")
+    return match['name'], params
+
+def variant_key(source_sha, params, pillow_version):
+    """变体结果的缓存键：源文件内容、变体参数和 Pillow 版本任一变化都会重新生成"""
+    payload = json.dumps({'source': source_sha, 'params': params, 'pillow': pillow_version,
+                          'version': MANIFEST_VERSION}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def object_path(root, key, params):
+    return root / 'objects' / key[:2] / f"{key}{EXTENSIONS[params['format']]}"
+
+def _target_size(width, height, params):
+    if params['resize'] == 'stretch':
+        return params['width'], params['height']
+    limit = params['width']
+    if width <= limit and height <= limit:
+        return width, height
+    # 与 _resizeImageForLLM 相同：按最长边缩放并四舍五入
+    scale = limit / max(width, height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+def _enhance(image, enhance, ImageEnhance):
+    """近似 img.adjustColor：亮度按比例缩放，饱和度在灰度和原色之间插值，对比度以中灰为中心拉伸"""
+    if enhance.get('brightness', 1.0) != 1.0:
+        image = ImageEnhance.Brightness(image).enhance(enhance['brightness'])
+    if enhance.get('saturation', 1.0) != 1.0:
+        image = ImageEnhance.Color(image).enhance(enhance['saturation'])
+    contrast = enhance.get('contrast', 1.0)
+    if contrast != 1.0:
+        table = [min(255, max(0, round((v - 127.5) * contrast + 127.5))) for v in range(256)]
+        # 透明度通道保持不变
+        alpha = list(range(256)) if 'A' in image.getbands() else []
+        image = image.point(table * (len(image.getbands()) - len(alpha) // 256) + alpha)
+    return image
+
+def render_variant(image, params, output):
+    """生成一个变体写入 output，返回 (宽, 高)"""
+    Image, ImageEnhance, _ = _pillow()
+    resample = {'nearest': Image.Resampling.NEAREST, 'cubic': Image.Resampling.BICUBIC}[params['interpolation']]
+    size = _target_size(image.width, image.height, params)
+    result = image if size == image.size else image.resize(size, resample)
+    if params.get('enhance'):
+        result = _enhance(result, params['enhance'], ImageEnhance)
+
+    output.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = output.with_name(f".{output.name}.{os.getpid()}.tmp")
+    if params['format'] == 'jpeg':
+        result.save(tmp_path, 'JPEG', quality=params['quality'])
+    else:
+        result.save(tmp_path, 'PNG')
+    os.replace(tmp_path, output)
+    return result.size
+
+def process_image(source, root, jobs, keep_orientation):
+    """子进程：解码一张照片，生成 jobs 中缺失的变体 [(变体名, 参数, 缓存键)]"""
+    Image, _, ImageOps = _pillow()
+    started = time.perf_counter()
+    with Image.open(source) as opened:
+        image = opened if keep_orientation else ImageOps.exif_transpose(opened)
+        # 应用中 img.decodeImage 得到的是不带透明度的 RGB 图像（PNG 保留透明度）
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+    decode_ms = (time.perf_counter() - started) * 1000
+
+    variants = {}
+    for name, params, key in jobs:
+        started = time.perf_counter()
+        frame = image
+        if params['format'] == 'jpeg' and frame.mode != 'RGB':
+            frame = frame.convert('RGB')
+        width, height = render_variant(frame, params, object_path(root, key, params))
+        variants[name] = {'key': key, 'width': width, 'height': height,
+                          'ms': round((time.perf_counter() - started) * 1000, 2)}
+    return {'width': image.width, 'height': image.height, 'decode_ms': round(decode_ms, 2), 'variants': variants}
+
+def link_output(obj, target):
+    """在变体目录中建立指向缓存文件的硬链接（跨文件系统时复制）"""
+    try:
+        if target.exists() and os.path.samefile(obj, target):
+            return
+    except OSError:
+        pass
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = target.with_name(f".{target.name}.link")
+    try:
+        os.link(obj, tmp_path)
+    except OSError:
+        shutil.copyfile(obj, tmp_path)
+    os.replace(tmp_path, target)
+
+def scan_sources(source_dir, exclude):
+    """源目录下的所有照片（相对路径排序）"""
+    found = []
+    for path in sorted(source_dir.rglob('*')):
+        if path.suffix.lower() not in IMAGE_EXTENSIONS or not path.is_file():
+            continue
+        if exclude and (path == exclude or exclude in path.parents):
+            continue
+        found.append(path)
+    return found
+
+def load_manifest(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get('version') != MANIFEST_VERSION:
+        return {}
+    return {entry['source']: entry for entry in manifest.get('images', [])}
+
+def environment():
+    """记录生成环境，便于判断两次生成的图片是否可比"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SCRIPT_DIR,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'host': platform.node(),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'commit': commit,
+    }
+
+def prune_outputs(root, keep_keys, keep_paths):
+    """删除清单不再引用的缓存文件和变体目录中的旧文件，返回 (文件数, 字节数)"""
+    removed = freed = 0
+    for path in sorted(root.rglob('*')):
+        if not path.is_file() or path.suffix not in EXTENSIONS.values():
+            continue
+        rel = path.relative_to(root)
+        keep = path.stem in keep_keys if rel.parts[0] == 'objects' else rel.as_posix() in keep_paths
+        if keep:
+            continue
+        # 变体目录中的文件是缓存文件的硬链接，只有删掉缓存文件时才真正释放空间
+        if rel.parts[0] == 'objects':
+            freed += path.stat().st_size
+        path.unlink()
+        removed += 1
+    for path in sorted(root.rglob('*'), reverse=True):
+        if path.is_dir() and not any(path.iterdir()):
+            path.rmdir()
+    return removed, freed
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='批量生成识别基准测试用的模型输入图片')
+    parser.add_argument('source', type=Path, help='照片目录')
+    parser.add_argument('--output-dir', type=Path, help='输出目录 (默认: <照片目录>_prepared)')
+    parser.add_argument('--variants', default=','.join(PRESETS),
+                        help=f"要生成的预设变体，逗号分隔 (默认: {','.join(PRESETS)})")
+    parser.add_argument('--variant', action='append', type=parse_variant, default=[],
+                        help='自定义变体: name=WxH[:jpeg<质量>|:png] 或 name=max<边长>[...]，可重复')
+    parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count() or 1, help='并行进程数 (默认: CPU 核数)')
+    parser.add_argument('--keep-orientation', action='store_true',
+                        help='不按 EXIF 方向旋转照片（默认按相册中看到的方向处理）')
+    parser.add_argument('--force', action='store_true', help='忽略缓存，重新生成所有变体')
+    parser.add_argument('--prune', action='store_true', help='删除清单不再引用的缓存文件和旧的变体文件')
+    args = parser.parse_args()
+
+    Image, _, _ = _pillow()
+    if not args.source.is_dir():
+        print(f"❌ 照片目录不存在: {args.source}")
+        sys.exit(1)
+    source_dir = args.source.resolve()
+    root = (args.output_dir or source_dir.with_name(f"{source_dir.name}_prepared")).resolve()
+
+    variants = {}
+    for name in filter(None, (n.strip() for n in args.variants.split(','))):
+        if name not in PRESETS:
+            print(f"❌ 未知的预设变体: {name} (可选: {', '.join(PRESETS)})")
+            sys.exit(1)
+        variants[name] = PRESETS[name]
+    variants.update(dict(args.variant))
+    if not variants:
+        print("❌ 没有要生成的变体")
+        sys.exit(1)
+
+    manifest_path = root / 'manifest.json'
+    previous = {} if args.force else load_manifest(manifest_path)
+    sources = scan_sources(source_dir, root)
+    print(f"📁 {source_dir}: {len(sources)} 张照片 → {root}")
+    print(f"🖼️  变体: {', '.join(variants)} (Pillow {Image.__version__}，{args.jobs} 个进程)")
+
+    started = time.monotonic()
+    entries = {}
+    pending = []
+    hashed = 0
+    for path in sources:
+        rel = path.relative_to(source_dir).as_posix()
+        stat = path.stat()
+        old = previous.get(rel)
+        if old and old.get('bytes') == stat.st_size and old.get('mtime_ns') == stat.st_mtime_ns:
+            sha = old['sha256']
+        else:
+            sha = file_sha256(path)
+            hashed += 1
+        entry = {'source': rel, 'sha256': sha, 'bytes': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                 'variants': {}}
+        if old and old.get('sha256') == sha:
+            entry.update({k: old[k] for k in ('width', 'height', 'decode_ms') if k in old})
+
+        jobs = []
+        for name, params in variants.items():
+            key = variant_key(sha, params, Image.__version__)
+            obj = object_path(root, key, params)
+            cached = (old or {}).get('variants', {}).get(name)
+            if args.force or not obj.is_file():
+                jobs.append((name, params, key))
+            elif cached and cached.get('key') == key:
+                entry['variants'][name] = dict(cached, cached=True)
+            else:
+                # 内容相同的照片（复制或改名）直接复用已生成的文件
+                with Image.open(obj) as existing:
+                    width, height = existing.size
+                entry['variants'][name] = {'key': key, 'width': width, 'height': height, 'ms': None,
+                                           'cached': True}
+        entries[rel] = entry
+        if jobs:
+            pending.append((path, rel, jobs))
+    print(f"🔍 扫描完成: 计算哈希 {hashed} 张，需要处理 {len(pending)} 张 ({time.monotonic() - started:.1f} 秒)")
+
+    failed = []
+    processed = 0
+    if pending:
+        with ProcessPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+            futures = {pool.submit(process_image, path, root, jobs, args.keep_orientation): rel
+                       for path, rel, jobs in pending}
+            for future in as_completed(futures):
+                rel = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    failed.append({'source': rel, 'error': f"{type(e).__name__}: {e}"})
+                    print(f"⚠️ {rel}: {e}")
+                    del entries[rel]
+                    continue
+                entry = entries[rel]
+                entry.update({k: result[k] for k in ('width', 'height', 'decode_ms')})
+                for name, info in result['variants'].items():
+                    entry['variants'][name] = dict(info, cached=False)
+                processed += 1
+                if processed % 100 == 0:
+                    print(f"  ... {processed}/{len(pending)}")
+
+    for entry in entries.values():
+        stem = str(Path(entry['source']).with_suffix(''))
+        for name, info in entry['variants'].items():
+            params = variants[name]
+            obj = object_path(root, info['key'], params)
+            target = root / name / f"{stem}{EXTENSIONS[params['format']]}"
+            link_output(obj, target)
+            info['path'] = target.relative_to(root).as_posix()
+            info['bytes'] = obj.stat().st_size
+    elapsed = time.monotonic() - started
+
+    images = [entries[rel] for rel in sorted(entries)]
+    summary = {}
+    for name in variants:
+        infos = [e['variants'][name] for e in images if name in e['variants']]
+        fresh = [i['ms'] for i in infos if not i['cached']]
+        summary[name] = {
+            'params': variants[name],
+            'images': len(infos),
+            'generated': len(fresh),
+            'bytes': sum(i['bytes'] for i in infos),
+            'mean_bytes': round(sum(i['bytes'] for i in infos) / len(infos)) if infos else None,
+            'p50_ms': percentile(fresh, 0.5),
+            'p95_ms': percentile(fresh, 0.95),
+        }
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'source_dir': str(source_dir),
+        'pillow': Image.__version__,
+        'orientation': 'original' if args.keep_orientation else 'exif',
+        'environment': environment(),
+        'totals': {
+            'images': len(images),
+            'processed': processed,
+            'failed': len(failed),
+            'source_bytes': sum(e['bytes'] for e in images),
+            'jobs': args.jobs,
+            'seconds': round(elapsed, 2),
+        },
+        'variants': summary,
+        'images': images,
+        'failed': failed,
+    }
+    root.mkdir(parents=True, exist_ok=True)
+    tmp_path = manifest_path.with_name(f".{manifest_path.name}.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+    print(f"\n  {'变体':<12} {'张数':>6} {'新生成':>6} {'平均大小':>10} {'总大小':>10} {'p50':>8} {'p95':>8}")
+    for name, info in summary.items():
+        p50 = f"{info['p50_ms']:.1f}ms" if info['p50_ms'] is not None else '-'
+        p95 = f"{info['p95_ms']:.1f}ms" if info['p95_ms'] is not None else '-'
+        mean = format_size(info['mean_bytes']) if info['mean_bytes'] is not None else '-'
+        print(f"  {name:<12} {info['images']:>6} {info['generated']:>6} {mean:>10} "
+              f"{format_size(info['bytes']):>10} {p50:>8} {p95:>8}")
+
+    if args.prune:
+        infos = [info for e in images for info in e['variants'].values()]
+        removed, freed = prune_outputs(root, {i['key'] for i in infos}, {i['path'] for i in infos})
+        print(f"🧹 删除 {removed} 个不再引用的文件，释放 {format_size(freed)}")
+
+    print(f"\n📄 清单: {manifest_path}")
+    if failed:
+        print(f"⚠️ {len(failed)} 张照片处理失败")
+        sys.exit(1)
+    print(f"✅ 完成: 处理 {processed} 张，复用缓存 {len(images) - processed} 张 ({elapsed:.1f} 秒)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+模型服务器的回源缓存（pull-through）模式
+
+本地还没有模型文件时，服务器在第一次请求时从上游（默认 HuggingFace）下载，
+一边下载一边提供服务:
+
+- 文件按固定大小分块写入预分配的 <模型>.part，每块的填充进度记录在
+  <模型>.part.json（与 download_storage.SegmentedPartFile 通用），重启后接着下载
+- 已经下载到的范围立即返回；客户端读到还没下载的位置时等待该块就绪，
+  同一块只会向上游请求一次，多个客户端共享同一份下载
+- 客户端正在等待的块优先下载，其余块在后台按顺序补齐
+- 全部下载完成后原子改名为模型文件，之后按普通模式提供服务
+
+这样整个设备实验室只需要从上游下载一次模型。
+"""
+
+import heapq
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from download_storage import MB, SegmentedPartFile, format_size
+
+# 回源分块大小，也是客户端等待的粒度
+CHUNK_SIZE = 8 * MB
+
+# 单次从上游读取的大小，读到即写入并唤醒等待的客户端
+READ_SIZE = MB
+
+# 客户端等待的块向后预取的块数（顺序读取时保持并发下载）
+READ_AHEAD = 4
+
+# 单块回源失败后的重试次数
+RETRIES = 3
+
+# 等待数据时超过这么久没有任何进展则放弃
+WAIT_TIMEOUT = 120
+
+# 优先级：客户端等待的块优先于后台补齐
+PRIORITY_DEMAND = 0
+PRIORITY_FILL = 1
+
+class UpstreamError(OSError):
+    """上游不可用或返回了错误的内容"""
+
+def upstream_headers(token=None):
+    headers = {'User-Agent': 'PlantMeet/1.0 Model Server'}
+    if token:
+        headers['Authorization'] = f'Bearer {token}'
+    return headers
+
+def probe_upstream(url, headers, timeout=30):
+    """请求首字节，返回文件总大小并确认上游支持范围请求
+
+    不用 HEAD：urllib 跟随重定向时会把 HEAD 改成 GET，下载整个文件。
+    """
+    request = urllib.request.Request(url, headers={**headers, 'Range': 'bytes=0-0'})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            content_range = response.headers.get('Content-Range', '')
+            if response.status != 206 or '/' not in content_range:
+                raise UpstreamError(f"上游不支持范围请求: {url}")
+            return int(content_range.rsplit('/', 1)[1])
+    except urllib.error.HTTPError as e:
+        raise UpstreamError(f"上游返回 HTTP {e.code}: {url}") from e
+    except (urllib.error.URLError, ValueError) as e:
+        raise UpstreamError(f"无法访问上游 {url}: {e}") from e
+
+def upstream_size(target, url, headers):
+    """上游文件大小；上游暂时不可用但本地有同一来源的下载进度时沿用记录的大小"""
+    try:
+        return probe_upstream(url, headers)
+    except UpstreamError as e:
+        state = SegmentedPartFile(target, 0, identity=url)._read_state()
+        if state and state.get('identity') == url and state.get('size'):
+            print(f"⚠️  {e}，先提供已下载的部分")
+            return state['size']
+        raise
+
+class PullThroughCache:
+    """边从上游下载边提供服务的模型文件缓存"""
+
+    def __init__(self, target, url, size, headers=None, chunk_size=CHUNK_SIZE, connections=4,
+                 prefetch=True, registry=None):
+        self.url = url
+        self.size = size
+        self.headers = headers or {}
+        self.chunk_size = chunk_size
+        self.connections = connections
+        self.prefetch = prefetch
+        self.part = SegmentedPartFile(target, size, identity=url, segment_size=chunk_size)
+        self.target = self.part.target
+        self.complete = False
+        self.error = None
+
+        # 同一个条件变量既保护下载队列，也用于通知数据就绪
+        self._cond = threading.Condition()
+        self._queue = []
+        self._queued = {}
+        self._inflight = set()
+        self._failed = {}
+        self._seq = 0
+        self._started = False
+        self._stop = False
+        self._threads = []
+        self._read_fd = None
+
+        if registry is not None:
+            self._upstream_bytes = registry.counter('upstream_bytes_total', '从上游下载的字节数')
+            self._upstream_fetches = registry.counter('upstream_fetches_total', '向上游发起的分块请求数')
+            self._upstream_errors = registry.counter('upstream_errors_total', '上游分块请求失败次数')
+            self._waits = registry.counter('pull_through_waits_total', '客户端等待数据下载的次数')
+            self._filled = registry.gauge('pull_through_filled_bytes', '缓存中已下载的字节数')
+        else:
+            self._upstream_bytes = self._upstream_fetches = self._upstream_errors = None
+            self._waits = self._filled = None
+
+    def open(self):
+        """预分配 .part 文件并读取上次的进度"""
+        pending = self.part.open()
+        self._read_fd = os.open(self.part.path, os.O_RDONLY)
+        if self._filled is not None:
+            self._filled.inc(self.part.received)
+        if not pending:
+            self._finish()
+        return self.part.received
+
+    def close(self):
+        """停止下载并保存进度"""
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        if not self.complete:
+            self.part.close()
+        if self._read_fd is not None:
+            os.close(self._read_fd)
+            self._read_fd = None
+
+    # ---- 下载调度 ----
+
+    def _start(self):
+        """第一次有客户端请求时启动下载线程（调用方持有锁）"""
+        if self._started:
+            return
+        self._started = True
+        if self.prefetch:
+            for index, segment in enumerate(self.part.segments):
+                if segment[2] < segment[1]:
+                    self._enqueue(index, PRIORITY_FILL)
+        for i in range(self.connections):
+            thread = threading.Thread(target=self._fetcher, name=f'pull-through-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        print(f"⬇️  开始从上游下载: {self.url} "
+              f"(已有 {format_size(self.part.received)} / {format_size(self.size)})")
+
+    def _enqueue(self, index, priority):
+        """把块放入下载队列；已在队列中时只提升优先级（调用方持有锁）"""
+        if index in self._inflight or priority >= self._queued.get(index, PRIORITY_FILL + 1):
+            return
+        segment = self.part.segments[index]
+        if segment[2] >= segment[1]:
+            return
+        self._queued[index] = priority
+        self._seq += 1
+        heapq.heappush(self._queue, (priority, self._seq, index))
+        self._cond.notify_all()
+
+    def _demand(self, index):
+        """客户端需要第 index 块：连同后面几块一起优先下载（调用方持有锁）"""
+        self._start()
+        # 失败过的块有新的客户端请求时重试
+        self._failed.pop(index, None)
+        for i in range(index, min(index + READ_AHEAD, len(self.part.segments))):
+            self._enqueue(i, PRIORITY_DEMAND)
+
+    def _next(self):
+        """取出下一个要下载的块，停止时返回 None"""
+        with self._cond:
+            while not self._stop:
+                while self._queue:
+                    priority, _, index = heapq.heappop(self._queue)
+                    # 优先级提升后旧的队列项作废
+                    if self._queued.get(index) != priority:
+                        continue
+                    del self._queued[index]
+                    self._inflight.add(index)
+                    return index
+                self._cond.wait()
+            return None
+
+    def _fetcher(self):
+        while True:
+            index = self._next()
+            if index is None:
+                return
+            try:
+                self._fetch(index)
+            except Exception as e:
+                if self._upstream_errors is not None:
+                    self._upstream_errors.inc()
+                print(f"❌ 上游分块 {index} 下载失败: {e}")
+                with self._cond:
+                    self._failed[index] = e
+            finally:
+                with self._cond:
+                    self._inflight.discard(index)
+                    self._cond.notify_all()
+            self._check_complete()
+
+    def _fetch(self, index):
+        """下载一块的剩余部分，失败时退避重试"""
+        segment = self.part.segments[index]
+        for attempt in range(RETRIES + 1):
+            if segment[2] >= segment[1] or self._stop:
+                return
+            try:
+                self._fetch_range(segment)
+                return
+            except (OSError, urllib.error.URLError) as e:
+                if attempt == RETRIES or isinstance(e, urllib.error.HTTPError) and \
+                        400 <= e.code < 500 and e.code not in (408, 429):
+                    raise
+                time.sleep(2 ** attempt)
+
+    def _fetch_range(self, segment):
+        headers = {**self.headers, 'Range': f'bytes={segment[2]}-{segment[1] - 1}'}
+        request = urllib.request.Request(self.url, headers=headers)
+        if self._upstream_fetches is not None:
+            self._upstream_fetches.inc()
+        with urllib.request.urlopen(request, timeout=30) as response:
+            if response.status != 206:
+                raise UpstreamError(f"上游忽略了范围请求 (HTTP {response.status})")
+            while segment[2] < segment[1] and not self._stop:
+                data = response.read(min(READ_SIZE, segment[1] - segment[2]))
+                if not data:
+                    raise UpstreamError(f"上游连接提前结束于 {segment[2]}")
+                self.part.write_at(segment, data)
+                if self._upstream_bytes is not None:
+                    self._upstream_bytes.inc(len(data))
+                    self._filled.inc(len(data))
+                with self._cond:
+                    self._cond.notify_all()
+
+    def _check_complete(self):
+        with self._cond:
+            if self.complete or self._stop or self._inflight or self.part.pending():
+                return
+            self._finish()
+            self._cond.notify_all()
+
+    def _finish(self):
+        """全部下载完成：落盘并改名为模型文件（调用方持有锁或尚未启动下载）"""
+        try:
+            self.part.commit()
+        except (OSError, ValueError) as e:
+            self.error = e
+            print(f"❌ 保存模型文件失败: {e}")
+            return
+        self.complete = True
+        print(f"✅ 模型已从上游下载完成: {self.target} ({format_size(self.size)})")
+
+    # ---- 读取 ----
+
+    def _available(self, position):
+        """position 所在块中从 position 开始已经下载的字节数（调用方持有锁）"""
+        start, end, done = self.part.segments[position // self.chunk_size]
+        return max(0, done - position)
+
+    def wait_available(self, position):
+        """阻塞到 position 处至少有一个字节可读，返回可连续读取的字节数"""
+        index = position // self.chunk_size
+        with self._cond:
+            available = self._available(position)
+            if available:
+                # 顺序读取的客户端读到块内时就开始准备后面的块
+                if not self.complete:
+                    self._demand(index)
+                return available
+            self._demand(index)
+            if self._waits is not None:
+                self._waits.inc()
+            deadline = time.monotonic() + WAIT_TIMEOUT
+            while True:
+                available = self._available(position)
+                if available:
+                    return available
+                if index in self._failed:
+                    raise UpstreamError(f"上游下载失败: {self._failed[index]}")
+                if self._stop:
+                    raise UpstreamError("服务器正在停止")
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise UpstreamError(f"等待上游数据超时 (偏移 {position})")
+                done = self.part.segments[index][2]
+                self._cond.wait(remaining)
+                # 有进展就重新计时
+                if self.part.segments[index][2] != done or index in self._inflight:
+                    deadline = time.monotonic() + WAIT_TIMEOUT
+
+    def chunks(self, start, length, chunk_size=65536):
+        """按顺序产出 [start, start+length) 的数据，必要时等待下载"""
+        position = start
+        end = start + length
+        while position < end:
+            available = self.wait_available(position)
+            n = min(chunk_size, available, end - position)
+            data = os.pread(self._read_fd, n, position)
+            if not data:
+                raise UpstreamError(f"读取缓存文件失败 (偏移 {position})")
+            position += len(data)
+            yield data
+
+def attach_pull_through(server, target, url, size, headers=None, connections=4, prefetch=True):
+    """为 HTTP 服务器挂载回源缓存，处理器通过 self.server.pull_through 访问
+
+    需要服务器先经过 attach_metrics() 挂载指标。
+    """
+    cache = PullThroughCache(target, url, size, headers, connections=connections, prefetch=prefetch,
+                             registry=server.metrics.registry)
+    cache.open()
+    server.pull_through = cache
+    return cache
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+重新打包 .task 模型包，便于设备端直接 mmap 权重
+
+类似 Android 的 zipalign:
+- 大成员（默认 ≥ 1MB，主要是权重）改为不压缩存储
+- 所有不压缩的成员的数据起点对齐到页边界（默认 16KB，兼容 4KB 和 16KB 页的设备），
+  通过在本地文件头中填充扩展字段 0xD935（与 zipalign 相同）实现
+- 逐个成员流式复制，不把成员读入内存；写完后逐字节比较每个成员的内容，
+  校验通过才替换目标文件
+
+使用方法:
+python3 scripts/repack_task.py assets/models/gemma-3n-E4B-it-int4.task              # 输出 *.aligned.task
+python3 scripts/repack_task.py assets/models/gemma-3n-E4B-it-int4.task --in-place
+python3 scripts/repack_task.py model.task --check                                   # 只报告对齐情况
+"""
+
+import argparse
+import errno
+import os
+import shutil
+import struct
+import sys
+import time
+import zipfile
+from pathlib import Path
+
+from task_archive import STREAM_BLOCK, format_size, iter_member, read_members
+
+MB = 1024 * 1024
+
+DEFAULT_ALIGN = 16 * 1024
+DEFAULT_MIN_STORE = MB
+
+# zipalign 使用的对齐扩展字段: 字段 ID、长度、对齐值（2 字节），其后为填充
+ALIGNMENT_EXTRA_ID = 0xD935
+ALIGNMENT_EXTRA = struct.Struct('<HHH')
+
+# zip64 本地文件头扩展字段的长度（zipfile 写入的 ID、长度和两个 8 字节大小）
+ZIP64_LOCAL_EXTRA = 20
+
+LOCAL_HEADER_SIZE = 30
+
+def _encoded_name(name):
+    try:
+        return name.encode('ascii')
+    except UnicodeEncodeError:
+        return name.encode('utf-8')
+
+def alignment_extra(data_start, align):
+    """使 data_start + 扩展字段长度 对齐到 align 的扩展字段"""
+    padding = -(data_start + ALIGNMENT_EXTRA.size) % align
+    return ALIGNMENT_EXTRA.pack(ALIGNMENT_EXTRA_ID, 2 + padding, align) + bytes(padding)
+
+def _strip_alignment(extra):
+    """去掉扩展字段中已有的对齐填充（重新打包时重新计算）"""
+    result = b''
+    i = 0
+    while i + 4 <= len(extra):
+        field_id, length = struct.unpack_from('<HH', extra, i)
+        if field_id not in (ALIGNMENT_EXTRA_ID, 0x0001):
+            result += extra[i:i + 4 + length]
+        i += 4 + length
+    return result
+
+def alignment_report(members, align):
+    """统计不压缩的成员中数据起点对齐到 align 的个数和字节数"""
+    stored = [m for m in members if m['compression'] == 'stored']
+    aligned = [m for m in stored if m['offset'] % align == 0]
+    return {
+        'stored': len(stored),
+        'aligned': len(aligned),
+        'stored_bytes': sum(m['size'] for m in stored),
+        'aligned_bytes': sum(m['size'] for m in aligned),
+    }
+
+def plan_size(members, min_store):
+    """输出文件大小的上限估计（按存储方式计算成员数据，另加每个成员一页的填充）"""
+    total = 0
+    for m in members:
+        store = m['compression'] == 'stored' or m['size'] >= min_store
+        total += (m['size'] if store else m['compressed_size']) + len(m['name']) * 2 + 64 * 1024 + 200
+    return total
+
+def repack(source, output, align=DEFAULT_ALIGN, min_store=DEFAULT_MIN_STORE):
+    """把 source 重新打包到 output，返回新成员表"""
+    with open(source, 'rb') as src:
+        members = read_members(src)
+        with zipfile.ZipFile(src) as archive:
+            infos = {info.filename: info for info in archive.infolist()}
+
+        needed = plan_size(members, min_store)
+        free = shutil.disk_usage(Path(output).parent).free
+        if needed > free:
+            raise OSError(errno.ENOSPC, f"磁盘空间不足: 需要约 {format_size(needed)}，可用 {format_size(free)}")
+
+        with zipfile.ZipFile(output, 'w', allowZip64=True) as out:
+            for member in members:
+                old = infos[member['name']]
+                stored = member['compression'] == 'stored' or member['size'] >= min_store
+                info = zipfile.ZipInfo(old.filename, old.date_time)
+                info.external_attr = old.external_attr
+                info.create_system = old.create_system
+                info.comment = old.comment
+                info.file_size = member['size']
+                info.compress_type = zipfile.ZIP_STORED if stored else old.compress_type
+                extra = _strip_alignment(old.extra)
+                zip64 = member['size'] * 1.05 > zipfile.ZIP64_LIMIT
+                if stored:
+                    data_start = (out.start_dir + LOCAL_HEADER_SIZE + len(_encoded_name(info.filename))
+                                  + len(extra) + (ZIP64_LOCAL_EXTRA if zip64 else 0))
+                    info.extra = extra + alignment_extra(data_start, align)
+                else:
+                    info.extra = extra
+
+                with out.open(info, 'w', force_zip64=zip64) as dst:
+                    if stored and out.fp.tell() % align:
+                        raise ValueError(f"成员 {info.filename} 未能对齐 (偏移 {out.fp.tell()})")
+                    for data in iter_member(src, member):
+                        dst.write(data)
+                # 本地文件头已经写好，中央目录中只保留对齐值，不重复填充
+                if stored:
+                    info.extra = extra + ALIGNMENT_EXTRA.pack(ALIGNMENT_EXTRA_ID, 2, align)
+
+    with open(output, 'rb') as f:
+        return read_members(f)
+
+def _same_content(a, b):
+    """逐字节比较两个按块产出的数据流"""
+    pending_a = pending_b = b''
+    a, b = iter(a), iter(b)
+    while True:
+        if not pending_a:
+            pending_a = next(a, b'')
+        if not pending_b:
+            pending_b = next(b, b'')
+        if not pending_a or not pending_b:
+            return not pending_a and not pending_b
+        n = min(len(pending_a), len(pending_b))
+        if pending_a[:n] != pending_b[:n]:
+            return False
+        pending_a = pending_a[n:]
+        pending_b = pending_b[n:]
+
+def verify(source, output, align):
+    """逐字节比较两个归档的成员内容，并检查不压缩的成员都已对齐，返回问题列表"""
+    problems = []
+    with open(source, 'rb') as f_old, open(output, 'rb') as f_new:
+        old_members = {m['name']: m for m in read_members(f_old)}
+        new_members = {m['name']: m for m in read_members(f_new)}
+        if set(old_members) != set(new_members):
+            problems.append(f"成员不一致: {sorted(set(old_members) ^ set(new_members))}")
+        for name, new in new_members.items():
+            old = old_members.get(name)
+            if old is None:
+                continue
+            if new['compression'] == 'stored' and new['offset'] % align:
+                problems.append(f"{name} 没有对齐到 {align}")
+            if not _same_content(iter_member(f_old, old, STREAM_BLOCK), iter_member(f_new, new, STREAM_BLOCK)):
+                problems.append(f"{name} 内容不一致")
+    return problems
+
+def print_table(title, members, align):
+    print(f"\n{title}")
+    print(f"  {'成员':<36} {'偏移':>14} {'对齐':>6} {'大小':>10} {'压缩后':>10}  压缩")
+    for m in members:
+        mark = '✓' if m['offset'] % align == 0 else f"+{m['offset'] % align}"
+        if m['compression'] != 'stored':
+            mark = '-'
+        print(f"  {m['name']:<36} {m['offset']:>14} {mark:>6} {format_size(m['size']):>10} "
+              f"{format_size(m['compressed_size']):>10}  {m['compression']}")
+    report = alignment_report(members, align)
+    print(f"  不压缩成员 {report['aligned']}/{report['stored']} 个对齐到 {align // 1024}KB "
+          f"({format_size(report['aligned_bytes'])}/{format_size(report['stored_bytes'])})")
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='重新打包 .task 模型包：大成员不压缩并按页对齐')
+    parser.add_argument('source', type=Path, help='.task 文件')
+    parser.add_argument('--output', '-o', type=Path, help='输出文件 (默认: <文件名>.aligned.task)')
+    parser.add_argument('--in-place', action='store_true', help='校验通过后替换原文件')
+    parser.add_argument('--align', type=int, choices=[4096, 16384], default=DEFAULT_ALIGN,
+                        help='对齐字节数 (默认: 16384，同时满足 4KB 和 16KB 页)')
+    parser.add_argument('--min-store', type=float, default=DEFAULT_MIN_STORE / MB,
+                        help='不小于该大小 (MB) 的成员改为不压缩存储 (默认: 1)')
+    parser.add_argument('--check', action='store_true', help='只报告当前的对齐情况，不重新打包')
+    args = parser.parse_args()
+
+    try:
+        with open(args.source, 'rb') as f:
+            before = read_members(f)
+    except (OSError, zipfile.BadZipFile) as e:
+        print(f"❌ 无法读取 {args.source}: {e}")
+        sys.exit(1)
+    size_before = args.source.stat().st_size
+    print_table(f"📦 {args.source} ({format_size(size_before)})", before, args.align)
+
+    report = alignment_report(before, args.align)
+    if args.check:
+        sys.exit(0 if report['aligned'] == report['stored'] else 1)
+
+    if args.in_place:
+        target = args.source
+    else:
+        target = args.output or args.source.with_name(f"{args.source.stem}.aligned{args.source.suffix}")
+    tmp_path = target.with_name(f".{target.name}.repack")
+
+    started = time.monotonic()
+    try:
+        after = repack(args.source, tmp_path, args.align, int(args.min_store * MB))
+        size_after = tmp_path.stat().st_size
+        change = f"{'+' if size_after >= size_before else '-'}{format_size(abs(size_after - size_before))}"
+        print_table(f"📦 重新打包后 ({format_size(size_after)}，{change})", after, args.align)
+        print("\n🔍 逐字节比较成员内容...")
+        problems = verify(args.source, tmp_path, args.align)
+        if problems:
+            for problem in problems:
+                print(f"  ❌ {problem}")
+            raise ValueError("校验失败，原文件未改动")
+        # 原文件可能是共享模型缓存的只读硬链接，替换目录项不影响缓存中的文件
+        os.replace(tmp_path, target)
+    except (OSError, ValueError, zipfile.BadZipFile) as e:
+        print(f"❌ {e}")
+        try:
+            tmp_path.unlink()
+        except OSError:
+            pass
+        sys.exit(1)
+    print(f"✅ 已写入 {target} ({time.monotonic() - started:.1f} 秒)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+模型服务器监听套接字与快速启动
+
+- 直接尝试绑定端口（SO_REUSEADDR，可选 SO_REUSEPORT），只有端口确实被占用时才查找并终止占用进程
+- 端口占用进程通过 /proc/net/tcp 和 /proc/<pid>/fd 查找，非 Linux 平台退化为 lsof
+- 本机局域网地址通过 socket.if_nameindex + SIOCGIFADDR 获取，不需要向外部地址发起连接
+- 支持 socket activation：继承 systemd 传入的监听套接字（LISTEN_FDS）或 --listen-fd 指定的描述符
+- 绑定时跳过 HTTPServer 默认的 getfqdn() 反向解析，无网络时不会卡住
+"""
+
+import errno
+import os
+import signal
+import socket
+import socketserver
+import struct
+import subprocess
+import time
+from http.server import ThreadingHTTPServer
+
+# systemd socket activation 传入的第一个描述符
+SD_LISTEN_FDS_START = 3
+
+# Linux ioctl: 获取网卡 IPv4 地址
+SIOCGIFADDR = 0x8915
+
+TCP_LISTEN = '0A'
+
+class ModelHTTPServer(ThreadingHTTPServer):
+    """多线程 HTTP 服务器，支持 SO_REUSEPORT 和继承已监听的套接字"""
+
+    allow_reuse_address = True
+
+    def __init__(self, server_address, handler_class, reuse_port=False, listen_socket=None):
+        self.reuse_port = reuse_port
+        if listen_socket is None:
+            super().__init__(server_address, handler_class)
+            return
+
+        # 继承的套接字已经绑定并处于监听状态，跳过 bind/listen
+        super().__init__(server_address, handler_class, bind_and_activate=False)
+        self.socket.close()
+        self.socket = listen_socket
+        self.server_address = listen_socket.getsockname()
+        self.server_name = str(self.server_address[0])
+        self.server_port = self.server_address[1]
+
+    def server_bind(self):
+        if self.reuse_port and hasattr(socket, 'SO_REUSEPORT'):
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        socketserver.TCPServer.server_bind(self)
+        # HTTPServer.server_bind 会调用 socket.getfqdn()，无网络时可能卡住数秒
+        host, port = self.server_address[:2]
+        self.server_name = str(host)
+        self.server_port = port
+
+def inherited_listen_socket(listen_fd=None):
+    """返回继承的监听套接字：优先使用 listen_fd，其次是 systemd 的 LISTEN_FDS，没有则返回 None"""
+    if listen_fd is None:
+        if os.environ.get('LISTEN_PID') != str(os.getpid()):
+            return None
+        try:
+            if int(os.environ.get('LISTEN_FDS', '0')) < 1:
+                return None
+        except ValueError:
+            return None
+        listen_fd = SD_LISTEN_FDS_START
+        # 与 sd_listen_fds() 一致，避免子进程重复使用
+        for name in ('LISTEN_PID', 'LISTEN_FDS', 'LISTEN_FDNAMES'):
+            os.environ.pop(name, None)
+    sock = socket.socket(fileno=listen_fd)
+    sock.setblocking(True)
+    return sock
+
+def _listening_inodes(port):
+    """从 /proc/net/tcp{,6} 查找监听指定端口的套接字 inode"""
+    inodes = set()
+    for table in ('/proc/net/tcp', '/proc/net/tcp6'):
+        try:
+            with open(table, 'r') as f:
+                next(f, None)
+                for line in f:
+                    fields = line.split()
+                    if len(fields) < 10 or fields[3] != TCP_LISTEN:
+                        continue
+                    if int(fields[1].rsplit(':', 1)[1], 16) == port:
+                        inodes.add(fields[9])
+        except OSError:
+            continue
+    return inodes
+
+def port_owner_pids(port):
+    """返回监听指定端口的进程 PID 列表"""
+    if os.path.exists('/proc/net/tcp'):
+        inodes = _listening_inodes(port)
+        if not inodes:
+            return []
+        targets = {f'socket:[{inode}]' for inode in inodes}
+        pids = []
+        for pid in os.listdir('/proc'):
+            if not pid.isdigit():
+                continue
+            fd_dir = f'/proc/{pid}/fd'
+            try:
+                for fd in os.listdir(fd_dir):
+                    if os.readlink(f'{fd_dir}/{fd}') in targets:
+                        pids.append(int(pid))
+                        break
+            except OSError:
+                # 进程已退出或无权限访问
+                continue
+        return pids
+
+    # 非 Linux 平台使用 lsof
+    try:
+        result = subprocess.run(['lsof', '-ti', f'tcp:{port}', '-sTCP:LISTEN'],
+                                capture_output=True, text=True)
+        return [int(pid) for pid in result.stdout.split() if pid.isdigit()]
+    except OSError:
+        return []
+
+def port_in_use(port):
+    """端口是否已有监听者（Linux 上只读取 /proc，不发起连接）"""
+    if os.path.exists('/proc/net/tcp'):
+        return bool(_listening_inodes(port))
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.settimeout(0.2)
+        return s.connect_ex(('127.0.0.1', port)) == 0
+
+def free_port(port, timeout=2.0):
+    """终止占用端口的进程：先 SIGTERM，超时后 SIGKILL；返回被终止的 PID 列表"""
+    pids = [pid for pid in port_owner_pids(port) if pid != os.getpid()]
+    for pid in pids:
+        print(f"🔥 正在终止占用端口 {port} 的进程 PID: {pid}")
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except OSError:
+            pass
+
+    # 轮询端口释放，而不是固定等待
+    deadline = time.monotonic() + timeout
+    while pids and port_in_use(port) and time.monotonic() < deadline:
+        time.sleep(0.02)
+    if pids and port_in_use(port):
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError:
+                pass
+        deadline = time.monotonic() + timeout
+        while port_in_use(port) and time.monotonic() < deadline:
+            time.sleep(0.02)
+    return pids
+
+def lan_addresses():
+    """返回本机非回环 IPv4 地址列表 [(网卡名, 地址)]，不向外部地址发起连接"""
+    addresses = []
+    try:
+        import fcntl
+
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            for _, name in socket.if_nameindex():
+                try:
+                    packed = fcntl.ioctl(s.fileno(), SIOCGIFADDR,
+                                         struct.pack('256s', name.encode()[:15]))
+                except OSError:
+                    # 网卡没有 IPv4 地址或平台不支持该 ioctl
+                    continue
+                address = socket.inet_ntoa(packed[20:24])
+                if not address.startswith('127.'):
+                    addresses.append((name, address))
+    except (ImportError, OSError, AttributeError):
+        pass
+
+    if not addresses:
+        # 退化为解析本机主机名（macOS 等平台）
+        try:
+            for info in socket.getaddrinfo(socket.gethostname(), None, socket.AF_INET):
+                address = info[4][0]
+                if not address.startswith('127.') and (None, address) not in addresses:
+                    addresses.append((None, address))
+        except OSError:
+            pass
+    return addresses
+
+def get_local_ip():
+    """获取本机IP地址"""
+    addresses = lan_addresses()
+    return addresses[0][1] if addresses else "127.0.0.1"
+
+def parse_byte_range(range_header, size):
+    """解析 Range 请求头，返回 (起点, 终点)（含终点）；范围无法满足或格式错误时返回 None
+
+    支持 bytes=N-、bytes=N-M 和后缀范围 bytes=-N（最后 N 个字节，读取 zip 中央目录时使用），
+    多个范围时只取第一个。
+    """
+    unit, _, spec = range_header.strip().partition('=')
+    if unit.strip() != 'bytes':
+        return None
+    first, sep, last = spec.split(',', 1)[0].strip().partition('-')
+    if not sep or not (first or last):
+        return None
+    try:
+        if not first:
+            suffix = int(last)
+            if suffix <= 0 or size == 0:
+                return None
+            return max(0, size - suffix), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start < 0 or start >= size or end < start:
+        return None
+    return start, min(end, size - 1)
+
+def send_range_not_satisfiable(handler, size):
+    """返回 416，并在 Content-Range 中给出完整大小"""
+    handler.send_response(416)
+    handler.send_header('Content-Range', f'bytes */{size}')
+    handler.send_header('Content-Length', '0')
+    handler.end_headers()
+
+def reuseport_socket(host, port, backlog=ModelHTTPServer.request_queue_size):
+    """创建一个设置了 SO_REUSEPORT 的监听套接字，多个这样的套接字由内核分配连接"""
+    sock = socket.socket(ModelHTTPServer.address_family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if hasattr(socket, 'SO_REUSEPORT'):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    try:
+        sock.bind((host, port))
+        sock.listen(backlog)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+def create_server(host, port, handler_factory, reuse_port=False, listen_fd=None, kill_existing=True):
+    """创建服务器：继承套接字 > 直接绑定 > 清理占用进程后重新绑定"""
+    listen_socket = inherited_listen_socket(listen_fd)
+    if listen_socket is not None:
+        print(f"🔌 使用继承的监听套接字: {listen_socket.getsockname()}")
+        return ModelHTTPServer((host, port), handler_factory, listen_socket=listen_socket)
+
+    try:
+        return ModelHTTPServer((host, port), handler_factory, reuse_port=reuse_port)
+    except OSError as e:
+        if e.errno != errno.EADDRINUSE or not kill_existing:
+            raise
+    # 端口确实被占用时才清理
+    if free_port(port):
+        print(f"✅ 端口 {port} 已清理")
+    return ModelHTTPServer((host, port), handler_factory, reuse_port=reuse_port)
@@ -9,25 +9,27 @@ python3 scripts/simple_file_server.py [--port PORT]
 import os
 import sys
 import argparse
-import socket
+import errno
 from pathlib import Path
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import BaseHTTPRequestHandler
 from urllib.parse import unquote
 import time
 
-class SimpleFileHandler(BaseHTTPRequestHandler):
+from bandwidth import BandwidthHandlerMixin, attach_shaper
+from chunk_index import ChunkIndexHandlerMixin, attach_chunk_index
+from io_policy import attach_io_policy
+from model_store import resolve_model
+from server_socket import ModelHTTPServer, get_local_ip, parse_byte_range, send_range_not_satisfiable
+from transfer_metrics import MetricsHandlerMixin, attach_metrics
+
+class SimpleFileHandler(ChunkIndexHandlerMixin, BandwidthHandlerMixin, MetricsHandlerMixin,
+                        BaseHTTPRequestHandler):
     """简化的文件处理器，专门处理模型文件下载"""
     
     def __init__(self, *args, model_file_path=None, **kwargs):
         self.model_file_path = model_file_path
         super().__init__(*args, **kwargs)
     
-    def log_message(self, format, *args):
-        """自定义日志格式"""
-        client_ip = self.address_string()
-        timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
-        print(f"[{timestamp}] {client_ip} - {format % args}")
-    
     def end_headers(self):
         # 添加CORS头
         self.send_header('Access-Control-Allow-Origin', '*')
@@ -35,6 +37,11 @@ class SimpleFileHandler(BaseHTTPRequestHandler):
         self.send_header('Access-Control-Allow-Headers', 'Range, Authorization, User-Agent')
         super().end_headers()
     
+    def do_POST(self):
+        """处理POST请求（仅管理端点）"""
+        if not self.serve_bandwidth_admin():
+            self.send_error(404, "File not found")
+    
     def do_OPTIONS(self):
         """处理CORS预检请求"""
         self.send_response(200)
@@ -48,12 +55,16 @@ class SimpleFileHandler(BaseHTTPRequestHandler):
             self.send_header('Content-Length', str(file_size))
             self.send_header('Content-Type', 'application/octet-stream')
             self.send_header('Accept-Ranges', 'bytes')
+            self.send_digest_headers('gemma-3n-E4B-it-int4.task', self.model_file_path, 0, file_size)
             self.end_headers()
         else:
             self.send_error(404, "File not found")
     
     def do_GET(self):
         """处理GET请求"""
+        if self.serve_metrics_endpoint() or self.serve_bandwidth_admin() or self.serve_chunk_manifest():
+            return
+        
         if self.path != '/gemma-3n-E4B-it-int4.task':
             self.send_error(404, "File not found")
             return
@@ -68,18 +79,11 @@ class SimpleFileHandler(BaseHTTPRequestHandler):
             
             if range_header:
                 # 处理范围请求
-                range_spec = range_header.replace('bytes=', '').strip()
-                if '-' in range_spec:
-                    start_str, end_str = range_spec.split('-', 1)
-                    start = int(start_str) if start_str else 0
-                    end = int(end_str) if end_str else file_size - 1
-                else:
-                    start = int(range_spec)
-                    end = file_size - 1
-                
-                # 确保范围有效
-                start = max(0, min(start, file_size - 1))
-                end = max(start, min(end, file_size - 1))
+                byte_range = parse_byte_range(range_header, file_size)
+                if byte_range is None:
+                    send_range_not_satisfiable(self, file_size)
+                    return
+                start, end = byte_range
                 content_length = end - start + 1
                 
                 self.send_response(206)  # Partial Content
@@ -96,25 +100,22 @@ class SimpleFileHandler(BaseHTTPRequestHandler):
             
             self.send_header('Content-Type', 'application/octet-stream')
             self.send_header('Accept-Ranges', 'bytes')
+            self.send_digest_headers('gemma-3n-E4B-it-int4.task', self.model_file_path, start, content_length)
             self.end_headers()
             
             # 发送文件内容
-            with open(self.model_file_path, 'rb') as f:
-                f.seek(start)
-                remaining = content_length
-                
-                while remaining > 0:
-                    chunk_size = min(65536, remaining)  # 64KB chunks
-                    chunk = f.read(chunk_size)
-                    if not chunk:
-                        break
-                    
+            with self.server.io_policy.open_range(self.model_file_path, start, content_length) as reader, \
+                    self.track_transfer(bool(range_header), start) as transfer, \
+                    self.open_flow() as flow:
+                for chunk in reader.chunks(65536):  # 64KB chunks
                     try:
+                        flow.acquire(len(chunk))
                         self.wfile.write(chunk)
-                        remaining -= len(chunk)
+                        transfer.sent(len(chunk))
                     except (ConnectionResetError, BrokenPipeError):
                         # 客户端断开连接，正常情况
-                        print(f"客户端断开连接，已发送 {content_length - remaining} 字节")
+                        transfer.abort()
+                        self.log_message("客户端断开连接，已发送 %d 字节", transfer.sent_bytes)
                         break
                         
         except Exception as e:
@@ -125,25 +126,36 @@ class SimpleFileHandler(BaseHTTPRequestHandler):
                 except:
                     pass
 
-def get_local_ip():
-    """获取本机IP地址"""
-    try:
-        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
-            s.connect(("8.8.8.8", 80))
-            return s.getsockname()[0]
-    except:
-        return "127.0.0.1"
-
 def main():
     parser = argparse.ArgumentParser(description='简化文件服务器')
     parser.add_argument('--port', type=int, default=8001, help='服务器端口 (默认: 8001)')
     parser.add_argument('--host', default='0.0.0.0', help='绑定主机 (默认: 0.0.0.0)')
+    parser.add_argument('--log-sample', type=int, default=1,
+                        help='访问日志采样: 每 N 个请求打印 1 条，0 关闭 (默认: 1)')
+    parser.add_argument('--quiet', '-q', action='store_true', help='关闭访问日志 (等同 --log-sample 0)')
+    parser.add_argument('--global-rate', type=float, default=0,
+                        help='全局带宽上限 MB/s，0 不限速 (默认: 0)')
+    parser.add_argument('--client-rate', type=float, default=0,
+                        help='单客户端带宽上限 MB/s，0 不限速 (默认: 0)')
+    parser.add_argument('--admin-token', help='/admin/bandwidth 管理端点令牌，不设置时仅允许本机访问')
+    parser.add_argument('--io-mode', choices=['mmap', 'read'], default='read',
+                        help='文件读取方式: read 普通读取或 mmap 共享映射 (默认: read)；'
+                             'mmap 方式下文件被原地截断或覆盖写入时进程会因 SIGBUS 退出')
+    parser.add_argument('--no-fadvise', action='store_true',
+                        help='不调用 posix_fadvise/madvise 预读提示')
+    parser.add_argument('--warm-cache', action='store_true',
+                        help='启动后在后台线程预热模型文件的页缓存')
+    parser.add_argument('--warm-rate', type=float, default=0,
+                        help='页缓存预热限速 MB/s，0 不限速 (默认: 0)')
+    parser.add_argument('--model-dir', help='模型目录 (默认: assets/models)')
     args = parser.parse_args()
     
     # 获取模型文件路径
     script_dir = Path(__file__).parent
     project_root = script_dir.parent
-    model_file = project_root / 'assets' / 'models' / 'gemma-3n-E4B-it-int4.task'
+    model_dir = Path(args.model_dir).resolve() if args.model_dir else project_root / 'assets' / 'models'
+    # 检出目录中没有模型时直接使用共享模型缓存中的文件
+    model_file = resolve_model(model_dir / 'gemma-3n-E4B-it-int4.task')
     
     print("=== PlantMeet 简化文件服务器 ===")
     print(f"模型文件: {model_file}")
@@ -167,12 +179,20 @@ def main():
         return SimpleFileHandler(*args, model_file_path=model_file, **kwargs)
     
     try:
-        server = HTTPServer((args.host, args.port), handler_factory)
+        server = ModelHTTPServer((args.host, args.port), handler_factory)
+        attach_metrics(server, 0 if args.quiet else args.log_sample)
+        attach_shaper(server, args.global_rate, args.client_rate, args.admin_token)
+        io_policy = attach_io_policy(server, args.io_mode, not args.no_fadvise)
+        attach_chunk_index(server, model_file.parent, {'gemma-3n-E4B-it-int4.task': model_file}).warm()
+        if args.warm_cache:
+            io_policy.warm(model_file, args.warm_rate)
         local_ip = get_local_ip()
         
         print(f"\n🚀 服务器已启动:")
         print(f"  本地: http://localhost:{args.port}")
         print(f"  网络: http://{local_ip}:{args.port}")
+        print(f"  指标: http://{local_ip}:{args.port}/metrics, /stats.json")
+        print(f"  校验: http://{local_ip}:{args.port}/hashes/gemma-3n-E4B-it-int4.task")
         print(f"\n📱 编译命令:")
         print(f"flutter build apk --debug \\")
         print(f"  --dart-define=LOCAL_MODEL_SERVER=http://{local_ip}:{args.port} \\")
@@ -185,7 +205,7 @@ def main():
     except KeyboardInterrupt:
         print("\n\n🛑 服务器已停止")
     except OSError as e:
-        if e.errno == 48:
+        if e.errno == errno.EADDRINUSE:
             print(f"❌ 端口 {args.port} 已被占用")
             print(f"尝试其他端口: python3 scripts/simple_file_server.py --port {args.port + 1}")
         else:
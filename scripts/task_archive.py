@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+"""
+.task 模型包的成员索引
+
+.task 文件是 zip 格式的归档，包含权重、分词器和元数据等成员。这里只读取文件末尾的
+中央目录建立成员表（名称、数据偏移、大小、压缩方式），之后可以直接定位单个成员，
+不需要读取或解压整个 4.4 GB 文件:
+
+- 本地文件只读末尾几 KB 和每个成员 30 字节的本地文件头
+- URL 用范围请求读取末尾（第一次请求取最后 64KB，中央目录通常也在其中），
+  取出单个成员时再发一个覆盖该成员的范围请求
+- 模型服务器在 /<文件名>/members/ 列出成员，/<文件名>/members/<成员名> 发送单个成员
+  （未压缩的成员支持范围请求）
+
+使用方法:
+python3 scripts/task_archive.py list assets/models/gemma-3n-E4B-it-int4.task
+python3 scripts/task_archive.py list http://192.168.1.100:8001/gemma-3n-E4B-it-int4.task
+python3 scripts/task_archive.py cat assets/models/gemma-3n-E4B-it-int4.task TOKENIZER_MODEL -o tokenizer.model
+"""
+
+import argparse
+import io
+import json
+import os
+import struct
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import zipfile
+import zlib
+from pathlib import Path
+from urllib.parse import quote, unquote, urlsplit
+
+from server_socket import parse_byte_range, send_range_not_satisfiable
+
+MB = 1024 * 1024
+
+# 第一次读取文件末尾的大小：EOCD 加上最长 64KB 的注释，一般也包含整个中央目录
+TAIL_SIZE = 64 * 1024
+
+STREAM_BLOCK = MB
+
+LOCAL_HEADER = struct.Struct('<4s2B4HL2L2H')
+LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+
+COMPRESSION_NAMES = {
+    zipfile.ZIP_STORED: 'stored',
+    zipfile.ZIP_DEFLATED: 'deflate',
+    zipfile.ZIP_BZIP2: 'bzip2',
+    zipfile.ZIP_LZMA: 'lzma',
+}
+
+class HTTPRangeFile(io.RawIOBase):
+    """用 HTTP 范围请求实现的只读文件对象，供 zipfile 读取远程归档的中央目录"""
+
+    def __init__(self, url, headers=None, timeout=30):
+        super().__init__()
+        self.url = url
+        self.headers = dict(headers or {})
+        self.timeout = timeout
+        self.position = 0
+        self.requests = 0
+        self.received = 0
+        # 第一次请求读取文件末尾，同时得到文件大小
+        data, self.size = self._get(f'bytes=-{TAIL_SIZE}')
+        self._tail_start = self.size - len(data)
+        self._tail = data
+
+    def _open(self, byte_range):
+        request = urllib.request.Request(self.url, headers={**self.headers, 'Range': byte_range})
+        self.requests += 1
+        try:
+            response = urllib.request.urlopen(request, timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+            raise OSError(f"HTTP {e.code}: {self.url}") from e
+        except urllib.error.URLError as e:
+            raise OSError(f"无法访问 {self.url}: {e.reason}") from e
+        if response.status != 206:
+            response.close()
+            raise OSError(f"服务器不支持范围请求: {self.url}")
+        return response
+
+    def _get(self, byte_range):
+        with self._open(byte_range) as response:
+            data = response.read()
+            total = int(response.headers['Content-Range'].rsplit('/', 1)[1])
+        self.received += len(data)
+        return data, total
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self.position = max(0, offset)
+        return self.position
+
+    def readinto(self, buffer):
+        length = min(len(buffer), self.size - self.position)
+        if length <= 0:
+            return 0
+        if self.position >= self._tail_start:
+            start = self.position - self._tail_start
+            data = self._tail[start:start + length]
+        else:
+            data, _ = self._get(f'bytes={self.position}-{self.position + length - 1}')
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+    def stream(self, start, length, block_size=STREAM_BLOCK):
+        """用一个范围请求按块产出 [start, start+length) 的数据"""
+        if length <= 0:
+            return
+        with self._open(f'bytes={start}-{start + length - 1}') as response:
+            remaining = length
+            while remaining:
+                data = response.read(min(block_size, remaining))
+                if not data:
+                    raise OSError(f"连接提前结束，还差 {remaining} 字节")
+                self.received += len(data)
+                remaining -= len(data)
+                yield data
+
+def open_source(source, headers=None):
+    """打开本地文件或 URL，返回可 seek 的二进制文件对象"""
+    if urlsplit(str(source)).scheme in ('http', 'https'):
+        return HTTPRangeFile(str(source), headers)
+    return open(source, 'rb')
+
+def data_offset(f, header_offset):
+    """读取本地文件头，返回成员数据的起始偏移（本地头的扩展字段长度可能与中央目录不同）"""
+    f.seek(header_offset)
+    header = f.read(LOCAL_HEADER.size)
+    fields = LOCAL_HEADER.unpack(header) if len(header) == LOCAL_HEADER.size else None
+    if fields is None or fields[0] != LOCAL_HEADER_SIGNATURE:
+        raise zipfile.BadZipFile(f"偏移 {header_offset} 处不是本地文件头")
+    name_length, extra_length = fields[-2:]
+    return header_offset + LOCAL_HEADER.size + name_length + extra_length
+
+def read_members(f, resolve_offsets=True):
+    """解析中央目录，返回成员表 [{name, offset, size, compressed_size, compression, crc32, header_offset}]
+
+    resolve_offsets 为 False 时不读本地文件头，offset 为 None（远程列目录时省去每个成员一次请求）。
+    """
+    with zipfile.ZipFile(f) as archive:
+        infos = [info for info in archive.infolist() if not info.is_dir()]
+    members = []
+    for info in infos:
+        members.append({
+            'name': info.filename,
+            'offset': data_offset(f, info.header_offset) if resolve_offsets else None,
+            'size': info.file_size,
+            'compressed_size': info.compress_size,
+            'compression': COMPRESSION_NAMES.get(info.compress_type, str(info.compress_type)),
+            'crc32': info.CRC,
+            'header_offset': info.header_offset,
+        })
+    return members
+
+def iter_member(f, member, block_size=STREAM_BLOCK):
+    """按块产出成员解压后的内容，结束时校验 CRC32"""
+    offset = member['offset']
+    if offset is None:
+        offset = data_offset(f, member['header_offset'])
+    length = member['compressed_size']
+    if hasattr(f, 'stream'):
+        raw = f.stream(offset, length, block_size)
+    else:
+        raw = _read_span(f, offset, length, block_size)
+
+    if member['compression'] == 'stored':
+        decompress = None
+    elif member['compression'] == 'deflate':
+        decompress = zlib.decompressobj(-zlib.MAX_WBITS)
+    else:
+        raise ValueError(f"不支持的压缩方式: {member['compression']}")
+
+    crc = 0
+    for data in raw:
+        if decompress is not None:
+            data = decompress.decompress(data)
+        if data:
+            crc = zlib.crc32(data, crc)
+            yield data
+    if decompress is not None:
+        data = decompress.flush()
+        if data:
+            crc = zlib.crc32(data, crc)
+            yield data
+    if crc != member['crc32']:
+        raise ValueError(f"成员 {member['name']} CRC32 校验失败")
+
+def _read_span(f, start, length, block_size):
+    f.seek(start)
+    remaining = length
+    while remaining:
+        data = f.read(min(block_size, remaining))
+        if not data:
+            raise OSError(f"文件提前结束，还差 {remaining} 字节")
+        remaining -= len(data)
+        yield data
+
+class TaskArchiveStore:
+    """服务器侧：按名称登记的归档文件的成员表缓存，文件变化后重新解析"""
+
+    def __init__(self, files):
+        self.files = dict(files)
+        self._tables = {}
+        self._lock = threading.Lock()
+
+    def members(self, name):
+        """返回 (文件路径, {成员名: 成员})；文件不存在或不是 zip 归档时返回 None"""
+        path = self.files.get(name)
+        if path is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        key = (str(path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            table = self._tables.get(key)
+        if table is None:
+            try:
+                with open(path, 'rb') as f:
+                    table = {member['name']: member for member in read_members(f)}
+            except (OSError, zipfile.BadZipFile) as e:
+                print(f"⚠️  无法解析归档 {path}: {e}")
+                table = {}
+            with self._lock:
+                self._tables = {k: v for k, v in self._tables.items() if k[0] != key[0]}
+                self._tables[key] = table
+        return Path(path), table
+
+def attach_task_archive(server, files):
+    """为 HTTP 服务器挂载 .task 成员索引，处理器通过 self.server.task_archive 访问"""
+    server.task_archive = TaskArchiveStore(files)
+    return server.task_archive
+
+class TaskArchiveHandlerMixin:
+    """请求处理器混入类：/<文件名>/members/ 成员列表和 /<文件名>/members/<成员名> 单个成员
+
+    需要服务器先经过 attach_task_archive()、attach_io_policy() 挂载成员索引和读取策略，
+    并与 BandwidthHandlerMixin、MetricsHandlerMixin 一起使用。
+    """
+
+    MEMBERS_SEGMENT = '/members/'
+
+    def serve_task_member(self):
+        """处理成员端点，返回是否已处理"""
+        path = urlsplit(self.path).path
+        name, sep, member_name = path[1:].partition(self.MEMBERS_SEGMENT)
+        if not sep:
+            return False
+
+        archive = self.server.task_archive.members(unquote(name))
+        if archive is None or not archive[1]:
+            self.send_error(404, "Archive not found")
+            return True
+        file_path, table = archive
+
+        if not member_name:
+            self.send_member_list(name, table)
+            return True
+        member = table.get(unquote(member_name))
+        if member is None:
+            self.send_error(404, "Member not found")
+            return True
+        self.send_member(file_path, member)
+        return True
+
+    def send_member_list(self, name, table):
+        members = [{**member, 'url': f'/{name}{self.MEMBERS_SEGMENT}{quote(member["name"])}'}
+                   for member in sorted(table.values(), key=lambda m: m['header_offset'])]
+        body = json.dumps({'file': unquote(name), 'members': members}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def send_member(self, file_path, member):
+        """发送一个成员；未压缩的成员直接从文件中切出并支持范围请求，其余边读边解压"""
+        stored = member['compression'] == 'stored'
+        size = member['size']
+        start, length = 0, size
+        range_header = self.headers.get('Range')
+        ranged = bool(stored and range_header)
+        if ranged:
+            byte_range = parse_byte_range(range_header, size)
+            if byte_range is None:
+                send_range_not_satisfiable(self, size)
+                return
+            start, end = byte_range
+            length = end - start + 1
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(length))
+        self.send_header('Content-Type', 'application/octet-stream')
+        if stored:
+            self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('X-Member-Offset', str(member['offset']))
+        self.send_header('X-Member-Compression', member['compression'])
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        if self.command == 'HEAD':
+            return
+
+        with self.track_transfer(ranged, start) as transfer, self.open_flow() as flow:
+            if stored:
+                reader = self.server.io_policy.open_range(file_path, member['offset'] + start, length)
+            else:
+                reader = _MemberReader(file_path, member)
+            with reader:
+                for chunk in reader.chunks(65536):
+                    try:
+                        flow.acquire(len(chunk))
+                        self.wfile.write(chunk)
+                        transfer.sent(len(chunk))
+                    except (BrokenPipeError, ConnectionResetError):
+                        transfer.abort()
+                        break
+
+class _MemberReader:
+    """压缩成员的读取器，接口与 io_policy.RangeReader 一致"""
+
+    def __init__(self, path, member):
+        self.f = open(path, 'rb')
+        self.member = member
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.f.close()
+        return False
+
+    def chunks(self, chunk_size):
+        for data in iter_member(self.f, self.member, chunk_size):
+            view = memoryview(data)
+            for i in range(0, len(view), chunk_size):
+                yield view[i:i + chunk_size]
+
+def format_size(size_bytes):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size_bytes < 1024.0:
+            return f"{size_bytes:.1f} {unit}"
+        size_bytes /= 1024.0
+    return f"{size_bytes:.1f} TB"
+
+def auth_headers():
+    token = os.getenv('HF_TOKEN')
+    return {'Authorization': f'Bearer {token}'} if token else {}
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='.task 模型包成员索引')
+    sub = parser.add_subparsers(dest='command', required=True)
+    list_parser = sub.add_parser('list', help='列出成员（名称、偏移、大小、压缩方式）')
+    list_parser.add_argument('source', help='本地文件或 URL')
+    list_parser.add_argument('--json', action='store_true', help='输出 JSON')
+    cat_parser = sub.add_parser('cat', help='取出单个成员，不解压整个归档')
+    cat_parser.add_argument('source', help='本地文件或 URL')
+    cat_parser.add_argument('member', help='成员名')
+    cat_parser.add_argument('--output', '-o', help='输出文件 (默认: 标准输出)')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    try:
+        with open_source(args.source, auth_headers()) as f:
+            remote = isinstance(f, HTTPRangeFile)
+            # 远程归档只在取出成员时读取该成员的本地文件头
+            members = read_members(f, resolve_offsets=not remote)
+            if args.command == 'list':
+                if args.json:
+                    print(json.dumps(members, indent=2))
+                else:
+                    print(f"{'成员':<40} {'偏移':>14} {'大小':>10} {'压缩后':>10}  压缩")
+                    for m in members:
+                        offset = m['offset'] if m['offset'] is not None else f"~{m['header_offset']}"
+                        print(f"{m['name']:<40} {offset:>14} {format_size(m['size']):>10} "
+                              f"{format_size(m['compressed_size']):>10}  {m['compression']}")
+                    if remote:
+                        print("（~ 表示本地文件头的偏移，数据在其后几十字节）")
+            else:
+                member = next((m for m in members if m['name'] == args.member), None)
+                if member is None:
+                    print(f"❌ 没有成员 {args.member}，可用: {', '.join(m['name'] for m in members)}",
+                          file=sys.stderr)
+                    sys.exit(1)
+                out = open(args.output, 'wb') if args.output else sys.stdout.buffer
+                try:
+                    for data in iter_member(f, member):
+                        out.write(data)
+                finally:
+                    if args.output:
+                        out.close()
+            elapsed = (time.perf_counter() - started) * 1000
+            if remote:
+                print(f"\n{f.requests} 个范围请求，读取 {format_size(f.received)}，{elapsed:.0f} ms",
+                      file=sys.stderr)
+            else:
+                print(f"\n{len(members)} 个成员，{elapsed:.1f} ms", file=sys.stderr)
+    except (OSError, zipfile.BadZipFile, ValueError) as e:
+        print(f"❌ {e}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
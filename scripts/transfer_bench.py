@@ -0,0 +1,540 @@
+#!/usr/bin/env python3
+"""
+模型传输基准测试 - 在本机回环上测量模型服务器和下载客户端的吞吐，发现性能回退
+
+1. 生成指定大小的稀疏模型文件（不占磁盘，读取时全为零；--dense 生成随机数据）
+2. 依次在 127.0.0.1 上启动各个服务器变体（local_model_server.py / simple_file_server.py 的不同参数）
+3. 用 1…N 个并发客户端进程按三种方式下载:
+   full    完整下载
+   resume  从文件中间某处续传到结尾（Range: bytes=N-）
+   range   随机范围请求（默认 4MB）
+   客户端有两种:
+   raw       http.client 读完即丢，只测服务器本身（基线）
+   download  调用 download_model.download_model()，包含 requests、分块校验和 PartFile 落盘，
+             只测 full / resume（续传时预先留下一个中断的 .part 文件），需要 requests
+4. 统计总吞吐 MB/s、首字节延迟、服务器/客户端每 GB 的 CPU 时间、服务器峰值内存，
+   输出 JSON 报告；给出基线报告时逐项比较，超出容差视为回退并以非零状态码退出
+
+只使用标准库和本机回环，无需联网。
+
+使用方法:
+python3 scripts/transfer_bench.py                                  # 256MB，1/4 个客户端
+python3 scripts/transfer_bench.py --sizes 256M,4.4G --clients 1,4,16 -o report.json
+python3 scripts/transfer_bench.py --save-baseline bench-baseline.json
+python3 scripts/transfer_bench.py --baseline bench-baseline.json   # 与基线比较
+python3 scripts/transfer_bench.py --client-modes raw,download       # 同时测下载客户端
+"""
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from chunk_index import load_or_build_index
+
+MB = 1024 * 1024
+GB = 1024 * MB
+
+MODEL_FILENAME = 'gemma-3n-E4B-it-int4.task'
+SCRIPT_DIR = Path(__file__).parent
+
+# 服务器变体: 名称 -> 启动参数
+SERVERS = {
+    'local': ['local_model_server.py'],
+    'local-read': ['local_model_server.py', '--io-mode', 'read'],
+    'local-workers': ['local_model_server.py', '--workers', '4'],
+    'simple': ['simple_file_server.py'],
+}
+
+PATTERNS = ('full', 'resume', 'range')
+
+# 客户端: raw 只读不写（服务器基线），download 走 download_model.download_model() 的完整路径
+CLIENT_MODES = ('raw', 'download')
+DOWNLOAD_PATTERNS = ('full', 'resume')
+
+READ_BUFFER = 1 * MB
+SERVER_START_TIMEOUT = 15.0
+
+# 与基线比较时的默认容差（吞吐下降或延迟上升超过该比例视为回退）
+DEFAULT_TOLERANCE = 0.15
+
+CLK_TCK = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+def parse_size(text):
+    """解析 256M / 4.4G / 1048576 形式的大小"""
+    text = text.strip().upper().rstrip('B')
+    units = {'K': 1024, 'M': MB, 'G': GB}
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+def format_size(size_bytes):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size_bytes < 1024.0:
+            return f"{size_bytes:.1f} {unit}"
+        size_bytes /= 1024.0
+    return f"{size_bytes:.1f} TB"
+
+def make_model_file(directory, size, dense=False):
+    """在 directory 中生成指定大小的模型文件，返回路径；已存在且大小相同时复用"""
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / MODEL_FILENAME
+    if path.exists() and path.stat().st_size == size:
+        return path
+    with open(path, 'wb') as f:
+        if dense:
+            written = 0
+            while written < size:
+                written += f.write(os.urandom(min(8 * MB, size - written)))
+        else:
+            f.truncate(size)
+    return path
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+# ---- 服务器进程统计 ----
+
+def process_tree(pid):
+    """pid 及其所有子孙进程"""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat', 'r') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            children.setdefault(int(fields[1]), []).append(int(entry))
+        except (OSError, IndexError):
+            continue
+    tree, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        tree.append(current)
+        pending.extend(children.get(current, []))
+    return tree
+
+def cpu_seconds(pids):
+    """进程的用户态 + 内核态 CPU 时间之和（秒）"""
+    total = 0
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/stat', 'r') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            total += int(fields[11]) + int(fields[12])
+        except (OSError, IndexError):
+            continue
+    return total / CLK_TCK
+
+def reset_peak_rss(pids):
+    """清零峰值内存统计（写 /proc/<pid>/clear_refs），使每轮单独统计"""
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/clear_refs', 'w') as f:
+                f.write('5')
+        except OSError:
+            pass
+
+def peak_rss_mb(pids):
+    """所有进程的峰值常驻内存之和（MB）"""
+    total = 0
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/status', 'r') as f:
+                for line in f:
+                    if line.startswith('VmHWM:'):
+                        total += int(line.split()[1])
+                        break
+        except OSError:
+            continue
+    return total / 1024
+
+class ServerProcess:
+    """在回环地址上启动一个服务器变体"""
+
+    def __init__(self, name, model_dir):
+        self.name = name
+        self.model_dir = model_dir
+        self.port = free_port()
+        self.proc = None
+        self.log = None
+
+    def __enter__(self):
+        script, *extra = SERVERS[self.name]
+        cmd = [sys.executable, str(SCRIPT_DIR / script), '--host', '127.0.0.1', '--port', str(self.port),
+               '--quiet', '--model-dir', str(self.model_dir), *extra]
+        self.log = tempfile.TemporaryFile()
+        self.proc = subprocess.Popen(cmd, stdout=self.log, stderr=subprocess.STDOUT,
+                                     env={**os.environ, 'PYTHONUNBUFFERED': '1'})
+        deadline = time.monotonic() + SERVER_START_TIMEOUT
+        while time.monotonic() < deadline:
+            if self.proc.poll() is not None:
+                break
+            try:
+                with socket.create_connection(('127.0.0.1', self.port), timeout=0.2):
+                    return self
+            except OSError:
+                time.sleep(0.05)
+        self.log.seek(0)
+        output = self.log.read().decode('utf-8', 'replace')
+        self.__exit__(None, None, None)
+        raise RuntimeError(f"服务器 {self.name} 启动失败:\n{output}")
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.proc and self.proc.poll() is None:
+            self.proc.send_signal(signal.SIGINT)
+            try:
+                self.proc.wait(10)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+                self.proc.wait()
+        if self.log:
+            self.log.close()
+        return False
+
+    def pids(self):
+        return process_tree(self.proc.pid)
+
+# ---- 客户端（在独立进程中运行，避免客户端的 GIL 成为瓶颈） ----
+
+def _fetch(conn, path, headers, buffer):
+    """发送一个请求并读完响应体，返回 (字节数, 首字节延迟)"""
+    started = time.perf_counter()
+    conn.request('GET', path, headers=headers)
+    response = conn.getresponse()
+    if response.status not in (200, 206):
+        response.read()
+        raise http.client.HTTPException(f"HTTP {response.status}")
+    view = memoryview(buffer)
+    received = response.readinto(view[:1])
+    ttfb = time.perf_counter() - started
+    while True:
+        n = response.readinto(view)
+        if not n:
+            break
+        received += n
+    if response.will_close:
+        conn.close()
+    return received, ttfb
+
+def run_client(port, pattern, size, seed, start_at, range_size, range_requests):
+    """单个客户端进程：等到统一的开始时间后按 pattern 下载，返回统计"""
+    rng = random.Random(seed)
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    cpu_before = usage.ru_utime + usage.ru_stime
+    buffer = bytearray(READ_BUFFER)
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    path = f'/{MODEL_FILENAME}'
+    ttfbs, received, errors = [], 0, 0
+
+    time.sleep(max(0.0, start_at - time.time()))
+    started = time.time()
+    try:
+        if pattern == 'full':
+            requests = [{}]
+        elif pattern == 'resume':
+            offset = rng.randrange(size // 4, size * 3 // 4)
+            requests = [{'Range': f'bytes={offset}-'}]
+        else:
+            requests = []
+            for _ in range(range_requests):
+                offset = rng.randrange(0, max(1, size - range_size))
+                requests.append({'Range': f'bytes={offset}-{offset + range_size - 1}'})
+        for headers in requests:
+            try:
+                n, ttfb = _fetch(conn, path, headers, buffer)
+                received += n
+                ttfbs.append(ttfb)
+            except (OSError, http.client.HTTPException):
+                errors += 1
+                conn.close()
+    finally:
+        conn.close()
+    finished = time.time()
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return {
+        'bytes': received,
+        'started': started,
+        'finished': finished,
+        'ttfb': ttfbs,
+        'errors': errors,
+        'cpu_seconds': usage.ru_utime + usage.ru_stime - cpu_before,
+        'peak_rss_mb': usage.ru_maxrss / 1024,
+    }
+
+def run_download(port, pattern, size, seed, start_at, download_dir):
+    """单个客户端进程：用 download_model.download_model() 下载到 download_dir，返回统计
+
+    经过 requests、分块哈希表校验（verify_blocks）和 PartFile 预分配 + pwrite 落盘，
+    resume 时先留下一个写到文件中间的 .part 文件和进度记录，再由 download_model() 续传。
+    """
+    import contextlib
+    from download_model import download_model
+    from download_storage import BLOCK_SIZE, PartFile
+
+    rng = random.Random(seed)
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    cpu_before = usage.ru_utime + usage.ru_stime
+    url = f'http://127.0.0.1:{port}/{MODEL_FILENAME}'
+    target = Path(download_dir) / f'client-{seed}' / MODEL_FILENAME
+    shutil.rmtree(target.parent, ignore_errors=True)
+    offset = 0
+    if pattern == 'resume':
+        # 续传位置按 PartFile 的块大小对齐，与真实中断后的状态一致
+        offset = rng.randrange(size // 4, size * 3 // 4)
+        offset -= offset % BLOCK_SIZE
+        with PartFile(target, size, identity=url) as part:
+            part.offset = offset
+
+    time.sleep(max(0.0, start_at - time.time()))
+    started = time.time()
+    try:
+        # download_model() 逐块打印进度，丢弃输出
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            ok = download_model(url, target)
+        ok = ok and target.exists() and target.stat().st_size == size
+    finally:
+        finished = time.time()
+        shutil.rmtree(target.parent, ignore_errors=True)
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return {
+        'bytes': size - offset if ok else 0,
+        'started': started,
+        'finished': finished,
+        # HEAD、哈希表和数据请求由 download_model() 内部发出，不单独统计首字节延迟
+        'ttfb': [],
+        'errors': 0 if ok else 1,
+        'cpu_seconds': usage.ru_utime + usage.ru_stime - cpu_before,
+        'peak_rss_mb': usage.ru_maxrss / 1024,
+    }
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+def run_case(server, pattern, size, clients, range_size, range_requests, client_mode='raw', download_dir=None):
+    """一个测试用例：clients 个客户端并发下载，返回汇总结果"""
+    pids = server.pids()
+    reset_peak_rss(pids)
+    cpu_before = cpu_seconds(pids)
+    start_at = time.time() + 0.5
+    with ProcessPoolExecutor(max_workers=clients) as pool:
+        if client_mode == 'download':
+            futures = [pool.submit(run_download, server.port, pattern, size, i, start_at, str(download_dir))
+                       for i in range(clients)]
+        else:
+            futures = [pool.submit(run_client, server.port, pattern, size, i, start_at, range_size, range_requests)
+                       for i in range(clients)]
+        results = [f.result() for f in futures]
+    pids = server.pids()
+    server_cpu = cpu_seconds(pids) - cpu_before
+
+    total = sum(r['bytes'] for r in results)
+    elapsed = max(r['finished'] for r in results) - min(r['started'] for r in results)
+    ttfbs = [t for r in results for t in r['ttfb']]
+    gigabytes = total / GB if total else None
+    return {
+        'server': server.name,
+        'client': client_mode,
+        'size': size,
+        'pattern': pattern,
+        'clients': clients,
+        'bytes': total,
+        'seconds': round(elapsed, 3),
+        'mb_s': round(total / MB / elapsed, 1) if elapsed > 0 else None,
+        'per_client_mb_s': [round(r['bytes'] / MB / max(r['finished'] - r['started'], 1e-9), 1)
+                            for r in results],
+        'requests': len(ttfbs),
+        'errors': sum(r['errors'] for r in results),
+        'ttfb_ms': {
+            'p50': round(percentile(ttfbs, 0.5) * 1000, 2) if ttfbs else None,
+            'p95': round(percentile(ttfbs, 0.95) * 1000, 2) if ttfbs else None,
+            'max': round(max(ttfbs) * 1000, 2) if ttfbs else None,
+        },
+        'server_cpu_s_per_gb': round(server_cpu / gigabytes, 3) if gigabytes else None,
+        'client_cpu_s_per_gb': round(sum(r['cpu_seconds'] for r in results) / gigabytes, 3) if gigabytes else None,
+        # 含 mmap 映射的文件页；多进程模式下各进程分别计算
+        'server_peak_rss_mb': round(peak_rss_mb(pids), 1),
+        'client_peak_rss_mb': round(max(r['peak_rss_mb'] for r in results), 1),
+    }
+
+def case_key(result):
+    key = f"{result['server']}/{format_size(result['size'])}/{result['pattern']}/x{result['clients']}"
+    # raw 客户端的用例名保持不变，旧基线仍可比较
+    if result.get('client', 'raw') != 'raw':
+        key += f"/{result['client']}"
+    return key
+
+def compare(results, baseline, tolerance):
+    """与基线比较，返回回退列表 [(用例, 指标, 基线值, 当前值)]"""
+    previous = {case_key(r): r for r in baseline.get('results', [])}
+    regressions = []
+    for result in results:
+        base = previous.get(case_key(result))
+        if not base:
+            continue
+        checks = [
+            ('mb_s', base.get('mb_s'), result.get('mb_s'), False),
+            ('ttfb_p50_ms', (base.get('ttfb_ms') or {}).get('p50'), result['ttfb_ms']['p50'], True),
+            ('server_cpu_s_per_gb', base.get('server_cpu_s_per_gb'), result.get('server_cpu_s_per_gb'), True),
+        ]
+        for metric, old, new, lower_is_better in checks:
+            if old is None or new is None or old == 0:
+                continue
+            change = (new - old) / old
+            worse = change > tolerance if lower_is_better else change < -tolerance
+            result.setdefault('vs_baseline', {})[metric] = round(change * 100, 1)
+            if worse:
+                regressions.append((case_key(result), metric, old, new))
+    return regressions
+
+def environment():
+    """记录测试环境，便于判断两份报告是否可比"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SCRIPT_DIR,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'host': platform.node(),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'commit': commit,
+    }
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='模型服务器回环传输基准测试')
+    parser.add_argument('--sizes', default='256M', help='模型文件大小，逗号分隔 (默认: 256M，如 256M,4.4G)')
+    parser.add_argument('--servers', default='local,simple',
+                        help=f"服务器变体，逗号分隔 (可选: {', '.join(SERVERS)}; 默认: local,simple)")
+    parser.add_argument('--clients', default='1,4', help='并发客户端数，逗号分隔 (默认: 1,4)')
+    parser.add_argument('--patterns', default=','.join(PATTERNS),
+                        help=f"下载方式，逗号分隔 (默认: {','.join(PATTERNS)})")
+    parser.add_argument('--client-modes', default='raw',
+                        help=f"客户端，逗号分隔 (可选: {', '.join(CLIENT_MODES)}; 默认: raw；"
+                             f"download 只测 {'/'.join(DOWNLOAD_PATTERNS)}，写入工作目录)")
+    parser.add_argument('--range-size', default='4M', help='range 方式每个请求的大小 (默认: 4M)')
+    parser.add_argument('--range-requests', type=int, default=64, help='range 方式每个客户端的请求数 (默认: 64)')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='每个用例重复次数，取吞吐中位数的一轮 (默认: 1；比较基线时建议 3)')
+    parser.add_argument('--dense', action='store_true', help='生成随机数据文件而不是稀疏文件（占用磁盘）')
+    parser.add_argument('--work-dir', help='测试文件目录 (默认: 临时目录，结束后删除)')
+    parser.add_argument('--output', '-o', help='JSON 报告输出路径')
+    parser.add_argument('--baseline', help='基线报告，逐项比较并在回退时以状态码 1 退出')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help=f'回退容差比例 (默认: {DEFAULT_TOLERANCE})')
+    parser.add_argument('--save-baseline', help='把本次报告保存为基线')
+    args = parser.parse_args()
+
+    if not os.path.exists('/proc/self/stat'):
+        print("❌ 基准测试需要 Linux (/proc)")
+        sys.exit(1)
+
+    sizes = [parse_size(s) for s in args.sizes.split(',')]
+    servers = [s.strip() for s in args.servers.split(',')]
+    clients = [int(c) for c in args.clients.split(',')]
+    patterns = [p.strip() for p in args.patterns.split(',')]
+    client_modes = [m.strip() for m in args.client_modes.split(',')]
+    unknown = [s for s in servers if s not in SERVERS] + [p for p in patterns if p not in PATTERNS] + \
+        [m for m in client_modes if m not in CLIENT_MODES]
+    if unknown:
+        print(f"❌ 未知的服务器变体、下载方式或客户端: {', '.join(unknown)}")
+        sys.exit(1)
+    if 'download' in client_modes:
+        try:
+            import download_model  # noqa: F401
+        except ImportError:
+            raise SystemExit("❌ download 客户端需要 requests: pip install requests")
+    range_size = parse_size(args.range_size)
+
+    work_dir = Path(args.work_dir) if args.work_dir else Path(tempfile.mkdtemp(prefix='plantmeet_bench_'))
+    # 服务器启动时在后台加载分块索引；索引提前建好放在工作目录中，不计入服务器 CPU，也不写入用户缓存
+    os.environ['XDG_CACHE_HOME'] = str(work_dir / 'cache')
+    print("📏 PlantMeet 传输基准测试")
+    print(f"文件: {', '.join(format_size(s) for s in sizes)} ({'随机数据' if args.dense else '稀疏文件'})  "
+          f"服务器: {', '.join(servers)}  客户端: {', '.join(map(str, clients))} ({', '.join(client_modes)})  "
+          f"方式: {', '.join(patterns)}")
+
+    results = []
+    try:
+        for size in sizes:
+            model_path = make_model_file(work_dir / str(size), size, args.dense)
+            load_or_build_index(model_path)
+            model_dir = model_path.parent
+            for name in servers:
+                with ServerProcess(name, model_dir) as server:
+                    cases = [(mode, pattern) for mode in client_modes for pattern in patterns
+                             if mode == 'raw' or pattern in DOWNLOAD_PATTERNS]
+                    for mode, pattern in cases:
+                        for count in clients:
+                            # 重复多次取吞吐中位数的一轮，减少偶然波动造成的误报
+                            runs = [run_case(server, pattern, size, count, range_size, args.range_requests,
+                                             mode, work_dir / 'downloads')
+                                    for _ in range(args.repeat)]
+                            runs.sort(key=lambda r: r['mb_s'] or 0)
+                            result = runs[len(runs) // 2]
+                            if args.repeat > 1:
+                                result['repeat_mb_s'] = [r['mb_s'] for r in runs]
+                            results.append(result)
+                            print(f"  {case_key(result):<45} {result['mb_s']:>8} MB/s  "
+                                  + (f"TTFB p50 {result['ttfb_ms']['p50']} ms  " if result['requests'] else "")
+                                  + f"服务器 CPU {result['server_cpu_s_per_gb']} s/GB  "
+                                  f"内存 {result['server_peak_rss_mb']} MB"
+                                  + (f"  ❌ {result['errors']} 个错误" if result['errors'] else ""))
+    except KeyboardInterrupt:
+        print("\n🛑 已中断，输出已完成的用例")
+    except RuntimeError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {'environment': environment(), 'tolerance': args.tolerance, 'results': results}
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        report['baseline'] = {'path': args.baseline, 'environment': baseline.get('environment')}
+        report['regressions'] = [{'case': c, 'metric': m, 'baseline': old, 'current': new}
+                                 for c, m, old, new in regressions]
+        print(f"\n📊 与基线比较 ({args.baseline}，容差 {args.tolerance:.0%}):")
+        if regressions:
+            for case, metric, old, new in regressions:
+                print(f"  ❌ {case} {metric}: {old} -> {new}")
+        else:
+            print("  ✅ 没有发现性能回退")
+
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"📄 报告已保存: {path}")
+
+    if regressions or any(r['errors'] for r in results):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,431 @@
+#!/usr/bin/env python3
+"""
+模型服务器传输指标
+
+为 local_model_server.py / simple_file_server.py 提供计数器、仪表和直方图，
+并以 Prometheus 文本格式 (/metrics) 和 JSON (/stats.json) 导出。
+
+热路径上的更新不加锁：每个线程写自己的计数单元，只有读取（抓取指标）时才汇总所有线程的单元。
+"""
+
+import itertools
+import json
+import threading
+import time
+import weakref
+from collections import deque
+
+# 首字节延迟直方图边界（秒）
+TTFB_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# 单次传输吞吐直方图边界（MB/s）
+THROUGHPUT_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+# 中断位置直方图边界（已发送字节）
+ABORT_OFFSET_BUCKETS = (
+    1 << 20, 16 << 20, 64 << 20, 256 << 20, 1 << 30, 2 << 30, 4 << 30,
+)
+
+class _CellHolder:
+    """线程本地存储中的计数单元持有者，线程结束后被回收"""
+
+    __slots__ = ('cell', '__weakref__')
+
+class _ThreadCells:
+    """按线程分片的计数单元，写入只触及当前线程自己的列表
+
+    线程结束时其计数并入 retired，避免每请求一线程的服务器中单元无限增长。
+    """
+
+    def __init__(self, width):
+        self._width = width
+        self._local = threading.local()
+        self._cells = []
+        self._retired = [0] * width
+        self._lock = threading.Lock()
+
+    def cell(self):
+        """返回当前线程的计数单元，首次使用时注册（仅此处加锁）"""
+        holder = getattr(self._local, 'holder', None)
+        if holder is None:
+            holder = _CellHolder()
+            holder.cell = [0] * self._width
+            with self._lock:
+                self._cells.append(holder.cell)
+            weakref.finalize(holder, self._retire, holder.cell)
+            self._local.holder = holder
+        return holder.cell
+
+    def _retire(self, cell):
+        with self._lock:
+            for i, value in enumerate(cell):
+                self._retired[i] += value
+            self._cells.remove(cell)
+
+    def totals(self):
+        """汇总所有线程的计数单元"""
+        with self._lock:
+            totals = list(self._retired)
+            for cell in self._cells:
+                for i, value in enumerate(cell):
+                    totals[i] += value
+        return totals
+
+class Counter:
+    """单调递增计数器"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._cells = _ThreadCells(1)
+
+    def inc(self, amount=1):
+        self._cells.cell()[0] += amount
+
+    def value(self):
+        return self._cells.totals()[0]
+
+class Gauge(Counter):
+    """可增可减的仪表，各线程的增量之和即当前值"""
+
+    kind = 'gauge'
+
+    def dec(self, amount=1):
+        self._cells.cell()[0] -= amount
+
+class Histogram:
+    """固定边界直方图"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        # 单元布局: [各桶计数..., +Inf 桶计数, 观测总和]
+        self._cells = _ThreadCells(len(self.buckets) + 2)
+
+    def observe(self, value):
+        cell = self._cells.cell()
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        cell[index] += 1
+        cell[-1] += value
+
+    def snapshot(self):
+        """返回 {'buckets': [...], 'counts': [...], 'sum': x, 'count': n}，counts 为非累计计数"""
+        totals = self._cells.totals()
+        counts = totals[:-1]
+        return {
+            'buckets': list(self.buckets),
+            'counts': counts,
+            'sum': totals[-1],
+            'count': sum(counts),
+        }
+
+class MetricsRegistry:
+    """指标注册表，带标签的指标按标签值惰性创建"""
+
+    def __init__(self, prefix='plantmeet'):
+        self.prefix = prefix
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, factory, name, labels, *args):
+        key = (name, tuple(sorted(labels.items())))
+        metric = self._metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(key)
+                if metric is None:
+                    metric = factory(f"{self.prefix}_{name}", *args)
+                    self._metrics[key] = metric
+        return metric
+
+    def counter(self, name, help_text, **labels):
+        return self._get(Counter, name, labels, help_text)
+
+    def gauge(self, name, help_text, **labels):
+        return self._get(Gauge, name, labels, help_text)
+
+    def histogram(self, name, help_text, buckets, **labels):
+        return self._get(Histogram, name, labels, help_text, buckets)
+
+    def snapshot(self):
+        """导出所有指标的可合并快照"""
+        result = {}
+        for (name, labels), metric in sorted(self._metrics.items(), key=lambda item: item[0]):
+            entry = {'name': metric.name, 'type': metric.kind, 'help': metric.help,
+                     'labels': dict(labels)}
+            if metric.kind == 'histogram':
+                entry.update(metric.snapshot())
+            else:
+                entry['value'] = metric.value()
+            result[_series_key(metric.name, labels)] = entry
+        return result
+
+def _series_key(name, labels):
+    """指标序列的唯一键，如 name{a="1",b="2"}"""
+    if not labels:
+        return name
+    return name + '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}'
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return f"{value:.6g}" if isinstance(value, float) else str(value)
+
+def render_prometheus(snapshot):
+    """将快照渲染为 Prometheus 文本格式 (version 0.0.4)"""
+    lines = []
+    described = set()
+    for entry in snapshot.values():
+        name = entry['name']
+        if name not in described:
+            lines.append(f"# HELP {name} {entry['help']}")
+            lines.append(f"# TYPE {name} {entry['type']}")
+            described.add(name)
+
+        labels = entry['labels']
+        if entry['type'] != 'histogram':
+            lines.append(f"{_series_key(name, sorted(labels.items()))} {_format_value(entry['value'])}")
+            continue
+
+        cumulative = 0
+        bounds = [_format_value(float(b)) for b in entry['buckets']] + ['+Inf']
+        for bound, count in zip(bounds, entry['counts']):
+            cumulative += count
+            bucket_labels = sorted(list(labels.items()) + [('le', bound)])
+            lines.append(f"{_series_key(name + '_bucket', bucket_labels)} {cumulative}")
+        lines.append(f"{_series_key(name + '_sum', sorted(labels.items()))} {_format_value(float(entry['sum']))}")
+        lines.append(f"{_series_key(name + '_count', sorted(labels.items()))} {entry['count']}")
+    return '\n'.join(lines) + '\n'
+
+def merge_snapshots(snapshots):
+    """合并多个快照（如多个工作进程），计数器/仪表相加，直方图按桶相加"""
+    merged = {}
+    for snapshot in snapshots:
+        for key, entry in snapshot.items():
+            # 跳过不是指标的值（如误读的其他状态文件）
+            if not isinstance(entry, dict) or 'type' not in entry or 'labels' not in entry:
+                continue
+            current = merged.get(key)
+            if current is None:
+                merged[key] = {**entry, 'labels': dict(entry['labels'])}
+                if entry['type'] == 'histogram':
+                    merged[key]['counts'] = list(entry['counts'])
+                continue
+            if entry['type'] == 'histogram':
+                current['counts'] = [a + b for a, b in zip(current['counts'], entry['counts'])]
+                current['sum'] += entry['sum']
+                current['count'] += entry['count']
+            else:
+                current['value'] += entry['value']
+    return merged
+
+class Transfer:
+    """单次文件传输的跟踪器，由 TransferMetrics.transfer() 创建"""
+
+    def __init__(self, metrics, ranged, offset, request_started):
+        self._metrics = metrics
+        self.ranged = ranged
+        self.offset = offset
+        self.request_started = request_started
+        self.first_byte_at = None
+        self.sent_bytes = 0
+        self.aborted = False
+
+    def sent(self, nbytes):
+        """记录已发送的字节数，首次调用时记录首字节延迟"""
+        if self.first_byte_at is None:
+            self.first_byte_at = time.perf_counter()
+            self._metrics.ttfb.observe(self.first_byte_at - self.request_started)
+        self.sent_bytes += nbytes
+        self._metrics.bytes_served.inc(nbytes)
+
+    def abort(self):
+        """客户端中途断开"""
+        self.aborted = True
+
+    def __enter__(self):
+        self._metrics.active_transfers.inc()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._metrics.active_transfers.dec()
+        self._metrics.finish_transfer(self)
+        return False
+
+class TransferMetrics:
+    """模型服务器的指标集合"""
+
+    def __init__(self, recent_aborts=50):
+        self.registry = MetricsRegistry()
+        self.started_at = time.time()
+        registry = self.registry
+        self.connections = registry.gauge('active_connections', '当前打开的客户端连接数')
+        self.active_transfers = registry.gauge('active_transfers', '正在进行的文件传输数')
+        self.bytes_served = registry.counter('bytes_served_total', '已发送的文件字节数')
+        self.ttfb = registry.histogram('request_ttfb_seconds', '请求到首字节的延迟（秒）', TTFB_BUCKETS)
+        self.throughput = registry.histogram('transfer_throughput_mbps', '单次传输平均速度（MB/s）',
+                                             THROUGHPUT_BUCKETS)
+        self.abort_offsets = registry.histogram('abort_offset_bytes', '客户端中断时已发送的字节数',
+                                                ABORT_OFFSET_BUCKETS)
+        # deque.append 在 CPython 中是原子操作
+        self.recent_aborts = deque(maxlen=recent_aborts)
+
+    def transfer(self, ranged, offset=0, request_started=None):
+        """创建传输跟踪器，用法: with metrics.transfer(...) as t: t.sent(n)"""
+        kind = 'range' if ranged else 'full'
+        self.registry.counter('transfers_total', '文件传输次数', kind=kind).inc()
+        return Transfer(self, ranged, offset,
+                        request_started if request_started is not None else time.perf_counter())
+
+    def finish_transfer(self, transfer):
+        if transfer.first_byte_at is not None and transfer.sent_bytes:
+            elapsed = time.perf_counter() - transfer.first_byte_at
+            if elapsed > 0:
+                self.throughput.observe(transfer.sent_bytes / elapsed / (1024 * 1024))
+        if transfer.aborted:
+            self.registry.counter('transfer_aborts_total', '客户端中断的传输次数').inc()
+            self.abort_offsets.observe(transfer.sent_bytes)
+            self.recent_aborts.append({
+                'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'range_start': transfer.offset,
+                'sent_bytes': transfer.sent_bytes,
+                'abort_offset': transfer.offset + transfer.sent_bytes,
+            })
+
+    def request(self, method, status):
+        """记录一次请求的响应状态"""
+        self.registry.counter('requests_total', 'HTTP 请求数',
+                              method=method, status=str(status)).inc()
+
+    def snapshot(self):
+        return self.registry.snapshot()
+
+    def stats(self, snapshot=None):
+        """/stats.json 的内容：汇总值 + 完整指标快照"""
+        snapshot = snapshot if snapshot is not None else self.snapshot()
+
+        def value(key, default=0):
+            entry = snapshot.get(key)
+            return entry['value'] if entry else default
+
+        def hist_mean(key):
+            entry = snapshot.get(key)
+            return entry['sum'] / entry['count'] if entry and entry['count'] else None
+
+        return {
+            'uptime_seconds': round(time.time() - self.started_at, 1),
+            'active_connections': value('plantmeet_active_connections'),
+            'active_transfers': value('plantmeet_active_transfers'),
+            'bytes_served': value('plantmeet_bytes_served_total'),
+            'range_transfers': value('plantmeet_transfers_total{kind="range"}'),
+            'full_transfers': value('plantmeet_transfers_total{kind="full"}'),
+            'aborts': value('plantmeet_transfer_aborts_total'),
+            'mean_ttfb_seconds': hist_mean('plantmeet_request_ttfb_seconds'),
+            'mean_throughput_mbps': hist_mean('plantmeet_transfer_throughput_mbps'),
+            'recent_aborts': list(self.recent_aborts),
+            'metrics': snapshot,
+        }
+
+class SampledLogger:
+    """按比例采样的访问日志，避免逐请求打印拖慢传输"""
+
+    def __init__(self, sample_every=1):
+        # 0 表示关闭访问日志，1 表示全部打印，N 表示每 N 条打印 1 条
+        self.sample_every = sample_every
+        # itertools.count 的 next() 在 CPython 中是原子操作，无需加锁
+        self._seq = itertools.count()
+
+    def log(self, message):
+        if self.sample_every <= 0:
+            return
+        if next(self._seq) % self.sample_every == 0:
+            print(message)
+
+def attach_metrics(server, log_sample=1):
+    """为 HTTP 服务器挂载指标和访问日志，处理器通过 self.server 访问"""
+    server.metrics = TransferMetrics()
+    server.access_log = SampledLogger(log_sample)
+    return server.metrics
+
+class MetricsHandlerMixin:
+    """请求处理器混入类：连接计数、状态码统计、采样访问日志和 /metrics、/stats.json 端点
+
+    需要服务器先经过 attach_metrics() 挂载指标。
+    """
+
+    def setup(self):
+        super().setup()
+        self.request_started = time.perf_counter()
+        self.server.metrics.connections.inc()
+
+    def finish(self):
+        try:
+            super().finish()
+        finally:
+            self.server.metrics.connections.dec()
+
+    def handle_one_request(self):
+        # keep-alive 连接上的每个请求都重新计时
+        self.request_started = time.perf_counter()
+        super().handle_one_request()
+
+    def metrics_snapshot(self):
+        """指标快照；多进程模式下服务器提供 collect_metrics() 合并其他工作进程的指标"""
+        snapshot = self.server.metrics.snapshot()
+        collect = getattr(self.server, 'collect_metrics', None)
+        return collect(snapshot) if collect is not None else snapshot
+
+    def serve_metrics_endpoint(self):
+        """处理 /metrics 和 /stats.json，返回是否已处理"""
+        path = self.path.split('?', 1)[0]
+        if path == '/metrics':
+            body = render_prometheus(self.metrics_snapshot()).encode('utf-8')
+            content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        elif path == '/stats.json':
+            stats = self.server.metrics.stats(self.metrics_snapshot())
+            body = json.dumps(stats, ensure_ascii=False, indent=2).encode('utf-8')
+            content_type = 'application/json; charset=utf-8'
+        else:
+            return False
+
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+        return True
+
+    def track_transfer(self, ranged, offset=0):
+        """创建当前请求的传输跟踪器"""
+        return self.server.metrics.transfer(ranged, offset, self.request_started)
+
+    def log_request(self, code='-', size='-'):
+        self.server.metrics.request(self.command, int(code) if str(code).isdigit() else code)
+        super().log_request(code, size)
+
+    def log_error(self, format, *args):
+        # 错误日志不采样
+        self._print_log(format % args)
+
+    def log_message(self, format, *args):
+        """自定义日志格式（按采样比例打印）"""
+        self.server.access_log.log(self._format_log(format % args))
+
+    def _format_log(self, message):
+        client_ip = self.address_string()
+        timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
+        return f"[{timestamp}] {client_ip} - {message}"
+
+    def _print_log(self, message):
+        print(self._format_log(message))